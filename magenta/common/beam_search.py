@@ -28,6 +28,55 @@ import heapq
 BeamEntry = collections.namedtuple('BeamEntry', ['sequence', 'state', 'score'])
 
 
+def _seed_list_copies(obj, memo):
+  """Seeds a `copy.deepcopy` memo with shallow copies of lists within `obj`.
+
+  Every list reachable from `obj` through object attributes, tuples, and
+  dictionary values is mapped to a shallow copy of itself, so a subsequent
+  `copy.deepcopy(obj, memo)` copies those lists at C speed and shares their
+  elements with the original instead of recursing into them.
+
+  Args:
+    obj: The object whose lists to seed.
+    memo: The memo dictionary to seed, keyed by object id.
+  """
+  if id(obj) in memo:
+    return
+  if isinstance(obj, list):
+    memo[id(obj)] = list(obj)
+  elif isinstance(obj, tuple):
+    for value in obj:
+      _seed_list_copies(value, memo)
+  elif isinstance(obj, dict):
+    for value in obj.values():
+      _seed_list_copies(value, memo)
+  elif hasattr(obj, '__dict__'):
+    for value in vars(obj).values():
+      _seed_list_copies(value, memo)
+
+
+def _copy_on_write(obj):
+  """Copies a sequence or state, sharing the elements of any lists it holds.
+
+  Sequence events (and per-step control values) are only ever replaced or
+  appended, never modified in place, so branches of the same beam entry can
+  share them and only need their own list spines. Everything that is not a
+  list element, such as RNN state arrays, is deep-copied as before, unless it
+  defines its own copy-on-write `__deepcopy__` the way performance event arrays
+  do, in which case branches alias the common history and only store the
+  events appended after branching.
+
+  Args:
+    obj: The sequence or state to copy.
+
+  Returns:
+    A copy of `obj` that can be extended independently of the original.
+  """
+  memo = {}
+  _seed_list_copies(obj, memo)
+  return copy.deepcopy(obj, memo)
+
+
 def _generate_branches(beam_entries, generate_step_fn, branch_factor,
                        num_steps):
   """Performs a single iteration of branch generation for beam search.
@@ -51,10 +100,17 @@ def _generate_branches(beam_entries, generate_step_fn, branch_factor,
     The updated beam, with `branch_factor` times as many BeamEntry tuples.
   """
   if branch_factor > 1:
+    # The input beam is discarded after branching, so the first branch of each
+    # entry can extend the original sequence and state; only the remaining
+    # branches need copies.
     branched_entries = beam_entries * branch_factor
-    all_sequences = [copy.deepcopy(entry.sequence)
-                     for entry in branched_entries]
-    all_states = [copy.deepcopy(entry.state) for entry in branched_entries]
+    num_entries = len(beam_entries)
+    all_sequences = [entry.sequence for entry in beam_entries]
+    all_sequences += [_copy_on_write(entry.sequence)
+                      for entry in branched_entries[num_entries:]]
+    all_states = [entry.state for entry in beam_entries]
+    all_states += [_copy_on_write(entry.state)
+                   for entry in branched_entries[num_entries:]]
     all_scores = [entry.score for entry in branched_entries]
   else:
     # No need to make copies if there's no branching.
@@ -118,8 +174,8 @@ def beam_search(initial_sequence, initial_state, generate_step_fn, num_steps,
     search, b) the state corresponding to this sequence, and c) the score of
     this sequence.
   """
-  sequences = [copy.deepcopy(initial_sequence) for _ in range(beam_size)]
-  states = [copy.deepcopy(initial_state) for _ in range(beam_size)]
+  sequences = [_copy_on_write(initial_sequence) for _ in range(beam_size)]
+  states = [_copy_on_write(initial_state) for _ in range(beam_size)]
   scores = [0] * beam_size
 
   beam_entries = [BeamEntry(sequence, state, score)
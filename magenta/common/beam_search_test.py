@@ -15,6 +15,8 @@
 """Tests for beam search."""
 
 from magenta.common import beam_search
+from magenta.music import performance_lib
+import numpy as np
 import tensorflow as tf
 
 
@@ -83,6 +85,68 @@ class BeamSearchTest(tf.test.TestCase):
     self.assertEqual(state, 1)
     self.assertEqual(score, 16)
 
+  def testBranchesShareEventsButNotSequences(self):
+    events = [object() for _ in range(3)]
+
+    def generate_step_fn(sequences, states, scores):
+      for i, seq in enumerate(sequences):
+        seq.append(i)
+        states[i]['steps'].append(i)
+        scores[i] += i
+      return sequences, states, scores
+
+    initial_sequence = list(events)
+    initial_state = {'steps': []}
+    sequence, state, score = beam_search(
+        initial_sequence=initial_sequence, initial_state=initial_state,
+        generate_step_fn=generate_step_fn, num_steps=2, beam_size=1,
+        branch_factor=3, steps_per_iteration=1)
+
+    # The highest-scoring branch is always the last one. History events are
+    # shared with the initial sequence, which is itself left untouched.
+    self.assertEqual(sequence[3:], [2, 2])
+    for event, sequence_event in zip(events, sequence):
+      self.assertIs(event, sequence_event)
+    self.assertEqual(state, {'steps': [2, 2]})
+    self.assertEqual(score, 4)
+    self.assertEqual(initial_sequence, events)
+    self.assertEqual(initial_state, {'steps': []})
+
+  def testBranchesAliasCommonPrefix(self):
+    pe = performance_lib.PerformanceEvent
+    initial_events = [pe(pe.NOTE_ON, 60), pe(pe.TIME_SHIFT, 100),
+                      pe(pe.NOTE_OFF, 60)] * 10
+    initial_sequence = performance_lib.PerformanceEventArray()
+    for event in initial_events:
+      initial_sequence.append(event)
+    beam_size = 2
+    branch_histories = []
+
+    def generate_step_fn(sequences, states, scores):
+      branch_histories.append([seq.event_codes for seq in sequences])
+      for i, seq in enumerate(sequences):
+        seq.append(pe(pe.TIME_SHIFT, i + 1))
+        scores[i] += i
+      return sequences, states, scores
+
+    sequence, _, _ = beam_search(
+        initial_sequence=initial_sequence, initial_state=None,
+        generate_step_fn=generate_step_fn, num_steps=3, beam_size=beam_size,
+        branch_factor=3, steps_per_iteration=1)
+
+    # Each branch aliases the history of the beam entry it was branched from
+    # rather than holding its own copy.
+    for histories in branch_histories:
+      self.assertEqual(beam_size * 3, len(histories))
+      for i, history in enumerate(histories):
+        self.assertTrue(np.shares_memory(history, histories[i % beam_size]))
+    for history in branch_histories[0]:
+      self.assertEqual(initial_events, list(
+          performance_lib.PerformanceEventArray(history)))
+
+    self.assertEqual(33, len(sequence))
+    self.assertEqual(initial_events, list(sequence)[:30])
+    self.assertEqual(initial_events, list(initial_sequence))
 
 if __name__ == '__main__':
   tf.test.main()
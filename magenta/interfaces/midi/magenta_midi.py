@@ -149,6 +149,12 @@ tf.app.flags.DEFINE_float(
     'playback_offset',
     0.0,
     'Time in seconds to adjust playback time by.')
+tf.app.flags.DEFINE_float(
+    'scheduler_lookahead',
+    0.0005,
+    'Time in seconds before each scheduled event at which to stop waiting and '
+    'spin until the event. Larger values reduce timing jitter but use more '
+    'CPU.')
 tf.app.flags.DEFINE_integer(
     'playback_channel',
     0,
@@ -328,7 +334,8 @@ def main(unused_argv):
                          midi_hub.TextureType.POLYPHONIC,
                          passthrough=FLAGS.passthrough,
                          playback_channel=FLAGS.playback_channel,
-                         playback_offset=FLAGS.playback_offset)
+                         playback_offset=FLAGS.playback_offset,
+                         lookahead=FLAGS.scheduler_lookahead)
 
   control_map = {re.sub('_control_number$', '', f): FLAGS.__getattr__(f)
                  for f in _CONTROL_FLAGS}
@@ -385,6 +392,8 @@ def main(unused_argv):
     interaction.stop()
 
   print('Interaction stopped.')
+  for name, latency in sorted(hub.latency_histograms().items()):
+    tf.logging.info('Latency of %s events: %s', name, latency)
 
 
 def console_entry_point():
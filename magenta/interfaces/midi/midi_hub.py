@@ -17,10 +17,14 @@
 # TODO(adarob): Use flattened imports.
 
 import abc
+import bisect
 import collections
+import heapq
+import itertools
 import re
 import threading
 import time
+import traceback
 
 from magenta.common import concurrency
 from magenta.protobuf import music_pb2
@@ -38,6 +42,13 @@ _DEFAULT_METRONOME_MESSAGES = [
 ]
 _DEFAULT_METRONOME_CHANNEL = 1
 
+# How long before each event the scheduler stops waiting on its condition
+# variable and spins for the final moments instead.
+_DEFAULT_SCHEDULER_LOOKAHEAD = 0.0005
+_DEFAULT_NUM_CALLBACK_THREADS = 2
+# Upper limits of the latency histogram buckets, in milliseconds.
+_DEFAULT_LATENCY_BUCKET_LIMITS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
 # 0-indexed.
 _DRUM_CHANNEL = 9
 
@@ -176,8 +187,314 @@ class MidiSignal(object):
     return regex_pattern
 
 
-class Metronome(threading.Thread):
-  """A thread implementing a MIDI metronome.
+class LatencyHistogram(object):
+  """A histogram of how late scheduled events ran, in milliseconds.
+
+  Args:
+    bucket_limits_ms: Sorted upper limits of the histogram buckets, in
+        milliseconds. Latencies above the last limit are counted in a final
+        overflow bucket.
+  """
+
+  def __init__(self, bucket_limits_ms=_DEFAULT_LATENCY_BUCKET_LIMITS_MS):
+    self._lock = threading.Lock()
+    self._bucket_limits_ms = list(bucket_limits_ms)
+    self._counts = [0] * (len(self._bucket_limits_ms) + 1)
+    self._total_ms = 0.0
+    self._max_ms = 0.0
+
+  @concurrency.serialized
+  def record(self, latency):
+    """Records the latency in float seconds of one event."""
+    latency_ms = max(0.0, latency * 1000)
+    self._counts[bisect.bisect_left(self._bucket_limits_ms, latency_ms)] += 1
+    self._total_ms += latency_ms
+    self._max_ms = max(self._max_ms, latency_ms)
+
+  @property
+  @concurrency.serialized
+  def count(self):
+    """The number of recorded events."""
+    return sum(self._counts)
+
+  @property
+  @concurrency.serialized
+  def mean_ms(self):
+    """The mean latency in milliseconds, or 0 if nothing was recorded."""
+    count = sum(self._counts)
+    return self._total_ms / count if count else 0.0
+
+  @property
+  @concurrency.serialized
+  def max_ms(self):
+    """The maximum latency in milliseconds."""
+    return self._max_ms
+
+  @property
+  @concurrency.serialized
+  def buckets(self):
+    """A list of (upper limit in milliseconds, count) tuples."""
+    return list(zip(self._bucket_limits_ms + [float('inf')], self._counts))
+
+  def __str__(self):
+    return 'n=%d mean=%.2fms max=%.2fms [%s]' % (
+        self.count, self.mean_ms, self.max_ms,
+        ' '.join('<=%gms:%d' % bucket for bucket in self.buckets))
+
+
+class _ScheduledEvent(object):
+  """An event in a `MidiScheduler` timeline."""
+
+  __slots__ = ['time', 'fn', 'args', 'name', 'blocking', 'cancelled']
+
+  def __init__(self, time_, fn, args, name, blocking):
+    self.time = time_
+    self.fn = fn
+    self.args = args
+    self.name = name
+    self.blocking = blocking
+    self.cancelled = False
+
+
+class MidiScheduler(object):
+  """Runs timed MIDI events from a single timeline.
+
+  Events are kept in a priority queue ordered by time and run by a single
+  timing thread. The thread waits on a condition variable with a timeout until
+  `lookahead` seconds before the next event and then spins for the remaining
+  moments, yielding to other threads, so events can be added or cancelled at
+  any time without restarting anything.
+
+  Events that run user code, which may block, are marked `blocking` and are
+  handed to a pool of callback threads at their scheduled time, so they never
+  delay MIDI output. A new callback thread is started whenever a blocking event
+  is due and all of the existing ones are busy, so blocking events never wait
+  for each other.
+
+  The latency of each event, the difference between its scheduled time and
+  when it actually ran, is recorded in a `LatencyHistogram` per event name.
+
+  Args:
+    lookahead: The float time in seconds before each event at which the timing
+        thread stops waiting and starts spinning. Larger values reduce jitter
+        at the cost of CPU.
+    num_callback_threads: The number of threads for running blocking events to
+        start with.
+  """
+
+  def __init__(self, lookahead=_DEFAULT_SCHEDULER_LOOKAHEAD,
+               num_callback_threads=_DEFAULT_NUM_CALLBACK_THREADS):
+    self._lookahead = lookahead
+    self._lock = threading.RLock()
+    self._wake_cv = threading.Condition(self._lock)
+    # A heap of (time, sequence number, _ScheduledEvent) tuples. Cancelled
+    # events are dropped when they reach the top.
+    self._timeline = []
+    self._sequence_numbers = itertools.count()
+    self._histograms = collections.defaultdict(LatencyHistogram)
+    self._callback_queue = Queue.Queue()
+    # The callback threads, and how many of them are waiting for an event that
+    # has not already been handed to them.
+    self._callback_threads = []
+    self._num_idle_callback_threads = num_callback_threads
+    self._stopped = False
+
+    self._timeline_thread = threading.Thread(target=self._run_timeline)
+    self._timeline_thread.daemon = True
+    self._timeline_thread.start()
+    with self._lock:
+      for _ in range(num_callback_threads):
+        self._start_callback_thread()
+
+  def schedule(self, time_, fn, args=(), name='event', blocking=False):
+    """Schedules `fn(*args)` to be called at a wall time.
+
+    Args:
+      time_: The float wall time in seconds to call `fn` at. Events in the past
+          are run immediately.
+      fn: The function to call.
+      args: A tuple of arguments to call `fn` with.
+      name: The name of the latency histogram to record the event in.
+      blocking: If True, `fn` is called on a callback thread instead of the
+          timing thread, and may block.
+
+    Returns:
+      The scheduled event, which can be passed to `cancel`.
+
+    Raises:
+      MidiHubError: If the scheduler has been stopped.
+    """
+    event = _ScheduledEvent(time_, fn, args, name, blocking)
+    with self._lock:
+      if self._stopped:
+        raise MidiHubError('Cannot schedule events on a stopped scheduler.')
+      heapq.heappush(self._timeline,
+                     (time_, next(self._sequence_numbers), event))
+      if self._timeline[0][2] is event:
+        self._wake_cv.notify()
+    return event
+
+  def call_soon(self, fn, args=(), name='event', blocking=False):
+    """Schedules `fn(*args)` to be called as soon as possible."""
+    return self.schedule(time.time(), fn, args, name, blocking)
+
+  def cancel(self, event):
+    """Cancels a scheduled event, if it has not run yet."""
+    event.cancelled = True
+
+  @concurrency.serialized
+  def latency_histograms(self):
+    """Returns a dictionary mapping event names to `LatencyHistogram`s."""
+    return dict(self._histograms)
+
+  def stop(self, block=True):
+    """Stops the scheduler. Pending events are not run.
+
+    Args:
+      block: If True, blocks until the scheduler's threads terminate.
+    """
+    with self._lock:
+      if self._stopped:
+        return
+      self._stopped = True
+      self._wake_cv.notify()
+      threads = [self._timeline_thread] + self._callback_threads
+    for _ in threads[1:]:
+      self._callback_queue.put(None)
+    if block:
+      for thread in threads:
+        if thread is not threading.current_thread():
+          thread.join()
+
+  def _start_callback_thread(self):
+    """Starts a callback thread. Called with the lock held."""
+    thread = threading.Thread(target=self._run_callbacks)
+    thread.daemon = True
+    thread.start()
+    self._callback_threads.append(thread)
+
+  def _run_event(self, event):
+    """Records the latency of an event and runs it."""
+    with self._lock:
+      histogram = self._histograms[event.name]
+    histogram.record(time.time() - event.time)
+    try:
+      event.fn(*event.args)
+    except Exception:  # pylint:disable=broad-except
+      tf.logging.error('Scheduled %s event failed:\n%s', event.name,
+                       traceback.format_exc())
+
+  def _run_timeline(self):
+    """Runs events in time order until the scheduler is stopped."""
+    while True:
+      with self._lock:
+        while True:
+          if self._stopped:
+            return
+          while self._timeline and self._timeline[0][2].cancelled:
+            heapq.heappop(self._timeline)
+          if not self._timeline:
+            self._wake_cv.wait()
+            continue
+          delta = self._timeline[0][0] - time.time()
+          if delta <= self._lookahead:
+            break
+          self._wake_cv.wait(delta - self._lookahead)
+        event_time, _, event = heapq.heappop(self._timeline)
+
+      # Spin outside of the lock so events can still be scheduled, yielding so
+      # that other threads can still handle incoming messages.
+      while time.time() < event_time:
+        time.sleep(0)
+
+      if event.cancelled:
+        continue
+      if event.blocking:
+        self._hand_over(event)
+      else:
+        self._run_event(event)
+
+  def _hand_over(self, event):
+    """Hands a blocking event to an idle callback thread, or a new one."""
+    with self._lock:
+      if self._stopped:
+        return
+      if self._num_idle_callback_threads:
+        self._num_idle_callback_threads -= 1
+      else:
+        self._start_callback_thread()
+    self._callback_queue.put(event)
+
+  def _run_callbacks(self):
+    """Runs blocking events handed over by the timing thread."""
+    while True:
+      event = self._callback_queue.get()
+      if event is None:
+        return
+      if not event.cancelled:
+        self._run_event(event)
+      with self._lock:
+        self._num_idle_callback_threads += 1
+
+
+class _ScheduledTask(object):
+  """Base class for objects whose work is run by a `MidiScheduler`.
+
+  Provides the `start`, `join` and `is_alive` methods of the threads these
+  objects used to be. If no scheduler is given, the task creates its own and
+  stops it once finished.
+
+  Args:
+    scheduler: The MidiScheduler to run on, or None.
+  """
+
+  def __init__(self, scheduler=None):
+    self._owns_scheduler = scheduler is None
+    self._scheduler = MidiScheduler() if scheduler is None else scheduler
+    # Lock for serialization.
+    self._lock = threading.RLock()
+    self._started = False
+    self._finished = threading.Event()
+
+  def start(self):
+    """Starts the task.
+
+    Raises:
+      RuntimeError: If called more than once.
+    """
+    with self._lock:
+      if self._started:
+        raise RuntimeError('Tasks can only be started once.')
+      self._started = True
+      self._start()
+
+  def is_alive(self):
+    """Returns whether the task has started and not yet finished."""
+    return self._started and not self._finished.is_set()
+
+  def join(self, timeout=None):
+    """Blocks until the task finishes or the optional timeout occurs."""
+    if not self._started:
+      raise RuntimeError('Cannot join a task before it is started.')
+    self._finished.wait(timeout)
+
+  def _start(self):
+    """Schedules the first events. Called with the lock held."""
+    raise NotImplementedError
+
+  def _finish(self):
+    """Marks the task finished. Called with the lock held."""
+    if self._finished.is_set():
+      return
+    self._finished.set()
+    if self._owns_scheduler:
+      # Stop once the events that are already due, such as final callbacks,
+      # have been run.
+      self._scheduler.call_soon(self._scheduler.stop, args=(False,))
+
+
+class Metronome(_ScheduledTask):
+  """A MIDI metronome run by a `MidiScheduler`.
 
   Args:
     outport: The Mido port for sending messages.
@@ -193,8 +510,8 @@ class Metronome(threading.Thread):
         used in place of a MidiSignal to output nothing on a given tick.
     duration: The duration of the metronome's tick.
     channel: The MIDI channel to output on.
+    scheduler: The MidiScheduler to run on, or None to use a private one.
   """
-  daemon = True
 
   def __init__(self,
                outport,
@@ -204,12 +521,18 @@ class Metronome(threading.Thread):
                program=_DEFAULT_METRONOME_PROGRAM,
                signals=None,
                duration=_DEFAULT_METRONOME_TICK_DURATION,
-               channel=None):
+               channel=None,
+               scheduler=None):
+    super(Metronome, self).__init__(scheduler)
     self._outport = outport
+    # The scheduled event for the next tick, or None.
+    self._tick_event = None
+    # The number of scheduled tick note_off events that have not been sent.
+    self._pending_note_offs = 0
     self.update(
         qpm, start_time, stop_time, program, signals, duration, channel)
-    super(Metronome, self).__init__()
 
+  @concurrency.serialized
   def update(self,
              qpm,
              start_time,
@@ -218,9 +541,7 @@ class Metronome(threading.Thread):
              signals=None,
              duration=_DEFAULT_METRONOME_TICK_DURATION,
              channel=None):
-    """Updates Metronome options."""
-    # Locking is not required since variables are independent and assignment is
-    # atomic.
+    """Updates Metronome options, rescheduling the next tick."""
     self._channel = _DEFAULT_METRONOME_CHANNEL if channel is None else channel
 
     # Set the program number for the channels.
@@ -236,33 +557,63 @@ class Metronome(threading.Thread):
       self._messages = [s.to_message() if s else None for s in signals]
     self._duration = duration
 
-  def run(self):
-    """Sends message on the qpm interval until stop signal received."""
-    sleeper = concurrency.Sleeper()
-    while True:
-      now = time.time()
-      tick_number = max(0, int((now - self._start_time) // self._period) + 1)
-      tick_time = tick_number * self._period + self._start_time
+    if self._started and not self._finished.is_set():
+      self._schedule_tick()
 
-      if self._stop_time is not None and self._stop_time < tick_time:
-        break
+  def _start(self):
+    self._schedule_tick()
 
-      sleeper.sleep_until(tick_time)
+  def _schedule_tick(self, min_tick_number=0):
+    """Schedules the next tick from now, or finishes if past the stop time."""
+    if self._tick_event is not None:
+      self._scheduler.cancel(self._tick_event)
+      self._tick_event = None
 
-      metric_position = tick_number % len(self._messages)
-      tick_message = self._messages[metric_position]
+    now = time.time()
+    tick_number = max(min_tick_number,
+                      int((now - self._start_time) // self._period) + 1)
+    tick_time = tick_number * self._period + self._start_time
 
-      if tick_message is None:
-        continue
+    if self._stop_time is not None and self._stop_time < tick_time:
+      self._maybe_finish()
+      return
+
+    self._tick_event = self._scheduler.schedule(
+        tick_time, self._tick, args=(tick_number, tick_time), name='metronome')
+
+  @concurrency.serialized
+  def _tick(self, tick_number, tick_time):
+    """Sends the message for a tick and schedules the next one."""
+    self._tick_event = None
 
-      tick_message.channel = self._channel
+    metric_position = tick_number % len(self._messages)
+    tick_message = self._messages[metric_position]
+
+    if tick_message is not None:
+      tick_message = tick_message.copy(channel=self._channel)
       self._outport.send(tick_message)
 
       if tick_message.type == 'note_on':
-        sleeper.sleep(self._duration)
         end_tick_message = mido.Message(
             'note_off', note=tick_message.note, channel=self._channel)
-        self._outport.send(end_tick_message)
+        self._pending_note_offs += 1
+        self._scheduler.schedule(
+            tick_time + self._duration, self._end_tick,
+            args=(end_tick_message,), name='metronome')
+
+    self._schedule_tick(min_tick_number=tick_number + 1)
+
+  @concurrency.serialized
+  def _end_tick(self, end_tick_message):
+    """Sends the note_off message ending a tick."""
+    self._outport.send(end_tick_message)
+    self._pending_note_offs -= 1
+    self._maybe_finish()
+
+  def _maybe_finish(self):
+    """Finishes once no ticks or tick endings remain scheduled."""
+    if self._tick_event is None and not self._pending_note_offs:
+      self._finish()
 
   def stop(self, stop_time=0, block=True):
     """Signals for the metronome to stop.
@@ -270,19 +621,27 @@ class Metronome(threading.Thread):
     Args:
       stop_time: The float wall time in seconds after which the metronome should
           stop. By default, stops at next tick.
-      block: If true, blocks until thread terminates.
+      block: If true, blocks until the metronome stops.
     """
-    self._stop_time = stop_time
+    with self._lock:
+      self._stop_time = stop_time
+      if not self._started:
+        return
+      if self._tick_event is not None and stop_time < self._tick_event.time:
+        self._scheduler.cancel(self._tick_event)
+        self._tick_event = None
+      self._maybe_finish()
     if block:
       self.join()
 
 
-class MidiPlayer(threading.Thread):
-  """A thread for playing back a NoteSequence proto via MIDI.
+class MidiPlayer(_ScheduledTask):
+  """Plays back a NoteSequence proto via MIDI using a `MidiScheduler`.
 
   The NoteSequence times must be based on the wall time. The playhead matches
   the wall clock. The playback sequence may be updated at any time if
-  `allow_updates` is set to True.
+  `allow_updates` is set to True; only the next message is ever scheduled, so
+  an update simply replaces it.
 
   Args:
     outport: The Mido port for sending messages.
@@ -290,28 +649,28 @@ class MidiPlayer(threading.Thread):
     start_time: The float time before which to strip events. Defaults to
         construction time. Events before this time will be sent immediately on
         start.
-    allow_updates: If False, the thread will terminate after playback of
+    allow_updates: If False, the player will finish after playback of
         `sequence` completes and calling `update_sequence` will result in an
-        exception. Otherwise, the the thread will stay alive until `stop` is
+        exception. Otherwise, the the player will stay alive until `stop` is
         called, allowing for additional updates via `update_sequence`.
     channel: The MIDI channel to send playback events.
     offset: The float time in seconds to adjust the playback event times by.
+    scheduler: The MidiScheduler to run on, or None to use a private one.
   """
 
   def __init__(self, outport, sequence, start_time=time.time(),
-               allow_updates=False, channel=0, offset=0.0):
+               allow_updates=False, channel=0, offset=0.0, scheduler=None):
+    super(MidiPlayer, self).__init__(scheduler)
     self._outport = outport
     self._channel = channel
     self._offset = offset
 
     # Set of notes (pitches) that are currently on.
     self._open_notes = set()
-    # Lock for serialization.
-    self._lock = threading.RLock()
-    # A control variable to signal when the sequence has been updated.
-    self._update_cv = threading.Condition(self._lock)
     # The queue of mido.Message objects to send, sorted by ascending time.
     self._message_queue = collections.deque()
+    # The scheduled event for the next message, or None.
+    self._next_event = None
     # An event that is set when `stop` has been called.
     self._stop_signal = threading.Event()
 
@@ -322,8 +681,6 @@ class MidiPlayer(threading.Thread):
     # We now make whether we allow updates dependent on the argument.
     self._allow_updates = allow_updates
 
-    super(MidiPlayer, self).__init__()
-
   @concurrency.serialized
   def update_sequence(self, sequence, start_time=None):
     """Updates sequence being played by the MidiPlayer.
@@ -378,41 +735,45 @@ class MidiPlayer(threading.Thread):
 
     self._message_queue = collections.deque(
         sorted(new_message_list, key=lambda msg: (msg.time, msg.note)))
-    self._update_cv.notify()
+    if self._started:
+      self._schedule_next_message()
 
-  @concurrency.serialized
-  def run(self):
-    """Plays messages in the queue until empty and _allow_updates is False."""
+  def _start(self):
     # Assumes model where NoteSequence is time-stamped with wall time.
     # TODO(hanzorama): Argument to allow initial start not at sequence start?
-
     while self._message_queue and self._message_queue[0].time < time.time():
       self._message_queue.popleft()
+    self._schedule_next_message()
+
+  def _schedule_next_message(self):
+    """Schedules the message at the head of the queue, replacing any other."""
+    if self._next_event is not None:
+      self._scheduler.cancel(self._next_event)
+      self._next_event = None
+    if self._message_queue:
+      self._next_event = self._scheduler.schedule(
+          self._message_queue[0].time, self._send_messages, name='playback')
+    elif not self._allow_updates:
+      self._finish()
 
-    while True:
-      while self._message_queue:
-        delta = self._message_queue[0].time - time.time()
-        if delta > 0:
-          self._update_cv.wait(timeout=delta)
-        else:
-          msg = self._message_queue.popleft()
-          if msg.type == 'note_on':
-            self._open_notes.add(msg.note)
-          elif msg.type == 'note_off':
-            self._open_notes.discard(msg.note)
-          self._outport.send(msg)
-
-      # Either keep player alive and wait for sequence update, or return.
-      if self._allow_updates:
-        self._update_cv.wait()
-      else:
-        break
+  @concurrency.serialized
+  def _send_messages(self):
+    """Sends all messages that are due and schedules the next one."""
+    self._next_event = None
+    while self._message_queue and self._message_queue[0].time <= time.time():
+      msg = self._message_queue.popleft()
+      if msg.type == 'note_on':
+        self._open_notes.add(msg.note)
+      elif msg.type == 'note_off':
+        self._open_notes.discard(msg.note)
+      self._outport.send(msg)
+    self._schedule_next_message()
 
   def stop(self, block=True):
     """Signals for the playback to stop and ends all open notes.
 
     Args:
-      block: If true, blocks until thread terminates.
+      block: If true, blocks until playback finishes.
     """
     with self._lock:
       if not self._stop_signal.is_set():
@@ -424,13 +785,170 @@ class MidiPlayer(threading.Thread):
         for note in self._open_notes:
           self._message_queue.append(
               mido.Message(type='note_off', note=note, time=time.time()))
-        self._update_cv.notify()
-    if block:
+        if self._started:
+          self._schedule_next_message()
+    if block and self._started:
       self.join()
 
 
-class MidiCaptor(threading.Thread):
-  """Base class for thread that captures MIDI into a NoteSequence proto.
+class _PeriodicCaptureCallback(object):
+  """Calls a function with the captured sequence every period.
+
+  Runs on a `MidiScheduler` as a blocking event. Like `MidiCaptor.iterate`, if
+  a call takes longer than a period, the next call happens as soon as it
+  completes, and whole periods that were missed are skipped with a warning.
+  Once the captor terminates, the function is called with the final captured
+  sequence.
+
+  Args:
+    captor: The MidiCaptor whose captured sequence to pass to `fn`.
+    fn: The callback function to call, passing in the captured sequence.
+    period: A float period in seconds.
+    scheduler: The MidiScheduler to run on.
+  """
+
+  def __init__(self, captor, fn, period, scheduler):
+    self._captor = captor
+    self._fn = fn
+    self._period = period
+    self._scheduler = scheduler
+    # Held while calling `fn`, so calls never overlap.
+    self._lock = threading.Lock()
+    self._stop_signal = threading.Event()
+    self._next_time = time.time() + period
+    self._scheduler.schedule(self._next_time, self._call,
+                             name='capture_callback', blocking=True)
+
+  def _call(self):
+    """Calls the callback and schedules the next call."""
+    with self._lock:
+      if self._stop_signal.is_set():
+        return
+
+      # Acquire lock so that `captured_sequence` will be called before the
+      # captor terminates, if it has not already done so.
+      with self._captor._lock:  # pylint:disable=protected-access
+        alive = self._captor.is_alive()
+        if alive:
+          captured_sequence = self._captor.captured_sequence(self._next_time)
+      if not alive:
+        captured_sequence = self._captor.captured_sequence()
+        self._stop_signal.set()
+
+      self._fn(captured_sequence)
+      if not alive:
+        return
+
+      self._next_time += self._period
+      skipped_periods = (time.time() - self._next_time) // self._period
+      if skipped_periods > 0:
+        tf.logging.warn(
+            'Skipping %d %.3fs period(s) to catch up on callback.',
+            skipped_periods, self._period)
+        self._next_time += skipped_periods * self._period
+      try:
+        self._scheduler.schedule(self._next_time, self._call,
+                                 name='capture_callback', blocking=True)
+      except MidiHubError:
+        # The MidiHub was shut down while the callback ran.
+        pass
+
+  def finish(self):
+    """Calls the callback with the final sequence as soon as possible."""
+    try:
+      self._scheduler.call_soon(self._call, name='capture_callback',
+                                blocking=True)
+    except MidiHubError:
+      # The MidiHub was shut down.
+      pass
+
+  def stop(self):
+    """Stops calling the callback, without blocking."""
+    self._stop_signal.set()
+
+
+class _SignalCaptureCallback(object):
+  """Calls a function with the captured sequence at every signal message.
+
+  Runs on a `MidiScheduler` as blocking events. Like `MidiCaptor.iterate`, the
+  calls are made one at a time in the order of the signal messages, and once
+  the captor terminates the function is called with the final captured
+  sequence.
+
+  Args:
+    captor: The MidiCaptor whose captured sequence to pass to `fn`.
+    fn: The callback function to call, passing in the captured sequence.
+    scheduler: The MidiScheduler to run on.
+  """
+
+  def __init__(self, captor, fn, scheduler):
+    self._captor = captor
+    self._fn = fn
+    self._scheduler = scheduler
+    self._lock = threading.Lock()
+    self._stop_signal = threading.Event()
+    # The end times of the captured sequences still to be passed to `fn`, with
+    # None for the final sequence.
+    self._pending_end_times = collections.deque()
+    # Whether an event for calling `fn` is scheduled or running.
+    self._calling = False
+
+  def signal(self, end_time):
+    """Calls the callback with the sequence captured up to `end_time`."""
+    self._add_pending(end_time)
+
+  def finish(self):
+    """Calls the callback with the final sequence."""
+    self._add_pending(None)
+
+  def _add_pending(self, end_time):
+    with self._lock:
+      self._pending_end_times.append(end_time)
+      if self._calling:
+        return
+      self._calling = True
+    try:
+      self._scheduler.call_soon(self._call_pending, name='capture_callback',
+                                blocking=True)
+    except MidiHubError:
+      # The MidiHub was shut down.
+      pass
+
+  def _call_pending(self):
+    """Calls the callback for each pending signal, in order."""
+    while True:
+      with self._lock:
+        if not self._pending_end_times or self._stop_signal.is_set():
+          self._calling = False
+          return
+        end_time = self._pending_end_times.popleft()
+
+      if end_time is None:
+        # Wait for the captor to set its final captured sequence.
+        self._captor.join()
+        captured_sequence = self._captor.captured_sequence()
+        self._stop_signal.set()
+      else:
+        # Acquire lock so that `captured_sequence` will be called before the
+        # captor terminates, if it has not already done so.
+        with self._captor._lock:  # pylint:disable=protected-access
+          if not self._captor.is_alive():
+            continue
+          captured_sequence = self._captor.captured_sequence(end_time)
+      self._fn(captured_sequence)
+
+  def stop(self):
+    """Stops calling the callback, without blocking."""
+    self._stop_signal.set()
+
+
+class MidiCaptor(_ScheduledTask):
+  """Base class for capturing MIDI into a NoteSequence proto.
+
+  Received messages are captured by events on a `MidiScheduler`, which also
+  stops the capture at the stop time and runs the registered callbacks, so
+  capturing does not need a thread of its own. Keeps the `start`, `join` and
+  `is_alive` methods of the thread it used to be.
 
   If neither `stop_time` nor `stop_signal` are provided as arguments, the
   capture will continue until the `stop` method is called.
@@ -442,28 +960,32 @@ class MidiCaptor(threading.Thread):
     stop_time: The float wall time in seconds when the capture is to be stopped
         or None.
     stop_signal: A MidiSignal to use as a signal to stop capture.
+    scheduler: The MidiScheduler to run on, or None to use a private one.
   """
   _metaclass__ = abc.ABCMeta
 
-  # A message that is used to wake the consumer thread.
+  # A message that is put on the `iterate` queues once capture ends.
   _WAKE_MESSAGE = None
 
-  def __init__(self, qpm, start_time=0, stop_time=None, stop_signal=None):
-    # A lock for synchronization.
-    self._lock = threading.RLock()
-    self._receive_queue = Queue.Queue()
+  def __init__(self, qpm, start_time=0, stop_time=None, stop_signal=None,
+               scheduler=None):
+    super(MidiCaptor, self).__init__(scheduler)
     self._captured_sequence = music_pb2.NoteSequence()
     self._captured_sequence.tempos.add(qpm=qpm)
     self._start_time = start_time
     self._stop_time = stop_time
+    # The scheduled event for stopping at `stop_time`, or None.
+    self._stop_event = None
     self._stop_regex = re.compile(str(stop_signal))
     # A set of active MidiSignals being used by iterators.
     self._iter_signals = []
+    # Signal callbacks, as (compiled MidiSignal regex, callback) tuples.
+    self._signal_callbacks = []
     # An event that is set when `stop` has been called.
     self._stop_signal = threading.Event()
-    # Active callback threads keyed by unique thread name.
+    # Active callbacks keyed by unique name.
     self._callbacks = {}
-    super(MidiCaptor, self).__init__()
+    self._callback_names = ('Callback-%d' % i for i in itertools.count())
 
   @property
   @concurrency.serialized
@@ -493,19 +1015,20 @@ class MidiCaptor(threading.Thread):
     self._stop_time_unsafe = value
 
   def receive(self, msg):
-    """Adds received mido.Message to the queue for capture.
+    """Schedules a received mido.Message for capture.
 
     Args:
-      msg: The incoming mido.Message object to add to the queue for capture. The
-           time attribute is assumed to be pre-set with the wall time when the
-           message was received.
+      msg: The incoming mido.Message object to capture. The time attribute is
+           assumed to be pre-set with the wall time when the message was
+           received.
     Raises:
       MidiHubError: When the received message has an empty time attribute.
     """
     if not msg.time:
       raise MidiHubError(
           'MidiCaptor received message with empty time attribute: %s' % msg)
-    self._receive_queue.put(msg)
+    self._scheduler.call_soon(self._receive_message, args=(msg,),
+                              name='capture')
 
   @abc.abstractmethod
   def _capture_message(self, msg):
@@ -529,47 +1052,59 @@ class MidiCaptor(threading.Thread):
     new_note.is_drum = (msg.channel == _DRUM_CHANNEL)
     return new_note
 
-  def run(self):
-    """Captures incoming messages until stop time or signal received."""
-    while True:
-      timeout = None
-      stop_time = self._stop_time
-      if stop_time is not None:
-        timeout = stop_time - time.time()
-        if timeout <= 0:
-          break
-      try:
-        msg = self._receive_queue.get(block=True, timeout=timeout)
-      except Queue.Empty:
-        continue
-
-      if msg is MidiCaptor._WAKE_MESSAGE:
-        continue
+  def _start(self):
+    self._schedule_stop()
 
-      if msg.time <= self._start_time:
-        continue
+  def _schedule_stop(self):
+    """Schedules the end of capture at the stop time, if there is one."""
+    if self._stop_event is not None:
+      self._scheduler.cancel(self._stop_event)
+      self._stop_event = None
+    if self._stop_time is not None:
+      self._stop_event = self._scheduler.schedule(
+          self._stop_time, self._stop_capture, name='capture')
 
-      if self._stop_regex.match(str(msg)) is not None:
-        break
+  @concurrency.serialized
+  def _receive_message(self, msg):
+    """Captures a message, or stops capture if it is the stop signal."""
+    if not self.is_alive() or msg.time <= self._start_time:
+      return
 
-      with self._lock:
-        msg_str = str(msg)
-        for regex, queue in self._iter_signals:
-          if regex.match(msg_str) is not None:
-            queue.put(msg.copy())
+    msg_str = str(msg)
+    if self._stop_regex.match(msg_str) is not None:
+      stop_time = self._stop_time
+      self._finish_capture(stop_time if stop_time is not None else msg.time)
+      return
 
-      self._capture_message(msg)
+    for regex, queue in self._iter_signals:
+      if regex.match(msg_str) is not None:
+        queue.put(msg.copy())
+    for regex, callback in self._signal_callbacks:
+      if regex.match(msg_str) is not None:
+        callback.signal(msg.time)
 
-    stop_time = self._stop_time
-    end_time = stop_time if stop_time is not None else msg.time
+    self._capture_message(msg)
 
-    # Acquire lock to avoid race condition with `iterate`.
-    with self._lock:
-      # Set final captured sequence.
-      self._captured_sequence = self.captured_sequence(end_time)
-      # Wake up all generators.
-      for regex, queue in self._iter_signals:
-        queue.put(MidiCaptor._WAKE_MESSAGE)
+  @concurrency.serialized
+  def _stop_capture(self):
+    """Stops capture at the stop time."""
+    self._stop_event = None
+    if self.is_alive():
+      self._finish_capture(self._stop_time)
+
+  def _finish_capture(self, end_time):
+    """Sets the final captured sequence and finishes. Called with the lock."""
+    if self._stop_event is not None:
+      self._scheduler.cancel(self._stop_event)
+      self._stop_event = None
+    # Set final captured sequence.
+    self._captured_sequence = self.captured_sequence(end_time)
+    # Wake up all generators.
+    for regex, queue in self._iter_signals:
+      queue.put(MidiCaptor._WAKE_MESSAGE)
+    for callback in self._callbacks.values():
+      callback.finish()
+    self._finish()
 
   def stop(self, stop_time=None, block=True):
     """Ends capture and truncates the captured sequence at `stop_time`.
@@ -578,7 +1113,7 @@ class MidiCaptor(threading.Thread):
       stop_time: The float time in seconds to stop the capture, or None if it
          should be stopped now. May be in the past, in which case the captured
          sequence will be truncated appropriately.
-      block: If True, blocks until the thread terminates.
+      block: If True, blocks until the capture stops.
     Raises:
       MidiHubError: When called multiple times with a `stop_time`.
     """
@@ -591,22 +1126,22 @@ class MidiCaptor(threading.Thread):
       else:
         self._stop_signal.set()
         self._stop_time = time.time() if stop_time is None else stop_time
-        # Force the thread to wake since we've updated the stop time.
-        self._receive_queue.put(MidiCaptor._WAKE_MESSAGE)
+        if self.is_alive():
+          self._schedule_stop()
     if block:
       self.join()
 
   def captured_sequence(self, end_time=None):
     """Returns a copy of the current captured sequence.
 
-    If called before the thread terminates, `end_time` is required and any open
+    If called before the capture terminates, `end_time` is required and any open
     notes will have their end time set to it, any notes starting after it will
     be removed, and any notes ending after it will be truncated. `total_time`
     will also be set to `end_time`.
 
     Args:
       end_time: The float time in seconds to close any open notes and after
-          which to close or truncate notes, if the thread is still alive.
+          which to close or truncate notes, if the capture is still running.
           Otherwise, must be None.
 
     Returns:
@@ -614,8 +1149,8 @@ class MidiCaptor(threading.Thread):
       at and later notes removed or truncated to `end_time`.
 
     Raises:
-      MidiHubError: When the thread is alive and `end_time` is None or the
-         thread is terminated and `end_time` is not None.
+      MidiHubError: When the capture is running and `end_time` is None or the
+         capture is terminated and `end_time` is not None.
     """
     # Make a copy of the sequence currently being captured.
     current_captured_sequence = music_pb2.NoteSequence()
@@ -688,13 +1223,13 @@ class MidiCaptor(threading.Thread):
       else:
         signal_msg = queue.get()
         if signal_msg is MidiCaptor._WAKE_MESSAGE:
-          # This is only recieved when the thread is in the process of
+          # This is only recieved when the capture is in the process of
           # terminating. Wait until it is done before yielding the final
           # sequence.
           self.join()
           break
         end_time = signal_msg.time
-      # Acquire lock so that `captured_sequence` will be called before thread
+      # Acquire lock so that `captured_sequence` will be called before capture
       # terminates, if it has not already done so.
       with self._lock:
         if not self.is_alive():
@@ -710,12 +1245,14 @@ class MidiCaptor(threading.Thread):
     current captured NoteSequence.
 
     Exactly one of `signal` or `period` must be specified. Continues until the
-    captor thread terminates, at which point the callback is called with the
-    final sequence, or `cancel_callback` is called.
+    captor terminates, at which point the callback is called with the final
+    sequence, or `cancel_callback` is called.
 
     If callback execution is longer than a period, immediately calls upon
     completion and logs a warning.
 
+    Callbacks run on the captor's MidiScheduler, one call at a time.
+
     Args:
       fn: The callback function to call, passing in the captured sequence.
       signal: A MidiSignal to use as a signal to call `fn` on the current
@@ -724,53 +1261,44 @@ class MidiCaptor(threading.Thread):
           None.
 
     Returns:
-      The unqiue name of the callback thread to enable cancellation.
+      The unqiue name of the callback to enable cancellation.
 
     Raises:
       MidiHubError: If neither `signal` nor `period` or both are specified.
     """
-
-    class IteratorCallback(threading.Thread):
-      """A thread for executing a callback on each iteration."""
-
-      def __init__(self, iterator, fn):
-        self._iterator = iterator
-        self._fn = fn
-        self._stop_signal = threading.Event()
-        super(IteratorCallback, self).__init__()
-
-      def run(self):
-        """Calls the callback function for each iterator value."""
-        for captured_sequence in self._iterator:
-          if self._stop_signal.is_set():
-            break
-          self._fn(captured_sequence)
-
-      def stop(self):
-        """Stops the thread on next iteration, without blocking."""
-        self._stop_signal.set()
-
-    t = IteratorCallback(self.iterate(signal, period), fn)
-    t.start()
+    if (signal, period).count(None) != 1:
+      raise MidiHubError(
+          'Exactly one of `signal` or `period` must be provided to '
+          '`register_callback` call.')
 
     with self._lock:
-      assert t.name not in self._callbacks
-      self._callbacks[t.name] = t
-
-    return t.name
+      name = next(self._callback_names)
+      if period is not None:
+        callback = _PeriodicCaptureCallback(self, fn, period, self._scheduler)
+      else:
+        callback = _SignalCaptureCallback(self, fn, self._scheduler)
+        self._signal_callbacks.append((re.compile(str(signal)), callback))
+        if self._finished.is_set():
+          callback.finish()
+      self._callbacks[name] = callback
+    return name
 
   @concurrency.serialized
   def cancel_callback(self, name):
     """Cancels the callback with the given name.
 
-    While the thread may continue to run until the next iteration, the callback
-    function will not be executed.
+    While a call that has already started will complete, the callback function
+    will not be executed again.
 
     Args:
-      name: The unique name of the callback thread to cancel.
+      name: The unique name of the callback to cancel.
     """
-    self._callbacks[name].stop()
-    del self._callbacks[name]
+    callback = self._callbacks.pop(name)
+    callback.stop()
+    self._signal_callbacks = [
+        (regex, signal_callback)
+        for regex, signal_callback in self._signal_callbacks
+        if signal_callback is not callback]
 
 
 class MonophonicMidiCaptor(MidiCaptor):
@@ -871,10 +1399,15 @@ class MidiHub(object):
     playback_channel: The MIDI channel to send playback events.
     playback_offset: The float time in seconds to adjust the playback event
         times by.
+    lookahead: The float time in seconds before each scheduled event at which
+        the scheduler stops waiting and spins until the event time.
   """
 
   def __init__(self, input_midi_ports, output_midi_ports, texture_type,
-               passthrough=True, playback_channel=0, playback_offset=0.0):
+               passthrough=True, playback_channel=0, playback_offset=0.0,
+               lookahead=_DEFAULT_SCHEDULER_LOOKAHEAD):
+    # A single timeline for playback, metronome ticks and callbacks.
+    self._scheduler = MidiScheduler(lookahead)
     self._texture_type = texture_type
     self._passthrough = passthrough
     self._playback_channel = playback_channel
@@ -883,12 +1416,15 @@ class MidiHub(object):
     self._open_notes = set()
     # This lock is used by the serialized decorator.
     self._lock = threading.RLock()
+    # A separate lock for passthrough, so that passing messages through does
+    # not contend with the signal and capture bookkeeping.
+    self._passthrough_lock = threading.RLock()
     # A dictionary mapping a compiled MidiSignal regex to a condition variable
     # that will be notified when a matching messsage is received.
     self._signals = {}
     # A dictionary mapping a compiled MidiSignal regex to a list of functions
-    # that will be called with the triggering message in individual threads when
-    # a matching message is received.
+    # that will be called with the triggering message on the scheduler's
+    # callback threads when a matching message is received.
     self._callbacks = collections.defaultdict(list)
     # A dictionary mapping integer control numbers to most recently-received
     # integer value.
@@ -940,22 +1476,34 @@ class MidiHub(object):
       captor.join()
     for player in self._players:
       player.join()
+    self._scheduler.stop(block=False)
 
   @property
-  @concurrency.serialized
   def passthrough(self):
-    return self._passthrough
+    with self._passthrough_lock:
+      return self._passthrough
 
   @passthrough.setter
-  @concurrency.serialized
   def passthrough(self, value):
     """Sets passthrough value, closing all open notes if being disabled."""
-    if self._passthrough == value:
-      return
-    # Close all open notes.
-    while self._open_notes:
-      self._outport.send(mido.Message('note_off', note=self._open_notes.pop()))
-    self._passthrough = value
+    with self._passthrough_lock:
+      if self._passthrough == value:
+        return
+      # Close all open notes.
+      while self._open_notes:
+        self._outport.send(
+            mido.Message('note_off', note=self._open_notes.pop()))
+      self._passthrough = value
+
+  def latency_histograms(self):
+    """Returns the latencies of scheduled events.
+
+    Returns:
+      A dictionary mapping event names ('playback', 'metronome', 'capture',
+      'capture_callback' and 'signal_callback') to `LatencyHistogram`s of the
+      differences between when events were scheduled and when they ran.
+    """
+    return self._scheduler.latency_histograms()
 
   def _timestamp_and_handle_message(self, msg):
     """Stamps message with current time and passes it to the handler."""
@@ -965,7 +1513,6 @@ class MidiHub(object):
       msg.time = time.time()
     self._handle_message(msg)
 
-  @concurrency.serialized
   def _handle_message(self, msg):
     """Handles a single incoming MIDI message.
 
@@ -974,30 +1521,34 @@ class MidiHub(object):
     -Adds the message to any capture queues.
     -Passes the message through to the output port, if appropriate.
 
+    The serialization lock is only taken while signals or callbacks are
+    registered.
+
     Args:
       msg: The mido.Message MIDI message to handle.
     """
-    # Notify any threads waiting for this message.
-    msg_str = str(msg)
-    for regex in list(self._signals):
-      if regex.match(msg_str) is not None:
-        self._signals[regex].notify_all()
-        del self._signals[regex]
+    if self._signals or self._callbacks:
+      msg_str = str(msg)
+      with self._lock:
+        # Notify any threads waiting for this message.
+        for regex in list(self._signals):
+          if regex.match(msg_str) is not None:
+            self._signals[regex].notify_all()
+            del self._signals[regex]
 
-    # Call any callbacks waiting for this message.
-    for regex in list(self._callbacks):
-      if regex.match(msg_str) is not None:
-        for fn in self._callbacks[regex]:
-          threading.Thread(target=fn, args=(msg,)).start()
+        # Call any callbacks waiting for this message.
+        for regex in list(self._callbacks):
+          if regex.match(msg_str) is not None:
+            for fn in self._callbacks[regex]:
+              self._scheduler.call_soon(fn, args=(msg,),
+                                        name='signal_callback', blocking=True)
 
-        del self._callbacks[regex]
+            del self._callbacks[regex]
 
-    # Remove any captors that are no longer alive.
-    self._captors[:] = [t for t in self._captors if t.is_alive()]
-    # Add a different copy of the message to the receive queue of each live
-    # capture thread.
-    for t in self._captors:
-      t.receive(msg.copy())
+    # Hand a different copy of the message to each live captor.
+    for captor in list(self._captors):
+      if captor.is_alive():
+        captor.receive(msg.copy())
 
     # Update control values if this is a control change message.
     if msg.type == 'control_change':
@@ -1006,6 +1557,11 @@ class MidiHub(object):
       self._control_values[msg.control] = msg.value
 
     # Pass the message through to the output port, if appropriate.
+    with self._passthrough_lock:
+      self._pass_through_message(msg)
+
+  def _pass_through_message(self, msg):
+    """Passes a message through to the output port, if appropriate."""
     if not self._passthrough:
       pass
     elif self._texture_type == TextureType.POLYPHONIC:
@@ -1035,7 +1591,7 @@ class MidiHub(object):
     """Starts a MidiCaptor to compile incoming messages into a NoteSequence.
 
     If neither `stop_time` nor `stop_signal`, are provided, the caller must
-    explicitly stop the returned capture thread. If both are specified, the one
+    explicitly stop the returned captor. If both are specified, the one
     that occurs first will stop the capture.
 
     Args:
@@ -1047,14 +1603,17 @@ class MidiHub(object):
          the capture.
 
     Returns:
-      The MidiCaptor thread.
+      The MidiCaptor.
     """
     if self._texture_type == TextureType.MONOPHONIC:
       captor_class = MonophonicMidiCaptor
     else:
       captor_class = PolyphonicMidiCaptor
-    captor = captor_class(qpm, start_time, stop_time, stop_signal)
+    captor = captor_class(qpm, start_time, stop_time, stop_signal,
+                          scheduler=self._scheduler)
     with self._lock:
+      # Remove any captors that are no longer alive.
+      self._captors[:] = [t for t in self._captors if t.is_alive()]
       self._captors.append(captor)
     captor.start()
     return captor
@@ -1153,7 +1712,8 @@ class MidiHub(object):
           qpm, start_time, signals=signals, channel=channel)
     else:
       self._metronome = Metronome(
-          self._outport, qpm, start_time, signals=signals, channel=channel)
+          self._outport, qpm, start_time, signals=signals, channel=channel,
+          scheduler=self._scheduler)
       self._metronome.start()
 
   @concurrency.serialized
@@ -1182,10 +1742,11 @@ class MidiHub(object):
           allow the sequence to be updated and stay alive until `stop` is
           called.
     Returns:
-      The MidiPlayer thread handling playback to enable updating.
+      The MidiPlayer handling playback to enable updating.
     """
     player = MidiPlayer(self._outport, sequence, start_time, allow_updates,
-                        self._playback_channel, self._playback_offset)
+                        self._playback_channel, self._playback_offset,
+                        scheduler=self._scheduler)
     with self._lock:
       self._players.append(player)
     player.start()
@@ -151,6 +151,68 @@ class MidiHubTest(tf.test.TestCase):
       else:
         self.assertEqual(msg.type, 'note_off')
 
+    # Three ticks and their note_off messages.
+    latency = self.midi_hub.latency_histograms()['metronome']
+    self.assertEqual(6, latency.count)
+    self.assertLess(latency.mean_ms, 10)
+
+  def testLatencyHistogram(self):
+    histogram = midi_hub.LatencyHistogram(bucket_limits_ms=[1, 10])
+    for latency in [0.0005, 0.001, 0.002, 0.5, -0.001]:
+      histogram.record(latency)
+    self.assertEqual(5, histogram.count)
+    self.assertEqual([(1, 3), (10, 1), (float('inf'), 1)], histogram.buckets)
+    self.assertAlmostEqual(500, histogram.max_ms)
+    self.assertAlmostEqual(100.7, histogram.mean_ms)
+
+  def testMidiScheduler(self):
+    scheduler = midi_hub.MidiScheduler()
+    start_time = time.time() + 0.05
+    calls = Queue.Queue()
+
+    def fn(label):
+      calls.put((label, time.time()))
+
+    scheduler.schedule(start_time + 0.02, fn, args=('c',), name='test')
+    scheduler.schedule(start_time, fn, args=('a',), name='test')
+    cancelled = scheduler.schedule(start_time + 0.01, fn, args=('x',))
+    scheduler.schedule(start_time + 0.01, fn, args=('b',), name='test',
+                       blocking=True)
+    scheduler.cancel(cancelled)
+    time.sleep(0.1)
+    scheduler.stop()
+
+    for i, label in enumerate(['a', 'b', 'c']):
+      call_label, call_time = calls.get_nowait()
+      self.assertEqual(label, call_label)
+      self.assertAlmostEqual(start_time + 0.01 * i, call_time, delta=0.01)
+    self.assertTrue(calls.empty())
+    self.assertEqual(['test'], list(scheduler.latency_histograms()))
+    self.assertEqual(3, scheduler.latency_histograms()['test'].count)
+
+    with self.assertRaises(midi_hub.MidiHubError):
+      scheduler.schedule(time.time(), fn, args=('d',))
+
+  def testMidiScheduler_BlockingEventsDoNotWait(self):
+    scheduler = midi_hub.MidiScheduler(num_callback_threads=1)
+    release = threading.Event()
+    started = Queue.Queue()
+
+    def fn(label):
+      started.put(label)
+      release.wait(1.0)
+
+    start_time = time.time() + 0.05
+    for label in ['a', 'b', 'c']:
+      scheduler.schedule(start_time, fn, args=(label,), blocking=True)
+    time.sleep(0.2)
+
+    # Each blocking event got its own thread rather than waiting for the
+    # blocked ones to return.
+    self.assertEqual(3, started.qsize())
+    release.set()
+    scheduler.stop()
+
   def testStartPlayback_NoUpdates(self):
     # Use a time in the past to test handling of past notes.
     start_time = time.time() - 0.05
@@ -636,6 +698,26 @@ class MidiHubTest(tf.test.TestCase):
         [Note(1, 64, 2, 5), Note(2, 64, 3, 4), Note(3, 64, 4, end_time)])
     self.assertProtoEquals(captured_seqs[1], expected_seq)
 
+  def testStartCapture_Callback_Signal(self):
+    start_time = 1.0
+    captor = self.midi_hub.start_capture(
+        120, start_time,
+        stop_signal=midi_hub.MidiSignal(type='control_change', control=1))
+
+    captured_seqs = []
+    captor.register_callback(
+        captured_seqs.append, signal=midi_hub.MidiSignal(type='note_off'))
+
+    for msg in self.capture_messages[:-1]:
+      threading.Timer(0.2 * msg.time, self.port.callback, args=[msg]).start()
+    captor.join()
+    time.sleep(0.1)
+
+    # Called at each note_off and then with the final sequence.
+    self.assertEqual([3, 4, 5, 6], [seq.total_time for seq in captured_seqs])
+    self.assertProtoEquals(captor.captured_sequence(), captured_seqs[-1])
+    self.assertIn('capture', self.midi_hub.latency_histograms())
+
   def testPassThrough_Poly(self):
     self.midi_hub.passthrough = False
     self.send_capture_messages()
@@ -41,6 +41,11 @@ flags.DEFINE_string('fold_index', None,
 flags.DEFINE_string('unit', None, 'Note or frame or example.')
 flags.DEFINE_integer('ensemble_size', 5,
                      'Number of ensemble members to average.')
+flags.DEFINE_integer('batch_size', 128,
+                     'Number of frames to evaluate per model call when unit is '
+                     'frame. Frames of consecutive pieces of the same length '
+                     'share batches, and long pieces are split across '
+                     'batches. If 0, each piece is evaluated in one batch.')
 flags.DEFINE_bool('chronological', False,
                   'Indicates evaluation should proceed in chronological order.')
 flags.DEFINE_string('checkpoint', None, 'Path to checkpoint directory.')
@@ -78,7 +83,8 @@ def main(unused_argv):
     tf.gfile.MakeDirs(eval_logdir)
 
   evaluator = lib_evaluation.BaseEvaluator.make(
-      FLAGS.unit, wmodel=wmodel, chronological=FLAGS.chronological)
+      FLAGS.unit, wmodel=wmodel, chronological=FLAGS.chronological,
+      batch_size=FLAGS.batch_size or None)
   evaluator = lib_evaluation.EnsemblingEvaluator(evaluator, FLAGS.ensemble_size)
 
   if not FLAGS.sample_npy_path and FLAGS.fold is None:
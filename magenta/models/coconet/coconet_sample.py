@@ -50,6 +50,14 @@ flags.DEFINE_string("checkpoint", None, "Path to checkpoint file")
 flags.DEFINE_bool("midi_io", False, "Run in midi in and midi out mode."
                   "Does not write any midi or logs to disk.")
 flags.DEFINE_bool("tfsample", True, "Run sampling in Tensorflow graph.")
+flags.DEFINE_float("gibbs_convergence_threshold", None,
+                   "If set, stop resampling an example in Gibbs sampling once "
+                   "at most this fraction of its masked-out variables changes "
+                   "per step for gibbs_convergence_patience steps in a row. "
+                   "Only applies when tfsample is False.")
+flags.DEFINE_integer("gibbs_convergence_patience", 10,
+                     "Number of consecutive low-change Gibbs steps after which "
+                     "an example is considered converged.")
 
 
 def main(unused_argv):
@@ -335,6 +343,11 @@ class BaseStrategy(lib_util.Factory):
   # convenience function to avoid passing the same arguments over and over
   def make_sampler(self, key, **kwargs):
     kwargs.update(wmodel=self.wmodel, logger=self.logger)
+    if key == "gibbs":
+      kwargs.setdefault("convergence_threshold",
+                        FLAGS.gibbs_convergence_threshold)
+      kwargs.setdefault("convergence_patience",
+                        FLAGS.gibbs_convergence_patience)
     return lib_sampling.BaseSampler.make(key, **kwargs)
 
 
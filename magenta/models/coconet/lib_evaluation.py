@@ -17,6 +17,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import itertools
 import time
 
 from magenta.models.coconet import lib_tfutil
@@ -46,22 +48,10 @@ def evaluate(evaluator, pianorolls):
   example_losses = []
   unit_losses = []
 
-  for pi, pianoroll in enumerate(pianorolls):
-    tf.logging.info("evaluating piece %d", pi)
-    start_time = time.time()
-
-    unit_loss = -evaluator(pianoroll)
-    example_loss = np.mean(unit_loss)
-
+  for example_loss, unit_loss in evaluate_iter(evaluator, pianorolls):
     example_losses.append(example_loss)
     unit_losses.append(unit_loss)
 
-    duration = (time.time() - start_time) / 60.
-    _report(unit_loss, prefix="%i %5.2fmin " % (pi, duration))
-
-    if np.isinf(example_loss):
-      break
-
   _report(example_losses, prefix="FINAL example-level ")
   _report(unit_losses, prefix="FINAL unit-level ")
 
@@ -72,6 +62,35 @@ def evaluate(evaluator, pianorolls):
   return rval
 
 
+def evaluate_iter(evaluator, pianorolls):
+  """Evaluate a sequence of pianorolls, yielding losses as pieces finish.
+
+  Pianorolls are consumed lazily, so `pianorolls` may be a generator. The
+  evaluator may batch several pieces together, so a piece is reported once the
+  evaluator has finished it rather than as soon as it is read. Evaluation stops
+  after the first piece with an infinite example loss.
+
+  Args:
+    evaluator: an instance of BaseEvaluator
+    pianorolls: iterable of pianorolls to evaluate
+
+  Yields:
+    An `(example_loss, unit_loss)` tuple for each piece, in input order.
+  """
+  start_time = time.time()
+  for pi, unit_lls in enumerate(evaluator.evaluate_many(pianorolls)):
+    unit_loss = -unit_lls
+    example_loss = np.mean(unit_loss)
+
+    duration = (time.time() - start_time) / 60.
+    _report(unit_loss, prefix="%i %5.2fmin " % (pi, duration))
+    yield example_loss, unit_loss
+
+    if np.isinf(example_loss):
+      break
+    start_time = time.time()
+
+
 def _report(losses, prefix=""):
   tf.logging.info("%s loss %s", prefix, _statstr(_flatcat(losses)))
 
@@ -99,15 +118,19 @@ def _flatcat(xs):
 class BaseEvaluator(lib_util.Factory):
   """Evaluator base class."""
 
-  def __init__(self, wmodel, chronological):
+  def __init__(self, wmodel, chronological, batch_size=None):
     """Initialize BaseEvaluator instance.
 
     Args:
       wmodel: WrappedModel instance
       chronological: whether to evaluate in chronological order or in any order
+      batch_size: maximum number of examples per call to the model, for
+        evaluators that support it. If None, each piece is evaluated in a
+        single batch.
     """
     self.wmodel = wmodel
     self.chronological = chronological
+    self.batch_size = batch_size
 
     def predictor(pianorolls, masks):
       p = self.wmodel.sess.run(
@@ -139,6 +162,18 @@ class BaseEvaluator(lib_util.Factory):
     """
     raise NotImplementedError()
 
+  def evaluate_many(self, pianorolls):
+    """Evaluate a sequence of pianorolls.
+
+    Args:
+      pianorolls: iterable of pianorolls, each shaped (tt, pp, ii)
+
+    Yields:
+      unit log-likelihoods for each pianoroll, in order
+    """
+    for pianoroll in pianorolls:
+      yield self(pianoroll)
+
   def _update_lls(self, lls, x, pxhat, t, d):
     """Update accumulated log-likelihoods.
 
@@ -153,6 +188,21 @@ class BaseEvaluator(lib_util.Factory):
       t: the batch of time indices being evaluated, shape (B,).
       d: the batch of variable indices being evaluated, shape (B,).
     """
+    lls[t, d] = self._unit_lls(x, pxhat, t, d)
+
+  def _unit_lls(self, x, pxhat, t, d):
+    """Compute the log-likelihood of one variable for each batch element.
+
+    Args:
+      x: the pianorolls being evaluated, shape (B, tt, P, I).
+      pxhat: the probabilities output by the model, shape (B, tt, P, I).
+      t: the batch of time indices being evaluated, shape (B,).
+      d: the batch of variable indices being evaluated, shape (B,).
+
+    Returns:
+      The log-likelihood of variable `d[b]` at time `t[b]` in `x[b]`, shape
+      (B,).
+    """
     # The code below assumes x is binary, so instead of x * log(px) which is
     # inconveniently NaN if both x and log(px) are zero, we can use
     # where(x, log(px), 0).
@@ -161,7 +211,7 @@ class BaseEvaluator(lib_util.Factory):
       index = (np.arange(x.shape[0]), t, slice(None), d)
     else:
       index = (np.arange(x.shape[0]), t, d, slice(None))
-    lls[t, d] = np.log(np.where(x[index], pxhat[index], 1)).sum(axis=1)
+    return np.log(np.where(x[index], pxhat[index], 1)).sum(axis=1)
 
 
 class FrameEvaluator(BaseEvaluator):
@@ -177,44 +227,86 @@ class FrameEvaluator(BaseEvaluator):
   key = "frame"
 
   def __call__(self, pianoroll):
-    tt, pp, ii = pianoroll.shape
-    assert self.separate_instruments or ii == 1
-    dd = ii if self.separate_instruments else pp
+    return next(self.evaluate_many([pianoroll]))
 
-    # Compile a batch with each frame being an example.
-    bb = tt
-    xs = np.tile(pianoroll[None], [bb, 1, 1, 1])
+  def evaluate_many(self, pianorolls):
+    """Evaluate a sequence of pianorolls.
 
-    ts, ds = self.draw_ordering(tt, dd)
+    Each frame of each piece is one example: the frames ordered before it are
+    revealed and the frame itself is predicted one variable at a time. The
+    examples of consecutive pieces of the same shape are packed into batches
+    of `batch_size`, so short pieces share model calls and long pieces are
+    evaluated a chunk of frames at a time. Examples don't interact, so the
+    result is the same as evaluating each piece in a single batch.
 
-    # Set up sequence of masks to predict the first (according to ordering)
-    # instrument for each frame
-    mask = []
-    mask_scratch = np.ones([tt, pp, ii], dtype=np.float32)
-    for j, (t, d) in enumerate(zip(ts, ds)):
-      # When time rolls over, reveal the entire current frame for purposes of
-      # predicting the next one.
-      if j % dd != 0:
-        continue
-      mask.append(mask_scratch.copy())
-      mask_scratch[t, :, :] = 0
-    assert np.allclose(mask_scratch, 0)
-    del mask_scratch
-    mask = np.array(mask)
+    Args:
+      pianorolls: iterable of pianorolls, each shaped (tt, pp, ii)
 
-    lls = np.zeros([tt, dd], dtype=np.float32)
+    Yields:
+      frame log-likelihoods for each pianoroll, in order
+    """
+    pending = collections.deque()
+    rows = []
+    for pianoroll in pianorolls:
+      tt, pp, ii = pianoroll.shape
+      assert self.separate_instruments or ii == 1
+      dd = ii if self.separate_instruments else pp
+
+      if rows and rows[-1][0].pianoroll.shape != pianoroll.shape:
+        # Pieces of different shapes can't share a batch.
+        self._evaluate_frames(rows)
+        rows = []
+
+      piece = _FramePiece(pianoroll, *self.draw_ordering(tt, dd))
+      pending.append(piece)
+      rows.extend((piece, k) for k in range(tt))
+
+      batch_size = self.batch_size or tt
+      while len(rows) >= batch_size:
+        self._evaluate_frames(rows[:batch_size])
+        rows = rows[batch_size:]
+
+      while pending and pending[0].done:
+        yield pending.popleft().lls.sum(axis=1)
+
+    if rows:
+      self._evaluate_frames(rows)
+    while pending:
+      yield pending.popleft().lls.sum(axis=1)
+
+  def _evaluate_frames(self, rows):
+    """Evaluate a batch of frames from pieces of the same shape.
+
+    Args:
+      rows: list of `(piece, k)` pairs, each denoting the k-th frame in the
+        evaluation ordering of a `_FramePiece`.
+    """
+    pieces = [piece for piece, _ in rows]
+    ks = np.array([k for _, k in rows])
+    bb = len(rows)
+    _, pp, ii = pieces[0].pianoroll.shape
+    dd = pieces[0].lls.shape[1]
+
+    xs = np.stack([piece.pianoroll for piece in pieces])
+    ts = np.stack([piece.ts[k * dd:(k + 1) * dd] for piece, k in rows])
+    ds = np.stack([piece.ds[k * dd:(k + 1) * dd] for piece, k in rows])
+
+    # Reveal the entire frames that come before each example's frame in its
+    # ordering, and predict everything else.
+    ranks = np.stack([piece.frame_ranks for piece in pieces])
+    mask = np.tile((ranks >= ks[:, None])[:, :, None, None],
+                   [1, 1, pp, ii]).astype(np.float32)
 
     # We can't parallelize within the frame, as we need the predictions of
     # some of the other instruments.
     # Hence we outer loop over the instruments and parallelize across frames.
     xs_scratch = xs.copy()
     for d_idx in range(dd):
-      # Call out to the model to get predictions for the first instrument
+      # Call out to the model to get predictions for the next instrument
       # at each time step.
       pxhats = self.predictor(xs_scratch, mask)
 
-      t, d = ts[d_idx::dd], ds[d_idx::dd]
-      assert len(t) == bb and len(d) == bb
+      t, d = ts[:, d_idx], ds[:, d_idx]
 
       # Write in predictions and update mask.
       if self.separate_instruments:
@@ -223,21 +315,21 @@ class FrameEvaluator(BaseEvaluator):
         mask[np.arange(bb), t, :, d] = 0
         # Every example in the batch sees one frame more than the previous.
         assert np.allclose(
-            (1 - mask).sum(axis=(1, 2, 3)),
-            [(k * dd + d_idx + 1) * pp for k in range(mask.shape[0])])
+            (1 - mask).sum(axis=(1, 2, 3)), (ks * dd + d_idx + 1) * pp)
       else:
         xs_scratch[np.arange(bb), t, d, :] = (
             pxhats[np.arange(bb), t, d, :] > 0.5)
         mask[np.arange(bb), t, d, :] = 0
         # Every example in the batch sees one frame more than the previous.
         assert np.allclose(
-            (1 - mask).sum(axis=(1, 2, 3)),
-            [(k * dd + d_idx + 1) * ii for k in range(mask.shape[0])])
+            (1 - mask).sum(axis=(1, 2, 3)), (ks * dd + d_idx + 1) * ii)
 
-      self._update_lls(lls, xs, pxhats, t, d)
+      unit_lls = self._unit_lls(xs, pxhats, t, d)
+      for piece, t_, d_, ll in zip(pieces, t, d, unit_lls):
+        piece.lls[t_, d_] = ll
 
-    # conjunction over notes within frames; frame is the unit of prediction
-    return lls.sum(axis=1)
+    for piece in pieces:
+      piece.num_remaining -= 1
 
   def draw_ordering(self, tt, dd):
     o = np.arange(tt, dtype=np.int32)
@@ -252,6 +344,26 @@ class FrameEvaluator(BaseEvaluator):
     return ts, ds
 
 
+class _FramePiece(object):
+  """Evaluation state of a single pianoroll in FrameEvaluator."""
+
+  def __init__(self, pianoroll, ts, ds):
+    tt = pianoroll.shape[0]
+    dd = len(ts) // tt
+    self.pianoroll = pianoroll
+    self.ts = ts
+    self.ds = ds
+    # The position of each frame in the evaluation ordering.
+    self.frame_ranks = np.empty(tt, dtype=np.int64)
+    self.frame_ranks[ts[::dd]] = np.arange(tt)
+    self.lls = np.zeros([tt, dd], dtype=np.float32)
+    self.num_remaining = tt
+
+  @property
+  def done(self):
+    return self.num_remaining == 0
+
+
 class NoteEvaluator(BaseEvaluator):
   """Evalutes note-based negative likelihood."""
   key = "note"
@@ -313,3 +425,21 @@ class EnsemblingEvaluator(object):
   def __call__(self, pianoroll):
     lls = [self.evaluator(pianoroll) for _ in range(self.ensemble_size)]
     return logsumexp(lls, b=1. / len(lls), axis=0)
+
+  def evaluate_many(self, pianorolls):
+    """Evaluate a sequence of pianorolls, batching across ensemble members.
+
+    Args:
+      pianorolls: iterable of pianorolls
+
+    Yields:
+      ensembled unit log-likelihoods for each pianoroll, in order
+    """
+    repeated = (pianoroll for pianoroll in pianorolls
+                for _ in range(self.ensemble_size))
+    member_lls = self.evaluator.evaluate_many(repeated)
+    while True:
+      lls = list(itertools.islice(member_lls, self.ensemble_size))
+      if not lls:
+        return
+      yield logsumexp(lls, b=1. / len(lls), axis=0)
@@ -18,12 +18,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import time
+
 from magenta.models.coconet import lib_data
 from magenta.models.coconet import lib_logging
 from magenta.models.coconet import lib_mask
 from magenta.models.coconet import lib_tfutil
 from magenta.models.coconet import lib_util
 import numpy as np
+import tensorflow as tf
 
 ################
 ### Samplers ###
@@ -214,6 +217,12 @@ class GibbsSampler(BaseSampler):
     schedule: an instance of BaseSchedule; determines the subset size.
     num_steps: number of gibbs steps to perform. If not given, defaults to
         the number of masked-out variables.
+    convergence_threshold: if given, an example stops being resampled once
+        the fraction of its masked-out variables that change in a step has
+        been at most this value for `convergence_patience` consecutive steps.
+        `num_steps` remains the upper bound.
+    convergence_patience: number of consecutive low-change steps after which
+        an example is considered converged. Defaults to 10.
 
     Args:
       **kwargs: Possible keyword arguments listed above.
@@ -223,37 +232,87 @@ class GibbsSampler(BaseSampler):
     self.sampler = kwargs.pop("sampler")
     self.schedule = kwargs.pop("schedule")
     self.num_steps = kwargs.pop("num_steps", None)
+    self.convergence_threshold = kwargs.pop("convergence_threshold", None)
+    self.convergence_patience = kwargs.pop("convergence_patience", 10)
     super(GibbsSampler, self).__init__(**kwargs)
 
   def _run(self, pianorolls, masks):
-    print("shape", pianorolls.shape)
     if self.num_steps is None:
       num_steps = np.max(_numbers_of_masked_variables(masks))
     else:
       num_steps = self.num_steps
-    print("num_steps", num_steps)
+    tf.logging.info("gibbs: shape %r, num_steps %d", pianorolls.shape,
+                    num_steps)
+
+    # Updated in place, one row per example; converged examples drop out of
+    # `active` and are no longer passed to the inner sampler.
+    pianorolls = np.array(pianorolls)
+    masks = np.asarray(masks)
+    bb = len(pianorolls)
+    active = np.arange(bb)
+    num_masked = _numbers_of_masked_variables(
+        masks, separate_instruments=self.separate_instruments)
+    calm_steps = np.zeros(bb, dtype=np.int32)
+    # Only BernoulliMasker can write its masks into a preallocated buffer.
+    inner_masks_buffer = None
+    if isinstance(self.masker, BernoulliMasker):
+      inner_masks_buffer = np.empty(
+          pianorolls.shape, dtype=np.result_type(np.float32, masks.dtype))
 
     with self.logger.section("sequence", subsample_factor=10):
       for s in range(int(num_steps)):
-        # with lib_util.timing("gibbs step %d" % s):
-        print(".", end="")
+        if not active.size:
+          break
+        start_time = time.time()
+        all_active = active.size == bb
+        current = pianorolls if all_active else pianorolls[active]
         pm = self.schedule(s, num_steps)
+        masker_kwargs = {}
+        if inner_masks_buffer is not None:
+          masker_kwargs["out"] = inner_masks_buffer[:active.size]
         inner_masks = self.masker(
-            pianorolls.shape,
+            current.shape,
             pm=pm,
-            outer_masks=masks,
-            separate_instruments=self.separate_instruments)
-        pianorolls = self.sampler.run_nonverbose(pianorolls, inner_masks)
+            outer_masks=masks if all_active else masks[active],
+            separate_instruments=self.separate_instruments,
+            **masker_kwargs)
+        samples = self.sampler.run_nonverbose(current, inner_masks)
         if self.separate_instruments:
           # Ensure sampler did actually sample everything under inner_masks.
           assert np.all(
               np.where(
                   inner_masks.max(axis=2),
-                  np.isclose(pianorolls.max(axis=2), 1),
+                  np.isclose(samples.max(axis=2), 1),
                   1))
-        self.logger.log(
-            pianorolls=pianorolls, masks=inner_masks, predictions=pianorolls)
 
+        if self.convergence_threshold is not None:
+          if self.separate_instruments:
+            changes = (samples != current).any(axis=2).sum(axis=(1, 2))
+          else:
+            changes = (samples != current).sum(axis=(1, 2, 3))
+          change_rates = changes / np.maximum(num_masked[active], 1)
+          calm_steps[active] = np.where(
+              change_rates <= self.convergence_threshold,
+              calm_steps[active] + 1, 0)
+
+        if all_active:
+          pianorolls[...] = samples
+        else:
+          pianorolls[active] = samples
+        if not isinstance(self.logger, lib_logging.NoLogger):
+          # The buffers are overwritten by later steps, so log copies.
+          logged_pianorolls = np.array(pianorolls)
+          self.logger.log(
+              pianorolls=logged_pianorolls, masks=np.array(inner_masks),
+              predictions=logged_pianorolls, active=active,
+              step_time=time.time() - start_time)
+
+        if self.convergence_threshold is not None:
+          active = active[calm_steps[active] < self.convergence_patience]
+
+    if self.convergence_threshold is not None:
+      tf.logging.info("gibbs: %d of %d examples converged", bb - active.size,
+                      bb)
     self.logger.log(pianorolls=pianorolls, masks=masks, predictions=pianorolls)
     return pianorolls
 
@@ -323,7 +382,8 @@ class BernoulliMasker(BaseMasker):
   """Samples each element iid from a Bernoulli distribution."""
   key = "bernoulli"
 
-  def __call__(self, shape, pm=None, outer_masks=1., separate_instruments=True):
+  def __call__(self, shape, pm=None, outer_masks=1., separate_instruments=True,
+               out=None):
     """Sample a batch of masks.
 
     Args:
@@ -331,6 +391,7 @@ class BernoulliMasker(BaseMasker):
       pm: Bernoulli success probability
       outer_masks: indicator of area within which to mask out
       separate_instruments: whether instruments are separated
+      out: optional array of the given shape to write the masks into
 
     Returns:
       A batch of masks.
@@ -338,12 +399,14 @@ class BernoulliMasker(BaseMasker):
     assert pm is not None
     bb, tt, pp, ii = shape
     if separate_instruments:
-      probs = np.tile(np.random.random([bb, tt, 1, ii]), [1, 1, pp, 1])
+      probs = np.random.random([bb, tt, 1, ii])
     else:
       assert ii == 1
       probs = np.random.random([bb, tt, pp, ii]).astype(np.float32)
-    masks = probs < pm
-    return masks * outer_masks
+    masks = np.broadcast_to(probs < pm, tuple(shape))
+    if out is None:
+      return masks * outer_masks
+    return np.multiply(masks, outer_masks, out=out)
 
 
 class HarmonizationMasker(BaseMasker):
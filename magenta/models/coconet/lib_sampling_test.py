@@ -0,0 +1,149 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for lib_sampling."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+from magenta.models.coconet import lib_logging
+from magenta.models.coconet import lib_sampling
+import numpy as np
+import tensorflow as tf
+
+FakeHParams = collections.namedtuple('FakeHParams', ['separate_instruments'])
+FakeWrappedModel = collections.namedtuple('FakeWrappedModel', ['hparams'])
+
+
+class CountingPredictor(object):
+  """Predicts a fixed pitch per instrument and records batch sizes."""
+
+  def __init__(self):
+    self.batch_sizes = []
+
+  def __call__(self, pianorolls, masks):
+    self.batch_sizes.append(len(pianorolls))
+    predictions = np.zeros(pianorolls.shape, dtype=np.float32)
+    for i in range(pianorolls.shape[3]):
+      predictions[:, :, i, i] = 1.
+    return predictions
+
+
+class LibSamplingTest(tf.test.TestCase):
+
+  def make_gibbs_sampler(self, logger, masker=None, **kwargs):
+    wmodel = FakeWrappedModel(FakeHParams(separate_instruments=True))
+    inner_sampler = lib_sampling.IndependentSampler(wmodel=wmodel)
+    inner_sampler.predictor = CountingPredictor()
+    sampler = lib_sampling.GibbsSampler(
+        wmodel=wmodel,
+        logger=logger,
+        masker=masker or lib_sampling.BernoulliMasker(),
+        sampler=inner_sampler,
+        schedule=lib_sampling.ConstantSchedule(0.5),
+        **kwargs)
+    return sampler, inner_sampler.predictor
+
+  def testGibbsSamplerStopsConvergedExamples(self):
+    np.random.seed(0)
+    logger = lib_logging.Logger()
+    sampler, predictor = self.make_gibbs_sampler(
+        logger, num_steps=50, convergence_threshold=0.,
+        convergence_patience=3)
+    shape = [4, 8, 5, 2]
+    pianorolls = np.zeros(shape, dtype=np.float32)
+    masks = np.ones(shape, dtype=np.float32)
+    masks[3] = 0.
+
+    result = sampler(pianorolls, masks)
+
+    expected = np.zeros(shape, dtype=np.float32)
+    expected[:3, :, 0, 0] = 1.
+    expected[:3, :, 1, 1] = 1.
+    self.assertAllEqual(expected, result)
+    # The unmasked example never changes and converges first, and every
+    # example stops long before num_steps.
+    self.assertEqual(4, predictor.batch_sizes[0])
+    self.assertEqual(3, predictor.batch_sizes[3])
+    self.assertLess(len(predictor.batch_sizes), 50)
+    self.assertEqual(sorted(predictor.batch_sizes, reverse=True),
+                     predictor.batch_sizes)
+
+  def testGibbsSamplerRunsAllStepsByDefault(self):
+    np.random.seed(0)
+    sampler, predictor = self.make_gibbs_sampler(
+        lib_logging.NoLogger(), num_steps=20)
+    shape = [2, 4, 5, 2]
+    sampler(np.zeros(shape, dtype=np.float32),
+            np.ones(shape, dtype=np.float32))
+    self.assertEqual([2] * 20, predictor.batch_sizes)
+
+  def testGibbsSamplerLogsEachStep(self):
+    shape = [2, 4, 5, 2]
+    masks = np.ones(shape, dtype=np.float32)
+    np.random.seed(0)
+    first_inner_masks = lib_sampling.BernoulliMasker()(
+        shape, pm=0.5, outer_masks=masks)
+
+    np.random.seed(0)
+    logger = lib_logging.Logger()
+    sampler, _ = self.make_gibbs_sampler(logger, num_steps=2)
+    result = sampler(np.zeros(shape, dtype=np.float32), masks)
+
+    gibbs_section = logger.root.items[0][1]
+    sequence = [node for _, node in gibbs_section.items[0][1].items]
+    self.assertEqual(2, len(sequence))
+    # The sampler reuses its buffers, but logged values are not overwritten
+    # by later steps.
+    self.assertAllEqual(first_inner_masks, sequence[0]['masks'])
+    self.assertIsNot(result, sequence[-1]['pianorolls'])
+
+  def testGibbsSamplerWithMaskerWithoutOut(self):
+
+    class FullMasker(lib_sampling.BaseMasker):
+      key = 'test_full'
+
+      def __call__(self, shape, pm=None, outer_masks=1.,
+                   separate_instruments=True):
+        return np.ones(shape, dtype=np.float32) * outer_masks
+
+    np.random.seed(0)
+    sampler, predictor = self.make_gibbs_sampler(
+        lib_logging.NoLogger(), masker=FullMasker(), num_steps=3)
+    shape = [2, 4, 5, 2]
+    sampler(np.zeros(shape, dtype=np.float32),
+            np.ones(shape, dtype=np.float32))
+    self.assertEqual([2] * 3, predictor.batch_sizes)
+
+  def testBernoulliMaskerOut(self):
+    shape = [2, 3, 4, 2]
+    outer_masks = np.ones(shape, dtype=np.float32)
+    outer_masks[:, 0] = 0.
+    np.random.seed(0)
+    expected = lib_sampling.BernoulliMasker()(
+        shape, pm=0.5, outer_masks=outer_masks)
+    np.random.seed(0)
+    out = np.empty(shape, dtype=np.float32)
+    masks = lib_sampling.BernoulliMasker()(
+        shape, pm=0.5, outer_masks=outer_masks, out=out)
+    self.assertIs(out, masks)
+    self.assertAllEqual(expected, masks)
+    self.assertAllEqual(masks[:, :, :1], masks[:, :, 1:2])
+
+
+if __name__ == '__main__':
+  tf.test.main()
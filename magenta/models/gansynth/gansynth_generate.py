@@ -52,6 +52,17 @@ absl.flags.DEFINE_integer('batch_size', 8, 'Batch size for generation.')
 absl.flags.DEFINE_float('secs_per_instrument', 6.0,
                         'In random interpolations, the seconds it takes to '
                         'interpolate from one instrument to another.')
+absl.flags.DEFINE_integer('render_cache_size', 512,
+                          'Maximum number of generated notes to keep for '
+                          'reuse when synthesizing a MIDI file.')
+absl.flags.DEFINE_float('z_quantization', 0.0,
+                        'When synthesizing a MIDI file, notes with the same '
+                        'pitch whose latent vectors round to the same '
+                        'multiple of this step are generated only once. If 0, '
+                        'only notes with an identical latent vector are '
+                        'reused, which with interpolated latent vectors '
+                        'means notes with the same pitch and start time. '
+                        'Try 0.05 to also reuse notes close in time.')
 
 FLAGS = absl.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -82,9 +93,17 @@ def main(unused_argv):
     # Get latent vectors for each note
     z_notes = gu.get_z_notes(notes['start_times'], z_instruments, t_instruments)
 
-    # Generate audio for each note
+    # Generate audio for each note, rendering repeated notes only once
     print('Generating {} samples...'.format(len(z_notes)))
-    audio_notes = model.generate_samples_from_z(z_notes, notes['pitches'])
+    render_cache = gu.NoteRenderCache(
+        max_size=FLAGS.render_cache_size,
+        z_quantization=FLAGS.z_quantization)
+    audio_notes = render_cache.render(model, z_notes, notes['pitches'])
+    tf.logging.info(
+        'Rendered %d notes (%d generated, cache hit rate %.1f%%) at %.1f '
+        'notes/sec.', render_cache.hits + render_cache.misses,
+        render_cache.misses, 100.0 * render_cache.hit_rate,
+        render_cache.notes_per_second)
 
     # Make a single audio clip
     audio_clip = gu.combine_notes(audio_notes,
@@ -18,6 +18,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import time
+
 from magenta import music as mm
 from magenta.models.gansynth.lib import util
 import numpy as np
@@ -90,6 +93,10 @@ def get_envelope(t_note_length, t_attack=0.010, t_release=0.3, sr=16000):
 def combine_notes(audio_notes, start_times, end_times, velocities, sr=16000):
   """Combine audio from multiple notes into a single audio clip.
 
+  All notes are enveloped, normalized and mixed at once: the note segments
+  are laid end to end in a single flat buffer, which is then scattered into
+  the clip with `np.bincount`.
+
   Args:
     audio_notes: Array of audio [n_notes, audio_samples].
     start_times: Array of note starts in seconds [n_notes].
@@ -100,24 +107,42 @@ def combine_notes(audio_notes, start_times, end_times, velocities, sr=16000):
   Returns:
     audio_clip: Array of combined audio clip [audio_samples]
   """
-  n_notes = len(audio_notes)
+  start_times = np.asarray(start_times, dtype=np.float64)
+  end_times = np.asarray(end_times, dtype=np.float64)
+  velocities = np.asarray(velocities, dtype=np.float64)
   clip_length = end_times.max() + MAX_NOTE_LENGTH
-  audio_clip = np.zeros(int(clip_length) * sr)
-
-  for t_start, t_end, vel, i in zip(
-      start_times, end_times, velocities, range(n_notes)):
-    # Generate an amplitude envelope
-    t_note_length = t_end - t_start
-    envelope = get_envelope(t_note_length)
-    length = len(envelope)
-    audio_note = audio_notes[i, :length] * envelope
-    # Normalize
-    audio_note /= audio_note.max()
-    audio_note *= (vel / MAX_VELOCITY)
-    # Add to clip buffer
-    clip_start = int(t_start * sr)
-    clip_end = clip_start + length
-    audio_clip[clip_start:clip_end] += audio_note
+  n_clip_samples = int(clip_length) * sr
+
+  # Envelope lengths, matching get_envelope() for every note.
+  i_attack = int(sr * 0.010)
+  i_release = int(sr * 0.3)
+  t_note_lengths = np.minimum(end_times - start_times, MAX_NOTE_LENGTH)
+  i_sustain = np.array([int(sr * t) for t in t_note_lengths], dtype=np.int64)
+  lengths = i_sustain + i_release
+
+  # Flat layout: segment k holds samples [offsets[k], offsets[k] + lengths[k]).
+  offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+  note_idx = np.repeat(np.arange(len(lengths)), lengths)
+  pos = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+
+  # Linear attack, then linear release (which wins where they overlap).
+  envelope = np.ones(len(pos))
+  attack = pos < i_attack
+  envelope[attack] = pos[attack] / max(i_attack - 1, 1)
+  sustain_end = np.repeat(i_sustain, lengths)
+  release = pos >= sustain_end
+  envelope[release] = 1.0 - ((pos[release] - sustain_end[release]) /
+                             max(i_release - 1, 1))
+
+  segments = audio_notes[note_idx, pos] * envelope
+  # Normalize each note to its peak and scale by velocity.
+  peaks = np.maximum.reduceat(segments, offsets)
+  segments *= np.repeat(velocities / MAX_VELOCITY / peaks, lengths)
+
+  # Add to clip buffer
+  clip_starts = np.array([int(t * sr) for t in start_times], dtype=np.int64)
+  audio_clip = np.bincount(np.repeat(clip_starts, lengths) + pos,
+                           weights=segments, minlength=n_clip_samples)
 
   # Normalize
   audio_clip /= audio_clip.max()
@@ -125,6 +150,124 @@ def combine_notes(audio_notes, start_times, end_times, velocities, sr=16000):
   return audio_clip
 
 
+class NoteRenderCache(object):
+  """LRU cache of generated note audio keyed on (pitch, quantized z).
+
+  Notes that share a pitch and a latent vector (after rounding every
+  dimension to a multiple of `z_quantization`) are rendered by the generator
+  only once. Each call to `render` batches the unique notes that are not
+  already cached through a single `model.generate_samples_from_z` call.
+
+  With `z_quantization > 0` the quantized latent vector, not the original, is
+  rendered, so the audio for a key does not depend on which note filled it.
+
+  Attributes:
+    hits: Number of requested notes served without a generator forward pass,
+        including repeats within a single `render` call.
+    misses: Number of notes that were passed to the generator.
+    render_time: Total seconds spent in `render`.
+  """
+
+  def __init__(self, max_size=512, z_quantization=0.0):
+    """Creates a NoteRenderCache.
+
+    Args:
+      max_size: Maximum number of rendered notes to keep.
+      z_quantization: Step to which latent vector dimensions are rounded before
+          lookup. If 0, latent vectors must match exactly.
+
+    Raises:
+      ValueError: If `max_size` is not positive or `z_quantization` is
+          negative.
+    """
+    if max_size <= 0:
+      raise ValueError('max_size must be positive: %d' % max_size)
+    if z_quantization < 0:
+      raise ValueError('z_quantization must be non-negative: %f' %
+                       z_quantization)
+    self._max_size = max_size
+    self._z_quantization = z_quantization
+    self._cache = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.render_time = 0.0
+
+  def __len__(self):
+    return len(self._cache)
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.0
+
+  @property
+  def notes_per_second(self):
+    total = self.hits + self.misses
+    return total / self.render_time if self.render_time else 0.0
+
+  def _quantize(self, z):
+    """Returns the keyed latent vectors and the vectors to render."""
+    z = np.asarray(z, dtype=np.float64)
+    if not self._z_quantization:
+      # Adding 0.0 folds -0.0 into 0.0 so both produce the same key bytes.
+      return z + 0.0, z
+    steps = np.round(z / self._z_quantization) + 0.0
+    return steps, steps * self._z_quantization
+
+  def render(self, model, z_notes, pitches, max_audio_length=64000):
+    """Returns generated audio for each note, rendering only uncached notes.
+
+    Args:
+      model: A `Model` (or anything with `generate_samples_from_z`).
+      z_notes: Latent vectors for each note [n_notes, n_latent dims].
+      pitches: Integer MIDI pitches for each note [n_notes].
+      max_audio_length: Integer, trim to this many samples.
+
+    Returns:
+      An array of audio for the notes [n_notes, max_audio_length].
+    """
+    start_time = time.time()
+    pitches = np.asarray(pitches)
+    z_keys, z_render = self._quantize(z_notes)
+
+    # Deduplicate within the request, in order of first appearance.
+    unique_index = {}
+    first_note = []
+    inverse = np.empty(len(pitches), dtype=np.int64)
+    for i, (pitch, z_key) in enumerate(zip(pitches, z_keys)):
+      key = (int(pitch), z_key.tobytes())
+      if key not in unique_index:
+        unique_index[key] = len(first_note)
+        first_note.append(i)
+      inverse[i] = unique_index[key]
+    keys = list(unique_index)
+
+    audio = [None] * len(keys)
+    to_render = []
+    for u, key in enumerate(keys):
+      if key in self._cache:
+        audio[u] = self._cache.pop(key)
+        self._cache[key] = audio[u]
+      else:
+        to_render.append(u)
+
+    if to_render:
+      note_indices = [first_note[u] for u in to_render]
+      rendered = model.generate_samples_from_z(
+          z_render[note_indices], pitches[note_indices].tolist(),
+          max_audio_length=max_audio_length)
+      for u, wave in zip(to_render, rendered):
+        audio[u] = wave
+        self._cache[keys[u]] = wave
+        if len(self._cache) > self._max_size:
+          self._cache.popitem(last=False)
+
+    self.misses += len(to_render)
+    self.hits += len(pitches) - len(to_render)
+    self.render_time += time.time() - start_time
+    return np.stack(audio, axis=0)[inverse]
+
+
 def save_wav(audio, fname, sr=16000):
   wavfile.write(fname, sr, audio.astype('float32'))
   print('Saved to {}'.format(fname))
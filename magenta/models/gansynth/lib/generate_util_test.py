@@ -0,0 +1,119 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for generate_util."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from magenta.models.gansynth.lib import generate_util as gu
+import numpy as np
+import tensorflow as tf
+
+
+class FakeModel(object):
+  """Renders each note as a constant wave derived from its pitch and z."""
+
+  def __init__(self):
+    self.rendered = []
+
+  def generate_samples_from_z(self, z, pitches, max_audio_length=64000):
+    self.rendered.append(len(pitches))
+    values = np.asarray(pitches, dtype=np.float64) + np.sum(z, axis=1)
+    return np.tile(values[:, np.newaxis], [1, max_audio_length])
+
+
+class GenerateUtilTest(tf.test.TestCase):
+
+  def testCombineNotesMatchesPerNoteMix(self):
+    sr = 16000
+    rng = np.random.RandomState(0)
+    start_times = np.array([0.0, 0.5, 0.505, 2.0])
+    end_times = np.array([0.4, 4.5, 0.51, 2.25])
+    velocities = np.array([100, 60, 127, 30])
+    audio_notes = rng.uniform(0.1, 1.0, size=[4, 64000])
+
+    n_samples = int(end_times.max() + gu.MAX_NOTE_LENGTH) * sr
+    expected = np.zeros(n_samples)
+    for i in range(4):
+      envelope = gu.get_envelope(end_times[i] - start_times[i])
+      audio_note = audio_notes[i, :len(envelope)] * envelope
+      audio_note /= audio_note.max()
+      audio_note *= velocities[i] / gu.MAX_VELOCITY
+      clip_start = int(start_times[i] * sr)
+      expected[clip_start:clip_start + len(envelope)] += audio_note
+    expected /= expected.max()
+    expected /= 2.0
+
+    audio_clip = gu.combine_notes(
+        audio_notes, start_times, end_times, velocities, sr=sr)
+    self.assertAllClose(expected, audio_clip)
+
+  def testRenderCacheDeduplicates(self):
+    model = FakeModel()
+    cache = gu.NoteRenderCache()
+    z = np.array([[0.0, 1.0], [0.0, 1.0], [2.0, 0.0], [0.0, 1.0]])
+    pitches = [60, 60, 60, 62]
+
+    audio = cache.render(model, z, pitches, max_audio_length=8)
+    self.assertEqual([3], model.rendered)
+    self.assertAllClose([61.0, 61.0, 62.0, 63.0], audio[:, 0])
+    self.assertEqual(1, cache.hits)
+    self.assertEqual(3, cache.misses)
+
+    audio = cache.render(model, z[:2], pitches[:2], max_audio_length=8)
+    self.assertEqual([3], model.rendered)
+    self.assertAllClose([61.0, 61.0], audio[:, 0])
+    self.assertEqual(3, cache.hits)
+    self.assertAlmostEqual(0.5, cache.hit_rate)
+
+  def testRenderCacheQuantizesZ(self):
+    model = FakeModel()
+    cache = gu.NoteRenderCache(z_quantization=0.5)
+    z = np.array([[0.9, 0.1], [1.1, -0.1], [1.4, 0.0]])
+
+    audio = cache.render(model, z, [60, 60, 60], max_audio_length=8)
+    self.assertEqual([2], model.rendered)
+    self.assertAllClose([61.0, 61.0, 61.5], audio[:, 0])
+
+  def testRenderCacheEvictsLeastRecentlyUsed(self):
+    model = FakeModel()
+    cache = gu.NoteRenderCache(max_size=2)
+    z = np.zeros([1, 2])
+
+    cache.render(model, z, [60], max_audio_length=8)
+    cache.render(model, z, [61], max_audio_length=8)
+    cache.render(model, z, [60], max_audio_length=8)
+    cache.render(model, z, [62], max_audio_length=8)
+    self.assertEqual(2, len(cache))
+    self.assertEqual([1, 1, 1], model.rendered)
+
+    # 61 was least recently used and has been evicted; 60 is still cached.
+    cache.render(model, z, [60], max_audio_length=8)
+    self.assertEqual([1, 1, 1], model.rendered)
+    cache.render(model, z, [61], max_audio_length=8)
+    self.assertEqual([1, 1, 1, 1], model.rendered)
+
+  def testRenderCacheLargerThanMaxSize(self):
+    model = FakeModel()
+    cache = gu.NoteRenderCache(max_size=1)
+    audio = cache.render(
+        model, np.zeros([3, 2]), [60, 61, 60], max_audio_length=8)
+    self.assertAllClose([60.0, 61.0, 60.0], audio[:, 0])
+    self.assertEqual(1, len(cache))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -32,4 +32,5 @@ from .lstm_models import HierarchicalLstmDecoder
 from .lstm_models import HierarchicalLstmEncoder
 from .lstm_models import MultiOutCategoricalLstmDecoder
 from .lstm_models import SplitMultiOutLstmDecoder
+from .trained_model import BatchedTrainedModel
 from .trained_model import TrainedModel
@@ -23,6 +23,10 @@ import collections
 import copy
 import functools
 import itertools
+import multiprocessing
+import multiprocessing.pool
+import random
+import time
 
 import magenta.music as mm
 from magenta.music import chords_lib
@@ -56,10 +60,10 @@ OUTPUT_VELOCITY = 80
 CHORD_SYMBOL = music_pb2.NoteSequence.TextAnnotation.CHORD_SYMBOL
 
 
-def _maybe_pad_seqs(seqs, dtype):
+def _maybe_pad_seqs(seqs, dtype, depth):
   """Pads sequences to match the longest and returns as a numpy array."""
   if not len(seqs):  # pylint:disable=g-explicit-length-test,len-as-condition
-    return np.zeros((0, 0, 0), dtype)
+    return np.zeros((0, 0, depth), dtype)
   lengths = [len(s) for s in seqs]
   if len(set(lengths)) == 1:
     return np.array(seqs, dtype)
@@ -307,6 +311,20 @@ class BaseConverter(object):
     else:
       return ConverterTensors()
 
+  def to_tensors_by_split(self, item):
+    """Python method that converts each split of `item` into tensors.
+
+    `to_tensors` samples up to `max_tensors_per_item` tensors from each split
+    and then again from their union. Items are not split by default.
+
+    Args:
+      item: The item to convert.
+
+    Returns:
+      A list of ConverterTensors, one per split.
+    """
+    return [self.to_tensors(item)]
+
   def _combine_to_tensor_results(self, to_tensor_results):
     """Combines the results of multiple to_tensors calls into one result."""
     results = []
@@ -345,15 +363,8 @@ class BaseConverter(object):
       lengths: A tf.int32 Tensor, shaped [num encoded seqs], containing the
         unpadded lengths of the tensor sequences resulting from the input.
     """
-    def _convert_and_pad(item_str):
-      item = self.str_to_item_fn(item_str)  # pylint:disable=not-callable
-      tensors = self.to_tensors(item)
-      inputs = _maybe_pad_seqs(tensors.inputs, self.input_dtype)
-      outputs = _maybe_pad_seqs(tensors.outputs, self.output_dtype)
-      controls = _maybe_pad_seqs(tensors.controls, self.control_dtype)
-      return inputs, outputs, controls, np.array(tensors.lengths, np.int32)
     inputs, outputs, controls, lengths = tf.py_func(
-        _convert_and_pad,
+        functools.partial(_convert_and_pad, self),
         [item_scalar],
         [self.input_dtype, self.output_dtype, self.control_dtype, tf.int32],
         stateful=False,
@@ -365,6 +376,38 @@ class BaseConverter(object):
     return inputs, outputs, controls, lengths
 
 
+def _convert_and_pad(data_converter, item_str, split_sizes=False):
+  """Converts a raw item into padded numpy arrays of tensors and lengths.
+
+  Args:
+    data_converter: The converter to use.
+    item_str: The raw item string.
+    split_sizes: Whether to also return the number of tensors from each split
+        of the item, as produced by `to_tensors_by_split`.
+
+  Returns:
+    The padded inputs, outputs and controls and the lengths, followed by the
+    split sizes if requested.
+  """
+  item = data_converter.str_to_item_fn(item_str)  # pylint:disable=not-callable
+  if split_sizes:
+    split_tensors = data_converter.to_tensors_by_split(item)
+    tensors = ConverterTensors(*[list(itertools.chain.from_iterable(field))
+                                 for field in zip(*split_tensors)])
+  else:
+    tensors = data_converter.to_tensors(item)
+  inputs = _maybe_pad_seqs(tensors.inputs, data_converter.input_dtype,
+                           data_converter.input_depth)
+  outputs = _maybe_pad_seqs(tensors.outputs, data_converter.output_dtype,
+                            data_converter.output_depth)
+  controls = _maybe_pad_seqs(tensors.controls, data_converter.control_dtype,
+                             data_converter.control_depth)
+  result = inputs, outputs, controls, np.array(tensors.lengths, np.int32)
+  if split_sizes:
+    result += (np.array([len(t.lengths) for t in split_tensors], np.int64),)
+  return result
+
+
 def preprocess_notesequence(note_sequence, presplit_on_time_changes):
   """Preprocesses a single NoteSequence, resulting in multiple sequences."""
   if presplit_on_time_changes:
@@ -431,15 +474,20 @@ class BaseNoteSequenceConverter(BaseConverter):
     """Python method that decodes samples into list of NoteSequences."""
     return self._to_items(samples, controls)
 
-  def to_tensors(self, note_sequence):
-    """Python method that converts `note_sequence` into list of tensors."""
+  def to_tensors_by_split(self, note_sequence):
+    """Python method that converts each split of `note_sequence` to tensors."""
     note_sequences = preprocess_notesequence(
         note_sequence, self._presplit_on_time_changes)
 
     results = []
     for ns in note_sequences:
       results.append(super(BaseNoteSequenceConverter, self).to_tensors(ns))
-    return self._combine_to_tensor_results(results)
+    return results
+
+  def to_tensors(self, note_sequence):
+    """Python method that converts `note_sequence` into list of tensors."""
+    return self._combine_to_tensor_results(
+        self.to_tensors_by_split(note_sequence))
 
   def _to_items(self, samples, controls=None):
     """Python method that decodes samples into list of NoteSequences."""
@@ -1140,14 +1188,315 @@ def count_examples(examples_path, data_converter,
   return num_examples
 
 
+# Names of the padded arrays stored in each pretensorized example. The
+# number of tensors from each split of the item is stored as 'split_sizes'.
+_PRETENSORIZED_FIELDS = ('inputs', 'outputs', 'controls', 'lengths')
+
+# Per-process state for conversion workers, set by `_init_conversion_worker`.
+_worker_data_converter = None
+_worker_note_sequence_augmenter = None
+
+
+def _init_conversion_worker(data_converter, note_sequence_augmenter,
+                            keep_all_tensors, reseed):
+  """Initializes a worker process that converts items into tensors.
+
+  Args:
+    data_converter: The converter to use in the worker.
+    note_sequence_augmenter: Optional NoteSequenceAugmenter to apply to each
+        item before conversion.
+    keep_all_tensors: Whether to disable `max_tensors_per_item` sampling in the
+        worker so that every tensor of an item is returned.
+    reseed: Whether to reseed the random number generators. Forked workers
+        inherit the parent's random state, which would otherwise make every
+        worker draw the same samples and augmentations.
+  """
+  global _worker_data_converter, _worker_note_sequence_augmenter
+  data_converter = copy.copy(data_converter)
+  if keep_all_tensors:
+    data_converter.max_tensors_per_item = None
+  _worker_data_converter = data_converter
+  _worker_note_sequence_augmenter = note_sequence_augmenter
+  if reseed:
+    np.random.seed()
+    random.seed()
+
+
+def _convert_items(item_strs, split_sizes=False):
+  """Converts a chunk of raw items into padded tensors in a worker.
+
+  Items that produce no tensors are dropped.
+
+  Args:
+    item_strs: A list of raw item strings.
+    split_sizes: Whether to append the number of tensors from each split of
+        the item to each tuple.
+
+  Returns:
+    A list of (inputs, outputs, controls, lengths) numpy array tuples.
+  """
+  results = []
+  for item_str in item_strs:
+    if _worker_note_sequence_augmenter is not None:
+      note_sequence = music_pb2.NoteSequence.FromString(item_str)
+      item_str = _worker_note_sequence_augmenter.augment(
+          note_sequence).SerializeToString()
+    tensors = _convert_and_pad(_worker_data_converter, item_str, split_sizes)
+    if len(tensors[3]):  # pylint:disable=g-explicit-length-test
+      results.append(tensors)
+  return results
+
+
+def _make_conversion_pool(num_workers, data_converter,
+                          note_sequence_augmenter=None,
+                          keep_all_tensors=False):
+  """Returns a pool of conversion workers, or a single in-process thread."""
+  initargs = (data_converter, note_sequence_augmenter, keep_all_tensors)
+  if num_workers > 1:
+    return multiprocessing.Pool(
+        num_workers, initializer=_init_conversion_worker,
+        initargs=initargs + (True,))
+  return multiprocessing.pool.ThreadPool(
+      1, initializer=_init_conversion_worker, initargs=initargs + (False,))
+
+
+def _convert_in_pool(pool, item_strs, chunk_size, max_pending_chunks,
+                     split_sizes=False):
+  """Yields converted tensors for `item_strs` in order, converting in `pool`.
+
+  At most `max_pending_chunks` chunks are submitted at a time so that an
+  endless stream of items does not accumulate in memory.
+
+  Args:
+    pool: A pool initialized by `_init_conversion_worker`.
+    item_strs: An iterable of raw item strings.
+    chunk_size: The number of items to send to a worker at once.
+    max_pending_chunks: The maximum number of chunks being converted at once.
+    split_sizes: Whether to append the number of tensors from each split of
+        the item to each tuple.
+
+  Yields:
+    (inputs, outputs, controls, lengths) numpy array tuples.
+  """
+  item_strs = iter(item_strs)
+  pending = collections.deque()
+  while True:
+    chunk = list(itertools.islice(item_strs, chunk_size))
+    if chunk:
+      pending.append(pool.apply_async(_convert_items, (chunk, split_sizes)))
+    if not pending:
+      return
+    if not chunk or len(pending) >= max_pending_chunks:
+      for tensors in pending.popleft().get():
+        yield tensors
+
+
+def _read_items(filenames, file_reader, repeat):
+  """Yields raw items from files, reshuffling the file order on each pass."""
+  filenames = list(filenames)
+  while True:
+    if repeat:
+      random.shuffle(filenames)
+    for filename in filenames:
+      for item_str in file_reader(filename):
+        yield item_str
+    if not repeat:
+      return
+
+
+def _tensors_to_example(inputs, outputs, controls, lengths, split_sizes):
+  """Serializes padded tensors of a single item as a tf.train.Example."""
+  feature = {}
+  for name, array in zip(_PRETENSORIZED_FIELDS,
+                         [inputs, outputs, controls, lengths]):
+    if array.dtype == np.bool:
+      array = array.astype(np.uint8)
+    feature[name] = tf.train.Feature(bytes_list=tf.train.BytesList(
+        value=[np.ascontiguousarray(array).tobytes()]))
+    feature[name + '_shape'] = tf.train.Feature(
+        int64_list=tf.train.Int64List(value=array.shape))
+  feature['split_sizes'] = tf.train.Feature(
+      int64_list=tf.train.Int64List(value=split_sizes))
+  return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def pretensorize(examples_path, output_path, data_converter, num_shards=1,
+                 num_workers=1, chunk_size=64,
+                 file_reader=tf.python_io.tf_record_iterator):
+  """Converts items to padded tensors offline and writes them to TFRecords.
+
+  Conversion runs in a pool of worker processes. Every tensor of each item is
+  kept, ignoring `max_tensors_per_item`, along with the number of tensors from
+  each split of the item, so that `get_dataset` can sample from them like the
+  converter when reading with `pretensorized=True`. Items that produce no
+  tensors are skipped.
+
+  Args:
+    examples_path: Path (or glob) of TFRecord files of raw items.
+    output_path: Prefix of the output files, which are named
+        `<output_path>-<shard>-of-<num_shards>`.
+    data_converter: The converter used to convert items into tensors.
+    num_shards: The number of output files, written to in round-robin order.
+    num_workers: The number of worker processes to convert items with.
+    chunk_size: The number of items to send to a worker at once.
+    file_reader: The Python reader to use for reading files.
+
+  Returns:
+    A tuple containing the number of items and tensors written.
+
+  Raises:
+    ValueError: If no files match examples path.
+  """
+  filenames = tf.gfile.Glob(examples_path)
+  if not filenames:
+    raise ValueError(
+        'No files were found matching examples path: %s' % examples_path)
+
+  writers = [
+      tf.python_io.TFRecordWriter(
+          '%s-%05d-of-%05d' % (output_path, i, num_shards))
+      for i in range(num_shards)]
+  pool = _make_conversion_pool(
+      num_workers, data_converter, keep_all_tensors=True)
+  num_items = 0
+  num_tensors = 0
+  start_time = time.time()
+  try:
+    for tensors in _convert_in_pool(
+        pool, _read_items(filenames, file_reader, repeat=False), chunk_size,
+        max_pending_chunks=2 * num_workers, split_sizes=True):
+      example = _tensors_to_example(*tensors)
+      writers[num_items % num_shards].write(example.SerializeToString())
+      num_items += 1
+      num_tensors += len(tensors[3])
+      if num_items % 1000 == 0:
+        tf.logging.info('Wrote %d items (%d examples).', num_items,
+                        num_tensors)
+  finally:
+    pool.terminate()
+    for writer in writers:
+      writer.close()
+
+  elapsed = time.time() - start_time
+  tf.logging.info(
+      'Wrote %d items (%d examples) in %.1f sec (%.1f examples/sec).',
+      num_items, num_tensors, elapsed,
+      num_tensors / elapsed if elapsed else 0.0)
+  return num_items, num_tensors
+
+
+def _parse_pretensorized_fn(data_converter):
+  """Returns a function that parses a pretensorized example into tensors."""
+  dtypes = [data_converter.input_dtype, data_converter.output_dtype,
+            data_converter.control_dtype, np.int32]
+  ranks = [3, 3, 3, 1 + len(data_converter.length_shape)]
+
+  def _parse(serialized_example):
+    features = {}
+    for name, rank in zip(_PRETENSORIZED_FIELDS, ranks):
+      features[name] = tf.FixedLenFeature([], tf.string)
+      features[name + '_shape'] = tf.FixedLenFeature([rank], tf.int64)
+    features['split_sizes'] = tf.VarLenFeature(tf.int64)
+    parsed = tf.parse_single_example(serialized_example, features)
+    tensors = []
+    for name, dtype in zip(_PRETENSORIZED_FIELDS, dtypes):
+      tensor = tf.decode_raw(
+          parsed[name], np.uint8 if dtype == np.bool else dtype)
+      tensor = tf.reshape(tensor, tf.to_int32(parsed[name + '_shape']))
+      tensors.append(tf.cast(tensor, dtype))
+    inputs, outputs, controls, lengths = tensors
+    inputs.set_shape([None, None, data_converter.input_depth])
+    outputs.set_shape([None, None, data_converter.output_depth])
+    controls.set_shape([None, None, data_converter.control_depth])
+    lengths.set_shape([None] + list(data_converter.length_shape))
+    split_sizes = tf.to_int32(tf.sparse_tensor_to_dense(parsed['split_sizes']))
+    return inputs, outputs, controls, lengths, split_sizes
+
+  return _parse
+
+
+def _sample_pretensorized_fn(data_converter):
+  """Returns a function that limits the tensors read for each item.
+
+  Mirrors the sampling in `to_tensors`: up to `max_tensors_per_item` tensors
+  are kept from each split of the item, and then up to `max_tensors_per_item`
+  from their union. They are drawn at random (redrawn every epoch) when
+  training, and the first ones are kept otherwise.
+
+  Args:
+    data_converter: The converter whose sampling settings to use.
+
+  Returns:
+    A function mapping padded item tensors and split sizes to sampled item
+    tensors.
+  """
+  max_tensors = data_converter.max_tensors_per_item
+  is_training = data_converter.is_training
+
+  def _sample(inputs, outputs, controls, lengths, split_sizes):
+    tensors = (inputs, outputs, controls, lengths)
+    if not max_tensors:
+      return tensors
+    num_tensors = tf.shape(lengths)[0]
+    split_ends = tf.cumsum(split_sizes)
+    split_ids = tf.reduce_sum(tf.to_int32(
+        tf.range(num_tensors)[:, tf.newaxis] >= split_ends), axis=1)
+    if is_training:
+      # Shuffle the tensors within each split.
+      _, order = tf.nn.top_k(
+          -(tf.to_float(split_ids) + tf.random_uniform([num_tensors])),
+          k=num_tensors)
+    else:
+      order = tf.range(num_tensors)
+    # The tensors in `order` are still grouped by split, so their position
+    # within the split is their position minus the start of the split.
+    split_starts = split_ends - split_sizes
+    positions = tf.range(num_tensors) - tf.gather(
+        split_starts, tf.gather(split_ids, order))
+    indices = tf.boolean_mask(order, positions < max_tensors)
+    if is_training:
+      indices = tf.random_shuffle(indices)
+    indices = indices[:max_tensors]
+    return tuple(tf.gather(t, indices) for t in tensors)
+
+  return _sample
+
+
+def count_pretensorized_examples(examples_path, data_converter,
+                                 file_reader=tf.python_io.tf_record_iterator):
+  """Counts the examples `get_dataset` reads from pretensorized files."""
+  max_tensors = data_converter.max_tensors_per_item
+  num_examples = 0
+  for f in tf.gfile.Glob(examples_path):
+    tf.logging.info('Counting examples in %s.', f)
+    for example_str in file_reader(f):
+      example = tf.train.Example.FromString(example_str)
+      split_sizes = example.features.feature['split_sizes'].int64_list.value
+      if max_tensors:
+        num_examples += min(
+            sum(min(size, max_tensors) for size in split_sizes), max_tensors)
+      else:
+        num_examples += sum(split_sizes)
+  tf.logging.info('Total examples: %d', num_examples)
+  return num_examples
+
+
 def get_dataset(
     config,
     num_threads=1,
     tf_file_reader=tf.data.TFRecordDataset,
     prefetch_size=4,
-    is_training=False):
+    is_training=False,
+    num_workers=0,
+    pretensorized=False,
+    file_reader=tf.python_io.tf_record_iterator):
   """Get input tensors from dataset for training or evaluation.
 
+  By default, items are converted by `data_converter.tf_to_tensors`, whose
+  Python conversion holds the GIL and so effectively runs on a single core.
+  Setting `num_workers` converts items in that many processes instead, and
+  `pretensorized` reads tensors written ahead of time by `pretensorize`.
+
   Args:
     config: A Config object containing dataset information.
     num_threads: The number of threads to use for pre-processing.
@@ -1155,6 +1504,13 @@ def get_dataset(
     prefetch_size: The number of batches to prefetch. Disabled when 0.
     is_training: Whether or not the dataset is used in training. Determines
       whether dataset is shuffled and repeated, etc.
+    num_workers: The number of processes to convert items with, or 0 to convert
+      them in the TensorFlow graph.
+    pretensorized: Whether the examples path contains tensors written by
+      `pretensorize` instead of raw items. The NoteSequence augmenter is not
+      applied in this case.
+    file_reader: The Python reader to use for reading files when `num_workers`
+      is positive.
 
   Returns:
     A tf.data.Dataset containing input, output, control, and length tensors.
@@ -1172,20 +1528,11 @@ def get_dataset(
 
   tf.logging.info('Reading examples from: %s', examples_path)
 
-  num_files = len(tf.gfile.Glob(examples_path))
+  filenames = tf.gfile.Glob(examples_path)
+  num_files = len(filenames)
   if not num_files:
     raise ValueError(
         'No files were found matching examples path: %s' %  examples_path)
-  files = tf.data.Dataset.list_files(examples_path)
-  if is_training:
-    files = files.apply(
-        tf.contrib.data.shuffle_and_repeat(buffer_size=num_files))
-
-  reader = files.apply(
-      tf.contrib.data.parallel_interleave(
-          tf_file_reader,
-          cycle_length=num_threads,
-          sloppy=True))
 
   def _remove_pad_fn(padded_seq_1, padded_seq_2, padded_seq_3, length):
     if length.shape.ndims == 0:
@@ -1195,12 +1542,54 @@ def get_dataset(
       # Don't remove padding for hierarchical examples.
       return padded_seq_1, padded_seq_2, padded_seq_3, length
 
-  dataset = reader
-  if note_sequence_augmenter is not None:
-    dataset = dataset.map(note_sequence_augmenter.tf_augment)
+  if num_workers and not pretensorized:
+    def _generate_tensors():
+      pool = _make_conversion_pool(
+          num_workers, data_converter, note_sequence_augmenter)
+      try:
+        for tensors in _convert_in_pool(
+            pool, _read_items(filenames, file_reader, repeat=is_training),
+            chunk_size=16, max_pending_chunks=2 * num_workers):
+          yield tensors
+      finally:
+        pool.terminate()
+
+    dataset = tf.data.Dataset.from_generator(
+        _generate_tensors,
+        (data_converter.input_dtype, data_converter.output_dtype,
+         data_converter.control_dtype, tf.int32),
+        (tf.TensorShape([None, None, data_converter.input_depth]),
+         tf.TensorShape([None, None, data_converter.output_depth]),
+         tf.TensorShape([None, None, data_converter.control_depth]),
+         tf.TensorShape([None] + list(data_converter.length_shape))))
+  else:
+    files = tf.data.Dataset.list_files(examples_path)
+    if is_training:
+      files = files.apply(
+          tf.contrib.data.shuffle_and_repeat(buffer_size=num_files))
+
+    reader = files.apply(
+        tf.contrib.data.parallel_interleave(
+            tf_file_reader,
+            cycle_length=num_threads,
+            sloppy=True))
+
+    dataset = reader
+    if pretensorized:
+      if note_sequence_augmenter is not None:
+        tf.logging.warning(
+            'NoteSequence augmentation is not applied to pretensorized '
+            'examples.')
+      dataset = dataset.map(_parse_pretensorized_fn(data_converter),
+                            num_parallel_calls=num_threads)
+      dataset = dataset.map(_sample_pretensorized_fn(data_converter),
+                            num_parallel_calls=num_threads)
+    else:
+      if note_sequence_augmenter is not None:
+        dataset = dataset.map(note_sequence_augmenter.tf_augment)
+      dataset = dataset.map(data_converter.tf_to_tensors,
+                            num_parallel_calls=num_threads)
   dataset = (dataset
-             .map(data_converter.tf_to_tensors,
-                  num_parallel_calls=num_threads)
              .flat_map(lambda *t: tf.data.Dataset.from_tensor_slices(t))
              .map(_remove_pad_fn))
   if is_training:
@@ -1214,6 +1603,37 @@ def get_dataset(
   return dataset
 
 
+def benchmark_dataset(dataset, num_batches):
+  """Measures how many examples per second a dataset produces.
+
+  The first batch is excluded from the measurement, since it includes the time
+  to start up readers and worker processes.
+
+  Args:
+    dataset: A tf.data.Dataset of batches as returned by `get_dataset`.
+    num_batches: The number of batches to time.
+
+  Returns:
+    The number of examples produced per second.
+  """
+  next_batch = dataset.make_one_shot_iterator().get_next()
+  num_examples = 0
+  with tf.Session() as sess:
+    sess.run(next_batch)
+    start_time = time.time()
+    for _ in range(num_batches):
+      try:
+        lengths = sess.run(next_batch[3])
+      except tf.errors.OutOfRangeError:
+        break
+      num_examples += len(lengths)
+  elapsed = time.time() - start_time
+  examples_per_second = num_examples / elapsed if elapsed else 0.0
+  tf.logging.info('Read %d examples in %.1f sec (%.1f examples/sec).',
+                  num_examples, elapsed, examples_per_second)
+  return examples_per_second
+
+
 class GrooveConverter(BaseNoteSequenceConverter):
   """Converts to and from hit/velocity/offset representations.
 
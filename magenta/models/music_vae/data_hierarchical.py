@@ -351,8 +351,8 @@ class BaseHierarchicalNoteSequenceConverter(BaseHierarchicalConverter):
     """Python method that decodes samples into list of NoteSequences."""
     return self.to_items(samples, controls)
 
-  def to_tensors(self, note_sequence):
-    """Python method that converts `note_sequence` into list of tensors."""
+  def to_tensors_by_split(self, note_sequence):
+    """Python method that converts each split of `note_sequence` to tensors."""
     note_sequences = data.preprocess_notesequence(
         note_sequence, self._presplit_on_time_changes)
 
@@ -360,7 +360,12 @@ class BaseHierarchicalNoteSequenceConverter(BaseHierarchicalConverter):
     for ns in note_sequences:
       results.append(
           super(BaseHierarchicalNoteSequenceConverter, self).to_tensors(ns))
-    return self._combine_to_tensor_results(results)
+    return results
+
+  def to_tensors(self, note_sequence):
+    """Python method that converts `note_sequence` into list of tensors."""
+    return self._combine_to_tensor_results(
+        self.to_tensors_by_split(note_sequence))
 
   def _to_items(self, samples, controls=None):
     """Python method that decodes samples into list of NoteSequences."""
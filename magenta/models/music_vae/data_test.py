@@ -19,10 +19,13 @@ from __future__ import division
 from __future__ import print_function
 
 import functools
+import os
 
+from magenta.models.music_vae import configs
 from magenta.models.music_vae import data
 import magenta.music as mm
 from magenta.music import constants
+from magenta.music import note_sequence_io
 from magenta.music import testing_lib
 from magenta.protobuf import music_pb2
 import numpy as np
@@ -1295,5 +1298,110 @@ class GrooveConverterTest(tf.test.TestCase):
     self.compare_seqs(self.one_bar_sequence, sequences[0])
 
 
+class GetDatasetTest(tf.test.TestCase):
+
+  def setUp(self):
+    sequence = music_pb2.NoteSequence()
+    sequence.tempos.add(qpm=60)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(32, 100, 2, 4), (33, 1, 6, 11), (34, 1, 11, 13),
+         (35, 1, 17, 19)])
+    testing_lib.add_track_to_sequence(
+        sequence, 1,
+        [(35, 127, 2, 4), (36, 50, 6, 8),
+         (71, 100, 33, 37), (73, 100, 34, 37),
+         (33, 1, 50, 55), (34, 1, 55, 56)])
+    empty_sequence = music_pb2.NoteSequence()
+    empty_sequence.tempos.add(qpm=60)
+
+    self.examples_path = os.path.join(
+        self.get_temp_dir(), 'examples.tfrecord')
+    with note_sequence_io.NoteSequenceRecordWriter(
+        self.examples_path) as writer:
+      for i, ns in enumerate([sequence, empty_sequence, sequence]):
+        ns.id = str(i)
+        writer.write(ns)
+
+    converter = data.OneHotMelodyConverter(
+        steps_per_quarter=1, slice_bars=2, max_tensors_per_notesequence=2)
+    self.config = configs.Config(
+        model=None,
+        hparams=tf.contrib.training.HParams(batch_size=3),
+        note_sequence_augmenter=None,
+        data_converter=converter,
+        train_examples_path=self.examples_path,
+        eval_examples_path=self.examples_path)
+    # Each non-empty sequence produces 5 tensors, of which 2 are kept.
+    self.expected_examples = self.read_examples(data.get_dataset(self.config))
+
+  def read_examples(self, dataset, num_batches=None):
+    next_batch = dataset.make_one_shot_iterator().get_next()
+    examples = []
+    with self.test_session() as sess:
+      while num_batches is None or num_batches > 0:
+        try:
+          inputs, _, _, lengths = sess.run(next_batch)
+        except tf.errors.OutOfRangeError:
+          break
+        examples.extend(
+            tuple(np.argmax(x[:l], axis=-1)) for x, l in zip(inputs, lengths))
+        if num_batches is not None:
+          num_batches -= 1
+    return examples
+
+  def testWorkers(self):
+    self.assertEqual(4, len(self.expected_examples))
+    dataset = data.get_dataset(self.config, num_workers=2)
+    self.assertEqual(self.expected_examples, self.read_examples(dataset))
+
+  def testPretensorized(self):
+    output_path = os.path.join(self.get_temp_dir(), 'tensors.tfrecord')
+    num_items, num_tensors = data.pretensorize(
+        self.examples_path, output_path, self.config.data_converter,
+        num_shards=1, num_workers=2)
+    self.assertEqual((2, 10), (num_items, num_tensors))
+
+    tensors_path = output_path + '-00000-of-00001'
+    config = configs.update_config(self.config, {
+        'train_examples_path': tensors_path,
+        'eval_examples_path': tensors_path})
+    self.assertEqual(
+        4,
+        data.count_pretensorized_examples(tensors_path, config.data_converter))
+    dataset = data.get_dataset(config, pretensorized=True)
+    self.assertEqual(self.expected_examples, self.read_examples(dataset))
+
+    # When training, each item's tensors are sampled from all of its tensors.
+    unsampled_config = configs.update_config(config, {
+        'data_converter': data.OneHotMelodyConverter(
+            steps_per_quarter=1, slice_bars=2)})
+    all_examples = set(self.read_examples(
+        data.get_dataset(unsampled_config, pretensorized=True)))
+    self.assertEqual(5, len(all_examples))
+    dataset = data.get_dataset(config, pretensorized=True, is_training=True)
+    examples = self.read_examples(dataset, num_batches=4)
+    self.assertEqual(12, len(examples))
+    self.assertTrue(set(examples).issubset(all_examples))
+
+  def testSamplePretensorizedSplits(self):
+    converter = data.OneHotMelodyConverter(max_tensors_per_notesequence=1)
+    tensors = (tf.zeros([6, 1, 1]), tf.zeros([6, 1, 1]), tf.zeros([6, 1, 1]),
+               tf.range(6), tf.constant([1, 5]))
+    lengths = data._sample_pretensorized_fn(converter)(*tensors)[3]
+    converter.is_training = True
+    sampled_lengths = data._sample_pretensorized_fn(converter)(*tensors)[3]
+    with self.test_session() as sess:
+      self.assertAllEqual([0], sess.run(lengths))
+      samples = [sess.run(sampled_lengths) for _ in range(400)]
+    # One tensor is drawn from each split before drawing from their union,
+    # so the only tensor of the first split is kept half of the time.
+    self.assertTrue(all(len(sample) == 1 for sample in samples))
+    first_split_rate = (
+        sum(sample[0] == 0 for sample in samples) / len(samples))
+    self.assertGreaterEqual(first_split_rate, 0.4)
+    self.assertLessEqual(first_split_rate, 0.6)
+
+
 if __name__ == '__main__':
   tf.test.main()
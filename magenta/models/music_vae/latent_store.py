@@ -0,0 +1,466 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent store of MusicVAE encodings with nearest-neighbor search.
+
+Encoding a library of NoteSequences is expensive, and interpolation, similarity
+search and attribute-vector arithmetic tend to encode the same sequences over
+and over. A `LatentStore` keeps the `z`, `mu` and `sigma` encodings of each
+sequence on disk, keyed by a hash of the sequence contents, in a directory keyed
+by the model checkpoint. The arrays are memory-mapped, so opening a large store
+is cheap, and top-k queries over `mu` are answered without running the encoder.
+
+Layout:
+  <store_dir>/<model key>/meta.json
+  <store_dir>/<model key>/index.jsonl  (one {"hash", "id"} line per row)
+  <store_dir>/<model key>/{z,mu,sigma}.f32  (raw float32 rows)
+  <store_dir>/<model key>/centroids.npy  (only if `build_ivf` was called)
+
+Rows are appended to the arrays before their index line is written, so an
+interrupted insertion leaves at most some unindexed trailing rows, which are
+ignored and overwritten on the next insertion. A store must only be written by
+one process at a time, and must be on a local filesystem.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+from magenta.models.music_vae import trained_model as trained_model_lib
+from magenta.music import note_sequence_io
+from magenta.protobuf import music_pb2
+import numpy as np
+import tensorflow as tf
+
+_ARRAY_NAMES = ('z', 'mu', 'sigma')
+
+
+def checkpoint_key(checkpoint_dir_or_path):
+  """Returns a string key identifying a model checkpoint.
+
+  Args:
+    checkpoint_dir_or_path: A checkpoint directory, whose most recent checkpoint
+        is used, or a direct path to a checkpoint, as accepted by
+        `TrainedModel`.
+
+  Returns:
+    A hex string derived from the checkpoint path and the sizes and
+    modification times of its files, so a checkpoint overwritten in place gets
+    a new key.
+  """
+  if tf.gfile.IsDirectory(checkpoint_dir_or_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_dir_or_path)
+  else:
+    checkpoint_path = checkpoint_dir_or_path
+  key = hashlib.sha1(os.path.abspath(checkpoint_path).encode('utf-8'))
+  # A checkpoint prefix names several files, e.g. `model.ckpt-1.index`.
+  for path in sorted(tf.gfile.Glob(checkpoint_path + '*')):
+    if path != checkpoint_path and not path.startswith(checkpoint_path + '.'):
+      continue
+    stat = tf.gfile.Stat(path)
+    key.update(('\n%s %d %d' % (os.path.basename(path), stat.length,
+                                 stat.mtime_nsec)).encode('utf-8'))
+  return key.hexdigest()[:16]
+
+
+def note_sequence_hash(note_sequence):
+  """Returns a hash of the contents of a NoteSequence.
+
+  The `id`, `filename` and `collection_name` fields are ignored, so copies of
+  the same music from different sources share a hash.
+
+  Args:
+    note_sequence: A NoteSequence proto.
+
+  Returns:
+    A hex string.
+  """
+  contents = music_pb2.NoteSequence()
+  contents.CopyFrom(note_sequence)
+  contents.ClearField('id')
+  contents.ClearField('filename')
+  contents.ClearField('collection_name')
+  return hashlib.sha1(contents.SerializeToString()).hexdigest()
+
+
+class LatentStore(object):
+  """On-disk store of MusicVAE encodings, keyed by NoteSequence contents.
+
+  Each stored sequence is a row with an id (the NoteSequence id, or its hash
+  if it has none). Nearest-neighbor queries over `mu` are exact by default.
+  After `build_ivf`, queries can instead probe the closest clusters of an
+  inverted-file index, which is approximate but much faster on large stores.
+  """
+
+  def __init__(self, store_dir, model_key, z_size):
+    """Opens or creates a `LatentStore`.
+
+    Args:
+      store_dir: The root directory of the store. It is created if needed, and
+          may be shared by stores for different models.
+      model_key: A string identifying the model, e.g. from `checkpoint_key`.
+      z_size: The size of the latent vectors.
+
+    Raises:
+      ValueError: If the store exists with a different `z_size`.
+    """
+    self._dir = os.path.join(store_dir, model_key)
+    self._z_size = z_size
+    self._hits = 0
+    self._misses = 0
+
+    if not os.path.isdir(self._dir):
+      os.makedirs(self._dir)
+    meta_path = os.path.join(self._dir, 'meta.json')
+    if os.path.exists(meta_path):
+      with open(meta_path) as f:
+        meta = json.load(f)
+      if meta['z_size'] != z_size:
+        raise ValueError('Store at %s has z_size %d, not %d.' %
+                         (self._dir, meta['z_size'], z_size))
+    else:
+      with open(meta_path, 'w') as f:
+        json.dump({'model_key': model_key, 'z_size': z_size}, f)
+
+    self._hashes = []
+    self._ids = []
+    index_path = os.path.join(self._dir, 'index.jsonl')
+    if os.path.exists(index_path):
+      with open(index_path) as f:
+        for line in f:
+          if line.strip():
+            entry = json.loads(line)
+            self._hashes.append(entry['hash'])
+            self._ids.append(entry['id'])
+    self._row_by_hash = dict((h, i) for i, h in enumerate(self._hashes))
+    self._row_by_id = {}
+    for i, sequence_id in enumerate(self._ids):
+      self._row_by_id.setdefault(sequence_id, i)
+
+    self._arrays = None
+    self._sq_norms = None
+    self._centroids = None
+    self._assignments = None
+    centroids_path = os.path.join(self._dir, 'centroids.npy')
+    if os.path.exists(centroids_path):
+      self._centroids = np.load(centroids_path)
+
+  def __len__(self):
+    return len(self._ids)
+
+  @property
+  def ids(self):
+    """The ids of the stored sequences, in row order."""
+    return list(self._ids)
+
+  @property
+  def hits(self):
+    """The number of sequences `encode` found in the store."""
+    return self._hits
+
+  @property
+  def misses(self):
+    """The number of sequences `encode` had to run through the encoder."""
+    return self._misses
+
+  def _path(self, name):
+    return os.path.join(self._dir, name + '.f32')
+
+  def _get_arrays(self):
+    """Returns the memory-mapped (z, mu, sigma) arrays of all indexed rows."""
+    if self._arrays is None:
+      shape = (len(self), self._z_size)
+      if len(self):
+        self._arrays = tuple(
+            np.memmap(self._path(name), dtype=np.float32, mode='r',
+                      shape=shape)
+            for name in _ARRAY_NAMES)
+      else:
+        self._arrays = tuple(
+            np.zeros(shape, np.float32) for _ in _ARRAY_NAMES)
+    return self._arrays
+
+  def row(self, note_sequence):
+    """Returns the row of a NoteSequence's encoding, or None if not stored."""
+    return self._row_by_hash.get(note_sequence_hash(note_sequence))
+
+  def get(self, sequence_id):
+    """Returns the stored `z`, `mu` and `sigma` of the sequence with an id.
+
+    Args:
+      sequence_id: The id of a stored sequence.
+
+    Returns:
+      The `z`, `mu` and `sigma` vectors of the sequence.
+
+    Raises:
+      KeyError: If no sequence with that id is stored.
+    """
+    i = self._row_by_id[sequence_id]
+    return tuple(array[i] for array in self._get_arrays())
+
+  def add(self, note_sequences, z, mu, sigma):
+    """Inserts encodings of NoteSequences, skipping ones already stored.
+
+    Args:
+      note_sequences: A list of NoteSequences.
+      z: The encoded `z` of each NoteSequence, shaped [n, z_size].
+      mu: The encoded `mu` of each NoteSequence, shaped [n, z_size].
+      sigma: The encoded `sigma` of each NoteSequence, shaped [n, z_size].
+
+    Returns:
+      The number of NoteSequences inserted.
+    """
+    return self._add([note_sequence_hash(note_sequence)
+                      for note_sequence in note_sequences],
+                     [note_sequence.id for note_sequence in note_sequences],
+                     z, mu, sigma)
+
+  def _add(self, hashes, ids, z, mu, sigma):
+    """Inserts encodings given the NoteSequence hashes and ids."""
+    new_rows = []
+    new_entries = []
+    pending_hashes = set()
+    for i, (sequence_hash, sequence_id) in enumerate(zip(hashes, ids)):
+      if sequence_hash in self._row_by_hash or sequence_hash in pending_hashes:
+        continue
+      pending_hashes.add(sequence_hash)
+      new_rows.append(i)
+      new_entries.append(
+          {'hash': sequence_hash, 'id': sequence_id or sequence_hash})
+    if not new_rows:
+      return 0
+
+    # Write the rows first and the index lines after, so a row is only ever
+    # indexed once its vectors are on disk.
+    row_bytes = self._z_size * np.dtype(np.float32).itemsize
+    for name, values in zip(_ARRAY_NAMES, (z, mu, sigma)):
+      values = np.asarray(values, np.float32)[new_rows]
+      with open(self._path(name), 'ab') as f:
+        # Drops unindexed rows left by an interrupted insertion.
+        f.truncate(len(self) * row_bytes)
+        f.write(values.tobytes())
+    with open(os.path.join(self._dir, 'index.jsonl'), 'a') as f:
+      for entry in new_entries:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    first_row = len(self)
+    for offset, entry in enumerate(new_entries):
+      self._hashes.append(entry['hash'])
+      self._ids.append(entry['id'])
+      self._row_by_hash[entry['hash']] = first_row + offset
+      self._row_by_id.setdefault(entry['id'], first_row + offset)
+    self._arrays = None
+    self._sq_norms = None
+    if self._assignments is not None:
+      new_mu = np.asarray(mu, np.float32)[new_rows]
+      self._assignments = np.concatenate(
+          [self._assignments, self._assign(new_mu)])
+    return len(new_rows)
+
+  def encode(self, model, note_sequences):
+    """Encodes NoteSequences, running only the uncached ones through `model`.
+
+    Newly encoded sequences are inserted into the store.
+
+    Args:
+      model: A `TrainedModel` or `BatchedTrainedModel`.
+      note_sequences: A list of NoteSequences.
+
+    Returns:
+      The `z`, `mu` and `sigma` values for each NoteSequence, as arrays shaped
+      [n, z_size].
+    """
+    hashes = [note_sequence_hash(note_sequence)
+              for note_sequence in note_sequences]
+    missing = [i for i, sequence_hash in enumerate(hashes)
+               if sequence_hash not in self._row_by_hash]
+    self._hits += len(hashes) - len(missing)
+    self._misses += len(missing)
+    if missing:
+      missing_sequences = [note_sequences[i] for i in missing]
+      self._add([hashes[i] for i in missing],
+                [note_sequences[i].id for i in missing],
+                *model.encode(missing_sequences))
+    rows = [self._row_by_hash[sequence_hash] for sequence_hash in hashes]
+    return tuple(np.array(array[rows]) for array in self._get_arrays())
+
+  def build_from_tfrecord(self, model, tfrecord_path, chunk_size=256):
+    """Encodes and inserts every NoteSequence in a TFRecord file.
+
+    Sequences that are already stored are not re-encoded. Sequences from which
+    the model's data converter doesn't extract exactly one example are skipped.
+
+    Args:
+      model: A `TrainedModel` or `BatchedTrainedModel`.
+      tfrecord_path: Path to a TFRecord file of NoteSequences.
+      chunk_size: The number of new sequences to encode at a time.
+
+    Returns:
+      The number of NoteSequences inserted.
+    """
+    num_inserted = 0
+    num_skipped = 0
+    chunk = []
+    chunk_hashes = []
+
+    def _encode_and_add(note_sequences, hashes):
+      return self._add(hashes, [ns.id for ns in note_sequences],
+                       *model.encode(note_sequences))
+
+    def _flush():
+      try:
+        return _encode_and_add(chunk, chunk_hashes), 0
+      except (trained_model_lib.NoExtractedExamplesError,
+              trained_model_lib.MultipleExtractedExamplesError):
+        # Find the offending sequences one at a time.
+        inserted = 0
+        skipped = 0
+        for note_sequence, sequence_hash in zip(chunk, chunk_hashes):
+          try:
+            inserted += _encode_and_add([note_sequence], [sequence_hash])
+          except (trained_model_lib.NoExtractedExamplesError,
+                  trained_model_lib.MultipleExtractedExamplesError):
+            skipped += 1
+        return inserted, skipped
+
+    for note_sequence in note_sequence_io.note_sequence_record_iterator(
+        tfrecord_path):
+      sequence_hash = note_sequence_hash(note_sequence)
+      if sequence_hash in self._row_by_hash or sequence_hash in chunk_hashes:
+        continue
+      chunk.append(note_sequence)
+      chunk_hashes.append(sequence_hash)
+      if len(chunk) == chunk_size:
+        inserted, skipped = _flush()
+        num_inserted += inserted
+        num_skipped += skipped
+        chunk = []
+        chunk_hashes = []
+        tf.logging.info('Inserted %d sequences into the latent store.',
+                        num_inserted)
+    if chunk:
+      inserted, skipped = _flush()
+      num_inserted += inserted
+      num_skipped += skipped
+
+    tf.logging.info(
+        'Inserted %d sequences from %s into the latent store (%d skipped); '
+        'it now holds %d.', num_inserted, tfrecord_path, num_skipped,
+        len(self))
+    return num_inserted
+
+  def build_ivf(self, num_lists, num_iterations=10, seed=None):
+    """Builds an inverted-file index over `mu` for approximate queries.
+
+    The stored `mu` vectors are clustered with k-means, and each query then
+    only scans the rows in its closest clusters. Rows inserted later are
+    assigned to the existing clusters; call again to re-cluster.
+
+    Args:
+      num_lists: The number of clusters.
+      num_iterations: The number of k-means iterations.
+      seed: Optional seed for choosing the initial centroids.
+
+    Raises:
+      ValueError: If the store holds fewer than `num_lists` sequences.
+    """
+    _, mu, _ = self._get_arrays()
+    if len(mu) < num_lists:
+      raise ValueError('Cannot build %d lists from %d sequences.' %
+                       (num_lists, len(mu)))
+    rng = np.random.RandomState(seed)
+    centroids = np.array(mu[rng.choice(len(mu), num_lists, replace=False)])
+    for _ in range(num_iterations):
+      self._centroids = centroids
+      assignments = self._assign(mu)
+      for j in range(num_lists):
+        members = assignments == j
+        if members.any():
+          centroids[j] = mu[members].mean(axis=0)
+    self._centroids = centroids
+    self._assignments = self._assign(mu)
+    np.save(os.path.join(self._dir, 'centroids.npy'), centroids)
+
+  def _assign(self, vectors):
+    """Returns the index of the closest centroid to each vector."""
+    distances = (
+        np.square(self._centroids).sum(axis=1)[np.newaxis, :] -
+        2 * np.dot(vectors, self._centroids.T))
+    return np.argmin(distances, axis=1)
+
+  def nearest(self, query, k=10, num_probes=None, exclude_ids=()):
+    """Finds the stored sequences whose `mu` is closest to a query vector.
+
+    Args:
+      query: A latent vector of size `z_size`.
+      k: The number of results to return.
+      num_probes: If given and `build_ivf` has been called, only the rows in
+          the `num_probes` clusters closest to the query are searched.
+          Otherwise the search is exact.
+      exclude_ids: Ids of sequences to leave out of the results.
+
+    Returns:
+      A list of up to `k` (id, distance) pairs, closest first, where distance
+      is the Euclidean distance between `mu` and the query.
+    """
+    _, mu, _ = self._get_arrays()
+    if self._sq_norms is None:
+      self._sq_norms = np.square(mu).sum(axis=1)
+    query = np.asarray(query, np.float32)
+
+    if num_probes is not None and self._centroids is not None:
+      if self._assignments is None:
+        self._assignments = self._assign(mu)
+      centroid_distances = np.square(self._centroids - query).sum(axis=1)
+      probes = np.argsort(centroid_distances)[:num_probes]
+      candidates = np.flatnonzero(np.isin(self._assignments, probes))
+      sq_distances = (self._sq_norms[candidates] -
+                      2 * np.dot(mu[candidates], query))
+    else:
+      candidates = np.arange(len(mu))
+      sq_distances = self._sq_norms - 2 * np.dot(mu, query)
+    sq_distances += np.square(query).sum()
+
+    exclude_rows = [self._row_by_id[sequence_id] for sequence_id in exclude_ids
+                    if sequence_id in self._row_by_id]
+    sq_distances[np.isin(candidates, exclude_rows)] = np.inf
+    k = min(k, len(candidates) -
+            np.count_nonzero(np.isin(candidates, exclude_rows)))
+    if k <= 0:
+      return []
+
+    top = np.argpartition(sq_distances, k - 1)[:k]
+    top = top[np.argsort(sq_distances[top])]
+    return [(self._ids[candidates[i]],
+             float(np.sqrt(max(sq_distances[i], 0.0)))) for i in top]
+
+  def nearest_to_id(self, sequence_id, k=10, num_probes=None):
+    """Finds the stored sequences closest to a stored sequence.
+
+    Args:
+      sequence_id: The id of a stored sequence.
+      k: The number of results to return, not counting the sequence itself.
+      num_probes: See `nearest`.
+
+    Returns:
+      A list of up to `k` (id, distance) pairs, closest first.
+    """
+    _, mu, _ = self.get(sequence_id)
+    return self.nearest(mu, k=k, num_probes=num_probes,
+                        exclude_ids=[sequence_id])
@@ -0,0 +1,147 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for latent_store."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+from magenta.models.music_vae import latent_store
+from magenta.models.music_vae import trained_model
+from magenta.music import note_sequence_io
+from magenta.protobuf import music_pb2
+import numpy as np
+import tensorflow as tf
+
+
+class FakeModel(object):
+  """Encodes a NoteSequence to a vector filled with its first pitch."""
+
+  def __init__(self):
+    self.encoded = []
+
+  def encode(self, note_sequences):
+    self.encoded.extend(ns.id for ns in note_sequences)
+    for ns in note_sequences:
+      if not ns.notes:
+        raise trained_model.NoExtractedExamplesError(ns.id)
+    mu = np.array([[ns.notes[0].pitch] * 2 for ns in note_sequences],
+                  np.float32)
+    return mu + 0.5, mu, np.ones_like(mu)
+
+
+def make_sequence(sequence_id, pitch=None):
+  ns = music_pb2.NoteSequence(id=sequence_id)
+  if pitch is not None:
+    ns.notes.add(pitch=pitch, start_time=0.0, end_time=1.0)
+  return ns
+
+
+class LatentStoreTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.store_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+
+  def testEncodeCaches(self):
+    store_dir = self.store_dir
+    model = FakeModel()
+    store = latent_store.LatentStore(store_dir, 'model', 2)
+    sequences = [make_sequence('a', 60), make_sequence('b', 62)]
+
+    z, mu, sigma = store.encode(model, sequences)
+    self.assertAllEqual([[60, 60], [62, 62]], mu)
+    self.assertAllEqual(mu + 0.5, z)
+    self.assertAllEqual(np.ones([2, 2]), sigma)
+    self.assertEqual(['a', 'b'], model.encoded)
+
+    # The same contents under a different id are found by hash, and the store
+    # persists across instances.
+    store = latent_store.LatentStore(store_dir, 'model', 2)
+    _, mu, _ = store.encode(
+        model, [make_sequence('c', 62), make_sequence('d', 64)])
+    self.assertAllEqual([[62, 62], [64, 64]], mu)
+    self.assertEqual(['a', 'b', 'd'], model.encoded)
+    self.assertEqual((1, 1), (store.hits, store.misses))
+    self.assertEqual(['a', 'b', 'd'], store.ids)
+
+    # A different model has a separate store.
+    store = latent_store.LatentStore(store_dir, 'other_model', 2)
+    self.assertEqual(0, len(store))
+
+    with self.assertRaises(ValueError):
+      latent_store.LatentStore(store_dir, 'model', 3)
+
+  def testBuildFromTfRecord(self):
+    tfrecord_path = os.path.join(self.store_dir, 'sequences.tfrecord')
+    with note_sequence_io.NoteSequenceRecordWriter(tfrecord_path) as writer:
+      for i, pitch in enumerate([60, 61, None, 60, 63]):
+        writer.write(make_sequence(str(i), pitch))
+
+    store = latent_store.LatentStore(self.store_dir, 'model', 2)
+    model = FakeModel()
+    self.assertEqual(
+        3, store.build_from_tfrecord(model, tfrecord_path, chunk_size=2))
+    self.assertEqual(['0', '1', '4'], store.ids)
+    _, mu, _ = store.get('4')
+    self.assertAllEqual([63, 63], mu)
+
+  def testNearest(self):
+    store = latent_store.LatentStore(self.store_dir, 'model', 2)
+    pitches = [60, 61, 64, 70, 71, 80]
+    store.encode(FakeModel(),
+                 [make_sequence(str(p), p) for p in pitches])
+
+    results = store.nearest([62, 62], k=3)
+    self.assertEqual(['61', '60', '64'], [i for i, _ in results])
+    self.assertAlmostEqual(np.sqrt(2), results[0][1], places=5)
+
+    self.assertEqual(['71'], [i for i, _ in store.nearest_to_id('70', k=1)])
+    self.assertEqual(['61', '60'],
+                     [i for i, _ in store.nearest_to_id('64', k=2)])
+
+    store.build_ivf(num_lists=3, seed=0)
+    store.add([make_sequence('79', 79)], [[79.5, 79.5]], [[79, 79]],
+              [[1, 1]])
+    results = store.nearest([80, 80], k=2, num_probes=1)
+    self.assertEqual(['80', '79'], [i for i, _ in results])
+    # Excluded ids outside the probed clusters do not shrink the results.
+    self.assertEqual(
+        store.nearest([80, 80], k=10, num_probes=1),
+        store.nearest([80, 80], k=10, num_probes=1, exclude_ids=['60']))
+
+  def testCheckpointKey(self):
+    checkpoint_dir = os.path.join(self.store_dir, 'train')
+    tf.gfile.MakeDirs(checkpoint_dir)
+    checkpoint_path = os.path.join(checkpoint_dir, 'model.ckpt-1')
+
+    def write_checkpoint(contents):
+      for suffix in ['.index', '.data-00000-of-00001']:
+        with tf.gfile.Open(checkpoint_path + suffix, 'w') as f:
+          f.write(contents)
+      tf.train.update_checkpoint_state(checkpoint_dir, checkpoint_path)
+
+    write_checkpoint('a')
+    key = latent_store.checkpoint_key(checkpoint_dir)
+    self.assertEqual(key, latent_store.checkpoint_key(checkpoint_path))
+    # A checkpoint overwritten in place gets a new key.
+    write_checkpoint('bb')
+    self.assertNotEqual(key, latent_store.checkpoint_key(checkpoint_path))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,90 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Converts NoteSequences to MusicVAE tensors ahead of training."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from magenta.models.music_vae import configs
+from magenta.models.music_vae import data
+import tensorflow as tf
+
+flags = tf.app.flags
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'config', '',
+    'The name of the config whose data converter to use.')
+flags.DEFINE_string(
+    'examples_path', None,
+    'Path to a TFRecord file of NoteSequence examples.')
+flags.DEFINE_string(
+    'output_path', None,
+    'Prefix of the sharded TFRecord files to write tensors to.')
+flags.DEFINE_integer(
+    'num_shards', 1,
+    'The number of output files.')
+flags.DEFINE_integer(
+    'num_workers', 4,
+    'The number of processes to convert NoteSequences with.')
+flags.DEFINE_string(
+    'log', 'INFO',
+    'The threshold for what messages will be logged: '
+    'DEBUG, INFO, WARN, ERROR, or FATAL.')
+
+
+def run(config_map):
+  """Converts the examples with the data converter of the config.
+
+  Args:
+    config_map: Dictionary mapping configuration name to Config object.
+
+  Raises:
+    ValueError: if required flags are missing or invalid.
+  """
+  if FLAGS.config not in config_map:
+    raise ValueError('Invalid config: %s' % FLAGS.config)
+  if not FLAGS.examples_path:
+    raise ValueError('`--examples_path` is required.')
+  if not FLAGS.output_path:
+    raise ValueError('`--output_path` is required.')
+
+  output_path = os.path.expanduser(FLAGS.output_path)
+  output_dir = os.path.dirname(output_path)
+  if output_dir:
+    tf.gfile.MakeDirs(output_dir)
+
+  data.pretensorize(
+      os.path.expanduser(FLAGS.examples_path),
+      output_path,
+      config_map[FLAGS.config].data_converter,
+      num_shards=FLAGS.num_shards,
+      num_workers=FLAGS.num_workers)
+
+
+def main(unused_argv):
+  tf.logging.set_verbosity(FLAGS.log)
+  run(configs.CONFIG_MAP)
+
+
+def console_entry_point():
+  tf.app.run(main)
+
+
+if __name__ == '__main__':
+  console_entry_point()
@@ -73,6 +73,18 @@ flags.DEFINE_integer(
 flags.DEFINE_integer(
     'num_data_threads', 4,
     'The number of data preprocessing threads.')
+flags.DEFINE_integer(
+    'num_data_workers', 0,
+    'The number of processes to convert examples to tensors with, or 0 to '
+    'convert them in the TensorFlow graph.')
+flags.DEFINE_boolean(
+    'pretensorized', False,
+    'Whether the examples path contains tensors written by '
+    '`music_vae_pretensorize` instead of NoteSequences.')
+flags.DEFINE_integer(
+    'benchmark_num_batches', 0,
+    'If positive, measure the throughput of the data pipeline over this many '
+    'batches instead of training or evaluating.')
 flags.DEFINE_integer(
     'prefetch_size', 4,
     'How many batches to prefetch at the end of the data pipeline.')
@@ -287,7 +299,14 @@ def run(config_map,
         tf_file_reader=tf_file_reader,
         num_threads=FLAGS.num_data_threads,
         prefetch_size=FLAGS.prefetch_size,
-        is_training=is_training)
+        is_training=is_training,
+        num_workers=FLAGS.num_data_workers,
+        pretensorized=FLAGS.pretensorized,
+        file_reader=file_reader)
+
+  if FLAGS.benchmark_num_batches > 0:
+    data.benchmark_dataset(dataset_fn(), FLAGS.benchmark_num_batches)
+    return
 
   if is_training:
     train(
@@ -302,7 +321,9 @@ def run(config_map,
         num_ps_tasks=FLAGS.num_ps_tasks,
         task=FLAGS.task)
   else:
-    num_batches = FLAGS.eval_num_batches or data.count_examples(
+    count_examples = (data.count_pretensorized_examples
+                      if FLAGS.pretensorized else data.count_examples)
+    num_batches = FLAGS.eval_num_batches or count_examples(
         config.eval_examples_path,
         config.data_converter,
         file_reader) // config.hparams.batch_size
@@ -18,9 +18,13 @@ from __future__ import division
 from __future__ import print_function
 
 import copy
+import itertools
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import tarfile
+import time
 
 from backports import tempfile
 import numpy as np
@@ -35,6 +39,36 @@ class MultipleExtractedExamplesError(Exception):
   pass
 
 
+# The data converter used by conversion workers, set by `_init_worker`.
+_worker_data_converter = None
+
+
+def _init_worker(data_converter):
+  global _worker_data_converter
+  _worker_data_converter = data_converter
+
+
+def _extract_tensors(note_sequence):
+  """Extracts the single example from a NoteSequence in a worker."""
+  extracted_tensors = _worker_data_converter.to_tensors(note_sequence)
+  if not extracted_tensors.inputs:
+    raise NoExtractedExamplesError(
+        'No examples extracted from NoteSequence: %s' % note_sequence)
+  if len(extracted_tensors.inputs) > 1:
+    raise MultipleExtractedExamplesError(
+        'Multiple (%d) examples extracted from NoteSequence: %s' %
+        (len(extracted_tensors.inputs), note_sequence))
+  return (extracted_tensors.inputs[0], extracted_tensors.lengths[0],
+          extracted_tensors.controls[0])
+
+
+def _to_items(samples, controls=None):
+  """Converts decoded samples to NoteSequences in a worker."""
+  if controls is None:
+    return _worker_data_converter.to_items(samples)
+  return _worker_data_converter.to_items(samples, controls)
+
+
 class TrainedModel(object):
   """An interface to a trained model for encoding, decoding, and sampling.
 
@@ -246,43 +280,63 @@ class TrainedModel(object):
       raise RuntimeError('Cannot encode with a non-conditional model.')
 
     n = len(input_tensors)
-    input_depth = self._config.data_converter.input_depth
     batch_size = self._config.hparams.batch_size
+    if control_tensors is None:
+      control_tensors = [None] * n
+    max_length = max([len(t) for t in input_tensors])
+
+    outputs = []
+    for batch_begin in range(0, n, batch_size):
+      batch_end = batch_begin + batch_size
+      outputs.append(self._encode_batch(
+          input_tensors[batch_begin:batch_end],
+          lengths[batch_begin:batch_end],
+          control_tensors[batch_begin:batch_end],
+          max_length=max_length))
+    assert outputs
+    return tuple(np.vstack(v) for v in zip(*outputs))
+
+  def _encode_batch(self, input_tensors, lengths, control_tensors,
+                    max_length=None):
+    """Encodes at most one batch of input tensors, padding it as needed.
+
+    Args:
+      input_tensors: Collection of at most `batch_size` input tensors.
+      lengths: Collection of lengths of input tensors.
+      control_tensors: Collection of control tensors, or None for each input
+        without controls.
+      max_length: Length to pad the input tensors to. Defaults to the length of
+        the longest input tensor.
+    Returns:
+      The encoded `z`, `mu`, and `sigma` values for the given inputs.
+    """
+    n = len(input_tensors)
+    batch_size = self._config.hparams.batch_size
+    input_depth = self._config.data_converter.input_depth
+    control_depth = self._config.data_converter.control_depth
+    assert 0 < n <= batch_size
+    if max_length is None:
+      max_length = max([len(t) for t in input_tensors])
 
-    batch_pad_amt = -n % batch_size
-    if batch_pad_amt > 0:
-      input_tensors += [np.zeros([0, input_depth])] * batch_pad_amt
+    # Pads with empty examples to make a full batch.
     length_array = np.array(lengths, np.int32)
     length_array = np.pad(
         length_array,
-        [(0, batch_pad_amt)] + [(0, 0)] * (length_array.ndim - 1),
+        [(0, batch_size - n)] + [(0, 0)] * (length_array.ndim - 1),
         'constant')
-
-    max_length = max([len(t) for t in input_tensors])
-    inputs_array = np.zeros(
-        [len(input_tensors), max_length, input_depth])
+    inputs_array = np.zeros([batch_size, max_length, input_depth])
+    controls_array = np.zeros([batch_size, max_length, control_depth])
     for i, t in enumerate(input_tensors):
       inputs_array[i, :len(t)] = t
-
-    control_depth = self._config.data_converter.control_depth
-    controls_array = np.zeros(
-        [len(input_tensors), max_length, control_depth])
-    if control_tensors is not None:
-      control_tensors += [np.zeros([0, control_depth])] * batch_pad_amt
-      for i, t in enumerate(control_tensors):
+    for i, t in enumerate(control_tensors):
+      if t is not None:
         controls_array[i, :len(t)] = t
 
-    outputs = []
-    for i in range(len(inputs_array) // batch_size):
-      batch_begin = i * batch_size
-      batch_end = (i+1) * batch_size
-      feed_dict = {self._inputs: inputs_array[batch_begin:batch_end],
-                   self._controls: controls_array[batch_begin:batch_end],
-                   self._inputs_length: length_array[batch_begin:batch_end]}
-      outputs.append(
-          self._sess.run([self._z, self._mu, self._sigma], feed_dict))
-    assert outputs
-    return tuple(np.vstack(v)[:n] for v in zip(*outputs))
+    feed_dict = {self._inputs: inputs_array,
+                 self._controls: controls_array,
+                 self._inputs_length: length_array}
+    z, mu, sigma = self._sess.run([self._z, self._mu, self._sigma], feed_dict)
+    return z[:n], mu[:n], sigma[:n]
 
   def decode(self, z, length=None, temperature=1.0, c_input=None):
     """Decodes a collection of latent vectors into NoteSequences.
@@ -328,33 +382,44 @@ class TrainedModel(object):
       ValueError: If `length` is not specified and an end token is not being
         used.
     """
+    length = self._check_decode_args(length)
+    batch_size = self._config.hparams.batch_size
+
+    outputs = []
+    for i in range(0, len(z), batch_size):
+      outputs.extend(self._decode_batch(
+          z[i:i + batch_size], length, temperature, c_input,
+          return_full_results))
+    return outputs[:len(z)]
+
+  def _check_decode_args(self, length):
+    """Validates decoding arguments, returning the length to decode to."""
     if not self._config.hparams.z_size:
       raise RuntimeError('Cannot decode with a non-conditional model.')
 
     if not length and self._config.data_converter.end_token is None:
       raise ValueError(
           'A length must be specified when the end token is not used.')
-    batch_size = self._config.hparams.batch_size
-    n = len(z)
-    length = length or tf.int32.max
+    return length or tf.int32.max
 
-    batch_pad_amt = -n % batch_size
-    z = np.pad(z, [(0, batch_pad_amt), (0, 0)], mode='constant')
-
-    outputs = []
-    for i in range(len(z) // batch_size):
-      feed_dict = {
-          self._temperature: temperature,
-          self._z_input: z[i*batch_size:(i+1)*batch_size],
-          self._max_length: length,
-      }
-      if self._c_input is not None:
-        feed_dict[self._c_input] = c_input
-      if return_full_results:
-        outputs.extend(self._sess.run(self._decoder_results, feed_dict))
-      else:
-        outputs.extend(self._sess.run(self._outputs, feed_dict))
-    return outputs[:n]
+  def _decode_batch(self, z, length, temperature, c_input,
+                    return_full_results=False):
+    """Decodes at most one batch of latent vectors, padding it as needed."""
+    n = len(z)
+    batch_size = self._config.hparams.batch_size
+    assert 0 < n <= batch_size
+    feed_dict = {
+        self._temperature: temperature,
+        self._z_input: np.pad(z, [(0, batch_size - n), (0, 0)],
+                              mode='constant'),
+        self._max_length: length,
+    }
+    if self._c_input is not None:
+      feed_dict[self._c_input] = c_input
+    if return_full_results:
+      return self._sess.run(self._decoder_results, feed_dict)
+    else:
+      return self._sess.run(self._outputs, feed_dict)[:n]
 
   def interpolate(self, start_sequence, end_sequence, num_steps,
                   length=None, temperature=1.0, assert_same_length=True):
@@ -390,3 +455,130 @@ class TrainedModel(object):
         length=length,
         z=z,
         temperature=temperature)
+
+
+class BatchedTrainedModel(object):
+  """A throughput-oriented interface for encoding and decoding at scale.
+
+  Accepts any number of NoteSequences or latent vectors. NoteSequences are
+  converted to and from tensors in a pool of workers while the session runs,
+  so the conversion of one batch overlaps with the model run of another. Items
+  are grouped into the full, fixed-size batches the graph was built with, and
+  the final batch is padded. Results are returned in input order.
+
+  After each call, `sequences_per_second` and `batch_fill_ratio` hold the
+  throughput and the fraction of batch rows that held real items.
+
+  Args:
+    trained_model: The TrainedModel to encode and decode with.
+    num_workers: The number of worker processes to convert NoteSequences with.
+      If 1, conversion runs in a single background thread.
+  """
+
+  def __init__(self, trained_model, num_workers=1):
+    if num_workers < 1:
+      raise ValueError('num_workers must be at least 1, got %d' % num_workers)
+    self._model = trained_model
+    self._config = trained_model._config  # pylint:disable=protected-access
+    self._num_workers = num_workers
+    self.sequences_per_second = 0.0
+    self.batch_fill_ratio = 0.0
+
+  @property
+  def batch_size(self):
+    return self._config.hparams.batch_size
+
+  def _make_pool(self):
+    initargs = (self._config.data_converter,)
+    if self._num_workers > 1:
+      return multiprocessing.Pool(
+          self._num_workers, initializer=_init_worker, initargs=initargs)
+    return multiprocessing.pool.ThreadPool(
+        1, initializer=_init_worker, initargs=initargs)
+
+  def _record_stats(self, action, num_items, num_batches, start_time):
+    elapsed = time.time() - start_time
+    self.sequences_per_second = num_items / elapsed if elapsed else 0.0
+    self.batch_fill_ratio = (
+        num_items / (num_batches * self.batch_size) if num_batches else 0.0)
+    tf.logging.info(
+        '%s %d sequences in %d batches (%.1f%% full) at %.1f sequences/sec.',
+        action, num_items, num_batches, 100.0 * self.batch_fill_ratio,
+        self.sequences_per_second)
+
+  def encode(self, note_sequences):
+    """Encodes NoteSequences into latent vectors.
+
+    Args:
+      note_sequences: An iterable of NoteSequence objects to encode.
+    Returns:
+      The encoded `z`, `mu`, and `sigma` values.
+    Raises:
+      RuntimeError: If called for a non-conditional model.
+      NoExtractedExamplesError: If no examples were extracted.
+      MultipleExtractedExamplesError: If multiple examples were extracted.
+    """
+    z_size = self._config.hparams.z_size
+    if not z_size:
+      raise RuntimeError('Cannot encode with a non-conditional model.')
+
+    start_time = time.time()
+    outputs = []
+    pool = self._make_pool()
+    try:
+      extracted = pool.imap(_extract_tensors, note_sequences)
+      while True:
+        batch = list(itertools.islice(extracted, self.batch_size))
+        if not batch:
+          break
+        inputs, lengths, controls = zip(*batch)
+        # Each batch is only padded to its own longest sequence.
+        outputs.append(self._model._encode_batch(  # pylint:disable=protected-access
+            inputs, lengths, controls))
+    finally:
+      pool.terminate()
+
+    self._record_stats('Encoded', sum(len(z) for z, _, _ in outputs),
+                       len(outputs), start_time)
+    if not outputs:
+      return tuple(np.zeros([0, z_size], np.float32) for _ in range(3))
+    return tuple(np.vstack(v) for v in zip(*outputs))
+
+  def decode(self, z, length=None, temperature=1.0, c_input=None):
+    """Decodes latent vectors into NoteSequences.
+
+    Args:
+      z: A collection of latent vectors to decode.
+      length: The maximum length of a sample in decoder iterations. Required
+        if end tokens are not being used.
+      temperature: The softmax temperature to use (if applicable).
+      c_input: Control sequence (if applicable).
+    Returns:
+      A list of decodings as NoteSequence objects.
+    Raises:
+      RuntimeError: If called for a non-conditional model.
+      ValueError: If `length` is not specified and an end token is not being
+        used.
+    """
+    length = self._model._check_decode_args(length)  # pylint:disable=protected-access
+
+    start_time = time.time()
+    pending = []
+    pool = self._make_pool()
+    try:
+      for i in range(0, len(z), self.batch_size):
+        samples = self._model._decode_batch(  # pylint:disable=protected-access
+            z[i:i + self.batch_size], length, temperature, c_input)
+        controls = None
+        if c_input is not None:
+          controls = np.tile(np.expand_dims(c_input, 0), [len(samples), 1, 1])
+        # Converts this batch while the next one is decoded.
+        pending.append(pool.apply_async(_to_items, (samples, controls)))
+      results = []
+      for p in pending:
+        results.extend(p.get())
+    finally:
+      pool.terminate()
+
+    self._record_stats('Decoded', len(results), len(pending), start_time)
+    return results
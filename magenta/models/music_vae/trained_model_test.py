@@ -0,0 +1,97 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for MusicVAE trained_model."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+from magenta.models.music_vae import data
+from magenta.models.music_vae import trained_model
+import numpy as np
+import tensorflow as tf
+
+FakeHParams = collections.namedtuple('FakeHParams', ['batch_size', 'z_size'])
+FakeConfig = collections.namedtuple('FakeConfig', ['hparams', 'data_converter'])
+
+
+class FakeConverter(object):
+  """Converts an integer `n` to a single input of length `n`."""
+
+  def to_tensors(self, item):
+    if not item:
+      return data.ConverterTensors()
+    return data.ConverterTensors(inputs=[np.full([item, 2], item)])
+
+  def to_items(self, samples):
+    return [float(sample.sum()) for sample in samples]
+
+
+class FakeTrainedModel(object):
+  """Encodes each input to its length and decodes each z to twice itself."""
+
+  def __init__(self, batch_size):
+    self._config = FakeConfig(FakeHParams(batch_size, 1), FakeConverter())
+    self.batch_sizes = []
+
+  def _encode_batch(self, input_tensors, lengths, control_tensors):
+    self.batch_sizes.append(len(input_tensors))
+    assert len(control_tensors) == len(input_tensors)
+    z = np.array(lengths, np.float32)[:, np.newaxis]
+    return z, z, np.zeros_like(z)
+
+  def _check_decode_args(self, length):
+    return length
+
+  def _decode_batch(self, z, length, temperature, c_input):
+    self.batch_sizes.append(len(z))
+    return 2 * np.array(z)[:, :, np.newaxis]
+
+
+class BatchedTrainedModelTest(tf.test.TestCase):
+
+  def testEncode(self):
+    for num_workers in [1, 2]:
+      model = FakeTrainedModel(batch_size=4)
+      batched_model = trained_model.BatchedTrainedModel(
+          model, num_workers=num_workers)
+      z, mu, sigma = batched_model.encode(iter(range(1, 11)))
+      self.assertAllEqual(np.arange(1, 11)[:, np.newaxis], z)
+      self.assertAllEqual(z, mu)
+      self.assertAllEqual(np.zeros([10, 1]), sigma)
+      self.assertEqual([4, 4, 2], model.batch_sizes)
+      self.assertAlmostEqual(10 / 12, batched_model.batch_fill_ratio)
+
+  def testEncodeNoExtractedExamples(self):
+    batched_model = trained_model.BatchedTrainedModel(
+        FakeTrainedModel(batch_size=4))
+    with self.assertRaises(trained_model.NoExtractedExamplesError):
+      batched_model.encode([1, 0, 2])
+
+  def testDecode(self):
+    for num_workers in [1, 2]:
+      model = FakeTrainedModel(batch_size=3)
+      batched_model = trained_model.BatchedTrainedModel(
+          model, num_workers=num_workers)
+      z = np.arange(7, dtype=np.float32)[:, np.newaxis]
+      self.assertEqual([2.0 * i for i in range(7)], batched_model.decode(z))
+      self.assertEqual([3, 3, 1], model.batch_sizes)
+      self.assertAlmostEqual(7 / 9, batched_model.batch_fill_ratio)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -875,6 +875,65 @@ def causal_linear(x, n_inputs, n_outputs, name, filter_length, rate,
   return y, (init_1, init_2), (push_1, push_2)
 
 
+def causal_linear_buffered(x, n_inputs, n_outputs, name, filter_length, rate,
+                           batch_size, step):
+  """Applies dilated convolution using a circular history buffer.
+
+  Unlike `causal_linear`, whose queues only advance once per `session.run`,
+  the history lives in a local variable indexed by `step`, so the convolution
+  can be applied repeatedly inside a `tf.while_loop`. Assumes a filter_length
+  of 3.
+
+  Args:
+    x: The [mb, time, channels] tensor input.
+    n_inputs: The input number of channels.
+    n_outputs: The output number of channels.
+    name: The variable scope to provide to W and biases.
+    filter_length: The length of the convolution, assumed to be 3.
+    rate: The rate or dilation
+    batch_size: Non-symbolic value for batch_size.
+    step: Scalar int32 tensor, the index of the current time step.
+
+  Returns:
+    y: The output of the operation
+    history: The [2 * rate, mb, n_inputs] local variable holding past inputs.
+    push: Op writing `x` to the history, run after the history is read.
+  """
+  assert filter_length == 3
+
+  # x[t - k] is stored at index (t - k) % (2 * rate) of the history.
+  history = tf.get_variable(
+      name=name + "/history",
+      shape=[2 * rate, batch_size, n_inputs],
+      dtype=tf.float32,
+      initializer=tf.zeros_initializer(),
+      trainable=False,
+      collections=[tf.GraphKeys.LOCAL_VARIABLES])
+  index = tf.mod(step, 2 * rate)
+  state_2 = tf.gather(history, index)
+  state_1 = tf.gather(history, tf.mod(step + rate, 2 * rate))
+
+  # get pretrained weights
+  w = tf.get_variable(
+      name=name + "/W",
+      shape=[1, filter_length, n_inputs, n_outputs],
+      dtype=tf.float32)
+  b = tf.get_variable(
+      name=name + "/biases", shape=[n_outputs], dtype=tf.float32)
+
+  # perform op w/ cached states
+  y = tf.nn.bias_add(
+      tf.matmul(state_2, w[0][0]) + tf.matmul(state_1, w[0][1]) +
+      tf.matmul(x[:, 0, :], w[0][2]), b)
+
+  # x[t - 2 * rate] is no longer needed once read, so x[t] replaces it.
+  with tf.control_dependencies([state_1, state_2]):
+    push = tf.scatter_update(history, index, x[:, 0, :])
+
+  y = tf.expand_dims(y, 1)
+  return y, history, push
+
+
 def linear(x, n_inputs, n_outputs, name):
   """Simple linear layer.
 
@@ -20,6 +20,9 @@ Ramachandran, P., Le Paine, T., Khorrami, P., Babaeizadeh, M.,
 Chang, S., Zhang, Y., ... Huang, T. (2017).
 Fast Generation For Convolutional Autoregressive Models, 1-5.
 """
+import collections
+import time
+
 from magenta.models.nsynth import utils
 from magenta.models.nsynth.wavenet.h512_bo16 import Config
 from magenta.models.nsynth.wavenet.h512_bo16 import FastGenerationConfig
@@ -27,6 +30,9 @@ import numpy as np
 from scipy.io import wavfile
 import tensorflow as tf
 
+# Number of samples generated per session.run by `synthesize`.
+DEFAULT_BLOCK_SIZE = 512
+
 
 def sample_categorical(probability_mass_function):
   """Sample from a categorical distribution.
@@ -82,6 +88,22 @@ def load_fastgen_nsynth(batch_size=1):
   return graph
 
 
+def load_fastgen_nsynth_block(batch_size=1, block_size=DEFAULT_BLOCK_SIZE):
+  """Load the NSynth fast generation network that generates blocks of samples.
+
+  Args:
+    batch_size: Batch size number of observations to process. [1]
+    block_size: Number of samples generated per session.run. [512]
+  Returns:
+    graph: The network as a dict with the generated block of audio in
+      {"audio"}. See `FastGenerationConfig.build_block`.
+  """
+  config = FastGenerationConfig(batch_size=batch_size)
+  with tf.device("/gpu:0"):
+    graph = config.build_block(block_size)
+  return graph
+
+
 def encode(wav_data, checkpoint_path, sample_length=64000):
   """Generate an array of encodings from an array of audio.
 
@@ -137,6 +159,29 @@ def load_batch_audio(files, sample_length=64000):
   return batch
 
 
+def load_encodings(files, sample_length=None):
+  """Load encodings from .npy files without padding them to the same length.
+
+  Args:
+    files: A list of filepaths to .npy files
+    sample_length: Maximum sample length, or None to load whole encodings.
+
+  Raises:
+    ValueError: .npy array has wrong dimensions.
+
+  Returns:
+    encodings: A list of [length, dims] encoding arrays.
+  """
+  encodings = []
+  for f in files:
+    data = np.load(f)
+    if data.ndim != 2:
+      raise ValueError("Encoding file should have 2 dims "
+                       "[time, channels], not {}".format(data.ndim))
+    encodings.append(data[:sample_length])
+  return encodings
+
+
 def load_batch_encodings(files, sample_length=125):
   """Load a batch of encodings from .npy files.
 
@@ -196,46 +241,115 @@ def generate_audio_sample(sess, net, audio, encoding):
   return audio_gen
 
 
+class _SynthesisJob(object):
+  """The audio generated so far from one encoding."""
+
+  def __init__(self, encoding, save_path, hop_length):
+    self.encoding = encoding
+    self.save_path = save_path
+    self.audio = np.zeros([len(encoding) * hop_length], dtype=np.float32)
+    self.position = 0
+    self._hop_length = hop_length
+
+  @property
+  def done(self):
+    return self.position == len(self.audio)
+
+  def encoding_block(self, block_size):
+    """Returns the per-sample encodings of the next block, [block_size, dim]."""
+    encoding_i = (self.position + np.arange(block_size)) // self._hop_length
+    return self.encoding[np.minimum(encoding_i, len(self.encoding) - 1)]
+
+  def append(self, audio_block):
+    """Appends a generated block, returning the number of samples used."""
+    num_samples = min(len(audio_block), len(self.audio) - self.position)
+    self.audio[self.position:self.position + num_samples] = (
+        audio_block[:num_samples])
+    self.position += num_samples
+    return num_samples
+
+
 def synthesize(encodings,
                save_paths,
                checkpoint_path="model.ckpt-200000",
-               samples_per_save=10000):
+               samples_per_save=10000,
+               batch_size=None,
+               block_size=DEFAULT_BLOCK_SIZE):
   """Synthesize audio from an array of encodings.
 
+  Samples are drawn in-graph, `block_size` at a time per session.run. Up to
+  `batch_size` encodings are generated together; whenever one is finished it
+  is saved and the next encoding takes its place in the batch, so encodings
+  of different lengths keep the whole batch busy.
+
   Args:
-    encodings: Numpy array with shape [batch_size, time, dim].
-    save_paths: Iterable of output file names.
+    encodings: Numpy array with shape [batch_size, time, dim], or a list of
+      [time, dim] arrays of possibly different lengths.
+    save_paths: Iterable of output file names, one per encoding.
     checkpoint_path: Location of the pretrained model. [model.ckpt-200000]
     samples_per_save: Save files after every amount of generated samples.
+    batch_size: Number of encodings to generate at once. Defaults to all of
+      them.
+    block_size: Number of samples generated per session.run. [512]
+
+  Returns:
+    The number of samples generated per second.
   """
+  jobs = collections.deque(zip(encodings, save_paths))
+  batch_size = min(batch_size or len(jobs), len(jobs))
+  hop_length = Config().ae_hop_length
+
   session_config = tf.ConfigProto(allow_soft_placement=True)
   session_config.gpu_options.allow_growth = True
   with tf.Graph().as_default(), tf.Session(config=session_config) as sess:
-    net = load_fastgen_nsynth(batch_size=encodings.shape[0])
+    net = load_fastgen_nsynth_block(batch_size=batch_size,
+                                    block_size=block_size)
     saver = tf.train.Saver()
     saver.restore(sess, checkpoint_path)
 
-    # Get lengths
-    batch_size, encoding_length, _ = encodings.shape
-    hop_length = Config().ae_hop_length
-    total_length = encoding_length * hop_length
-
-    # initialize queues w/ 0s
+    # initialize generation state w/ 0s
     sess.run(net["init_ops"])
 
-    # Regenerate the audio file sample by sample
-    audio_batch = np.zeros(
-        (batch_size, total_length), dtype=np.float32)
-    audio = np.zeros([batch_size, 1])
-
-    for sample_i in range(total_length):
-      encoding_i = sample_i // hop_length
-      audio = generate_audio_sample(sess, net,
-                                    audio, encodings[:, encoding_i, :])
-      audio_batch[:, sample_i] = audio[:, 0]
-      if sample_i % 100 == 0:
-        tf.logging.info("Sample: %d" % sample_i)
-      if sample_i % samples_per_save == 0 and save_paths:
-        save_batch(audio_batch, save_paths)
-
-    save_batch(audio_batch, save_paths)
+    slots = [None] * batch_size
+    reset = np.zeros([batch_size], dtype=bool)
+    encoding_block = np.zeros(net["encoding"].shape.as_list(),
+                              dtype=np.float32)
+    num_samples = 0
+    start_time = time.time()
+    while True:
+      # Start the next encodings in the free batch entries.
+      for i in range(batch_size):
+        if slots[i] is None and jobs:
+          slots[i] = _SynthesisJob(*jobs.popleft(), hop_length=hop_length)
+          reset[i] = True
+      if not any(slots):
+        break
+      if reset.any():
+        sess.run(net["reset_ops"], feed_dict={net["reset"]: reset})
+        reset[:] = False
+
+      encoding_block.fill(0)
+      for i, job in enumerate(slots):
+        if job is not None:
+          encoding_block[i] = job.encoding_block(block_size)
+      audio_block = sess.run(
+          net["audio"], feed_dict={net["encoding"]: encoding_block})
+
+      for i, job in enumerate(slots):
+        if job is None:
+          continue
+        position = job.position
+        num_samples += job.append(audio_block[i])
+        if job.done:
+          save_batch([job.audio], [job.save_path])
+          slots[i] = None
+        elif position // samples_per_save != job.position // samples_per_save:
+          save_batch([job.audio], [job.save_path])
+      tf.logging.log_every_n(
+          tf.logging.INFO, "Samples: %d (%.1f samples/sec)", 10, num_samples,
+          num_samples / (time.time() - start_time))
+
+  elapsed = time.time() - start_time
+  tf.logging.info("Generated %d samples in %.1f seconds (%.1f samples/sec).",
+                  num_samples, elapsed, num_samples / elapsed)
+  return num_samples / elapsed
@@ -22,7 +22,9 @@ import os
 
 from absl.testing import parameterized
 import librosa
+from magenta.models.nsynth import utils
 from magenta.models.nsynth.wavenet import fastgen
+from magenta.models.nsynth.wavenet import h512_bo16
 import numpy as np
 import tensorflow as tf
 
@@ -39,6 +41,66 @@ class FastegenTest(parameterized.TestCase, tf.test.TestCase):
       self.assertEqual(net['encoding'].shape, (batch_size, 16))
       self.assertEqual(net['predictions'].shape, (batch_size, 256))
 
+  @parameterized.parameters(
+      {'batch_size': 1, 'block_size': 1},
+      {'batch_size': 4, 'block_size': 16})
+  def testLoadFastgenNsynthBlock(self, batch_size, block_size):
+    with tf.Graph().as_default(), self.test_session() as sess:
+      net = fastgen.load_fastgen_nsynth_block(batch_size=batch_size,
+                                              block_size=block_size)
+      self.assertEqual(net['encoding'].shape, (batch_size, block_size, 16))
+      self.assertEqual(net['audio'].shape, (batch_size, block_size))
+
+      sess.run(tf.global_variables_initializer())
+      sess.run(net['init_ops'])
+      encoding = np.random.randn(batch_size, block_size, 16)
+      for _ in range(2):
+        audio = sess.run(net['audio'], feed_dict={net['encoding']: encoding})
+        self.assertEqual(audio.shape, (batch_size, block_size))
+        self.assertTrue(np.all(np.abs(audio) <= 1.0))
+      sess.run(net['reset_ops'],
+               feed_dict={net['reset']: np.ones([batch_size], dtype=bool)})
+
+  def testBuildBlockMatchesBuild(self, batch_size=2, block_size=4,
+                                 num_blocks=3):
+    encoding = np.random.randn(
+        batch_size, block_size * num_blocks, 16).astype(np.float32)
+    config = h512_bo16.FastGenerationConfig(batch_size=batch_size)
+
+    # Generate one sample per run, taking the most likely one each time.
+    with tf.Graph().as_default() as graph, self.test_session(graph) as sess:
+      x = tf.placeholder(tf.float32, shape=[batch_size, 1])
+      net = config.build({'wav': x})
+      sess.run(tf.global_variables_initializer())
+      sess.run(net['init_ops'])
+      weights = {v.op.name: sess.run(v) for v in tf.global_variables()}
+      audio = np.zeros([batch_size, 1], dtype=np.float32)
+      expected = []
+      for i in range(block_size * num_blocks):
+        probs = sess.run([net['predictions'], net['push_ops']],
+                         feed_dict={x: audio,
+                                    net['encoding']: encoding[:, i]})[0]
+        sample_bin = np.argmax(probs, axis=1)[:, np.newaxis]
+        audio = utils.inv_mu_law_numpy(sample_bin - 128)
+        expected.append(audio[:, 0])
+      expected = np.stack(expected, axis=1)
+
+    # Generate the same samples a block at a time with the same weights.
+    with tf.Graph().as_default() as graph, self.test_session(graph) as sess:
+      net = config.build_block(block_size, greedy=True)
+      sess.run(tf.global_variables_initializer())
+      for v in tf.global_variables():
+        v.load(weights[v.op.name], sess)
+      sess.run(net['init_ops'])
+      blocks = []
+      for i in range(num_blocks):
+        blocks.append(sess.run(
+            net['audio'],
+            feed_dict={net['encoding']:
+                           encoding[:, i * block_size:(i + 1) * block_size]}))
+
+    self.assertAllClose(expected, np.concatenate(blocks, axis=1))
+
   @parameterized.parameters(
       {'batch_size': 1, 'sample_length': 1024 * 10},
       {'batch_size': 10, 'sample_length': 1024 * 10},
@@ -98,6 +160,18 @@ class FastegenTest(parameterized.TestCase, tf.test.TestCase):
     batch_data = fastgen.load_batch_encodings(files, sample_length=end_length)
     self.assertEqual(batch_data.shape, (n_files, end_length, channels))
 
+  def testLoadEncodings(self, channels=16):
+    test_dir = tf.test.get_temp_dir()
+    tf.gfile.MakeDirs(test_dir)
+    files = []
+    for length in [16, 64]:
+      fname = os.path.join(test_dir, 'test_embedding_{}.npy'.format(length))
+      files.append(fname)
+      np.save(fname, np.random.randn(length, channels))
+    encodings = fastgen.load_encodings(files, sample_length=32)
+    self.assertEqual([(16, channels), (32, channels)],
+                     [e.shape for e in encodings])
+
   @parameterized.parameters(
       {'batch_size': 1},
       {'batch_size': 10},
@@ -31,55 +31,45 @@ class FastGenerationConfig(object):
   def __init__(self, batch_size=1):
     """."""
     self.batch_size = batch_size
+    self.num_z = 16
 
-  def build(self, inputs):
-    """Build the graph for this configuration.
+  def _build_decoder(self, x, en, causal_linear):
+    """Build one time step of the WaveNet decoder.
 
     Args:
-      inputs: A dict of inputs. For training, should contain 'wav'.
+      x: The [mb, 1] float tensor of the previous audio sample.
+      en: The [mb, 1, num_z] float tensor encoding of the current sample.
+      causal_linear: A function taking the keyword arguments of
+        `utils.causal_linear` other than `batch_size`, returning its output.
 
     Returns:
-      A dict of outputs that includes the 'predictions',
-      'init_ops', the 'push_ops', and the 'quantized_input'.
+      logits: The [mb, 256] logits of the current sample.
+      x_quantized: The Mu-Law quantized `x`.
     """
     num_stages = 10
     num_layers = 30
     filter_length = 3
     width = 512
     skip_width = 256
-    num_z = 16
+    num_z = self.num_z
 
     # Encode the source with 8-bit Mu-Law.
-    x = inputs['wav']
-    batch_size = self.batch_size
     x_quantized = utils.mu_law(x)
     x_scaled = tf.cast(x_quantized, tf.float32) / 128.0
     x_scaled = tf.expand_dims(x_scaled, 2)
 
-    encoding = tf.placeholder(
-        name='encoding', shape=[batch_size, num_z], dtype=tf.float32)
-    en = tf.expand_dims(encoding, 1)
-
-    init_ops, push_ops = [], []
-
     ###
     # The WaveNet Decoder.
     ###
     l = x_scaled
-    l, inits, pushs = utils.causal_linear(
+    l = causal_linear(
         x=l,
         n_inputs=1,
         n_outputs=width,
         name='startconv',
         rate=1,
-        batch_size=batch_size,
         filter_length=filter_length)
 
-    for init in inits:
-      init_ops.append(init)
-    for push in pushs:
-      push_ops.append(push)
-
     # Set up skip connections.
     s = utils.linear(l, width, skip_width, name='skip_start')
 
@@ -88,20 +78,14 @@ class FastGenerationConfig(object):
       dilation = 2**(i % num_stages)
 
       # dilated masked cnn
-      d, inits, pushs = utils.causal_linear(
+      d = causal_linear(
           x=l,
           n_inputs=width,
           n_outputs=width * 2,
           name='dilatedconv_%d' % (i + 1),
           rate=dilation,
-          batch_size=batch_size,
           filter_length=filter_length)
 
-      for init in inits:
-        init_ops.append(init)
-      for push in pushs:
-        push_ops.append(push)
-
       # local conditioning
       d += utils.linear(en, num_z, width * 2, name='cond_map_%d' % (i + 1))
 
@@ -122,10 +106,36 @@ class FastGenerationConfig(object):
     s = tf.nn.relu(s)
 
     ###
-    # Compute the logits and get the loss.
+    # Compute the logits.
     ###
     logits = utils.linear(s, skip_width, 256, name='logits')
     logits = tf.reshape(logits, [-1, 256])
+    return logits, x_quantized
+
+  def build(self, inputs):
+    """Build the graph for this configuration.
+
+    Args:
+      inputs: A dict of inputs. For training, should contain 'wav'.
+
+    Returns:
+      A dict of outputs that includes the 'predictions',
+      'init_ops', the 'push_ops', and the 'quantized_input'.
+    """
+    batch_size = self.batch_size
+    encoding = tf.placeholder(
+        name='encoding', shape=[batch_size, self.num_z], dtype=tf.float32)
+    en = tf.expand_dims(encoding, 1)
+
+    init_ops, push_ops = [], []
+
+    def causal_linear(**kwargs):
+      y, inits, pushs = utils.causal_linear(batch_size=batch_size, **kwargs)
+      init_ops.extend(inits)
+      push_ops.extend(pushs)
+      return y
+
+    logits, x_quantized = self._build_decoder(inputs['wav'], en, causal_linear)
     probs = tf.nn.softmax(logits, name='softmax')
 
     return {
@@ -136,6 +146,96 @@ class FastGenerationConfig(object):
         'quantized_input': x_quantized,
     }
 
+  def build_block(self, block_size, greedy=False):
+    """Build a graph generating a block of samples per `session.run`.
+
+    The decoder is stepped `block_size` times inside a `tf.while_loop`, with
+    each sample drawn in-graph and fed back as the next input. The decoder
+    state, the last sample, and the time step live in local variables, so
+    consecutive runs continue where the previous one stopped.
+
+    Args:
+      block_size: The number of samples generated per run.
+      greedy: If True, each sample is the most likely one instead of being
+        drawn from the predicted distribution.
+
+    Returns:
+      A dict of outputs that includes the 'encoding' placeholder for the
+      [mb, block_size, num_z] per-sample encodings, the generated [mb,
+      block_size] 'audio', the 'init_ops', and the 'reset_ops' that zero the
+      state of the batch entries set in the [mb] boolean 'reset' placeholder.
+    """
+    batch_size = self.batch_size
+    encoding = tf.placeholder(
+        name='encoding', shape=[batch_size, block_size, self.num_z],
+        dtype=tf.float32)
+    reset = tf.placeholder(name='reset', shape=[batch_size], dtype=tf.bool)
+
+    step = tf.get_variable(
+        'generation/step', shape=[], dtype=tf.int32,
+        initializer=tf.zeros_initializer(), trainable=False,
+        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+    last_sample = tf.get_variable(
+        'generation/last_sample', shape=[batch_size, 1], dtype=tf.float32,
+        initializer=tf.zeros_initializer(), trainable=False,
+        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+    start_step = tf.identity(step)
+    histories = []
+
+    def body(i, x, samples):
+      """Generates the sample at index `i` of the block."""
+      push_ops = []
+
+      def causal_linear(**kwargs):
+        y, history, push = utils.causal_linear_buffered(
+            batch_size=batch_size, step=start_step + i, **kwargs)
+        histories.append(history)
+        push_ops.append(push)
+        return y
+
+      en = tf.expand_dims(encoding[:, i], 1)
+      logits, _ = self._build_decoder(x, en, causal_linear)
+      if greedy:
+        sample_bin = tf.argmax(logits, axis=1, output_type=tf.int32)[:, None]
+      else:
+        sample_bin = tf.multinomial(logits, 1, output_dtype=tf.int32)
+      # The next step reads the histories, so it must follow this step's
+      # writes to them.
+      with tf.control_dependencies(push_ops):
+        x = utils.inv_mu_law(sample_bin - 128)
+        next_i = i + 1
+      return next_i, x, samples.write(i, x[:, 0])
+
+    _, x, samples = tf.while_loop(
+        lambda i, x, samples: i < block_size,
+        body,
+        [0, tf.identity(last_sample),
+         tf.TensorArray(tf.float32, size=block_size,
+                        element_shape=[batch_size])],
+        parallel_iterations=1,
+        back_prop=False)
+    # The loop reads `step` through `start_step`, so the state may only be
+    # advanced once the loop is done.
+    with tf.control_dependencies([x]):
+      update_ops = [tf.assign(last_sample, x), tf.assign_add(step, block_size)]
+    with tf.control_dependencies(update_ops):
+      audio = tf.transpose(samples.stack(), name='audio')
+    audio.set_shape([batch_size, block_size])
+
+    keep = tf.cast(tf.logical_not(reset), tf.float32)
+    reset_ops = [tf.assign(last_sample, last_sample * keep[:, tf.newaxis])]
+    for history in histories:
+      reset_ops.append(
+          tf.assign(history, history * keep[tf.newaxis, :, tf.newaxis]))
+
+    return {
+        'init_ops': [tf.local_variables_initializer()],
+        'reset_ops': reset_ops,
+        'reset': reset,
+        'encoding': encoding,
+        'audio': audio,
+    }
+
 
 class Config(object):
   """Configuration object that helps manage the graph."""
@@ -33,6 +33,8 @@ tf.app.flags.DEFINE_string("checkpoint_path", "model.ckpt-200000",
 tf.app.flags.DEFINE_integer("sample_length", 100000000,
                             "Max output file size in samples.")
 tf.app.flags.DEFINE_integer("batch_size", 1, "Number of samples per a batch.")
+tf.app.flags.DEFINE_integer("block_size", fastgen.DEFAULT_BLOCK_SIZE,
+                            "Number of samples generated per session.run.")
 tf.app.flags.DEFINE_string("log", "INFO",
                            "The threshold for what messages will be logged."
                            "DEBUG, INFO, WARN, ERROR, or FATAL.")
@@ -73,37 +75,37 @@ def main(unused_argv=None):
     raise ValueError(
         "source_path {} must be a folder or file.".format(source_path))
 
-  # Now synthesize from files one batch at a time
   batch_size = FLAGS.batch_size
   sample_length = FLAGS.sample_length
-  n = len(files)
-  for start in range(0, n, batch_size):
-    end = start + batch_size
-    batch_files = files[start:end]
-    save_names = [
-        os.path.join(save_path,
-                     "gen_" + os.path.splitext(os.path.basename(f))[0] + ".wav")
-        for f in batch_files
-    ]
-    # Encode waveforms
-    if file_extension == ".wav":
+  save_names = [
+      os.path.join(save_path,
+                   "gen_" + os.path.splitext(os.path.basename(f))[0] + ".wav")
+      for f in files
+  ]
+  # Encode waveforms one batch at a time
+  if file_extension == ".wav":
+    encodings = []
+    for start in range(0, len(files), batch_size):
       batch_data = fastgen.load_batch_audio(
-          batch_files, sample_length=sample_length)
-      encodings = fastgen.encode(
-          batch_data, checkpoint_path, sample_length=sample_length)
-    # Or load encodings
-    else:
-      encodings = fastgen.load_batch_encodings(
-          batch_files, sample_length=sample_length)
-    # Synthesize multi-gpu
-    if FLAGS.gpu_number != 0:
-      with tf.device("/device:GPU:%d" % FLAGS.gpu_number):
-        fastgen.synthesize(
-            encodings, save_names, checkpoint_path=checkpoint_path)
-    # Single gpu
-    else:
+          files[start:start + batch_size], sample_length=sample_length)
+      encodings.extend(fastgen.encode(
+          batch_data, checkpoint_path, sample_length=sample_length))
+  # Or load encodings, keeping their different lengths
+  else:
+    encodings = fastgen.load_encodings(files, sample_length=sample_length)
+
+  # Synthesize all files at once, so a finished file frees its place in the
+  # batch for the next one. Multi-gpu:
+  if FLAGS.gpu_number != 0:
+    with tf.device("/device:GPU:%d" % FLAGS.gpu_number):
       fastgen.synthesize(
-          encodings, save_names, checkpoint_path=checkpoint_path)
+          encodings, save_names, checkpoint_path=checkpoint_path,
+          batch_size=batch_size, block_size=FLAGS.block_size)
+  # Single gpu
+  else:
+    fastgen.synthesize(
+        encodings, save_names, checkpoint_path=checkpoint_path,
+        batch_size=batch_size, block_size=FLAGS.block_size)
 
 
 def console_entry_point():
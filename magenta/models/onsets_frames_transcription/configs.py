@@ -38,6 +38,9 @@ DEFAULT_HPARAMS = tf_utils.merge_hparams(
         spec_n_bins=229,
         spec_fmin=30.0,  # A0
         cqt_bins_per_octave=36,
+        # If set, spectrograms of unaugmented audio are cached in this
+        # directory. See spectrogram_cache.py.
+        spec_cache_dir='',
         truncated_length_secs=0,
         max_expected_train_example_len=0,
         onset_length=32,
@@ -33,6 +33,7 @@ import zlib
 import librosa
 from magenta.models.onsets_frames_transcription import audio_transform
 from magenta.models.onsets_frames_transcription import constants
+from magenta.models.onsets_frames_transcription import spectrogram_cache
 from magenta.music import audio_io
 from magenta.music import sequences_lib
 from magenta.protobuf import music_pb2
@@ -125,9 +126,28 @@ def wav_to_spec(wav_audio, hparams):
   return spec
 
 
-def wav_to_spec_op(wav_audio, hparams):
+def wav_to_spec_op(wav_audio, hparams, use_spectrogram_cache=False):
+  """Transforms a wav-encoded audio string into a spectrogram tensor.
+
+  Args:
+    wav_audio: String tensor containing WAV data.
+    hparams: HParams object specifying hyperparameters.
+    use_spectrogram_cache: Whether to read and write spectrograms through the
+        cache in `hparams.spec_cache_dir`.
+
+  Returns:
+    A float32 tensor of shape [frames, hparams_frame_size(hparams)].
+  """
+  spec_fn = functools.partial(wav_to_spec, hparams=hparams)
+  if use_spectrogram_cache:
+    cache = spectrogram_cache.get_spectrogram_cache(
+        hparams.spec_cache_dir, hparams)
+    def cached_spec_fn(wav_audio):
+      return np.asarray(cache.get_or_compute(wav_audio, spec_fn),
+                        dtype=np.float32)
+    spec_fn = cached_spec_fn
   spec = tf.py_func(
-      functools.partial(wav_to_spec, hparams=hparams),
+      spec_fn,
       [wav_audio],
       tf.float32,
       name='wav_to_spec')
@@ -317,7 +337,12 @@ def preprocess_data(sequence_id, sequence, audio, velocity_range, hparams,
         hparams=hparams,
         jitter_amount_sec=wav_jitter_amount_ms / 1000.)
 
-  spec = wav_to_spec_op(audio, hparams=hparams)
+  # Augmented audio differs on every read, so its spectrograms are not cached.
+  augmented = is_training and (hparams.transform_audio or
+                               wav_jitter_amount_ms > 0)
+  spec = wav_to_spec_op(
+      audio, hparams=hparams,
+      use_spectrogram_cache=bool(hparams.spec_cache_dir) and not augmented)
   spectrogram_hash = get_spectrogram_hash_op(spec)
 
   labels, label_weights, onsets, offsets, velocities = sequence_to_pianoroll_op(
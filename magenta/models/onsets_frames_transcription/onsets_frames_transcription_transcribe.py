@@ -18,16 +18,22 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import math
 import os
+import time
 
 from magenta.models.onsets_frames_transcription import configs
 from magenta.models.onsets_frames_transcription import constants
 from magenta.models.onsets_frames_transcription import data
 from magenta.models.onsets_frames_transcription import split_audio_and_label_data
 from magenta.models.onsets_frames_transcription import train_util
+from magenta.music import audio_io
+from magenta.music import constants as music_constants
 from magenta.music import midi_io
 from magenta.music import sequences_lib
 from magenta.protobuf import music_pb2
+import numpy as np
 import tensorflow as tf
 
 FLAGS = tf.app.flags.FLAGS
@@ -50,6 +56,30 @@ tf.app.flags.DEFINE_float(
 tf.app.flags.DEFINE_float(
     'onset_threshold', 0.5,
     'Threshold to use when sampling from the acoustic model.')
+tf.app.flags.DEFINE_float(
+    'chunk_secs', 0,
+    'If positive, transcribe in streaming mode: the audio is read and run '
+    'through the model in chunks of this many seconds, so memory use does '
+    'not grow with the length of the recording, and the MIDI file is '
+    'periodically rewritten with the notes transcribed so far (see '
+    '--midi_rewrite_secs). Only local, uncompressed WAV files are supported '
+    'in this mode.')
+tf.app.flags.DEFINE_float(
+    'chunk_context_secs', 2.0,
+    'In streaming mode, the seconds of audio on each side of a chunk that are '
+    'also run through the model so predictions near chunk boundaries see the '
+    'same context as in the middle of a chunk. Predictions for the context '
+    'are discarded.')
+tf.app.flags.DEFINE_float(
+    'max_pending_secs', 600,
+    'In streaming mode, notes are emitted once a frame with no active pitch '
+    'follows them. If no such frame occurs for this many seconds, notes that '
+    'are still active are ended there to bound memory use.')
+tf.app.flags.DEFINE_float(
+    'midi_rewrite_secs', 60,
+    'In streaming mode, the minimum number of seconds between rewrites of the '
+    'partial MIDI file. The complete transcription is always written at the '
+    'end.')
 tf.app.flags.DEFINE_string(
     'log', 'INFO',
     'The threshold for what messages will be logged: '
@@ -71,6 +101,146 @@ def create_example(filename):
   return example_list[0].SerializeToString()
 
 
+def create_chunk_examples(filename, hparams, chunk_secs, context_secs):
+  """Reads a WAV file in overlapping windows and creates an Example for each.
+
+  Chunk boundaries fall on spectrogram frame boundaries. The samples are
+  normalized by the peak of the whole recording rather than of each window,
+  matching `create_example`.
+
+  Args:
+    filename: Path to a local WAV file.
+    hparams: HParams object specifying hyperparameters.
+    chunk_secs: The length of each chunk in seconds.
+    context_secs: The seconds of audio to include on each side of a chunk.
+
+  Yields:
+    Tuples of a serialized Example proto for the window around a chunk, the
+    number of context frames before the chunk in that window, and the number
+    of frames in the chunk.
+  """
+  reader = audio_io.WavFileReader(filename)
+  frames_per_second = data.hparams_frames_per_second(hparams)
+  # Keep the trailing partial frame, like the one-pass spectrogram does.
+  total_frames = int(math.ceil(reader.duration_secs * frames_per_second))
+  chunk_frames = max(1, int(round(chunk_secs * frames_per_second)))
+  context_frames = int(round(context_secs * frames_per_second))
+  peak = reader.peak() or 1.0
+
+  for start in range(0, total_frames, chunk_frames):
+    end = min(start + chunk_frames, total_frames)
+    window_start = max(0, start - context_frames)
+    window_end = min(total_frames, end + context_frames)
+    samples = reader.read(window_start / frames_per_second,
+                          window_end / frames_per_second,
+                          hparams.sample_rate) / peak
+    example = split_audio_and_label_data.create_example(
+        filename, music_pb2.NoteSequence(),
+        audio_io.samples_to_wav_data(samples, hparams.sample_rate),
+        velocity_range=music_pb2.VelocityRange(min=0, max=0))
+    yield example.SerializeToString(), start - window_start, end - start
+
+
+class StreamingTranscriber(object):
+  """Turns consecutive chunks of predictions into notes as they become final.
+
+  Thresholded predictions are buffered until a frame in which no pitch is
+  active. Decoding with `sequences_lib.pianoroll_to_note_sequence` does not
+  carry any state across such a frame, so everything up to it is decoded and
+  appended to `sequence`, giving the same notes as decoding the recording in
+  one pass. If no such frame occurs within `max_pending_frames`, the buffered
+  frames are decoded anyway and notes still active at the end are ended there.
+  """
+
+  def __init__(self, hparams, frame_threshold, onset_threshold,
+               max_pending_frames):
+    self._frames_per_second = data.hparams_frames_per_second(hparams)
+    self._frame_threshold = frame_threshold
+    self._onset_threshold = onset_threshold
+    self._max_pending_frames = max_pending_frames
+    self._decoded_frames = 0
+    self._pending_frames = np.zeros([0, constants.MIDI_PITCHES], dtype=bool)
+    self._pending_onsets = np.zeros([0, constants.MIDI_PITCHES], dtype=bool)
+    self._pending_velocities = np.zeros([0, constants.MIDI_PITCHES],
+                                        dtype=np.float32)
+    self.sequence = music_pb2.NoteSequence()
+    self.sequence.tempos.add().qpm = music_constants.DEFAULT_QUARTERS_PER_MINUTE
+    self.sequence.ticks_per_quarter = music_constants.STANDARD_PPQ
+
+  @property
+  def num_frames(self):
+    """The number of frames added so far."""
+    return self._decoded_frames + len(self._pending_frames)
+
+  def add_chunk(self, prediction, start_frame, num_frames):
+    """Adds the predictions for a chunk, decoding any notes that are final.
+
+    Args:
+      prediction: The model's prediction dictionary for the window around the
+          chunk.
+      start_frame: The index of the chunk's first frame in the window.
+      num_frames: The number of frames in the chunk.
+
+    Returns:
+      The number of notes added to `sequence`.
+    """
+    chunk = slice(start_frame, start_frame + num_frames)
+    self._pending_frames = np.concatenate(
+        [self._pending_frames,
+         prediction['frame_probs_flat'][chunk] > self._frame_threshold])
+    self._pending_onsets = np.concatenate(
+        [self._pending_onsets,
+         prediction['onset_probs_flat'][chunk] > self._onset_threshold])
+    self._pending_velocities = np.concatenate(
+        [self._pending_velocities, prediction['velocity_values_flat'][chunk]])
+
+    inactive = np.where(~np.logical_or(self._pending_frames,
+                                       self._pending_onsets).any(axis=1))[0]
+    if inactive.size:
+      return self._decode(inactive[-1] + 1)
+    if len(self._pending_frames) > self._max_pending_frames:
+      tf.logging.warning(
+          'No frame without active pitches in %d frames; ending active notes '
+          'at frame %d.', len(self._pending_frames), self.num_frames)
+      return self._decode(len(self._pending_frames))
+    return 0
+
+  def finish(self):
+    """Decodes all remaining frames and returns the complete sequence."""
+    self._decode(len(self._pending_frames))
+    # Match the total time of decoding the whole recording at once.
+    self.sequence.total_time = (
+        (self._decoded_frames + 1) / self._frames_per_second)
+    return self.sequence
+
+  def _decode(self, num_frames):
+    """Decodes the first `num_frames` pending frames into notes."""
+    if not num_frames:
+      return 0
+    segment = sequences_lib.pianoroll_to_note_sequence(
+        self._pending_frames[:num_frames],
+        frames_per_second=self._frames_per_second,
+        min_duration_ms=0,
+        min_midi_pitch=constants.MIN_MIDI_PITCH,
+        onset_predictions=self._pending_onsets[:num_frames],
+        velocity_values=self._pending_velocities[:num_frames])
+    offset_secs = self._decoded_frames / self._frames_per_second
+    for note in segment.notes:
+      new_note = self.sequence.notes.add()
+      new_note.CopyFrom(note)
+      new_note.start_time += offset_secs
+      new_note.end_time += offset_secs
+    self.sequence.total_time = max(
+        self.sequence.total_time,
+        (self._decoded_frames + num_frames) / self._frames_per_second)
+
+    self._decoded_frames += num_frames
+    self._pending_frames = self._pending_frames[num_frames:]
+    self._pending_onsets = self._pending_onsets[num_frames:]
+    self._pending_velocities = self._pending_velocities[num_frames:]
+    return len(segment.notes)
+
+
 def transcribe_audio(prediction, hparams, frame_threshold, onset_threshold):
   """Transcribes an audio file."""
   frame_predictions = prediction['frame_probs_flat'] > frame_threshold
@@ -88,6 +258,64 @@ def transcribe_audio(prediction, hparams, frame_threshold, onset_threshold):
   return sequence_prediction
 
 
+def transcribe_streaming(filename, midi_filename, hparams, estimator,
+                         checkpoint_path, preprocess_fn, dataset):
+  """Transcribes an audio file chunk by chunk.
+
+  Chunks are fed to a single `estimator.predict` call as they are read, so the
+  checkpoint is only loaded once and only a few chunks are in memory at a time.
+  When new notes have been transcribed, the MIDI file is rewritten, at most
+  once every `--midi_rewrite_secs` seconds, so long recordings do not cause a
+  rewrite per chunk.
+
+  Args:
+    filename: Path to a local WAV file.
+    midi_filename: Path to write the partial transcriptions to.
+    hparams: HParams object specifying hyperparameters.
+    estimator: The estimator to run inference with.
+    checkpoint_path: The checkpoint to use, or None for the latest.
+    preprocess_fn: A function that takes a serialized Example and returns the
+        corresponding element of `dataset` as numpy arrays.
+    dataset: The preprocessing dataset, used for its output types and shapes.
+
+  Returns:
+    The complete transcription as a NoteSequence.
+  """
+  frames_per_second = data.hparams_frames_per_second(hparams)
+  # The chunk spans of inputs that have been fed but not yet predicted.
+  chunk_spans = collections.deque()
+
+  def chunk_generator():
+    for example, start_frame, num_frames in create_chunk_examples(
+        filename, hparams, FLAGS.chunk_secs, FLAGS.chunk_context_secs):
+      chunk_spans.append((start_frame, num_frames))
+      yield preprocess_fn(example)
+
+  def input_fn(params):
+    del params
+    return tf.data.Dataset.from_generator(
+        chunk_generator, dataset.output_types, dataset.output_shapes)
+
+  transcriber = StreamingTranscriber(
+      hparams, FLAGS.frame_threshold, FLAGS.onset_threshold,
+      max_pending_frames=int(FLAGS.max_pending_secs * frames_per_second))
+  num_unwritten_notes = 0
+  last_write_time = time.time()
+  for prediction in estimator.predict(
+      input_fn, checkpoint_path=checkpoint_path, yield_single_examples=False):
+    start_frame, num_frames = chunk_spans.popleft()
+    num_unwritten_notes += transcriber.add_chunk(
+        prediction, start_frame, num_frames)
+    if (num_unwritten_notes and
+        time.time() - last_write_time >= FLAGS.midi_rewrite_secs):
+      midi_io.sequence_proto_to_midi_file(transcriber.sequence, midi_filename)
+      num_unwritten_notes = 0
+      last_write_time = time.time()
+    tf.logging.info('Transcribed %.1f seconds.',
+                    transcriber.num_frames / frames_per_second)
+  return transcriber.finish()
+
+
 def main(argv):
   tf.logging.set_verbosity(FLAGS.log)
 
@@ -121,8 +349,26 @@ def main(argv):
           tf.initializers.local_variables()
       ])
 
+      checkpoint_path = None
+      if FLAGS.checkpoint_path:
+        checkpoint_path = os.path.expanduser(FLAGS.checkpoint_path)
+
+      def preprocess(serialized_example):
+        sess.run(iterator.initializer, {examples: [serialized_example]})
+        return sess.run(next_record)
+
       for filename in argv[1:]:
         tf.logging.info('Starting transcription for %s...', filename)
+        midi_filename = filename + '.midi'
+
+        if FLAGS.chunk_secs > 0:
+          sequence_prediction = transcribe_streaming(
+              filename, midi_filename, hparams, estimator, checkpoint_path,
+              preprocess, dataset)
+          midi_io.sequence_proto_to_midi_file(sequence_prediction,
+                                              midi_filename)
+          tf.logging.info('Transcription written to %s.', midi_filename)
+          continue
 
         # The reason we bounce between two Dataset objects is so we can use
         # the data processing functionality in data.py without having to
@@ -136,9 +382,6 @@ def main(argv):
           return tf.data.Dataset.from_tensors(sess.run(next_record))
 
         tf.logging.info('Running inference...')
-        checkpoint_path = None
-        if FLAGS.checkpoint_path:
-          checkpoint_path = os.path.expanduser(FLAGS.checkpoint_path)
         prediction_list = list(
             estimator.predict(
                 input_fn,
@@ -150,7 +393,6 @@ def main(argv):
                                                FLAGS.frame_threshold,
                                                FLAGS.onset_threshold)
 
-        midi_filename = filename + '.midi'
         midi_io.sequence_proto_to_midi_file(sequence_prediction, midi_filename)
 
         tf.logging.info('Transcription written to %s.', midi_filename)
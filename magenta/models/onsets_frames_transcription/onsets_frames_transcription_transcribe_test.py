@@ -0,0 +1,115 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for onsets_frames_transcription_transcribe."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from magenta.models.onsets_frames_transcription import constants
+from magenta.models.onsets_frames_transcription import onsets_frames_transcription_transcribe as transcribe
+
+import numpy as np
+import tensorflow as tf
+
+FRAME_THRESHOLD = 0.5
+ONSET_THRESHOLD = 0.5
+
+
+def note_tuples(sequence):
+  return [(note.pitch, note.velocity, round(note.start_time, 6),
+           round(note.end_time, 6)) for note in sequence.notes]
+
+
+class StreamingTranscriberTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.hparams = tf.contrib.training.HParams(
+        sample_rate=16000, spec_hop_length=512)
+
+  def make_prediction(self, num_frames, seed):
+    """Returns random predictions with some frames where nothing is active."""
+    rng = np.random.RandomState(seed)
+    frame_probs = rng.uniform(size=[num_frames, constants.MIDI_PITCHES])
+    frame_probs[:, rng.uniform(size=constants.MIDI_PITCHES) < 0.9] = 0.
+    onset_probs = frame_probs * rng.uniform(size=frame_probs.shape)
+    silent = rng.uniform(size=num_frames) < 0.15
+    frame_probs[silent] = 0.
+    onset_probs[silent] = 0.
+    return {
+        'frame_probs_flat': frame_probs,
+        'onset_probs_flat': onset_probs,
+        'velocity_values_flat': rng.uniform(size=frame_probs.shape),
+    }
+
+  def transcribe_in_chunks(self, prediction, chunk_frames, context_frames,
+                           max_pending_frames, seed=0):
+    """Streams `prediction` in chunks whose context frames are garbage."""
+    rng = np.random.RandomState(seed)
+    transcriber = transcribe.StreamingTranscriber(
+        self.hparams, FRAME_THRESHOLD, ONSET_THRESHOLD, max_pending_frames)
+    total_frames = len(prediction['frame_probs_flat'])
+    for start in range(0, total_frames, chunk_frames):
+      end = min(start + chunk_frames, total_frames)
+      window_start = max(0, start - context_frames)
+      window_end = min(total_frames, end + context_frames)
+      window_prediction = {}
+      for key, values in prediction.items():
+        window = rng.uniform(size=[window_end - window_start, values.shape[1]])
+        window[start - window_start:end - window_start] = values[start:end]
+        window_prediction[key] = window
+      transcriber.add_chunk(window_prediction, start - window_start,
+                            end - start)
+    self.assertEqual(total_frames, transcriber.num_frames)
+    return transcriber.finish()
+
+  def testMatchesOnePassTranscription(self):
+    for seed, chunk_frames, context_frames in [
+        (0, 10, 3), (1, 7, 0), (2, 32, 5), (3, 1, 1), (4, 200, 4)]:
+      prediction = self.make_prediction(100, seed)
+      expected = transcribe.transcribe_audio(
+          prediction, self.hparams, FRAME_THRESHOLD, ONSET_THRESHOLD)
+      sequence = self.transcribe_in_chunks(
+          prediction, chunk_frames, context_frames, max_pending_frames=1000)
+      self.assertTrue(expected.notes)
+      self.assertEqual(note_tuples(expected), note_tuples(sequence))
+      self.assertAlmostEqual(expected.total_time, sequence.total_time)
+
+  def testEndsNotesAfterMaxPendingFrames(self):
+    frames_per_second = 16000 / 512
+    prediction = {
+        'frame_probs_flat': np.zeros([40, constants.MIDI_PITCHES]),
+        'onset_probs_flat': np.zeros([40, constants.MIDI_PITCHES]),
+        'velocity_values_flat': np.zeros([40, constants.MIDI_PITCHES]),
+    }
+    prediction['frame_probs_flat'][:, 39] = 1.
+    prediction['onset_probs_flat'][0, 39] = 1.
+    prediction['onset_probs_flat'][25, 39] = 1.
+
+    sequence = self.transcribe_in_chunks(
+        prediction, chunk_frames=10, context_frames=2, max_pending_frames=15)
+
+    # Nothing is inactive, so the 20 frames buffered after the second chunk
+    # are decoded and the first note is ended there. The note starting at
+    # frame 25 continues to the end.
+    self.assertEqual(
+        [(60, 10, 0.0, round(20 / frames_per_second, 6)),
+         (60, 10, round(25 / frames_per_second, 6),
+          round(40 / frames_per_second, 6))],
+        note_tuples(sequence))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,140 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Precomputes the spectrograms of a set of examples into the cache.
+
+Training and evaluation with `spec_cache_dir` set only compute each
+spectrogram once, but that first epoch still pays for all of them. This script
+computes them ahead of time, in parallel, so training starts with a warm cache.
+
+Example usage:
+  $ onsets_frames_transcription_warm_spectrogram_cache \
+    --examples_path=/path/to/train.tfrecord* \
+    --hparams=spec_cache_dir=/path/to/spec_cache \
+    --num_workers=16
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import functools
+import multiprocessing
+import time
+
+from magenta.models.onsets_frames_transcription import configs
+from magenta.models.onsets_frames_transcription import data
+from magenta.models.onsets_frames_transcription import spectrogram_cache
+import tensorflow as tf
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('config', 'onsets_frames',
+                           'Name of the config to use.')
+tf.app.flags.DEFINE_string(
+    'examples_path', None,
+    'Glob of TFRecord files of unpreprocessed examples, as read by '
+    'data.provide_batch with preprocess_examples=True.')
+tf.app.flags.DEFINE_string(
+    'hparams', '',
+    'A comma-separated list of `name=value` hyperparameter values. Must set '
+    'spec_cache_dir.')
+tf.app.flags.DEFINE_integer(
+    'num_workers', 1,
+    'The number of processes to compute spectrograms with.')
+tf.app.flags.DEFINE_string(
+    'log', 'INFO',
+    'The threshold for what messages will be logged: '
+    'DEBUG, INFO, WARN, ERROR, or FATAL.')
+
+
+def _audio_iterator(examples_path):
+  """Yields the wav data of every example in the matching TFRecord files."""
+  for filename in tf.gfile.Glob(examples_path):
+    for record in tf.python_io.tf_record_iterator(filename):
+      example = tf.train.Example.FromString(record)
+      yield example.features.feature['audio'].bytes_list.value[0]
+
+
+def _warm(wav_audio, hparams):
+  """Computes and caches one spectrogram, returning whether it was a hit."""
+  cache = spectrogram_cache.get_spectrogram_cache(
+      hparams.spec_cache_dir, hparams)
+  hits = cache.hits
+  cache.get_or_compute(wav_audio, functools.partial(data.wav_to_spec,
+                                                    hparams=hparams))
+  return cache.hits > hits
+
+
+def warm_spectrogram_cache(examples_path, hparams, num_workers=1):
+  """Computes and caches the spectrograms of all examples not yet cached.
+
+  Args:
+    examples_path: Glob of TFRecord files of unpreprocessed examples.
+    hparams: HParams object specifying hyperparameters, including
+        `spec_cache_dir`.
+    num_workers: The number of processes to compute spectrograms with.
+
+  Returns:
+    A tuple of the number of spectrograms that were already cached and the
+    number that were computed.
+
+  Raises:
+    ValueError: If `hparams.spec_cache_dir` is not set.
+  """
+  if not hparams.spec_cache_dir:
+    raise ValueError('hparams.spec_cache_dir must be set.')
+
+  warm_fn = functools.partial(_warm, hparams=hparams)
+  pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+  results = (pool.imap_unordered(warm_fn, _audio_iterator(examples_path))
+             if pool else (warm_fn(a) for a in _audio_iterator(examples_path)))
+
+  num_hits = num_misses = 0
+  start_time = time.time()
+  try:
+    for hit in results:
+      if hit:
+        num_hits += 1
+      else:
+        num_misses += 1
+      tf.logging.log_every_n(
+          tf.logging.INFO, '%d spectrograms computed, %d already cached.',
+          100, num_misses, num_hits)
+  finally:
+    if pool:
+      pool.terminate()
+
+  tf.logging.info(
+      'Computed %d spectrograms (%d already cached) in %.1f seconds.',
+      num_misses, num_hits, time.time() - start_time)
+  return num_hits, num_misses
+
+
+def main(unused_argv):
+  tf.logging.set_verbosity(FLAGS.log)
+  tf.app.flags.mark_flags_as_required(['examples_path'])
+
+  hparams = configs.CONFIG_MAP[FLAGS.config].hparams
+  hparams.parse(FLAGS.hparams)
+
+  warm_spectrogram_cache(FLAGS.examples_path, hparams, FLAGS.num_workers)
+
+
+def console_entry_point():
+  tf.app.run(main)
+
+
+if __name__ == '__main__':
+  console_entry_point()
@@ -0,0 +1,190 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache of spectrograms computed from wav audio.
+
+Computing a CQT or mel spectrogram is the most expensive part of reading a
+training example, and without a cache it is repeated for the same audio every
+epoch. Cached spectrograms are stored as `.npy` files keyed by a hash of the
+wav data and of the hparams that determine the spectrogram, so changing any of
+those hparams starts a separate cache. Local cache files are memory-mapped when
+read, so only the frames that are actually used get read from disk.
+
+Layout:
+  <cache_dir>/<hparams key>/hparams.json
+  <cache_dir>/<hparams key>/<audio hash[:2]>/<audio hash>.npy
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+import tensorflow as tf
+
+# The hparams that determine the spectrogram computed from a wav file.
+SPEC_HPARAMS = ('sample_rate', 'spec_type', 'spec_hop_length', 'spec_n_bins',
+                'spec_fmin', 'spec_log_amplitude', 'spec_mel_htk',
+                'cqt_bins_per_octave')
+
+# Log the hit rate every this many lookups.
+_LOG_EVERY_N_LOOKUPS = 1000
+
+
+def spec_hparams_key(hparams):
+  """Returns a string key identifying the spectrogram hparams."""
+  values = dict((name, getattr(hparams, name)) for name in SPEC_HPARAMS)
+  return hashlib.sha1(
+      json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class SpectrogramCache(object):
+  """Caches spectrograms on disk, keyed by wav data and spectrogram hparams.
+
+  Lookups may happen concurrently from `tf.py_func` calls in a `tf.data`
+  pipeline, so the hit and miss counters are updated under a lock.
+  """
+
+  def __init__(self, cache_dir, hparams):
+    """Constructs a `SpectrogramCache`.
+
+    Args:
+      cache_dir: The root directory of the cache. It is created if needed, and
+          may be shared by caches with different hparams.
+      hparams: HParams object with the spectrogram hparams in `SPEC_HPARAMS`.
+    """
+    self._dir = os.path.join(cache_dir, spec_hparams_key(hparams))
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+
+    tf.gfile.MakeDirs(self._dir)
+    hparams_path = os.path.join(self._dir, 'hparams.json')
+    if not tf.gfile.Exists(hparams_path):
+      with tf.gfile.Open(hparams_path, 'w') as f:
+        f.write(json.dumps(
+            dict((name, getattr(hparams, name)) for name in SPEC_HPARAMS),
+            sort_keys=True))
+
+  @property
+  def hits(self):
+    """The number of lookups that found a cached spectrogram."""
+    return self._hits
+
+  @property
+  def misses(self):
+    """The number of lookups that had to compute the spectrogram."""
+    return self._misses
+
+  def _path(self, wav_audio):
+    audio_hash = hashlib.sha1(wav_audio).hexdigest()
+    return os.path.join(self._dir, audio_hash[:2], audio_hash + '.npy')
+
+  def _record_lookup(self, hit):
+    with self._lock:
+      if hit:
+        self._hits += 1
+      else:
+        self._misses += 1
+      lookups = self._hits + self._misses
+      if lookups % _LOG_EVERY_N_LOOKUPS == 0:
+        tf.logging.info('Spectrogram cache: %d hits, %d misses (%.1f%% hits).',
+                        self._hits, self._misses,
+                        100.0 * self._hits / lookups)
+
+  def get(self, wav_audio):
+    """Returns the cached spectrogram for `wav_audio`, or None.
+
+    Lookups through `get` are not counted; see `get_or_compute`.
+
+    Args:
+      wav_audio: The contents of a wav file.
+
+    Returns:
+      The cached spectrogram as a read-only, memory-mapped array if the cache
+      is local, or None if it is not cached.
+    """
+    path = self._path(wav_audio)
+    if os.path.exists(path):
+      return np.load(path, mmap_mode='r')
+    if not tf.gfile.Exists(path):
+      return None
+    with tf.gfile.Open(path, 'rb') as f:
+      return np.load(f)
+
+  def put(self, wav_audio, spec):
+    """Writes the spectrogram for `wav_audio` to the cache.
+
+    The file is written under a temporary name and then renamed, so concurrent
+    readers never see a partial file.
+
+    Args:
+      wav_audio: The contents of a wav file.
+      spec: The spectrogram computed from `wav_audio`.
+    """
+    path = self._path(wav_audio)
+    tf.gfile.MakeDirs(os.path.dirname(path))
+    temp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    with tf.gfile.Open(temp_path, 'wb') as f:
+      np.save(f, spec)
+    tf.gfile.Rename(temp_path, path, overwrite=True)
+
+  def get_or_compute(self, wav_audio, compute_fn):
+    """Returns the spectrogram for `wav_audio`, computing it on a miss.
+
+    Args:
+      wav_audio: The contents of a wav file.
+      compute_fn: A function that takes `wav_audio` and returns its
+          spectrogram. Called only on a cache miss, after which the result is
+          written to the cache.
+
+    Returns:
+      The spectrogram for `wav_audio`.
+    """
+    spec = self.get(wav_audio)
+    self._record_lookup(hit=spec is not None)
+    if spec is None:
+      spec = compute_fn(wav_audio)
+      self.put(wav_audio, spec)
+    return spec
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_spectrogram_cache(cache_dir, hparams):
+  """Returns the shared `SpectrogramCache` for a directory and hparams.
+
+  Sharing one instance per process lets its hit and miss counters cover every
+  input pipeline that reads through it.
+
+  Args:
+    cache_dir: The root directory of the cache.
+    hparams: HParams object with the spectrogram hparams in `SPEC_HPARAMS`.
+
+  Returns:
+    A `SpectrogramCache`.
+  """
+  key = (cache_dir, spec_hparams_key(hparams))
+  with _caches_lock:
+    if key not in _caches:
+      _caches[key] = SpectrogramCache(cache_dir, hparams)
+    return _caches[key]
@@ -0,0 +1,82 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for spectrogram_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from magenta.models.onsets_frames_transcription import spectrogram_cache
+import numpy as np
+import tensorflow as tf
+
+
+class SpectrogramCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.hparams = tf.contrib.training.HParams(
+        sample_rate=16000,
+        spec_type='mel',
+        spec_mel_htk=True,
+        spec_log_amplitude=True,
+        spec_hop_length=512,
+        spec_n_bins=229,
+        spec_fmin=30.0,
+        cqt_bins_per_octave=36)
+    self.computed = []
+
+  def _compute(self, wav_audio):
+    self.computed.append(wav_audio)
+    return np.full([len(wav_audio), 2], len(self.computed), dtype=np.float32)
+
+  def testGetOrCompute(self):
+    cache = spectrogram_cache.SpectrogramCache(self.get_temp_dir(),
+                                               self.hparams)
+    self.assertIsNone(cache.get(b'abc'))
+
+    spec = cache.get_or_compute(b'abc', self._compute)
+    self.assertAllEqual(np.ones([3, 2]), spec)
+    self.assertEqual([b'abc'], self.computed)
+    self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+    # A second lookup reads the cached spectrogram instead of recomputing it.
+    spec = cache.get_or_compute(b'abc', self._compute)
+    self.assertAllEqual(np.ones([3, 2]), spec)
+    self.assertIsInstance(spec, np.memmap)
+    self.assertEqual([b'abc'], self.computed)
+    self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    cache.get_or_compute(b'abcd', self._compute)
+    self.assertEqual([b'abc', b'abcd'], self.computed)
+    self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+  def testHparamsChangeKey(self):
+    cache_dir = self.get_temp_dir()
+    cache = spectrogram_cache.SpectrogramCache(cache_dir, self.hparams)
+    cache.get_or_compute(b'abc', self._compute)
+
+    self.hparams.spec_n_bins = 88
+    other_cache = spectrogram_cache.SpectrogramCache(cache_dir, self.hparams)
+    self.assertIsNone(other_cache.get(b'abc'))
+
+  def testGetSpectrogramCacheIsShared(self):
+    cache_dir = self.get_temp_dir()
+    self.assertIs(
+        spectrogram_cache.get_spectrogram_cache(cache_dir, self.hparams),
+        spectrogram_cache.get_spectrogram_cache(cache_dir, self.hparams))
+
+
+if __name__ == '__main__':
+  tf.test.main()
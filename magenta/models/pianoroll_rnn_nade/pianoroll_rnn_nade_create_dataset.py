@@ -39,6 +39,10 @@ flags.DEFINE_float(
     'Fraction of input to set aside for eval set. Partition is randomly '
     'selected.')
 flags.DEFINE_string('config', 'rnn-nade', 'Which config to use.')
+flags.DEFINE_integer(
+    'num_workers', 1,
+    'The number of worker processes to convert NoteSequences with. If greater '
+    'than 1, each dataset is written as one TFRecord shard per worker.')
 flags.DEFINE_string(
     'log', 'INFO',
     'The threshold for what messages will be logged DEBUG, INFO, WARN, ERROR, '
@@ -56,10 +60,11 @@ def main(unused_argv):
 
   input_dir = os.path.expanduser(FLAGS.input)
   output_dir = os.path.expanduser(FLAGS.output_dir)
-  pipeline.run_pipeline_serial(
+  pipeline.run_pipeline_parallel(
       pipeline_instance,
       pipeline.tf_record_iterator(input_dir, pipeline_instance.input_type),
-      output_dir)
+      output_dir,
+      num_workers=FLAGS.num_workers)
 
 
 def console_entry_point():
@@ -20,12 +20,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import contextlib
 import copy
 import functools
 import hashlib
 import logging
 import os
 import random
+import time
 
 from absl import flags
 import apache_beam as beam
@@ -47,11 +49,36 @@ flags.DEFINE_string(
     'pipeline_options', '',
     'Command line flags to use in constructing the Beam pipeline options.')
 
-# TODO(iansimon): Figure out how to avoid explicitly serializing and
-# deserializing NoteSequence protos.
+# Encode NoteSequence protos between stages with their own coder, so that they
+# only need to be parsed once when read.
+beam.coders.registry.register_coder(
+    music_pb2.NoteSequence, beam.coders.ProtoCoder)
 
 
-@typehints.with_output_types(typehints.KV[str, str])
+@contextlib.contextmanager
+def _stage_timer(namespace, stage):
+  """Context manager that records time spent in a stage as a Beam metric."""
+  start_time = time.time()
+  yield
+  Metrics.distribution(namespace, '%s_msec' % stage).update(
+      int(1000 * (time.time() - start_time)))
+
+
+def _parse_note_sequence(ns):
+  """Parse a NoteSequence proto if serialized, for string inputs."""
+  if isinstance(ns, music_pb2.NoteSequence):
+    return ns
+  with _stage_timer('parse_note_sequence', 'parse'):
+    return music_pb2.NoteSequence.FromString(ns)
+
+
+def _key_note_sequence(ns_str):
+  """Parse a serialized NoteSequence proto and key it by its id."""
+  ns = _parse_note_sequence(ns_str)
+  return ns.id, ns
+
+
+@typehints.with_output_types(typehints.KV[str, music_pb2.NoteSequence])
 class ReadNoteSequencesFromTFRecord(beam.PTransform):
   """Beam PTransform that reads NoteSequence protos from TFRecord."""
 
@@ -64,8 +91,7 @@ class ReadNoteSequencesFromTFRecord(beam.PTransform):
     # but for some reason ReadFromTFRecord doesn't work with gs:// URLs.
     pcoll |= beam.Create([self._tfrecord_path])
     pcoll |= beam.io.tfrecordio.ReadAllFromTFRecord()
-    pcoll |= beam.Map(
-        lambda ns_str: (music_pb2.NoteSequence.FromString(ns_str).id, ns_str))
+    pcoll |= beam.Map(_key_note_sequence)
     return pcoll
 
 
@@ -82,16 +108,29 @@ def select_split(cumulative_splits, kv, unused_num_partitions):
 
 
 def filter_invalid_notes(min_pitch, max_pitch, kv):
-  """Filter notes with out-of-range pitch from NoteSequence protos."""
-  key, ns_str = kv
-  ns = music_pb2.NoteSequence.FromString(ns_str)
+  """Filter notes with out-of-range pitch from NoteSequence protos.
+
+  Args:
+    min_pitch: Minimum MIDI pitch value; notes with lower pitch will be dropped.
+    max_pitch: Maximum MIDI pitch value; notes with greater pitch will be
+        dropped.
+    kv: An `(id, ns)` tuple, where `ns` is a NoteSequence proto or a serialized
+        NoteSequence proto (which will be parsed).
+
+  Returns:
+    An `(id, ns)` tuple with the filtered NoteSequence proto. The input proto
+    is not modified; it is copied only if some notes need to be dropped.
+  """
+  key, ns = kv
+  ns = _parse_note_sequence(ns)
   valid_notes = [note for note in ns.notes
                  if min_pitch <= note.pitch <= max_pitch]
   if len(valid_notes) < len(ns.notes):
+    ns = copy.deepcopy(ns)
     del ns.notes[:]
     ns.notes.extend(valid_notes)
     Metrics.counter('filter_invalid_notes', 'out_of_range_pitch').inc()
-  return key, ns.SerializeToString()
+  return key, ns
 
 
 class DataAugmentationError(Exception):
@@ -154,15 +193,16 @@ class ExtractExamplesDoFn(beam.DoFn):
   def process(self, kv):
     # Seed random number generator based on key so that hop times are
     # deterministic.
-    key, ns_str = kv
+    key, ns = kv
     m = hashlib.md5(key)
     random.seed(int(m.hexdigest(), 16))
 
-    # Deserialize NoteSequence proto.
-    ns = music_pb2.NoteSequence.FromString(ns_str)
+    # Deserialize NoteSequence proto, if the input is serialized.
+    ns = _parse_note_sequence(ns)
 
     # Apply sustain pedal.
-    ns = sequences_lib.apply_sustain_control_changes(ns)
+    with _stage_timer('extract_examples', 'sustain'):
+      ns = sequences_lib.apply_sustain_control_changes(ns)
 
     # Remove control changes as there are potentially a lot of them and they are
     # no longer needed.
@@ -173,6 +213,43 @@ class ExtractExamplesDoFn(beam.DoFn):
       Metrics.counter('extract_examples', 'sequence_too_short').inc()
       return
 
+    # Each stage below is applied to all sequences derived from this element
+    # before moving on to the next stage, except for encoding, which yields
+    # each example as soon as it is encoded.
+    with _stage_timer('extract_examples', 'split'):
+      sequences = self._split_sequence(ns)
+
+    if self._encode_score_fns:
+      with _stage_timer('extract_examples', 'extract_score'):
+        sequence_pairs = [self._extract_score(performance_sequence)
+                          for performance_sequence in sequences]
+      sequence_pairs = [pair for pair in sequence_pairs if pair is not None]
+    else:
+      sequence_pairs = [(performance_sequence, None)
+                        for performance_sequence in sequences]
+
+    with _stage_timer('extract_examples', 'augment'):
+      augmented_pairs = [
+          self._augment(augment_fn, performance_sequence, score_sequence)
+          for performance_sequence, score_sequence in sequence_pairs
+          for augment_fn in self._augment_fns]
+    augmented_pairs = [pair for pair in augmented_pairs if pair is not None]
+
+    # Time spent downstream of each yielded example is not counted.
+    encode_seconds = 0.0
+    try:
+      for performance_sequence, score_sequence in augmented_pairs:
+        start_time = time.time()
+        example = self._encode(performance_sequence, score_sequence)
+        encode_seconds += time.time() - start_time
+        if example is not None:
+          yield example
+    finally:
+      Metrics.distribution('extract_examples', 'encode_msec').update(
+          int(1000 * encode_seconds))
+
+  def _split_sequence(self, ns):
+    """Replicate and split a NoteSequence according to the hop sizes."""
     sequences = []
     for _ in range(self._num_replications):
       if self._max_hop_size_seconds:
@@ -202,126 +279,132 @@ class ExtractExamplesDoFn(beam.DoFn):
           sequences += sequences_lib.split_note_sequence(ns, hop_times[1:-1])
       else:
         sequences += [ns]
-
-    for performance_sequence in sequences:
-      if self._encode_score_fns:
-        # We need to extract a score.
-        if not self._absolute_timing:
-          # Beats are required to extract a score with metric timing.
-          beats = [
-              ta for ta in performance_sequence.text_annotations
-              if (ta.annotation_type ==
-                  music_pb2.NoteSequence.TextAnnotation.BEAT)
-              and ta.time <= performance_sequence.total_time
-          ]
-          if len(beats) < 2:
-            Metrics.counter('extract_examples', 'not_enough_beats').inc()
-            continue
-
-          # Ensure the sequence starts and ends on a beat.
-          performance_sequence = sequences_lib.extract_subsequence(
-              performance_sequence,
-              start_time=min(beat.time for beat in beats),
-              end_time=max(beat.time for beat in beats)
-          )
-
-          # Infer beat-aligned chords (only for relative timing).
-          try:
-            chord_inference.infer_chords_for_sequence(
-                performance_sequence,
-                chord_change_prob=0.25,
-                chord_note_concentration=50.0,
-                add_key_signatures=True)
-          except chord_inference.ChordInferenceError:
-            Metrics.counter('extract_examples', 'chord_inference_failed').inc()
-            continue
-
-        # Infer melody regardless of relative/absolute timing.
-        try:
-          melody_instrument = melody_inference.infer_melody_for_sequence(
-              performance_sequence,
-              melody_interval_scale=2.0,
-              rest_prob=0.1,
-              instantaneous_non_max_pitch_prob=1e-15,
-              instantaneous_non_empty_rest_prob=0.0,
-              instantaneous_missing_pitch_prob=1e-15)
-        except melody_inference.MelodyInferenceError:
-          Metrics.counter('extract_examples', 'melody_inference_failed').inc()
-          continue
-
-        if not self._absolute_timing:
-          # Now rectify detected beats to occur at fixed tempo.
-          # TODO(iansimon): also include the alignment
-          score_sequence, unused_alignment = sequences_lib.rectify_beats(
-              performance_sequence, beats_per_minute=SCORE_BPM)
-        else:
-          # Score uses same timing as performance.
-          score_sequence = copy.deepcopy(performance_sequence)
-
-        # Remove melody notes from performance.
-        performance_notes = []
-        for note in performance_sequence.notes:
-          if note.instrument != melody_instrument:
-            performance_notes.append(note)
-        del performance_sequence.notes[:]
-        performance_sequence.notes.extend(performance_notes)
-
-        # Remove non-melody notes from score.
-        score_notes = []
-        for note in score_sequence.notes:
-          if note.instrument == melody_instrument:
-            score_notes.append(note)
-        del score_sequence.notes[:]
-        score_sequence.notes.extend(score_notes)
-
-        # Remove key signatures and beat/chord annotations from performance.
-        del performance_sequence.key_signatures[:]
-        del performance_sequence.text_annotations[:]
-
-        Metrics.counter('extract_examples', 'extracted_score').inc()
-
-      for augment_fn in self._augment_fns:
-        # Augment and encode the performance.
-        try:
-          augmented_performance_sequence = augment_fn(performance_sequence)
-        except DataAugmentationError:
-          Metrics.counter(
-              'extract_examples', 'augment_performance_failed').inc()
-          continue
-        example_dict = {
-            'targets': self._encode_performance_fn(
-                augmented_performance_sequence)
-        }
-        if not example_dict['targets']:
-          Metrics.counter('extract_examples', 'skipped_empty_targets').inc()
-          continue
-
-        if self._encode_score_fns:
-          # Augment the extracted score.
-          try:
-            augmented_score_sequence = augment_fn(score_sequence)
-          except DataAugmentationError:
-            Metrics.counter('extract_examples', 'augment_score_failed').inc()
-            continue
-
-          # Apply all score encoding functions.
-          skip = False
-          for name, encode_score_fn in self._encode_score_fns.items():
-            example_dict[name] = encode_score_fn(augmented_score_sequence)
-            if not example_dict[name]:
-              Metrics.counter('extract_examples',
-                              'skipped_empty_%s' % name).inc()
-              skip = True
-              break
-          if skip:
-            continue
-
-        Metrics.counter('extract_examples', 'encoded_example').inc()
-        Metrics.distribution(
-            'extract_examples', 'performance_length_in_seconds').update(
-                int(augmented_performance_sequence.total_time))
-
-        yield generator_utils.to_example(example_dict)
+    return sequences
+
+  def _extract_score(self, performance_sequence):
+    """Extract a `(performance, score)` pair, or None on failure."""
+    if not self._absolute_timing:
+      # Beats are required to extract a score with metric timing.
+      beats = [
+          ta for ta in performance_sequence.text_annotations
+          if (ta.annotation_type ==
+              music_pb2.NoteSequence.TextAnnotation.BEAT)
+          and ta.time <= performance_sequence.total_time
+      ]
+      if len(beats) < 2:
+        Metrics.counter('extract_examples', 'not_enough_beats').inc()
+        return None
+
+      # Ensure the sequence starts and ends on a beat.
+      performance_sequence = sequences_lib.extract_subsequence(
+          performance_sequence,
+          start_time=min(beat.time for beat in beats),
+          end_time=max(beat.time for beat in beats)
+      )
+
+      # Infer beat-aligned chords (only for relative timing).
+      try:
+        chord_inference.infer_chords_for_sequence(
+            performance_sequence,
+            chord_change_prob=0.25,
+            chord_note_concentration=50.0,
+            add_key_signatures=True)
+      except chord_inference.ChordInferenceError:
+        Metrics.counter('extract_examples', 'chord_inference_failed').inc()
+        return None
+    else:
+      # Melody inference adds notes to the sequence, which may be shared with
+      # other replications when not splitting.
+      performance_sequence = copy.deepcopy(performance_sequence)
+
+    # Infer melody regardless of relative/absolute timing.
+    try:
+      melody_instrument = melody_inference.infer_melody_for_sequence(
+          performance_sequence,
+          melody_interval_scale=2.0,
+          rest_prob=0.1,
+          instantaneous_non_max_pitch_prob=1e-15,
+          instantaneous_non_empty_rest_prob=0.0,
+          instantaneous_missing_pitch_prob=1e-15)
+    except melody_inference.MelodyInferenceError:
+      Metrics.counter('extract_examples', 'melody_inference_failed').inc()
+      return None
+
+    if not self._absolute_timing:
+      # Now rectify detected beats to occur at fixed tempo.
+      # TODO(iansimon): also include the alignment
+      score_sequence, unused_alignment = sequences_lib.rectify_beats(
+          performance_sequence, beats_per_minute=SCORE_BPM)
+    else:
+      # Score uses same timing as performance.
+      score_sequence = copy.deepcopy(performance_sequence)
+
+    # Remove melody notes from performance.
+    performance_notes = []
+    for note in performance_sequence.notes:
+      if note.instrument != melody_instrument:
+        performance_notes.append(note)
+    del performance_sequence.notes[:]
+    performance_sequence.notes.extend(performance_notes)
+
+    # Remove non-melody notes from score.
+    score_notes = []
+    for note in score_sequence.notes:
+      if note.instrument == melody_instrument:
+        score_notes.append(note)
+    del score_sequence.notes[:]
+    score_sequence.notes.extend(score_notes)
+
+    # Remove key signatures and beat/chord annotations from performance.
+    del performance_sequence.key_signatures[:]
+    del performance_sequence.text_annotations[:]
+
+    Metrics.counter('extract_examples', 'extracted_score').inc()
+    return performance_sequence, score_sequence
+
+  def _augment(self, augment_fn, performance_sequence, score_sequence):
+    """Augment a performance and score, returning None on failure."""
+    try:
+      augmented_performance_sequence = augment_fn(performance_sequence)
+    except DataAugmentationError:
+      Metrics.counter(
+          'extract_examples', 'augment_performance_failed').inc()
+      return None
+
+    augmented_score_sequence = None
+    if score_sequence is not None:
+      try:
+        augmented_score_sequence = augment_fn(score_sequence)
+      except DataAugmentationError:
+        Metrics.counter('extract_examples', 'augment_score_failed').inc()
+        return None
+
+    return augmented_performance_sequence, augmented_score_sequence
+
+  def _encode(self, performance_sequence, score_sequence):
+    """Encode a performance and score as an Example, or None if empty."""
+    example_dict = {
+        'targets': self._encode_performance_fn(performance_sequence)
+    }
+    if not example_dict['targets']:
+      Metrics.counter('extract_examples', 'skipped_empty_targets').inc()
+      return None
+
+    if self._encode_score_fns:
+      # Apply all score encoding functions.
+      for name, encode_score_fn in self._encode_score_fns.items():
+        example_dict[name] = encode_score_fn(score_sequence)
+        if not example_dict[name]:
+          Metrics.counter('extract_examples',
+                          'skipped_empty_%s' % name).inc()
+          return None
+
+    Metrics.counter('extract_examples', 'encoded_example').inc()
+    Metrics.distribution(
+        'extract_examples', 'performance_length_in_seconds').update(
+            int(performance_sequence.total_time))
+
+    return generator_utils.to_example(example_dict)
 
 
 def generate_examples(input_transform, output_dir, problem_name, splits,
@@ -334,7 +417,8 @@ def generate_examples(input_transform, output_dir, problem_name, splits,
   Args:
     input_transform: The input PTransform object that reads input NoteSequence
         protos, or dictionary mapping split names to such PTransform objects.
-        Should produce `(id, NoteSequence)` tuples.
+        Should produce `(id, NoteSequence)` tuples; serialized NoteSequence
+        protos are also accepted, and will be parsed once.
     output_dir: The directory to write the resulting TFRecord file containing
         examples.
     problem_name: Name of the Tensor2Tensor problem, used as a base filename
@@ -425,7 +509,8 @@ def generate_examples(input_transform, output_dir, problem_name, splits,
         max_hop = max_hop_size_seconds
       s |= 'preshuffle_%s' % split_name >> beam.Reshuffle()
       s |= 'filter_invalid_notes_%s' % split_name >> beam.Map(
-          functools.partial(filter_invalid_notes, min_pitch, max_pitch))
+          functools.partial(filter_invalid_notes, min_pitch, max_pitch)
+      ).with_output_types(typehints.KV[str, music_pb2.NoteSequence])
       s |= 'extract_examples_%s' % split_name >> beam.ParDo(
           ExtractExamplesDoFn(
               min_hop, max_hop,
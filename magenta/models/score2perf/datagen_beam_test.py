@@ -20,11 +20,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 import tempfile
 
 import apache_beam as beam
+from apache_beam.testing import test_pipeline
+from apache_beam.testing import util as beam_test_util
 from magenta.models.score2perf import datagen_beam
 from magenta.models.score2perf import music_encoders
+from magenta.music import note_sequence_io
 from magenta.music import testing_lib
 from magenta.protobuf import music_pb2
 import tensorflow as tf
@@ -32,11 +36,14 @@ import tensorflow as tf
 
 class GenerateExamplesTest(tf.test.TestCase):
 
-  def testGenerateExamples(self):
-    ns = music_pb2.NoteSequence()
+  def setUp(self):
+    self.ns = music_pb2.NoteSequence(id='0')
     testing_lib.add_track_to_sequence(
-        ns, 0, [(60, 100, 0.0, 1.0), (64, 100, 1.0, 2.0), (67, 127, 2.0, 3.0)])
-    input_transform = beam.transforms.Create([('0', ns.SerializeToString())])
+        self.ns, 0,
+        [(60, 100, 0.0, 1.0), (64, 100, 1.0, 2.0), (67, 127, 2.0, 3.0),
+         (120, 100, 2.0, 3.0)])
+
+  def generate_examples(self, input_transform):
     output_dir = tempfile.mkdtemp()
     encoder = music_encoders.MidiPerformanceEncoder(
         steps_per_second=100,
@@ -56,6 +63,48 @@ class GenerateExamplesTest(tf.test.TestCase):
         num_replications=1,
         encode_performance_fn=encoder.encode_note_sequence)
 
+    examples = []
+    for filename in tf.gfile.Glob(
+        os.path.join(output_dir, 'test_problem-train.tfrecord*')):
+      examples.extend(
+          tf.train.Example.FromString(record)
+          for record in tf.python_io.tf_record_iterator(filename))
+    return examples
+
+  def testGenerateExamples(self):
+    examples = self.generate_examples(
+        beam.transforms.Create([('0', self.ns.SerializeToString())]))
+    self.assertEqual(1, len(examples))
+
+    # NoteSequence inputs are used directly and produce the same examples.
+    self.assertEqual(
+        examples,
+        self.generate_examples(beam.transforms.Create([('0', self.ns)])))
+
+  def testFilterInvalidNotes(self):
+    key, ns = datagen_beam.filter_invalid_notes(
+        21, 108, ('0', self.ns.SerializeToString()))
+    self.assertEqual('0', key)
+    self.assertEqual([60, 64, 67], [note.pitch for note in ns.notes])
+
+    # The input proto is not modified.
+    _, ns = datagen_beam.filter_invalid_notes(21, 108, ('0', self.ns))
+    self.assertEqual(3, len(ns.notes))
+    self.assertEqual(4, len(self.ns.notes))
+
+  def testReadNoteSequencesFromTFRecord(self):
+    tfrecord_path = os.path.join(tempfile.mkdtemp(), 'sequences.tfrecord')
+    with note_sequence_io.NoteSequenceRecordWriter(tfrecord_path) as writer:
+      writer.write(self.ns)
+
+    coder = beam.coders.registry.get_coder(music_pb2.NoteSequence)
+    self.assertEqual(self.ns, coder.decode(coder.encode(self.ns)))
+
+    with test_pipeline.TestPipeline() as p:
+      sequences = p | datagen_beam.ReadNoteSequencesFromTFRecord(tfrecord_path)
+      beam_test_util.assert_that(
+          sequences, beam_test_util.equal_to([('0', self.ns)]))
+
 
 if __name__ == '__main__':
   tf.test.main()
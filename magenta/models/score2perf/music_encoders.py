@@ -18,11 +18,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import hashlib
 import tempfile
 
 import magenta
 from magenta.music import performance_lib
 from magenta.protobuf import music_pb2
+import numpy as np
 
 import pygtrie
 
@@ -35,7 +38,7 @@ class MidiPerformanceEncoder(object):
   """Convert between performance event indices and (filenames of) MIDI files."""
 
   def __init__(self, steps_per_second, num_velocity_bins, min_pitch, max_pitch,
-               add_eos=False, ngrams=None):
+               add_eos=False, ngrams=None, cache_size=64):
     """Initialize a MidiPerformanceEncoder object.
 
     Encodes MIDI using a performance event encoding. Index 0 is unused as it is
@@ -61,6 +64,9 @@ class MidiPerformanceEncoder(object):
       ngrams: Optional list of performance event n-grams (tuples) to be
           represented by new indices. N-grams must have length at least 2 and
           should be pre-offset by the number of reserved IDs.
+      cache_size: Number of recently encoded NoteSequences whose encodings are
+          kept, so that identical sequences (e.g. replications of the same
+          segment) are only encoded once. If zero, nothing is cached.
 
     Raises:
       ValueError: If any n-gram has length less than 2, or contains one of the
@@ -70,6 +76,8 @@ class MidiPerformanceEncoder(object):
     self._num_velocity_bins = num_velocity_bins
     self._add_eos = add_eos
     self._ngrams = ngrams or []
+    self._cache_size = cache_size
+    self._cache = collections.OrderedDict()
 
     for ngram in self._ngrams:
       if len(ngram) < 2:
@@ -105,27 +113,47 @@ class MidiPerformanceEncoder(object):
     Returns:
       ids: List of performance event indices.
     """
-    performance = magenta.music.Performance(
-        magenta.music.quantize_note_sequence_absolute(
-            ns, self._steps_per_second),
-        num_velocity_bins=self._num_velocity_bins)
+    if self._cache_size:
+      # Key by the contents of the NoteSequence, which include the effect of
+      # any transposition or time stretch applied to it.
+      key = hashlib.md5(ns.SerializeToString(deterministic=True)).digest()
+      if key in self._cache:
+        ids = self._cache.pop(key)
+        self._cache[key] = ids
+        return list(ids)
+
+    ids = self._encode_note_sequence(ns)
+
+    if self._cache_size:
+      self._cache[key] = tuple(ids)
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+
+    return ids
 
-    event_ids = [self._encoding.encode_event(event) + self.num_reserved_ids
-                 for event in performance]
-
-    # Greedily encode performance event n-grams as new indices.
-    ids = []
-    j = 0
-    while j < len(event_ids):
-      ngram = ()
-      for i in event_ids[j:]:
-        ngram += (i,)
-        if self._ngrams_trie.has_key(ngram):
-          best_ngram = ngram
-        if not self._ngrams_trie.has_subtrie(ngram):
-          break
-      ids.append(self._ngrams_trie[best_ngram])
-      j += len(best_ngram)
+  def _encode_note_sequence(self, ns):
+    """Encode a NoteSequence without using the cache."""
+    event_codes = performance_lib.note_sequence_to_event_codes(
+        ns, self._steps_per_second, num_velocity_bins=self._num_velocity_bins)
+    event_ids = (self._encoding.encode_event_codes(event_codes) +
+                 self.num_reserved_ids).tolist()
+
+    if self._ngrams:
+      # Greedily encode performance event n-grams as new indices.
+      ids = []
+      j = 0
+      while j < len(event_ids):
+        ngram = ()
+        for i in event_ids[j:]:
+          ngram += (i,)
+          if self._ngrams_trie.has_key(ngram):
+            best_ngram = ngram
+          if not self._ngrams_trie.has_subtrie(ngram):
+            break
+        ids.append(self._ngrams_trie[best_ngram])
+        j += len(best_ngram)
+    else:
+      ids = event_ids
 
     if self._add_eos:
       ids.append(text_encoder.EOS_ID)
@@ -161,19 +189,22 @@ class MidiPerformanceEncoder(object):
       ids = text_encoder.strip_ids(ids, list(range(self.num_reserved_ids)))
 
     # Decode indices corresponding to event n-grams back into the n-grams.
-    event_ids = []
-    for i in ids:
-      if i >= self.unigram_vocab_size:
-        event_ids += self._ngrams[i - self.unigram_vocab_size]
-      else:
-        event_ids.append(i)
+    if self._ngrams:
+      event_ids = []
+      for i in ids:
+        if i >= self.unigram_vocab_size:
+          event_ids += self._ngrams[i - self.unigram_vocab_size]
+        else:
+          event_ids.append(i)
+    else:
+      event_ids = ids
 
     performance = magenta.music.Performance(
         quantized_sequence=None,
         steps_per_second=self._steps_per_second,
         num_velocity_bins=self._num_velocity_bins)
-    for i in event_ids:
-      performance.append(self._encoding.decode_event(i - self.num_reserved_ids))
+    performance.extend_codes(self._encoding.decode_event_codes(
+        np.array(event_ids, dtype=np.int64) - self.num_reserved_ids))
 
     ns = performance.to_sequence()
 
@@ -126,6 +126,31 @@ class MidiPerformanceEncoderTest(tf.test.TestCase):
 
     self.assertEqual(expected_ids, ids)
 
+  def testEncodeNoteSequenceCache(self):
+    encoder = music_encoders.MidiPerformanceEncoder(
+        steps_per_second=100, num_velocity_bins=32, min_pitch=21, max_pitch=108,
+        add_eos=True)
+    uncached_encoder = music_encoders.MidiPerformanceEncoder(
+        steps_per_second=100, num_velocity_bins=32, min_pitch=21, max_pitch=108,
+        add_eos=True, cache_size=0)
+
+    ns = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        ns, 0, [(60, 100, 0.0, 4.0), (64, 100, 0.0, 3.0), (67, 127, 1.0, 2.0)])
+    ids = encoder.encode_note_sequence(ns)
+    self.assertEqual(uncached_encoder.encode_note_sequence(ns), ids)
+
+    # Mutating the returned ids does not affect the cached encoding.
+    ids.append(0)
+    self.assertEqual(ids[:-1], encoder.encode_note_sequence(ns))
+
+    # A transposed sequence is a different cache entry.
+    for note in ns.notes:
+      note.pitch += 2
+    self.assertEqual(uncached_encoder.encode_note_sequence(ns),
+                     encoder.encode_note_sequence(ns))
+    self.assertNotEqual(ids[:-1], encoder.encode_note_sequence(ns))
+
   def testEncode(self):
     encoder = music_encoders.MidiPerformanceEncoder(
         steps_per_second=100, num_velocity_bins=32, min_pitch=21, max_pitch=108,
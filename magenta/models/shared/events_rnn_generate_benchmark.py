@@ -0,0 +1,141 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the Python side of a batched event sequence generation step.
+
+Between two `session.run` calls, `EventSequenceRnnModel._generate_step` samples
+the next event for every sequence in the batch and builds the next inputs
+batch. This script times that method on a melody model whose session is
+replaced by a fake one returning random softmax outputs, so only the Python
+work is measured, and reports generation steps per second. Run it at two
+revisions to compare them.
+"""
+
+import copy
+import time
+
+from magenta.models.shared import events_rnn_model
+import magenta.music as mm
+import numpy as np
+import tensorflow as tf
+
+flags = tf.app.flags
+FLAGS = tf.app.flags.FLAGS
+flags.DEFINE_integer(
+    'batch_size', 128,
+    'The model batch size.')
+flags.DEFINE_integer(
+    'num_sequences', 0,
+    'The number of event sequences to extend at each step. If 0, one full '
+    'batch is used. Use a number that is not a multiple of --batch_size to '
+    'include batch padding.')
+flags.DEFINE_integer(
+    'num_steps', 200,
+    'The number of generation steps to time.')
+flags.DEFINE_integer(
+    'primer_length', 32,
+    'The length of the primer melody each event sequence starts from.')
+flags.DEFINE_integer(
+    'rnn_state_size', 512,
+    'The size of the fake RNN state of each event sequence.')
+
+
+class _FakeDimension(object):
+
+  def __init__(self, value):
+    self.value = value
+
+
+class _FakeTensor(object):
+  """Stands in for a graph tensor used as a fetch or feed key."""
+
+  def __init__(self, name, shape=()):
+    self.name = name
+    self.shape = [_FakeDimension(d) for d in shape]
+
+
+class _FakeGraph(object):
+  """Holds the collections `EventSequenceRnnModel` looks up."""
+
+  def __init__(self, batch_size):
+    self._collections = {
+        'inputs': [_FakeTensor('inputs', [batch_size])],
+        'initial_state': [_FakeTensor('initial_state')],
+        'final_state': [_FakeTensor('final_state')],
+        'softmax': [_FakeTensor('softmax')],
+        'temperature': [_FakeTensor('temperature')],
+    }
+
+  def get_collection(self, name):
+    return self._collections[name]
+
+
+class _FakeSession(object):
+  """Returns the fed RNN state and random softmax outputs on every run."""
+
+  def __init__(self, batch_size, num_classes, num_softmaxes=16):
+    self.graph = _FakeGraph(batch_size)
+    logits = np.random.randn(num_softmaxes, batch_size, 1, num_classes)
+    self._softmaxes = (
+        np.exp(logits) / np.exp(logits).sum(axis=-1, keepdims=True))
+    self._num_runs = 0
+
+  def run(self, unused_fetches, feed_dict):
+    initial_state = feed_dict[tuple(self.graph.get_collection('initial_state'))]
+    softmax = self._softmaxes[self._num_runs % len(self._softmaxes)]
+    self._num_runs += 1
+    return initial_state, softmax
+
+
+def main(unused_argv):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  encoder_decoder = mm.LookbackEventSequenceEncoderDecoder(
+      mm.MelodyOneHotEncoding(min_note=48, max_note=84))
+  config = events_rnn_model.EventSequenceRnnConfig(
+      None, encoder_decoder, tf.contrib.training.HParams())
+  model = events_rnn_model.EventSequenceRnnModel(config)
+  model._session = _FakeSession(  # pylint: disable=protected-access
+      FLAGS.batch_size, encoder_decoder.num_classes)
+
+  num_sequences = FLAGS.num_sequences or FLAGS.batch_size
+  primer = [mm.MELODY_NO_EVENT] * FLAGS.primer_length
+  event_sequences = [copy.deepcopy(primer) for _ in range(num_sequences)]
+  inputs = encoder_decoder.get_inputs_batch(event_sequences)
+  model_states = [
+      events_rnn_model.ModelState(
+          inputs=inputs[i],
+          rnn_state=np.zeros(FLAGS.rnn_state_size, dtype=np.float32),
+          control_events=None, control_state=None)
+      for i in range(num_sequences)]
+  logliks = np.zeros(num_sequences)
+
+  start_time = time.time()
+  for _ in range(FLAGS.num_steps):
+    event_sequences, model_states, logliks = (
+        model._generate_step(  # pylint: disable=protected-access
+            event_sequences, model_states, logliks, temperature=1.0))
+  steps_per_second = FLAGS.num_steps / (time.time() - start_time)
+
+  tf.logging.info('Batch size %d, %d sequences, %d steps.', FLAGS.batch_size,
+                  num_sequences, FLAGS.num_steps)
+  tf.logging.info('Generation: %.1f steps/sec', steps_per_second)
+
+
+def console_entry_point():
+  tf.app.run(main)
+
+
+if __name__ == '__main__':
+  console_entry_point()
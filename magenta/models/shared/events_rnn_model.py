@@ -91,10 +91,11 @@ class EventSequenceRnnModel(mm.BaseModel):
 
     Args:
       event_sequences: A list of event sequences, each of which is a Python
-          list-like object. The list of event sequences should have length equal
-          to `self._batch_size()`. These are extended by this method.
+          list-like object. The list of event sequences should have length at
+          most `self._batch_size()`. These are extended by this method.
       inputs: A Python list of model inputs, with length equal to
-          `self._batch_size()`.
+          `self._batch_size()`. Entries past the number of event sequences are
+          batch padding and their outputs are discarded.
       initial_state: A numpy array containing the initial RNN state, where
           `initial_state.shape[0]` is equal to `self._batch_size()`.
       temperature: The softmax temperature.
@@ -103,12 +104,13 @@ class EventSequenceRnnModel(mm.BaseModel):
       final_state: The final RNN state, a numpy array the same size as
           `initial_state`.
       loglik: The log-likelihood of the chosen softmax value for each event
-          sequence, a 1-D numpy array of length
-          `self._batch_size()`. If `inputs` is a full-length inputs batch, the
-          log-likelihood of each entire sequence up to and including the
-          generated step will be computed and returned.
+          sequence, a 1-D numpy array of length `len(event_sequences)`. If
+          `inputs` is a full-length inputs batch, the log-likelihood of each
+          entire sequence up to and including the generated step will be
+          computed and returned.
     """
-    assert len(event_sequences) == self._batch_size()
+    assert len(event_sequences) <= self._batch_size()
+    assert len(inputs) == self._batch_size()
 
     graph_inputs = self._session.graph.get_collection('inputs')[0]
     graph_initial_state = self._session.graph.get_collection('initial_state')
@@ -125,6 +127,13 @@ class EventSequenceRnnModel(mm.BaseModel):
     final_state, softmax = self._session.run(
         [graph_final_state, graph_softmax], feed_dict)
 
+    # Drop the outputs for padding entries.
+    num_seqs = len(event_sequences)
+    if isinstance(softmax, list):
+      softmax = [sub_softmax[:num_seqs] for sub_softmax in softmax]
+    else:
+      softmax = softmax[:num_seqs]
+
     if isinstance(softmax, list):
       if softmax[0].shape[1] > 1:
         softmaxes = []
@@ -213,10 +222,10 @@ class EventSequenceRnnModel(mm.BaseModel):
     final_states = []
     logliks = np.array(logliks, dtype=np.float32)
 
-    # Add padding to fill the final batch.
+    # Add padding to fill the final batch. Only the model inputs and states are
+    # padded, with references to the last entry; the padding outputs are
+    # discarded, so no event sequences need to be copied.
     pad_amt = -len(event_sequences) % batch_size
-    padded_event_sequences = event_sequences + [
-        copy.deepcopy(event_sequences[-1]) for _ in range(pad_amt)]
     padded_inputs = inputs + [inputs[-1]] * pad_amt
     padded_initial_states = initial_states + [initial_states[-1]] * pad_amt
 
@@ -225,13 +234,13 @@ class EventSequenceRnnModel(mm.BaseModel):
       pad_amt = max(0, j - num_seqs)
       # Generate a single step for one batch of event sequences.
       batch_final_state, batch_loglik = self._generate_step_for_batch(
-          padded_event_sequences[i:j],
+          event_sequences[i:j],
           padded_inputs[i:j],
           state_util.batch(padded_initial_states[i:j], batch_size),
           temperature)
       final_states += state_util.unbatch(
           batch_final_state, batch_size)[:j - i - pad_amt]
-      logliks[i:j - pad_amt] += batch_loglik[:j - i - pad_amt]
+      logliks[i:j - pad_amt] += batch_loglik
 
     # Construct inputs for next step.
     if extend_control_events_callback is not None:
@@ -475,14 +484,14 @@ class EventSequenceRnnModel(mm.BaseModel):
       offset += batch_size
 
     if offset < len(event_sequences):
-      # There's an extra non-full batch. Pad it with a bunch of copies of the
-      # final sequence.
+      # There's an extra non-full batch. Pad it with references to the final
+      # sequence, which is only read and so does not need to be copied.
       num_extra = len(event_sequences) - offset
       pad_size = batch_size - num_extra
       batch_indices = range(offset, len(event_sequences))
       batch_loglik = self._evaluate_batch_log_likelihood(
-          [event_sequences[i] for i in batch_indices] + [
-              copy.deepcopy(event_sequences[-1]) for _ in range(pad_size)],
+          [event_sequences[i] for i in batch_indices] +
+          [event_sequences[-1]] * pad_size,
           [inputs[i] for i in batch_indices] + inputs[-1] * pad_size,
           np.append(initial_state[batch_indices],
                     np.tile(inputs[-1, :], (pad_size, 1)),
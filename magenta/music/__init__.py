@@ -125,6 +125,7 @@ from magenta.music.sequences_lib import infer_dense_chords_for_sequence
 from magenta.music.sequences_lib import MultipleTempoError
 from magenta.music.sequences_lib import MultipleTimeSignatureError
 from magenta.music.sequences_lib import NegativeTimeError
+from magenta.music.sequences_lib import NoteArrays
 from magenta.music.sequences_lib import quantize_note_sequence
 from magenta.music.sequences_lib import quantize_note_sequence_absolute
 from magenta.music.sequences_lib import quantize_to_step
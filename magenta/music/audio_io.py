@@ -74,7 +74,27 @@ def wav_data_to_samples(wav_data, sample_rate):
     native_sr, y = scipy.io.wavfile.read(six.BytesIO(wav_data))
   except Exception as e:  # pylint: disable=broad-except
     raise AudioIOReadError(e)
+  return _pcm_samples_to_mono_float32(y, native_sr, sample_rate)
 
+
+def _pcm_samples_to_mono_float32(y, native_sr, sample_rate):
+  """Converts PCM samples read from a WAV file to mono float32 samples.
+
+  Args:
+    y: A numpy array of int16 or float32 samples, of shape [samples] or
+        [samples, 2].
+    native_sr: The sample rate of `y`.
+    sample_rate: The number of samples per second at which the audio will be
+        returned. Resampling will be performed if necessary.
+
+  Returns:
+    A numpy array of audio samples, single-channel (mono) and sampled at the
+    specified rate, in float32 format.
+
+  Raises:
+    AudioIOError: If the samples are not 16-bit or 32-bit float PCM, or if
+        audio processing fails.
+  """
   if y.dtype == np.int16:
     # Convert to float32.
     y = int16_samples_to_float32(y)
@@ -96,6 +116,73 @@ def wav_data_to_samples(wav_data, sample_rate):
   return y
 
 
+class WavFileReader(object):
+  """Reads windows of samples from a WAV file without loading all of it.
+
+  The file is memory-mapped, so reading a window only touches the part of the
+  file it covers, and memory use is bounded by the window size rather than the
+  length of the recording.
+  """
+
+  def __init__(self, filename):
+    """Opens a WAV file.
+
+    Args:
+      filename: Path to a local 16-bit or 32-bit float PCM WAV file.
+
+    Raises:
+      AudioIOReadError: If scipy is unable to read the WAV file.
+    """
+    try:
+      self._native_sr, self._samples = scipy.io.wavfile.read(
+          filename, mmap=True)
+    except Exception as e:  # pylint: disable=broad-except
+      raise AudioIOReadError(e)
+
+  @property
+  def duration_secs(self):
+    """The length of the recording in seconds."""
+    return len(self._samples) / self._native_sr
+
+  def peak(self, block_secs=60):
+    """Returns the peak absolute amplitude of the mono float32 samples.
+
+    Args:
+      block_secs: The length of the blocks the file is scanned in, which
+          bounds the memory used.
+
+    Returns:
+      The peak absolute amplitude, at the native sample rate.
+    """
+    block_samples = max(1, int(block_secs * self._native_sr))
+    peak = 0.0
+    for start in range(0, len(self._samples), block_samples):
+      block = _pcm_samples_to_mono_float32(
+          np.asarray(self._samples[start:start + block_samples]),
+          self._native_sr, self._native_sr)
+      if block.size:
+        peak = max(peak, float(np.max(np.abs(block))))
+    return peak
+
+  def read(self, start_secs, end_secs, sample_rate):
+    """Reads a window of the recording.
+
+    Args:
+      start_secs: The start of the window in seconds.
+      end_secs: The end of the window in seconds.
+      sample_rate: The number of samples per second at which the audio will be
+          returned. Resampling will be performed if necessary.
+
+    Returns:
+      A numpy array of audio samples, single-channel (mono) and sampled at the
+      specified rate, in float32 format.
+    """
+    start = int(round(start_secs * self._native_sr))
+    end = int(round(end_secs * self._native_sr))
+    return _pcm_samples_to_mono_float32(
+        np.asarray(self._samples[start:end]), self._native_sr, sample_rate)
+
+
 def samples_to_wav_data(samples, sample_rate):
   """Converts floating point samples to wav data."""
   wav_io = six.BytesIO()
@@ -67,6 +67,27 @@ class AudioIoTest(tf.test.TestCase):
         wav_io.getvalue(), sample_rate=16000)
     np.testing.assert_array_equal(y, y_from_float)
 
+  def testWavFileReader(self):
+    w = wave.open(self.wav_filename, 'rb')
+    reader = audio_io.WavFileReader(self.wav_filename)
+    self.assertAlmostEqual(w.getnframes() / w.getframerate(),
+                           reader.duration_secs)
+
+    native_y = audio_io.wav_data_to_samples(self.wav_data, w.getframerate())
+    self.assertAlmostEqual(np.max(np.abs(native_y)), reader.peak(block_secs=1))
+
+    # Windows at the native rate are exact slices of the whole recording.
+    start = w.getframerate() // 2
+    end = start + w.getframerate() // 4
+    np.testing.assert_array_equal(
+        native_y[start:end],
+        reader.read(start / w.getframerate(), end / w.getframerate(),
+                    w.getframerate()))
+
+    y = reader.read(0.5, 0.75, sample_rate=16000)
+    self.assertEqual(4000, y.shape[0])
+    self.assertEqual(np.float32, y.dtype)
+
 
 if __name__ == '__main__':
   tf.test.main()
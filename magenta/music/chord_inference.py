@@ -19,6 +19,7 @@ from __future__ import division
 from __future__ import print_function
 
 import bisect
+import functools
 import itertools
 import math
 import numbers
@@ -56,8 +57,8 @@ _CHORDS = [constants.NO_CHORD] + list(
 # All key-chord pairs.
 _KEY_CHORDS = list(itertools.product(range(12), _CHORDS))
 
-# Maximum length of chord sequence to infer.
-_MAX_NUM_CHORDS = 1000
+# Cache of key-chord and transition log-likelihoods, keyed by model parameters.
+_KEY_CHORD_LOGLIK_CACHE = {}
 
 # Mapping from time signature to number of chords to infer per bar.
 _DEFAULT_TIME_SIGNATURE_CHORDS_PER_BAR = {
@@ -96,39 +97,65 @@ def _key_chord_distribution(chord_pitch_out_of_key_prob):
 def _key_chord_transition_distribution(
     key_chord_distribution, key_change_prob, chord_change_prob):
   """Transition distribution between key-chord pairs."""
-  mat = np.zeros([len(_KEY_CHORDS), len(_KEY_CHORDS)])
+  num_chords = len(_CHORDS)
 
-  for i, key_chord_1 in enumerate(_KEY_CHORDS):
-    key_1, chord_1 = key_chord_1
-    chord_index_1 = i % len(_CHORDS)
+  # Key change. Chord probability depends only on key and not previous chord.
+  key_change = (key_change_prob / 11) * key_chord_distribution
 
-    for j, key_chord_2 in enumerate(_KEY_CHORDS):
-      key_2, chord_2 = key_chord_2
-      chord_index_2 = j % len(_CHORDS)
+  # No key change, but chord change. Chord probability depends on key, but we
+  # have to redistribute the probability mass on the previous chord since we
+  # know the chord changed. Indexed by key, previous chord, and chord.
+  chord_change = (1 - key_change_prob) * (
+      chord_change_prob * (
+          key_chord_distribution[:, np.newaxis, :] +
+          key_chord_distribution[:, :, np.newaxis] / (num_chords - 1)))
 
-      if key_1 != key_2:
-        # Key change. Chord probability depends only on key and not previous
-        # chord.
-        mat[i, j] = (key_change_prob / 11)
-        mat[i, j] *= key_chord_distribution[key_2, chord_index_2]
+  # No key change and no chord change.
+  no_change = (1 - key_change_prob) * (1 - chord_change_prob)
 
-      else:
-        # No key change.
-        mat[i, j] = 1 - key_change_prob
-        if chord_1 != chord_2:
-          # Chord probability depends on key, but we have to redistribute the
-          # probability mass on the previous chord since we know the chord
-          # changed.
-          mat[i, j] *= (
-              chord_change_prob * (
-                  key_chord_distribution[key_2, chord_index_2] +
-                  key_chord_distribution[key_2, chord_index_1] / (len(_CHORDS) -
-                                                                  1)))
-        else:
-          # No chord change.
-          mat[i, j] *= 1 - chord_change_prob
+  mat = np.empty([12, num_chords, 12, num_chords])
+  mat[:] = key_change
+  for key in range(12):
+    mat[key, :, key, :] = chord_change[key]
+    mat[key, range(num_chords), key, range(num_chords)] = no_change
 
-  return mat
+  return mat.reshape([len(_KEY_CHORDS), len(_KEY_CHORDS)])
+
+
+def _key_chord_log_likelihoods(
+    key_change_prob, chord_change_prob, chord_pitch_out_of_key_prob):
+  """Log-likelihoods of chords under each key and of key-chord transitions.
+
+  These depend only on the model parameters, so are computed once for each set
+  of parameters and cached.
+
+  Args:
+    key_change_prob: Probability of a key change between two adjacent frames.
+    chord_change_prob: Probability of a chord change between two adjacent
+        frames.
+    chord_pitch_out_of_key_prob: Probability of a pitch in a chord not belonging
+        to the current key.
+
+  Returns:
+    A tuple `(key_chord_loglik, key_chord_transition_loglik)` of read-only numpy
+    arrays with shapes `[12, num_chords]` and `[num_key_chords,
+    num_key_chords]`.
+  """
+  params = (key_change_prob, chord_change_prob, chord_pitch_out_of_key_prob)
+  if params not in _KEY_CHORD_LOGLIK_CACHE:
+    key_chord_distribution = _key_chord_distribution(
+        chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
+    key_chord_transition_distribution = _key_chord_transition_distribution(
+        key_chord_distribution,
+        key_change_prob=key_change_prob,
+        chord_change_prob=chord_change_prob)
+    key_chord_loglik = np.log(key_chord_distribution)
+    key_chord_transition_loglik = np.log(key_chord_transition_distribution)
+    key_chord_loglik.setflags(write=False)
+    key_chord_transition_loglik.setflags(write=False)
+    _KEY_CHORD_LOGLIK_CACHE[params] = (
+        key_chord_loglik, key_chord_transition_loglik)
+  return _KEY_CHORD_LOGLIK_CACHE[params]
 
 
 def _chord_pitch_vectors():
@@ -199,6 +226,116 @@ def _chord_frame_log_likelihood(note_pitch_vectors, chord_note_concentration):
                                            _chord_pitch_vectors().T)
 
 
+def _dense_viterbi_step(loglik, key_chord_transition_loglik):
+  """Find the best parent of each key-chord pair by checking all pairs."""
+  num_key_chords = len(key_chord_transition_loglik)
+  mat = (np.tile(loglik[:, np.newaxis], [1, num_key_chords]) +
+         key_chord_transition_loglik)
+  parents = mat.argmax(axis=0)
+  return parents, mat[parents, range(num_key_chords)]
+
+
+def _factored_viterbi_step(loglik, key_chord_transition_loglik,
+                           max_chord_change_loglik, max_transition_loglik):
+  """Find the best parent of each key-chord pair using the transition structure.
+
+  The transition log-likelihood into a key-chord pair is the same from every
+  pair in a different key, so only the best such pairs need to be considered.
+  Within the same key, a previous chord can only be the best parent if its
+  log-likelihood is within the range of chord change log-likelihoods of the
+  best candidate. The few remaining candidates are then scored exactly as in
+  `_dense_viterbi_step`, so the result is identical (including ties, which go
+  to the lowest index).
+
+  Args:
+    loglik: Log-likelihood of the best sequence ending in each key-chord pair at
+        the previous frame.
+    key_chord_transition_loglik: Transition log-likelihood between key-chord
+        pairs.
+    max_chord_change_loglik: A numpy array with shape `[12, num_chords]`
+        containing, for each key-chord pair, the maximum transition
+        log-likelihood from a different chord in the same key.
+    max_transition_loglik: Maximum absolute value of the transition
+        log-likelihoods.
+
+  Returns:
+    A tuple `(parents, loglik)` containing the best parent of each key-chord
+    pair and the log-likelihood of the best sequence ending in that parent
+    followed by the key-chord pair.
+  """
+  num_chords = len(_CHORDS)
+  num_key_chords = len(loglik)
+  key_loglik = loglik.reshape([12, num_chords])
+  children = np.arange(num_key_chords)
+  child_keys = children // num_chords
+
+  # Rounding error bound for the sums below; candidates are pruned only when
+  # they are worse than the best by more than this.
+  eps = 4 * np.spacing(np.abs(loglik).max() + 2 * max_transition_loglik + 1)
+
+  # Candidate parents in a different key: all pairs close to the best pair in
+  # any other key.
+  key_max = key_loglik.max(axis=1)
+  top_keys = np.argsort(-key_max, kind='mergesort')[:2]
+  other_key_max = np.where(np.arange(12) == top_keys[0],
+                           key_max[top_keys[1]], key_max[top_keys[0]])
+  key_change_keys, key_change_parents = np.nonzero(
+      (loglik >= other_key_max[:, np.newaxis] - eps) &
+      (child_keys != np.arange(12)[:, np.newaxis]))
+  first_key_change_parents = key_change_parents[
+      np.searchsorted(key_change_keys, np.arange(12))]
+
+  # A lower bound on the best score for each key-chord pair, from a parent in a
+  # different key, the same pair, and the best pair in the same key.
+  chord_order = np.argsort(-key_loglik, axis=1, kind='mergesort')
+  lower_bound_parents = [
+      first_key_change_parents[child_keys],
+      children,
+      child_keys * num_chords + chord_order[child_keys, 0],
+  ]
+  best_loglik = np.max(
+      [loglik[parents] + key_chord_transition_loglik[parents, children]
+       for parents in lower_bound_parents], axis=0)
+
+  # Candidate parents in the same key: previous chords that could still reach
+  # the lower bound with the most likely chord change.
+  thresholds = (best_loglik - max_chord_change_loglik.ravel() - eps).reshape(
+      [12, num_chords])
+  sorted_key_loglik = -key_loglik[np.arange(12)[:, np.newaxis], chord_order]
+  counts = np.concatenate([
+      np.searchsorted(sorted_key_loglik[key], -thresholds[key], side='right')
+      for key in range(12)])
+  ranks = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+  chord_change_children = np.repeat(children, counts)
+  chord_change_keys = chord_change_children // num_chords
+  chord_change_parents = (chord_change_keys * num_chords +
+                          chord_order[chord_change_keys, ranks])
+
+  parents = np.concatenate([
+      children,
+      np.repeat(key_change_parents, num_chords),
+      chord_change_parents])
+  children = np.concatenate([
+      children,
+      (np.repeat(key_change_keys * num_chords, num_chords) +
+       np.tile(np.arange(num_chords), len(key_change_keys))),
+      chord_change_children])
+  scores = loglik[parents] + key_chord_transition_loglik[parents, children]
+
+  # Group the candidates by child and take the highest-scoring parent for each,
+  # breaking ties by lowest index.
+  order = np.argsort(children, kind='mergesort')
+  children, parents, scores = children[order], parents[order], scores[order]
+  starts = np.searchsorted(children, np.arange(num_key_chords))
+  best_scores = np.maximum.reduceat(scores, starts)
+  group_sizes = np.diff(np.append(starts, len(scores)))
+  is_best = scores == np.repeat(best_scores, group_sizes)
+  best_parents = np.minimum.reduceat(
+      np.where(is_best, parents, num_key_chords), starts)
+  return best_parents, best_scores
+
+
 def _key_chord_viterbi(chord_frame_loglik,
                        key_chord_loglik,
                        key_chord_transition_loglik):
@@ -206,31 +343,43 @@ def _key_chord_viterbi(chord_frame_loglik,
   num_frames, num_chords = chord_frame_loglik.shape
   num_key_chords = len(key_chord_transition_loglik)
 
-  loglik_matrix = np.zeros([num_frames, num_key_chords])
-  path_matrix = np.zeros([num_frames, num_key_chords], dtype=np.int32)
+  path_matrix = np.zeros([num_frames, num_key_chords], dtype=np.int16)
 
   # Initialize with a uniform distribution over keys.
-  for i, key_chord in enumerate(_KEY_CHORDS):
-    key, unused_chord = key_chord
-    chord_index = i % len(_CHORDS)
-    loglik_matrix[0, i] = (
-        -np.log(12) + key_chord_loglik[key, chord_index] +
-        chord_frame_loglik[0, chord_index])
+  loglik = (-np.log(12) + key_chord_loglik +
+            chord_frame_loglik[0][np.newaxis, :]).ravel()
+
+  if (np.all(np.isfinite(key_chord_loglik)) and
+      np.all(np.isfinite(key_chord_transition_loglik))):
+    # The transition structure can be used to avoid checking all pairs of
+    # key-chord pairs at each frame.
+    same_key_transition_loglik = key_chord_transition_loglik.reshape(
+        [12, num_chords, 12, num_chords])[range(12), :, range(12), :].copy()
+    same_key_transition_loglik[:, range(num_chords), range(num_chords)] = (
+        -np.inf)
+    max_chord_change_loglik = same_key_transition_loglik.max(axis=1)
+    max_transition_loglik = np.abs(key_chord_transition_loglik).max()
+    step_fn = functools.partial(
+        _factored_viterbi_step,
+        key_chord_transition_loglik=key_chord_transition_loglik,
+        max_chord_change_loglik=max_chord_change_loglik,
+        max_transition_loglik=max_transition_loglik)
+  else:
+    # With zero-probability transitions the pruning bounds are not valid, so
+    # fall back to checking all pairs.
+    step_fn = functools.partial(
+        _dense_viterbi_step,
+        key_chord_transition_loglik=key_chord_transition_loglik)
 
   for frame in range(1, num_frames):
-    # At each frame, store the log-likelihood of the best sequence ending in
-    # each key-chord pair, along with the index of the parent key-chord pair
+    # At each frame, compute the log-likelihood of the best sequence ending in
+    # each key-chord pair, and store the index of the parent key-chord pair
     # from the previous frame.
-    mat = (np.tile(loglik_matrix[frame - 1][:, np.newaxis],
-                   [1, num_key_chords]) +
-           key_chord_transition_loglik)
-    path_matrix[frame, :] = mat.argmax(axis=0)
-    loglik_matrix[frame, :] = (
-        mat[path_matrix[frame, :], range(num_key_chords)] +
-        np.tile(chord_frame_loglik[frame], 12))
+    path_matrix[frame, :], loglik = step_fn(loglik)
+    loglik += np.tile(chord_frame_loglik[frame], 12)
 
   # Reconstruct the most likely sequence of key-chord pairs.
-  path = [np.argmax(loglik_matrix[-1])]
+  path = [np.argmax(loglik)]
   for frame in range(num_frames, 1, -1):
     path.append(path_matrix[frame - 1, path[-1]])
 
@@ -259,6 +408,8 @@ class EmptySequenceError(ChordInferenceError):
 
 
 class SequenceTooLongError(ChordInferenceError):
+  # No longer raised, as chord inference time and memory are linear in the
+  # number of chords. Kept so that existing handlers still work.
   pass
 
 
@@ -307,8 +458,6 @@ def infer_chords_for_sequence(sequence,
     NonIntegerStepsPerChordError: If the number of quantized steps per chord
         is not an integer.
     EmptySequenceError: If `sequence` is empty.
-    SequenceTooLongError: If the number of chords to be inferred is too
-        large.
   """
   for ta in sequence.text_annotations:
     if ta.annotation_type == music_pb2.NoteSequence.TextAnnotation.CHORD_SYMBOL:
@@ -371,10 +520,6 @@ def infer_chords_for_sequence(sequence,
     if sequences_lib.is_quantized_sequence(sequence):
       sorted_beat_steps = [beat.quantized_step for beat in unique_sorted_beats]
 
-  if num_chords > _MAX_NUM_CHORDS:
-    raise SequenceTooLongError(
-        'NoteSequence too long for chord inference: %d frames' % num_chords)
-
   # Compute pitch vectors for each chord frame, then compute log-likelihood of
   # observing those pitch vectors under each possible chord.
   note_pitch_vectors = sequence_note_pitch_vectors(
@@ -383,16 +528,12 @@ def infer_chords_for_sequence(sequence,
   chord_frame_loglik = _chord_frame_log_likelihood(
       note_pitch_vectors, chord_note_concentration)
 
-  # Compute distribution over chords for each key, and transition distribution
-  # between key-chord pairs.
-  key_chord_distribution = _key_chord_distribution(
-      chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-  key_chord_transition_distribution = _key_chord_transition_distribution(
-      key_chord_distribution,
+  # Compute (cached) log-likelihood of chords under each key, and transition
+  # log-likelihood between key-chord pairs.
+  key_chord_loglik, key_chord_transition_loglik = _key_chord_log_likelihoods(
       key_change_prob=key_change_prob,
-      chord_change_prob=chord_change_prob)
-  key_chord_loglik = np.log(key_chord_distribution)
-  key_chord_transition_loglik = np.log(key_chord_transition_distribution)
+      chord_change_prob=chord_change_prob,
+      chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
 
   key_chords = _key_chord_viterbi(
       chord_frame_loglik, key_chord_loglik, key_chord_transition_loglik)
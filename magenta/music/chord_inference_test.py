@@ -22,6 +22,7 @@ from magenta.music import chord_inference
 from magenta.music import sequences_lib
 from magenta.music import testing_lib
 from magenta.protobuf import music_pb2
+import numpy as np
 import tensorflow as tf
 
 CHORD_SYMBOL = music_pb2.NoteSequence.TextAnnotation.CHORD_SYMBOL
@@ -131,6 +132,55 @@ class ChordInferenceTest(tf.test.TestCase):
 
     self.assertEqual(expected_chords, chords)
 
+  def testInferChordsForLongSequence(self):
+    sequence = music_pb2.NoteSequence()
+    chord_notes = [[60, 64, 67], [62, 65, 69], [60, 65, 69], [59, 62, 67]]
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(pitch, 100, float(i), i + 1.0)
+         for i in range(1200) for pitch in chord_notes[i % 4]])
+    quantized_sequence = sequences_lib.quantize_note_sequence(
+        sequence, steps_per_quarter=4)
+    chord_inference.infer_chords_for_sequence(
+        quantized_sequence, chords_per_bar=2)
+
+    chords = [ta.text for ta in quantized_sequence.text_annotations]
+    self.assertEqual(['C', 'Dm', 'F', 'G'] * 300, chords)
+
+  def testKeyChordViterbiMatchesDense(self):
+    key_chord_loglik, key_chord_transition_loglik = (
+        chord_inference._key_chord_log_likelihoods(
+            key_change_prob=0.01, chord_change_prob=0.5,
+            chord_pitch_out_of_key_prob=0.01))
+    num_chords = key_chord_loglik.shape[1]
+
+    def dense_key_chord_viterbi(chord_frame_loglik):
+      loglik = (-np.log(12) + key_chord_loglik +
+                chord_frame_loglik[0]).ravel()
+      path_matrix = []
+      for frame_loglik in chord_frame_loglik[1:]:
+        parents, loglik = chord_inference._dense_viterbi_step(
+            loglik, key_chord_transition_loglik)
+        loglik += np.tile(frame_loglik, 12)
+        path_matrix.append(parents)
+      path = [np.argmax(loglik)]
+      for parents in path_matrix[::-1]:
+        path.append(parents[path[-1]])
+      return [(index // num_chords, chord_inference._CHORDS[index % num_chords])
+              for index in path[::-1]]
+
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+      # Frames with few distinct pitch classes (or none) produce many ties.
+      note_pitch_vectors = (rng.rand(20, 12) < 0.2).astype(float)
+      chord_frame_loglik = chord_inference._chord_frame_log_likelihood(
+          note_pitch_vectors, chord_note_concentration=10.0)
+      self.assertEqual(
+          dense_key_chord_viterbi(chord_frame_loglik),
+          chord_inference._key_chord_viterbi(
+              chord_frame_loglik, key_chord_loglik,
+              key_chord_transition_loglik))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -62,6 +62,44 @@ DEFAULT_STEPS_PER_BAR = constants.DEFAULT_STEPS_PER_BAR
 DEFAULT_LOOKBACK_DISTANCES = [DEFAULT_STEPS_PER_BAR, DEFAULT_STEPS_PER_BAR * 2]
 
 
+def sample_categorical(probabilities, temperature=1.0):
+  """Samples a class index from each row of a batch of probability vectors.
+
+  Every row is sampled with a single NumPy call: the cumulative sum of each row
+  is compared against one uniform draw per row, scaled by the row total.
+
+  Args:
+    probabilities: An array-like of shape [..., num_classes] containing
+        non-negative (not necessarily normalized) class probabilities.
+    temperature: A positive float. Probabilities are raised to the power of
+        1 / `temperature` before sampling, which is equivalent to dividing the
+        logits by `temperature`. Greater than 1.0 makes samples more random,
+        less than 1.0 makes them less random.
+
+  Returns:
+    An int64 NumPy array of shape [...] containing the sampled class indices.
+
+  Raises:
+    ValueError: If `temperature` is not positive.
+  """
+  if temperature <= 0.0:
+    raise ValueError('temperature must be positive, got %s' % temperature)
+  probabilities = np.asarray(probabilities, dtype=np.float64)
+  if temperature != 1.0:
+    probabilities = probabilities ** (1.0 / temperature)
+  cdf = np.cumsum(probabilities, axis=-1)
+  thresholds = np.random.random(cdf.shape[:-1] + (1,)) * cdf[..., -1:]
+  indices = np.sum(cdf <= thresholds, axis=-1)
+  return np.minimum(indices, cdf.shape[-1] - 1).astype(np.int64)
+
+
+def _positions_array(events, positions):
+  """Returns `positions` as an int64 array, defaulting to every position."""
+  if positions is None:
+    return np.arange(len(events), dtype=np.int64)
+  return np.asarray(positions, dtype=np.int64).reshape([-1])
+
+
 class OneHotEncoding(object):
   """An interface for specifying a one-hot encoding of individual events."""
   __metaclass__ = abc.ABCMeta
@@ -108,6 +146,22 @@ class OneHotEncoding(object):
     """
     pass
 
+  def encode_events(self, events):
+    """Convert from a sequence of event values to an array of encoding integers.
+
+    Subclasses that can encode many events at once more efficiently than one at
+    a time should override this method.
+
+    Args:
+      events: A list-like sequence of event values to encode.
+
+    Returns:
+      A 1-D int64 NumPy array with the encoding of each event, each in range
+      [0, self.num_classes).
+    """
+    return np.array([self.encode_event(event) for event in events],
+                    dtype=np.int64)
+
   def event_to_num_steps(self, unused_event):
     """Returns the number of time steps corresponding to an event value.
 
@@ -238,6 +292,58 @@ class EventSequenceEncoderDecoder(object):
     """
     return len(labels)
 
+  def events_to_input_array(self, events, positions=None):
+    """Returns the input vectors for many positions as a NumPy array.
+
+    The default implementation calls `events_to_input` once per position.
+    Subclasses should override this method with a vectorized implementation
+    when possible. Overrides must return the same values `events_to_input`
+    would.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      A NumPy array of shape [len(positions), self.input_size].
+    """
+    positions = _positions_array(events, positions)
+    inputs = [self.events_to_input(events, position)
+              for position in positions.tolist()]
+    if not inputs:
+      return np.zeros([0, self.input_size], dtype=np.float32)
+    return np.array(inputs)
+
+  def events_to_label_array(self, events, positions=None):
+    """Returns the labels for many positions as a NumPy array.
+
+    The default implementation calls `events_to_label` once per position.
+    Subclasses should override this method with a vectorized implementation
+    when possible. Overrides must return the same values `events_to_label`
+    would.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      An integer NumPy array whose first dimension has size `len(positions)`.
+    """
+    positions = _positions_array(events, positions)
+    labels = [self.events_to_label(events, position)
+              for position in positions.tolist()]
+    if not labels:
+      return np.zeros([0], dtype=np.int64)
+    return np.array(labels, dtype=np.int64)
+
+  def _encode_arrays(self, events):
+    """Returns (inputs, labels) NumPy arrays for a single event sequence."""
+    positions = np.arange(max(len(events) - 1, 0), dtype=np.int64)
+    return (self.events_to_input_array(events, positions),
+            self.events_to_label_array(events, positions + 1))
+
   def encode(self, events):
     """Returns a SequenceExample for the given event sequence.
 
@@ -247,12 +353,41 @@ class EventSequenceEncoderDecoder(object):
     Returns:
       A tf.train.SequenceExample containing inputs and labels.
     """
-    inputs = []
-    labels = []
-    for i in range(len(events) - 1):
-      inputs.append(self.events_to_input(events, i))
-      labels.append(self.events_to_label(events, i + 1))
-    return sequence_example_lib.make_sequence_example(inputs, labels)
+    inputs, labels = self._encode_arrays(events)
+    return sequence_example_lib.make_sequence_example(
+        inputs.tolist(), labels.tolist())
+
+  def encode_batch(self, event_sequences):
+    """Returns padded input and label arrays for a batch of event sequences.
+
+    This is the NumPy counterpart of calling `encode` on each event sequence.
+    Sequences shorter than the longest one are padded with zeros, the same way
+    `sequence_example_lib.get_padded_batch` pads them.
+
+    Args:
+      event_sequences: A list of list-like event sequences.
+
+    Returns:
+      inputs: A float32 NumPy array of shape
+          [len(event_sequences), max_length, self.input_size], where
+          max_length is one less than the length of the longest event sequence.
+      labels: An int64 NumPy array whose first two dimensions have shape
+          [len(event_sequences), max_length].
+      lengths: An int32 NumPy array of shape [len(event_sequences)] containing
+          the unpadded length of each row of `inputs` and `labels`.
+    """
+    encoded = [self._encode_arrays(events) for events in event_sequences]
+    lengths = np.array([len(labels) for _, labels in encoded], dtype=np.int32)
+    max_length = lengths.max() if len(lengths) else 0
+    label_shape = encoded[0][1].shape[1:] if encoded else ()
+    inputs_batch = np.zeros(
+        [len(encoded), max_length, self.input_size], dtype=np.float32)
+    labels_batch = np.zeros(
+        (len(encoded), max_length) + label_shape, dtype=np.int64)
+    for i, (inputs, labels) in enumerate(encoded):
+      inputs_batch[i, :len(inputs)] = inputs
+      labels_batch[i, :len(labels)] = labels
+    return inputs_batch, labels_batch, lengths
 
   def get_inputs_batch(self, event_sequences, full_length=False):
     """Returns an inputs batch for the given event sequences.
@@ -274,45 +409,47 @@ class EventSequenceEncoderDecoder(object):
     """
     inputs_batch = []
     for events in event_sequences:
-      inputs = []
       if full_length:
-        for i in range(len(events)):
-          inputs.append(self.events_to_input(events, i))
+        inputs = self.events_to_input_array(events).tolist()
       else:
-        inputs.append(self.events_to_input(events, len(events) - 1))
+        inputs = [self.events_to_input(events, len(events) - 1)]
       inputs_batch.append(inputs)
     return inputs_batch
 
-  def extend_event_sequences(self, event_sequences, softmax):
+  def extend_event_sequences(self, event_sequences, softmax, temperature=1.0):
     """Extends the event sequences by sampling the softmax probabilities.
 
+    The next class for every event sequence is sampled at once with
+    `sample_categorical`.
+
     Args:
       event_sequences: A list of EventSequence objects.
       softmax: A list of softmax probability vectors. The list of softmaxes
-          should be the same length as the list of event sequences.
+          should be the same length as the list of event sequences. Extra
+          entries past the number of event sequences (e.g. batch padding) are
+          ignored.
+      temperature: An optional temperature to apply when sampling. Leave as
+          1.0 if the softmax already has temperature applied.
 
     Returns:
       A Python list of chosen class indices, one for each event sequence.
     """
-    chosen_classes = []
-    for i in range(len(event_sequences)):
-      if not isinstance(softmax[0][0][0], numbers.Number):
-        # In this case, softmax is a list of several sub-softmaxes, each
-        # potentially with a different size.
-        # shape: [[beam_size, event_num, softmax_size]]
-        chosen_class = []
-        for sub_softmax in softmax:
-          num_classes = len(sub_softmax[0][0])
-          chosen_class.append(
-              np.random.choice(num_classes, p=sub_softmax[i][-1]))
-      else:
-        # In this case, softmax is just one softmax.
-        # shape: [beam_size, event_num, softmax_size]
-        num_classes = len(softmax[0][0])
-        chosen_class = np.random.choice(num_classes, p=softmax[i][-1])
-      event = self.class_index_to_event(chosen_class, event_sequences[i])
-      event_sequences[i].append(event)
-      chosen_classes.append(chosen_class)
+    num_seqs = len(event_sequences)
+    if not isinstance(softmax[0][0][0], numbers.Number):
+      # In this case, softmax is a list of several sub-softmaxes, each
+      # potentially with a different size.
+      # shape: [[beam_size, event_num, softmax_size]]
+      chosen_classes = np.stack(
+          [sample_categorical(np.asarray(sub_softmax)[:num_seqs, -1],
+                              temperature)
+           for sub_softmax in softmax], axis=1).tolist()
+    else:
+      # In this case, softmax is just one softmax.
+      # shape: [beam_size, event_num, softmax_size]
+      chosen_classes = sample_categorical(
+          np.asarray(softmax)[:num_seqs, -1], temperature).tolist()
+    for events, chosen_class in zip(event_sequences, chosen_classes):
+      events.append(self.class_index_to_event(chosen_class, events))
     return chosen_classes
 
   def evaluate_log_likelihood(self, event_sequences, softmax):
@@ -400,6 +537,22 @@ class OneHotEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
     input_[self._one_hot_encoding.encode_event(events[position])] = 1.0
     return input_
 
+  def events_to_input_array(self, events, positions=None):
+    """Returns one-hot input vectors for many positions as a NumPy array.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      A float32 NumPy array of shape [len(positions), self.input_size].
+    """
+    indices = self.events_to_label_array(events, positions)
+    inputs = np.zeros([len(indices), self.input_size], dtype=np.float32)
+    inputs[np.arange(len(indices)), indices] = 1.0
+    return inputs
+
   def events_to_label(self, events, position):
     """Returns the label for the given position in the event sequence.
 
@@ -415,6 +568,23 @@ class OneHotEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
     """
     return self._one_hot_encoding.encode_event(events[position])
 
+  def events_to_label_array(self, events, positions=None):
+    """Returns the labels for many positions as a NumPy array.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      An int64 NumPy array of shape [len(positions)].
+    """
+    if positions is None:
+      return self._one_hot_encoding.encode_events(events)
+    positions = _positions_array(events, positions)
+    return self._one_hot_encoding.encode_events(
+        [events[position] for position in positions.tolist()])
+
   def class_index_to_event(self, class_index, events):
     """Returns the event for the given class index.
 
@@ -471,6 +641,19 @@ class OneHotIndexEventSequenceEncoderDecoder(OneHotEventSequenceEncoderDecoder):
     """
     return [self._one_hot_encoding.encode_event(events[position])]
 
+  def events_to_input_array(self, events, positions=None):
+    """Returns the one-hot indices for many positions as a NumPy array.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      An int64 NumPy array of shape [len(positions), 1].
+    """
+    return self.events_to_label_array(events, positions)[:, np.newaxis]
+
 
 class LookbackEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
   """An EventSequenceEncoderDecoder that encodes repeated events and meter."""
@@ -577,6 +760,87 @@ class LookbackEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
 
     return input_
 
+  def _lookback_repeats(self, events, positions):
+    """Returns whether each position repeats the event at each lookback.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A 1-D int64 NumPy array of event positions.
+
+    Returns:
+      A boolean NumPy array of shape [len(positions), num_lookbacks] that is
+      True where the event at a position equals the event one lookback
+      distance earlier. Events must be hashable.
+    """
+    lookback_positions = (
+        positions[:, np.newaxis] -
+        np.array(self._lookback_distances, dtype=np.int64)[np.newaxis, :])
+    valid = lookback_positions >= 0
+
+    # Give each distinct event an integer id so the comparisons can be done
+    # with array operations.
+    needed = np.unique(np.concatenate([positions, lookback_positions[valid]]))
+    event_ids = {}
+    ids = np.zeros(len(events), dtype=np.int64)
+    ids[needed] = [event_ids.setdefault(events[i], len(event_ids))
+                   for i in needed.tolist()]
+
+    return valid & (ids[positions][:, np.newaxis] ==
+                    ids[np.maximum(lookback_positions, 0)])
+
+  def events_to_input_array(self, events, positions=None):
+    """Returns the input vectors for many positions as a NumPy array.
+
+    Each event is encoded at most once, and the one-hot, binary counter and
+    repeat sections of all input vectors are filled in with array operations.
+    See `events_to_input` for the layout of each input vector.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      A float32 NumPy array of shape [len(positions), self.input_size].
+    """
+    positions = _positions_array(events, positions)
+    num_classes = self._one_hot_encoding.num_classes
+    rows = np.arange(len(positions))
+    lookback_positions = [positions - lookback_distance + 1
+                          for lookback_distance in self._lookback_distances]
+
+    # Encode only the events that are needed, each of them once.
+    needed = np.unique(np.concatenate(
+        [positions] + [lp[lp >= 0] for lp in lookback_positions]))
+    encodings = np.zeros(len(events), dtype=np.int64)
+    encodings[needed] = self._one_hot_encoding.encode_events(
+        [events[i] for i in needed.tolist()])
+
+    inputs = np.zeros([len(positions), self.input_size], dtype=np.float32)
+    offset = 0
+
+    # Last event.
+    inputs[rows, encodings[positions]] = 1.0
+    offset += num_classes
+
+    # Next event if repeating N positions ago.
+    for lp in lookback_positions:
+      indices = np.where(lp >= 0, encodings[np.maximum(lp, 0)],
+                         self.default_event_label)
+      inputs[rows, offset + indices] = 1.0
+      offset += num_classes
+
+    # Binary time counter giving the metric location of the *next* event.
+    counters = positions + 1
+    for i in range(self._binary_counter_bits):
+      inputs[:, offset] = np.where((counters >> i) % 2, 1.0, -1.0)
+      offset += 1
+
+    # Last event is repeating N bars ago.
+    inputs[:, offset:] = self._lookback_repeats(events, positions)
+
+    return inputs
+
   def events_to_label(self, events, position):
     """Returns the label for the given position in the event sequence.
 
@@ -621,6 +885,39 @@ class LookbackEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
     # specific event.
     return self._one_hot_encoding.encode_event(events[position])
 
+  def events_to_label_array(self, events, positions=None):
+    """Returns the labels for many positions as a NumPy array.
+
+    See `events_to_label` for the meaning of each label.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer event positions. If None, all
+          positions in the sequence are used.
+
+    Returns:
+      An int64 NumPy array of shape [len(positions)].
+    """
+    positions = _positions_array(events, positions)
+    num_classes = self._one_hot_encoding.num_classes
+    labels = self._one_hot_encoding.encode_events(
+        [events[position] for position in positions.tolist()])
+
+    # Later (more distant) lookbacks take precedence.
+    repeats = self._lookback_repeats(events, positions)
+    for i in range(len(self._lookback_distances)):
+      labels[repeats[:, i]] = num_classes + i
+
+    if self._lookback_distances:
+      default_event = self._one_hot_encoding.default_event
+      is_default = np.array(
+          [position < self._lookback_distances[-1] and
+           events[position] == default_event
+           for position in positions.tolist()], dtype=bool)
+      labels[is_default] = num_classes + len(self._lookback_distances) - 1
+
+    return labels
+
   def class_index_to_event(self, class_index, events):
     """Returns the event for the given class index.
 
@@ -815,12 +1112,16 @@ class ConditionalEventSequenceEncoderDecoder(object):
                        '(%d control events but %d target events)' % (
                            len(control_events), len(target_events)))
 
-    inputs = []
-    labels = []
-    for i in range(len(target_events) - 1):
-      inputs.append(self.events_to_input(control_events, target_events, i))
-      labels.append(self.events_to_label(target_events, i + 1))
-    return sequence_example_lib.make_sequence_example(inputs, labels)
+    positions = np.arange(max(len(target_events) - 1, 0), dtype=np.int64)
+    control_inputs = self._control_encoder_decoder.events_to_input_array(
+        control_events, positions + 1)
+    target_inputs = self._target_encoder_decoder.events_to_input_array(
+        target_events, positions)
+    labels = self._target_encoder_decoder.events_to_label_array(
+        target_events, positions + 1)
+    inputs = [control_input + target_input for control_input, target_input
+              in zip(control_inputs.tolist(), target_inputs.tolist())]
+    return sequence_example_lib.make_sequence_example(inputs, labels.tolist())
 
   def get_inputs_batch(self, control_event_sequences, target_event_sequences,
                        full_length=False):
@@ -872,19 +1173,22 @@ class ConditionalEventSequenceEncoderDecoder(object):
       inputs_batch.append(inputs)
     return inputs_batch
 
-  def extend_event_sequences(self, target_event_sequences, softmax):
+  def extend_event_sequences(self, target_event_sequences, softmax,
+                             temperature=1.0):
     """Extends the event sequences by sampling the softmax probabilities.
 
     Args:
       target_event_sequences: A list of target EventSequence objects.
       softmax: A list of softmax probability vectors. The list of softmaxes
           should be the same length as the list of event sequences.
+      temperature: An optional temperature to apply when sampling. Leave as
+          1.0 if the softmax already has temperature applied.
 
     Returns:
       A Python list of chosen class indices, one for each target event sequence.
     """
     return self._target_encoder_decoder.extend_event_sequences(
-        target_event_sequences, softmax)
+        target_event_sequences, softmax, temperature)
 
   def evaluate_log_likelihood(self, target_event_sequences, softmax):
     """Evaluate the log likelihood of multiple target event sequences.
@@ -25,6 +25,37 @@ import numpy as np
 import tensorflow as tf
 
 
+class SampleCategoricalTest(tf.test.TestCase):
+
+  def testDeterministic(self):
+    probabilities = [[0.0, 0.0, 1.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+    self.assertAllEqual(
+        [2, 0, 1], encoder_decoder.sample_categorical(probabilities))
+    self.assertAllEqual(
+        [2, 0, 1],
+        encoder_decoder.sample_categorical(probabilities, temperature=2.0))
+
+  def testDistribution(self):
+    np.random.seed(0)
+    probabilities = np.tile([[0.2, 0.0, 0.5, 0.3]], [20000, 1])
+    samples = encoder_decoder.sample_categorical(probabilities)
+    self.assertEqual((20000,), samples.shape)
+    self.assertAllClose([0.2, 0.0, 0.5, 0.3],
+                        np.bincount(samples, minlength=4) / 20000.0,
+                        atol=0.02)
+
+  def testTemperature(self):
+    np.random.seed(0)
+    probabilities = np.tile([[0.25, 0.75]], [20000, 1])
+    samples = encoder_decoder.sample_categorical(
+        probabilities, temperature=0.5)
+    # Squaring and renormalizing gives [0.1, 0.9].
+    self.assertAllClose([0.1, 0.9], np.bincount(samples) / 20000.0, atol=0.02)
+
+    with self.assertRaises(ValueError):
+      encoder_decoder.sample_categorical(probabilities, temperature=0.0)
+
+
 class OneHotEventSequenceEncoderDecoderTest(tf.test.TestCase):
 
   def setUp(self):
@@ -53,6 +84,22 @@ class OneHotEventSequenceEncoderDecoderTest(tf.test.TestCase):
     self.assertEqual(2, self.enc.events_to_label(events, 3))
     self.assertEqual(0, self.enc.events_to_label(events, 4))
 
+  def testEventsToInputArray(self):
+    events = [0, 1, 0, 2, 0]
+    self.assertAllEqual(
+        [self.enc.events_to_input(events, i) for i in range(5)],
+        self.enc.events_to_input_array(events))
+    self.assertAllEqual(
+        [self.enc.events_to_input(events, 3)],
+        self.enc.events_to_input_array(events, [3]))
+
+  def testEventsToLabelArray(self):
+    events = [0, 1, 0, 2, 0]
+    self.assertAllEqual(
+        [0, 1, 0, 2, 0], self.enc.events_to_label_array(events))
+    self.assertAllEqual(
+        [2, 0], self.enc.events_to_label_array(events, [3, 4]))
+
   def testClassIndexToEvent(self):
     events = [0, 1, 0, 2, 0]
     self.assertEqual(0, self.enc.class_index_to_event(0, events))
@@ -75,6 +122,16 @@ class OneHotEventSequenceEncoderDecoderTest(tf.test.TestCase):
         expected_inputs, expected_labels)
     self.assertEqual(sequence_example, expected_sequence_example)
 
+  def testEncodeBatch(self):
+    event_sequences = [[0, 1, 0, 2, 0], [0, 2]]
+    inputs, labels, lengths = self.enc.encode_batch(event_sequences)
+    self.assertAllEqual(
+        [[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]],
+         [[1.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]],
+        inputs)
+    self.assertAllEqual([[1, 0, 2, 0], [2, 0, 0, 0]], labels)
+    self.assertAllEqual([4, 1], lengths)
+
   def testGetInputsBatch(self):
     event_sequences = [[0, 1, 0, 2, 0], [0, 1, 2]]
     expected_inputs_1 = [[1.0, 0.0, 0.0],
@@ -234,6 +291,33 @@ class LookbackEventSequenceEncoderDecoderTest(tf.test.TestCase):
     labels = [0, 1, 3, 2, 4]
     self.assertEqual(5, self.enc.labels_to_num_steps(labels))
 
+  def testEventsToInputArray(self):
+    events = [0, 1, 0, 2, 0]
+    self.assertAllEqual(
+        [self.enc.events_to_input(events, i) for i in range(5)],
+        self.enc.events_to_input_array(events))
+    self.assertAllEqual(
+        [self.enc.events_to_input(events, 4),
+         self.enc.events_to_input(events, 1)],
+        self.enc.events_to_input_array(events, [4, 1]))
+
+  def testEventsToLabelArray(self):
+    events = [0, 1, 0, 2, 0]
+    self.assertAllEqual(
+        [4, 1, 4, 2, 4], self.enc.events_to_label_array(events))
+    self.assertAllEqual(
+        [2, 4], self.enc.events_to_label_array(events, [3, 4]))
+
+  def testEncodeMatchesEventsToInput(self):
+    events = [0, 1, 0, 2, 0, 0, 1, 1, 2]
+    expected_inputs = [self.enc.events_to_input(events, i)
+                       for i in range(len(events) - 1)]
+    expected_labels = [self.enc.events_to_label(events, i)
+                       for i in range(1, len(events))]
+    expected_sequence_example = sequence_example_lib.make_sequence_example(
+        expected_inputs, expected_labels)
+    self.assertProtoEquals(expected_sequence_example, self.enc.encode(events))
+
   def testEmptyLookback(self):
     enc = encoder_decoder.LookbackEventSequenceEncoderDecoder(
         testing_lib.TrivialOneHotEncoding(3), [], 2)
@@ -32,6 +32,7 @@ import collections
 from magenta.music import constants
 from magenta.music import encoder_decoder
 from magenta.music import melodies_lib
+import numpy as np
 
 NUM_SPECIAL_MELODY_EVENTS = constants.NUM_SPECIAL_MELODY_EVENTS
 MELODY_NOTE_OFF = constants.MELODY_NOTE_OFF
@@ -113,6 +114,30 @@ class MelodyOneHotEncoding(encoder_decoder.OneHotEncoding):
       return event + NUM_SPECIAL_MELODY_EVENTS
     return event - self._min_note + NUM_SPECIAL_MELODY_EVENTS
 
+  def encode_events(self, events):
+    """Collapses many melody event values into zero-based indices at once.
+
+    Args:
+      events: A list-like sequence of Melody event values.
+
+    Returns:
+      A 1-D int64 NumPy array with the same values `encode_event` returns for
+      each event.
+
+    Raises:
+      ValueError: If any event is a MIDI note not between self._min_note and
+          self._max_note, or an invalid special event value.
+    """
+    events = np.asarray(events, dtype=np.int64).reshape([-1])
+    invalid = ((events < -NUM_SPECIAL_MELODY_EVENTS) |
+               ((events >= 0) & (events < self._min_note)) |
+               (events >= self._max_note))
+    if np.any(invalid):
+      # Raise the same error the scalar version does for the first bad event.
+      self.encode_event(int(events[np.argmax(invalid)]))
+    return np.where(events < 0, events,
+                    events - self._min_note) + NUM_SPECIAL_MELODY_EVENTS
+
   def decode_event(self, index):
     """Expands a zero-based index value to its equivalent melody event value.
 
@@ -18,7 +18,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import bisect
+import math
 
 from magenta.music import constants
 from magenta.music import sequences_lib
@@ -28,8 +28,10 @@ import scipy
 REST = -1
 MELODY_VELOCITY = 127
 
-# Maximum number of melody frames to infer.
-MAX_NUM_FRAMES = 10000
+# Default memory budget in bytes for the Viterbi backpointers and
+# log-likelihoods. Longer sequences are processed in chunks, recomputing each
+# chunk during backtracking.
+DEFAULT_MAX_VITERBI_BYTES = 2 ** 28
 
 
 def _melody_transition_distribution(rest_prob, interval_prob_fn):
@@ -110,31 +112,34 @@ def sequence_note_frames(sequence):
            if not note.is_drum
            and note.program not in constants.UNPITCHED_PROGRAMS]
 
-  onset_times = [note.start_time for note in notes]
-  offset_times = [note.end_time for note in notes]
-  event_times = set(onset_times + offset_times)
+  onset_times = np.array([note.start_time for note in notes], dtype=float)
+  offset_times = np.array([note.end_time for note in notes], dtype=float)
+  note_pitches = np.array([note.pitch for note in notes], dtype=int)
 
-  event_times.discard(0.0)
-  event_times.discard(sequence.total_time)
-
-  event_times = sorted(event_times)
+  event_times = np.unique(np.concatenate([onset_times, offset_times]))
+  event_times = event_times[
+      (event_times != 0.0) & (event_times != sequence.total_time)]
   num_frames = len(event_times) + 1
 
-  pitches = sorted(set(note.pitch for note in notes))
-  pitch_map = dict((p, i) for i, p in enumerate(pitches))
+  pitches = np.unique(note_pitches)
   num_pitches = len(pitches)
+  pitch_indices = np.searchsorted(pitches, note_pitches)
 
-  has_onsets = np.zeros([num_frames, num_pitches], dtype=bool)
-  has_notes = np.zeros([num_frames, num_pitches], dtype=bool)
+  start_frames = np.searchsorted(event_times, onset_times, side='right')
+  end_frames = np.searchsorted(event_times, offset_times, side='left')
 
-  for note in notes:
-    start_frame = bisect.bisect_right(event_times, note.start_time)
-    end_frame = bisect.bisect_left(event_times, note.end_time)
+  has_onsets = np.zeros([num_frames, num_pitches], dtype=bool)
+  has_onsets[start_frames, pitch_indices] = True
 
-    has_onsets[start_frame, pitch_map[note.pitch]] = True
-    has_notes[start_frame:end_frame+1, pitch_map[note.pitch]] = True
+  # Count the notes present in each frame for each pitch by accumulating
+  # increments at note starts and decrements just past note ends.
+  note_counts = np.zeros([num_frames + 1, num_pitches], dtype=np.int32)
+  np.add.at(note_counts, (start_frames, pitch_indices), 1)
+  np.add.at(note_counts, (np.maximum(end_frames + 1, start_frames),
+                          pitch_indices), -1)
+  has_notes = np.cumsum(note_counts, axis=0)[:-1] > 0
 
-  return pitches, has_onsets, has_notes, event_times
+  return pitches.tolist(), has_onsets, has_notes, event_times.tolist()
 
 
 def _melody_frame_log_likelihood(pitches, has_onsets, has_notes, durations,
@@ -190,34 +195,106 @@ def _melody_frame_log_likelihood(pitches, has_onsets, has_notes, durations,
   return mat
 
 
-def _melody_viterbi(pitches, melody_frame_loglik, melody_transition_loglik):
-  """Use the Viterbi algorithm to infer a sequence of melody events."""
-  num_frames, num_melody_events = melody_frame_loglik.shape
+def _melody_viterbi_forward(loglik, melody_frame_loglik,
+                            melody_transition_loglik, path_matrix):
+  """Run the Viterbi recursion forward over a chunk of frames.
+
+  Args:
+    loglik: Log-likelihood of the best sequence ending in each melody event at
+        the frame preceding the chunk.
+    melody_frame_loglik: Log-likelihood of each frame in the chunk given each
+        melody event.
+    melody_transition_loglik: Transition log-likelihood between melody events.
+    path_matrix: A numpy array in which to store the index of the best parent
+        melody event for each frame in the chunk and each melody event.
+
+  Returns:
+    The log-likelihood of the best sequence ending in each melody event at the
+    last frame of the chunk.
+  """
+  num_melody_events = len(melody_transition_loglik)
+  for i, frame_loglik in enumerate(melody_frame_loglik):
+    mat = loglik[:, np.newaxis] + melody_transition_loglik
+    path_matrix[i, :] = mat.argmax(axis=0)
+    loglik = mat[path_matrix[i, :], range(num_melody_events)] + frame_loglik
+  return loglik
+
+
+def _melody_viterbi(pitches, num_frames, melody_frame_loglik_fn,
+                    melody_transition_loglik, max_bytes):
+  """Use the Viterbi algorithm to infer a sequence of melody events.
+
+  Frames are processed in chunks, with only the backpointers for a single chunk
+  kept in memory. If all frames do not fit in `max_bytes`, the log-likelihoods
+  at the start of each chunk are stored as checkpoints on the forward pass, and
+  each chunk is recomputed from its checkpoint while backtracking. This uses
+  memory proportional to the square root of the number of frames, at the cost
+  of running the forward pass twice.
+
+  Args:
+    pitches: A list of MIDI pitches present in the sequence, in ascending order.
+    num_frames: The number of frames.
+    melody_frame_loglik_fn: Function that takes start and end frame indices and
+        returns the log-likelihood of each frame in that range given each melody
+        event.
+    melody_transition_loglik: Transition log-likelihood between melody events.
+    max_bytes: Approximate maximum memory in bytes to use for backpointers and
+        log-likelihoods.
+
+  Returns:
+    A list of melody events, one per frame, each either REST or a (pitch,
+    is-onset) tuple.
+
+  Raises:
+    MelodyInferenceError: If the frames cannot be processed within
+        `max_bytes`.
+  """
+  num_melody_events = len(melody_transition_loglik)
   assert num_melody_events == 2 * len(pitches) + 1
 
-  loglik_matrix = np.zeros([num_frames, num_melody_events])
-  path_matrix = np.zeros([num_frames, num_melody_events], dtype=np.int32)
+  # Backpointer (int16) and frame log-likelihood (float64) bytes per frame,
+  # and checkpoint bytes per chunk.
+  frame_bytes = num_melody_events * (2 + 8)
+  checkpoint_bytes = num_melody_events * 8
+  if num_frames * frame_bytes <= max_bytes:
+    chunk_size = num_frames
+  else:
+    chunk_size = int(math.ceil(math.sqrt(num_frames)))
+    num_chunks = int(math.ceil(num_frames / chunk_size))
+    if chunk_size * frame_bytes + num_chunks * checkpoint_bytes > max_bytes:
+      raise MelodyInferenceError(
+          'Too many frames for melody inference within %d bytes: %d' %
+          (max_bytes, num_frames))
+  chunk_starts = list(range(0, num_frames, chunk_size))
+
+  path_matrix = np.zeros([chunk_size, num_melody_events], dtype=np.int16)
 
   # Assume the very first frame follows a rest.
-  loglik_matrix[0, :] = (
-      melody_transition_loglik[0, :] + melody_frame_loglik[0, :])
-
-  for frame in range(1, num_frames):
-    # At each frame, store the log-likelihood of the best sequence ending in
-    # each melody event, along with the index of the parent melody event from
-    # the previous frame.
-    mat = (np.tile(loglik_matrix[frame - 1][:, np.newaxis],
-                   [1, num_melody_events]) +
-           melody_transition_loglik)
-    path_matrix[frame, :] = mat.argmax(axis=0)
-    loglik_matrix[frame, :] = (
-        mat[path_matrix[frame, :], range(num_melody_events)] +
-        melody_frame_loglik[frame])
-
-  # Reconstruct the most likely sequence of melody events.
-  path = [np.argmax(loglik_matrix[-1])]
-  for frame in range(num_frames, 1, -1):
-    path.append(path_matrix[frame - 1, path[-1]])
+  first_frame_loglik = melody_frame_loglik_fn(0, 1)[0]
+  loglik = melody_transition_loglik[0, :] + first_frame_loglik
+
+  # Forward pass, storing the log-likelihoods preceding each chunk. The first
+  # frame has no parent, so the first chunk starts at the second frame.
+  checkpoints = []
+  for start in chunk_starts:
+    end = min(start + chunk_size, num_frames)
+    checkpoints.append(loglik)
+    loglik = _melody_viterbi_forward(
+        loglik, melody_frame_loglik_fn(max(start, 1), end),
+        melody_transition_loglik, path_matrix[max(start, 1) - start:])
+
+  # Reconstruct the most likely sequence of melody events, recomputing the
+  # backpointers for each chunk (except the last, which is still in memory).
+  path = [np.argmax(loglik)]
+  for i in range(len(chunk_starts) - 1, -1, -1):
+    start = chunk_starts[i]
+    end = min(start + chunk_size, num_frames)
+    if i < len(chunk_starts) - 1:
+      _melody_viterbi_forward(
+          checkpoints[i], melody_frame_loglik_fn(max(start, 1), end),
+          melody_transition_loglik, path_matrix[max(start, 1) - start:])
+    for frame in range(end - 1, max(start, 1) - 1, -1):
+      path.append(path_matrix[frame - start, path[-1]])
 
   # Mapping from melody event index to rest or (pitch, is-onset) tuple.
   def index_to_event(i):
@@ -242,7 +319,8 @@ def infer_melody_for_sequence(sequence,
                               rest_prob=0.1,
                               instantaneous_non_max_pitch_prob=1e-15,
                               instantaneous_non_empty_rest_prob=0.0,
-                              instantaneous_missing_pitch_prob=1e-15):
+                              instantaneous_missing_pitch_prob=1e-15,
+                              max_viterbi_bytes=DEFAULT_MAX_VITERBI_BYTES):
   """Infer melody for a NoteSequence.
 
   This is a work in progress and should not necessarily be expected to return
@@ -266,13 +344,16 @@ def infer_melody_for_sequence(sequence,
         least one note will be active during a melody rest.
     instantaneous_missing_pitch_prob: The instantaneous probability that the
         melody note will not be active.
+    max_viterbi_bytes: Approximate maximum memory in bytes to use for Viterbi
+        backpointers and log-likelihoods. Sequences whose frames do not all fit
+        are processed in chunks, which takes roughly twice as long.
 
   Returns:
     The instrument number used for the added melody.
 
   Raises:
     MelodyInferenceError: If `sequence` is quantized, or if the number of
-        frames is too large.
+        frames is too large to process within `max_viterbi_bytes`.
   """
   if sequences_lib.is_quantized_sequence(sequence):
     raise MelodyInferenceError(
@@ -293,18 +374,8 @@ def infer_melody_for_sequence(sequence,
     # No pitches present in sequence.
     return melody_instrument
 
-  if len(event_times) + 1 > MAX_NUM_FRAMES:
-    raise MelodyInferenceError(
-        'Too many frames for melody inference: %d' % (len(event_times) + 1))
-
   # Compute frame durations (times between consecutive note events).
-  if event_times:
-    durations = np.array(
-        [event_times[0]] +
-        [t2 - t1 for (t1, t2) in zip(event_times[:-1], event_times[1:])] +
-        [sequence.total_time - event_times[-1]])
-  else:
-    durations = np.array([sequence.total_time])
+  durations = np.diff([0.0] + event_times + [sequence.total_time])
 
   # Interval distribution is Cauchy-like.
   interval_prob_fn = lambda d: 1 / (1 + (d / melody_interval_scale) ** 2)
@@ -322,16 +393,20 @@ def infer_melody_for_sequence(sequence,
   melody_transition_loglik = np.log(
       melody_transition_distribution[pitch_indices, :][:, pitch_indices])
 
-  # Compute log-likelihood of each frame under each possibly melody event.
-  melody_frame_loglik = _melody_frame_log_likelihood(
-      pitches, has_onsets, has_notes, durations,
-      instantaneous_non_max_pitch_prob=instantaneous_non_max_pitch_prob,
-      instantaneous_non_empty_rest_prob=instantaneous_non_empty_rest_prob,
-      instantaneous_missing_pitch_prob=instantaneous_missing_pitch_prob)
+  # Log-likelihood of a range of frames under each possible melody event,
+  # computed as needed by Viterbi.
+  def melody_frame_loglik_fn(start, end):
+    return _melody_frame_log_likelihood(
+        pitches, has_onsets[start:end], has_notes[start:end],
+        durations[start:end],
+        instantaneous_non_max_pitch_prob=instantaneous_non_max_pitch_prob,
+        instantaneous_non_empty_rest_prob=instantaneous_non_empty_rest_prob,
+        instantaneous_missing_pitch_prob=instantaneous_missing_pitch_prob)
 
   # Compute the most likely sequence of melody events using Viterbi.
   melody_events = _melody_viterbi(
-      pitches, melody_frame_loglik, melody_transition_loglik)
+      pitches, len(durations), melody_frame_loglik_fn,
+      melody_transition_loglik, max_bytes=max_viterbi_bytes)
 
   def add_note(start_time, end_time, pitch):
     note = sequence.notes.add()
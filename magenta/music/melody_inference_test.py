@@ -112,6 +112,28 @@ class MelodyInferenceTest(tf.test.TestCase):
 
     self.assertEqual(expected_sequence, sequence)
 
+  def testMelodyInferenceChunked(self):
+    notes = []
+    for i in range(50):
+      # A melody with repeated notes over overlapping bass notes.
+      notes.append((60 + i // 2 % 12, 100, 0.5 * i, 0.5 * i + 0.5))
+      notes.append((36 + i % 3, 100, 0.5 * i, 0.5 * i + 1.0))
+    sequence = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(sequence, 0, notes)
+    chunked_sequence = music_pb2.NoteSequence()
+    chunked_sequence.CopyFrom(sequence)
+
+    melody_inference.infer_melody_for_sequence(sequence)
+    # Small enough that frames are processed in chunks.
+    melody_inference.infer_melody_for_sequence(
+        chunked_sequence, max_viterbi_bytes=10000)
+
+    self.assertEqual(sequence, chunked_sequence)
+
+    with self.assertRaises(melody_inference.MelodyInferenceError):
+      melody_inference.infer_melody_for_sequence(
+          chunked_sequence, max_viterbi_bytes=1000)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -14,11 +14,33 @@
 
 """For reading/writing serialized NoteSequence protos to/from TFRecord files."""
 
+import collections
 import hashlib
+import json
+import mmap
+import os
+import random
+import struct
 
 from magenta.protobuf import music_pb2
 import tensorflow as tf
 
+# Suffix appended to a TFRecord path to get the path of its index file.
+INDEX_SUFFIX = '.index'
+
+# A TFRecord record is framed by a little-endian uint64 length and a uint32
+# CRC of the length before the data, and a uint32 CRC of the data after it.
+_RECORD_HEADER_BYTES = 12
+_RECORD_FOOTER_BYTES = 4
+
+# Metadata for one NoteSequence record in a TFRecord file: the byte offset and
+# length of the serialized proto within the file, and selected fields of the
+# proto so records can be looked up and filtered without parsing them.
+NoteSequenceIndexEntry = collections.namedtuple(
+    'NoteSequenceIndexEntry',
+    ['offset', 'length', 'id', 'filename', 'collection_name', 'total_time',
+     'num_notes'])
+
 
 def generate_note_sequence_id(filename, collection_name, source_type):
   """Generates a unique ID for a sequence.
@@ -75,3 +97,303 @@ class NoteSequenceRecordWriter(tf.python_io.TFRecordWriter):
       note_sequence: A NoteSequence proto to write.
     """
     tf.python_io.TFRecordWriter.write(self, note_sequence.SerializeToString())
+
+
+def _record_spans(path):
+  """Yields the `(offset, length)` of each record's data in a TFRecord file.
+
+  Only the length headers are read; record checksums are not verified.
+
+  Args:
+    path: The path to an uncompressed TFRecord file.
+
+  Yields:
+    Tuples of the byte offset and byte length of each record's data.
+
+  Raises:
+    IOError: If the file ends partway through a record.
+  """
+  with tf.gfile.Open(path, 'rb') as f:
+    offset = 0
+    while True:
+      header = f.read(_RECORD_HEADER_BYTES)
+      if not header:
+        return
+      if len(header) < _RECORD_HEADER_BYTES:
+        raise IOError('Truncated record header at offset %d in %s' %
+                      (offset, path))
+      length, = struct.unpack('<Q', header[:8])
+      data_offset = offset + _RECORD_HEADER_BYTES
+      f.seek(data_offset + length + _RECORD_FOOTER_BYTES)
+      offset = data_offset + length + _RECORD_FOOTER_BYTES
+      yield data_offset, length
+
+
+def build_note_sequence_index(path, index_path=None):
+  """Builds and writes the index for a NoteSequence TFRecord file.
+
+  Each NoteSequence in the file is parsed once to extract its metadata. The
+  index is written as JSON lines: a header recording the size and modification
+  time of the TFRecord file, so a stale index can be detected, followed by one
+  `NoteSequenceIndexEntry` per record in file order.
+
+  Args:
+    path: The path to an uncompressed TFRecord file of serialized
+        NoteSequences.
+    index_path: The path to write the index to. Defaults to `path` with
+        `INDEX_SUFFIX` appended.
+
+  Returns:
+    The list of `NoteSequenceIndexEntry` tuples that was written.
+  """
+  header = _index_header(path)
+  entries = []
+  with tf.gfile.Open(path, 'rb') as f:
+    for offset, length in _record_spans(path):
+      f.seek(offset)
+      sequence = music_pb2.NoteSequence.FromString(f.read(length))
+      entries.append(NoteSequenceIndexEntry(
+          offset=offset, length=length, id=sequence.id,
+          filename=sequence.filename,
+          collection_name=sequence.collection_name,
+          total_time=sequence.total_time, num_notes=len(sequence.notes)))
+
+  with tf.gfile.Open(index_path or path + INDEX_SUFFIX, 'w') as f:
+    f.write(json.dumps(header) + '\n')
+    for entry in entries:
+      f.write(json.dumps(entry._asdict()) + '\n')
+  return entries
+
+
+def read_note_sequence_index(index_path):
+  """Reads an index written by `build_note_sequence_index`.
+
+  Args:
+    index_path: The path to the index file.
+
+  Returns:
+    A list of `NoteSequenceIndexEntry` tuples in file order.
+  """
+  with tf.gfile.Open(index_path, 'r') as f:
+    return [NoteSequenceIndexEntry(**fields)
+            for fields in (json.loads(line) for line in f)
+            if 'offset' in fields]
+
+
+def _index_header(path):
+  """Returns the index header identifying the current state of a file."""
+  stat = tf.gfile.Stat(path)
+  return {'tfrecord_size': stat.length, 'tfrecord_mtime_nsec': stat.mtime_nsec}
+
+
+def _index_is_current(path, index_path):
+  """Returns whether an index was built from the current version of a file.
+
+  Indexes without a header, written before headers were added, are never
+  current.
+
+  Args:
+    path: The path to the TFRecord file.
+    index_path: The path to the file's index.
+
+  Returns:
+    True if the index header matches the size and modification time of `path`.
+  """
+  with tf.gfile.Open(index_path, 'r') as f:
+    first_line = f.readline()
+  try:
+    header = json.loads(first_line)
+  except ValueError:
+    return False
+  return header == _index_header(path)
+
+
+class NoteSequenceStore(object):
+  """Random access to the NoteSequences in an indexed TFRecord file.
+
+  The store loads the file's index (see `build_note_sequence_index`), so
+  records can be looked up by id or filename, and filtered on their indexed
+  metadata, without parsing any protos. Only the records that are actually
+  read are parsed. Local files are read through a read-only memory map, and
+  other files (e.g. on GCS) through `tf.gfile` seeks.
+
+  Iterating over a store yields its NoteSequences in file order, so a store,
+  or a filtered or sampled view of one, can be passed anywhere an input
+  iterator of NoteSequences is expected, such as
+  `pipeline.run_pipeline_serial`.
+
+  This class implements `__enter__` and `__exit__`, and can be used in `with`
+  blocks like a normal file.
+  """
+
+  def __init__(self, path, index_path=None, build_index=False):
+    """Constructs a `NoteSequenceStore`.
+
+    Args:
+      path: The path to an uncompressed TFRecord file of serialized
+          NoteSequences.
+      index_path: The path to the file's index. Defaults to `path` with
+          `INDEX_SUFFIX` appended.
+      build_index: If True, build the index if it does not exist yet, or
+          rebuild it if the TFRecord file has changed since it was built.
+
+    Raises:
+      IOError: If the index does not exist or is out of date, and
+          `build_index` is False.
+    """
+    index_path = index_path or path + INDEX_SUFFIX
+    index_exists = tf.gfile.Exists(index_path)
+    if index_exists and _index_is_current(path, index_path):
+      entries = read_note_sequence_index(index_path)
+    elif build_index:
+      entries = build_note_sequence_index(path, index_path)
+    elif index_exists:
+      raise IOError('Index %s is out of date for %s, which has changed since '
+                    'the index was built' % (index_path, path))
+    else:
+      raise IOError('No index for %s at %s' % (path, index_path))
+    self._reader = _RecordReader(path)
+    self._set_entries(entries)
+
+  @classmethod
+  def _view(cls, store, entries):
+    """Returns a store over a subset of another store's entries."""
+    view = cls.__new__(cls)
+    view._reader = store._reader  # pylint: disable=protected-access
+    view._set_entries(entries)  # pylint: disable=protected-access
+    return view
+
+  def _set_entries(self, entries):
+    self._entries = list(entries)
+    self._positions_by_id = {}
+    self._positions_by_filename = {}
+    for i, entry in enumerate(self._entries):
+      self._positions_by_id.setdefault(entry.id, i)
+      self._positions_by_filename.setdefault(entry.filename, i)
+
+  @property
+  def entries(self):
+    """The `NoteSequenceIndexEntry` tuples of the records in this store."""
+    return list(self._entries)
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getitem__(self, i):
+    """Returns the `i`th NoteSequence in the store."""
+    return self._parse(self._entries[i])
+
+  def __iter__(self):
+    for entry in self._entries:
+      yield self._parse(entry)
+
+  def __contains__(self, sequence_id):
+    return sequence_id in self._positions_by_id
+
+  def _parse(self, entry):
+    return music_pb2.NoteSequence.FromString(
+        self._reader.read(entry.offset, entry.length))
+
+  def get_by_id(self, sequence_id):
+    """Returns the NoteSequence with the given id.
+
+    Args:
+      sequence_id: The NoteSequence id to look up.
+
+    Returns:
+      The first NoteSequence in the store with id `sequence_id`.
+
+    Raises:
+      KeyError: If there is no NoteSequence with that id.
+    """
+    return self[self._positions_by_id[sequence_id]]
+
+  def get_by_filename(self, filename):
+    """Returns the first NoteSequence with the given filename.
+
+    Args:
+      filename: The NoteSequence filename to look up.
+
+    Returns:
+      The first NoteSequence in the store with filename `filename`.
+
+    Raises:
+      KeyError: If there is no NoteSequence with that filename.
+    """
+    return self[self._positions_by_filename[filename]]
+
+  def filter(self, predicate):
+    """Returns a view of the records whose index entries satisfy `predicate`.
+
+    Args:
+      predicate: A function that takes a `NoteSequenceIndexEntry` and returns
+          True if the record should be kept.
+
+    Returns:
+      A `NoteSequenceStore` over the matching records, sharing this store's
+      underlying file.
+    """
+    return NoteSequenceStore._view(
+        self, [entry for entry in self._entries if predicate(entry)])
+
+  def sample(self, num_samples, seed=None):
+    """Returns a view of a random subset of the records, in file order.
+
+    Args:
+      num_samples: The number of records to sample without replacement. If
+          larger than the store, all records are kept.
+      seed: Optional seed for the random sampling.
+
+    Returns:
+      A `NoteSequenceStore` over the sampled records, sharing this store's
+      underlying file.
+    """
+    num_samples = min(num_samples, len(self._entries))
+    positions = sorted(
+        random.Random(seed).sample(range(len(self._entries)), num_samples))
+    return NoteSequenceStore._view(
+        self, [self._entries[i] for i in positions])
+
+  def close(self):
+    """Closes the underlying file, which is shared with any views."""
+    self._reader.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.close()
+
+
+class _RecordReader(object):
+  """Reads byte ranges from a file, memory-mapping it if it is local."""
+
+  def __init__(self, path):
+    self._path = path
+    self._file = None
+    self._mmap = None
+
+  def _open(self):
+    if os.path.isfile(self._path):
+      self._file = open(self._path, 'rb')
+      if os.path.getsize(self._path):
+        self._mmap = mmap.mmap(
+            self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._file = tf.gfile.Open(self._path, 'rb')
+
+  def read(self, offset, length):
+    if self._file is None:
+      self._open()
+    if self._mmap is not None:
+      return self._mmap[offset:offset + length]
+    self._file.seek(offset)
+    return self._file.read(length)
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+      self._mmap = None
+    if self._file is not None:
+      self._file.close()
+      self._file = None
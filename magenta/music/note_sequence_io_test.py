@@ -59,5 +59,74 @@ class NoteSequenceIoTest(tf.test.TestCase):
           note_sequence_io.note_sequence_record_iterator(temp_file.name)):
         self.assertEqual(sequence, sequences[i])
 
+  def testNoteSequenceStore(self):
+    sequences = []
+    for i in range(5):
+      sequence = music_pb2.NoteSequence()
+      sequence.id = '/id/midi/collection/%d' % i
+      sequence.filename = 'file_%d.mid' % i
+      sequence.collection_name = 'collection'
+      for pitch in range(i):
+        sequence.notes.add(pitch=pitch, start_time=pitch, end_time=pitch + 1)
+      sequence.total_time = i
+      sequences.append(sequence)
+
+    with tempfile.NamedTemporaryFile(prefix='NoteSequenceIoTest') as temp_file:
+      with note_sequence_io.NoteSequenceRecordWriter(temp_file.name) as writer:
+        for sequence in sequences:
+          writer.write(sequence)
+
+      index_path = temp_file.name + note_sequence_io.INDEX_SUFFIX
+      with self.assertRaises(IOError):
+        note_sequence_io.NoteSequenceStore(temp_file.name)
+      try:
+        with note_sequence_io.NoteSequenceStore(
+            temp_file.name, build_index=True) as store:
+          self.assertTrue(tf.gfile.Exists(index_path))
+          self.assertEqual(5, len(store))
+          self.assertEqual(sequences, list(store))
+          self.assertEqual(sequences[3], store[3])
+          self.assertEqual(sequences[2],
+                           store.get_by_id('/id/midi/collection/2'))
+          self.assertEqual(sequences[4], store.get_by_filename('file_4.mid'))
+          self.assertIn('/id/midi/collection/0', store)
+          with self.assertRaises(KeyError):
+            store.get_by_id('missing')
+
+          long_sequences = store.filter(lambda entry: entry.num_notes >= 3)
+          self.assertEqual(sequences[3:], list(long_sequences))
+          self.assertEqual(
+              [3.0, 4.0],
+              [entry.total_time for entry in long_sequences.entries])
+
+          sample = store.sample(3, seed=0)
+          self.assertEqual(3, len(sample))
+          self.assertEqual(
+              sorted(sample.entries, key=lambda entry: entry.offset),
+              sample.entries)
+          for sequence in sample:
+            self.assertIn(sequence, sequences)
+
+        # The index is reused once built.
+        self.assertEqual(
+            store.entries,
+            note_sequence_io.read_note_sequence_index(index_path))
+        with note_sequence_io.NoteSequenceStore(temp_file.name) as store:
+          self.assertEqual(sequences[1], store[1])
+
+        # A rewritten file makes the index stale, so it must be rebuilt.
+        with note_sequence_io.NoteSequenceRecordWriter(
+            temp_file.name) as writer:
+          for sequence in sequences[3:]:
+            writer.write(sequence)
+        with self.assertRaises(IOError):
+          note_sequence_io.NoteSequenceStore(temp_file.name)
+        with note_sequence_io.NoteSequenceStore(
+            temp_file.name, build_index=True) as store:
+          self.assertEqual(sequences[3:], list(store))
+      finally:
+        tf.gfile.Remove(index_path)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -302,6 +302,75 @@ class PerformanceOneHotEncoding(encoder_decoder.OneHotEncoding):
 
     raise ValueError('Unknown event type: %s' % event.event_type)
 
+  def encode_events(self, events):
+    """Encodes many events at once from their packed event codes.
+
+    Args:
+      events: A Performance, a PerformanceEventArray, or a list of
+          PerformanceEvents.
+
+    Returns:
+      A 1-D int64 NumPy array with the encoding of each event.
+
+    Raises:
+      ValueError: If an event has a type that is not encoded.
+    """
+    return self.encode_event_codes(performance_lib.pack_events(events))
+
+  def encode_event_codes(self, event_codes):
+    """Encodes many events given as packed event codes.
+
+    Args:
+      event_codes: A 1-D array of packed event codes (see
+          `performance_lib.pack_events`).
+
+    Returns:
+      A 1-D int64 NumPy array with the encoding of each event.
+
+    Raises:
+      ValueError: If an event has a type that is not encoded.
+    """
+    event_types, event_values = performance_lib.unpack_event_codes(
+        event_codes)
+    indices = np.zeros(len(event_types), dtype=np.int64)
+    encoded = np.zeros(len(event_types), dtype=bool)
+    offset = 0
+    for event_type, min_value, max_value in self._event_ranges:
+      is_type = event_types == event_type
+      indices[is_type] = offset + event_values[is_type] - min_value
+      encoded |= is_type
+      offset += max_value - min_value + 1
+    if not np.all(encoded):
+      raise ValueError('Unknown event type: %s' % event_types[~encoded][0])
+    return indices
+
+  def decode_event_codes(self, indices):
+    """Decodes many event indices at once into packed event codes.
+
+    Args:
+      indices: A 1-D array of event indices.
+
+    Returns:
+      A 1-D int32 NumPy array with the packed code of each decoded event.
+
+    Raises:
+      ValueError: If an index does not correspond to an event.
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape([-1])
+    event_codes = np.zeros(len(indices), dtype=np.int32)
+    decoded = np.zeros(len(indices), dtype=bool)
+    offset = 0
+    for event_type, min_value, max_value in self._event_ranges:
+      num_values = max_value - min_value + 1
+      is_type = (offset <= indices) & (indices < offset + num_values)
+      event_codes[is_type] = performance_lib.pack_event_codes(
+          event_type, min_value + indices[is_type] - offset)
+      decoded |= is_type
+      offset += num_values
+    if not np.all(decoded):
+      raise ValueError('Unknown event index: %s' % indices[~decoded][0])
+    return event_codes
+
   def decode_event(self, index):
     offset = 0
     for event_type, min_value, max_value in self._event_ranges:
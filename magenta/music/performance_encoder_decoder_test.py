@@ -69,6 +69,28 @@ class PerformanceOneHotEncodingTest(tf.test.TestCase):
       event = self.enc.decode_event(expected_index)
       self.assertEqual(expected_event, event)
 
+    expected_events, expected_indices = zip(*expected_pairs)
+    self.assertEqual(list(expected_indices),
+                     self.enc.encode_events(expected_events).tolist())
+    performance = performance_lib.Performance(
+        steps_per_second=100, num_velocity_bins=16)
+    for event in expected_events:
+      performance.append(event)
+    self.assertEqual(list(expected_indices),
+                     self.enc.encode_events(performance).tolist())
+
+    with self.assertRaises(ValueError):
+      self.enc.encode_events([
+          PerformanceEvent(event_type=PerformanceEvent.DURATION,
+                           event_value=1)])
+
+    event_codes = self.enc.decode_event_codes(expected_indices)
+    self.assertEqual(
+        list(expected_events),
+        list(performance_lib.PerformanceEventArray(event_codes)))
+    with self.assertRaises(ValueError):
+      self.enc.decode_event_codes([self.enc.num_classes])
+
   def testEventToNumSteps(self):
     self.assertEqual(0, self.enc.event_to_num_steps(
         PerformanceEvent(event_type=PerformanceEvent.NOTE_ON, event_value=60)))
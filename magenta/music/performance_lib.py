@@ -17,7 +17,7 @@
 from __future__ import division
 
 import abc
-import collections
+import itertools
 import math
 
 from magenta.music import constants
@@ -25,7 +25,7 @@ from magenta.music import events_lib
 from magenta.music import sequences_lib
 from magenta.pipelines import statistics
 from magenta.protobuf import music_pb2
-import tensorflow as tf
+import numpy as np
 
 MAX_MIDI_PITCH = constants.MAX_MIDI_PITCH
 MIN_MIDI_PITCH = constants.MIN_MIDI_PITCH
@@ -41,6 +41,17 @@ DEFAULT_MAX_SHIFT_QUARTERS = 4
 
 DEFAULT_PROGRAM = 0
 
+# Performance events are stored as int32 codes with the event type in the high
+# bits and the event value in the low `PACKED_EVENT_VALUE_BITS` bits.
+PACKED_EVENT_VALUE_BITS = 24
+_PACKED_EVENT_VALUE_MASK = (1 << PACKED_EVENT_VALUE_BITS) - 1
+
+# Note fields read when converting a quantized NoteSequence to a performance.
+_PERFORMANCE_NOTE_DTYPE = np.dtype([
+    ('start_time', np.float64), ('quantized_start_step', np.int64),
+    ('quantized_end_step', np.int64), ('pitch', np.int32),
+    ('velocity', np.int32), ('instrument', np.int32)])
+
 
 class PerformanceEvent(object):
   """Class for storing events in a performance."""
@@ -86,6 +97,178 @@ class PerformanceEvent(object):
             self.event_value == other.event_value)
 
 
+def pack_event_codes(event_types, event_values):
+  """Packs event types and values (scalars or arrays) into int32 event codes."""
+  return ((np.asarray(event_types, np.int32) << PACKED_EVENT_VALUE_BITS) |
+          np.asarray(event_values, np.int32))
+
+
+def unpack_event_codes(event_codes):
+  """Returns arrays of the event types and event values of event codes."""
+  event_codes = np.asarray(event_codes, np.int32)
+  return (event_codes >> PACKED_EVENT_VALUE_BITS,
+          event_codes & _PACKED_EVENT_VALUE_MASK)
+
+
+def _pack_event(event):
+  if not 0 <= event.event_value <= _PACKED_EVENT_VALUE_MASK:
+    raise ValueError('Event value cannot be packed: %s' % event.event_value)
+  return (event.event_type << PACKED_EVENT_VALUE_BITS) | event.event_value
+
+
+def _unpack_event(event_code):
+  event_code = int(event_code)
+  return PerformanceEvent(event_type=event_code >> PACKED_EVENT_VALUE_BITS,
+                          event_value=event_code & _PACKED_EVENT_VALUE_MASK)
+
+
+def pack_events(events):
+  """Returns the int32 event codes of a list-like sequence of events.
+
+  Args:
+    events: A BasePerformance, a PerformanceEventArray, or any other sequence of
+        PerformanceEvent objects.
+
+  Returns:
+    A 1-D int32 NumPy array with the packed code of each event. For
+    performances and event arrays this is the stored array itself, not a copy.
+  """
+  if isinstance(events, (BasePerformance, PerformanceEventArray)):
+    return events.event_codes
+  return np.array([_pack_event(event) for event in events], np.int32)
+
+
+# Read-only empty prefix of PerformanceEventArrays that were never copied.
+_EMPTY_EVENT_CODES = np.zeros([0], np.int32)
+_EMPTY_EVENT_CODES.flags.writeable = False
+
+
+class PerformanceEventArray(object):
+  """A list of PerformanceEvents stored as packed integer codes.
+
+  Supports the list operations performances use (indexing, slicing, iteration,
+  `append` and `pop`), creating PerformanceEvent objects only as they are
+  accessed. The `event_codes`, `event_types` and `event_values` arrays can be
+  used to process all events at once.
+
+  Deep copies are copy-on-write: the original and the copy share a read-only
+  prefix holding the events so far, and each only stores the events appended
+  after the copy was made. Branches of a beam search therefore alias their
+  common history instead of each holding a copy of it.
+  """
+
+  def __init__(self, event_codes=None):
+    """Constructs a PerformanceEventArray.
+
+    Args:
+      event_codes: Optional sequence of packed event codes to start with.
+    """
+    self._prefix = _EMPTY_EVENT_CODES
+    if event_codes is None:
+      self._codes = np.zeros([16], np.int32)
+      self._size = 0
+    else:
+      self._codes = np.array(event_codes, np.int32).reshape([-1])
+      self._size = len(self._codes)
+
+  @property
+  def event_codes(self):
+    """An int32 array of the packed event codes."""
+    if not self._size:
+      return self._prefix
+    if not len(self._prefix):
+      return self._codes[:self._size]
+    return np.concatenate([self._prefix, self._codes[:self._size]])
+
+  @property
+  def event_types(self):
+    return unpack_event_codes(self.event_codes)[0]
+
+  @property
+  def event_values(self):
+    return unpack_event_codes(self.event_codes)[1]
+
+  def __len__(self):
+    return len(self._prefix) + self._size
+
+  def _index(self, i):
+    """Returns the non-negative position of integer index `i`."""
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('PerformanceEventArray index out of range')
+    return i
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return PerformanceEventArray(self.event_codes[i])
+    i = self._index(i)
+    if i < len(self._prefix):
+      return _unpack_event(self._prefix[i])
+    return _unpack_event(self._codes[i - len(self._prefix)])
+
+  def __setitem__(self, i, event):
+    i = self._index(i)
+    if i < len(self._prefix):
+      # Move the shared events from position `i` on into this array's own
+      # storage, so only the end of the history is ever copied.
+      codes = np.concatenate(
+          [self._prefix[i:], self._codes[:self._size],
+           np.zeros([self._size + 1], np.int32)])
+      self._size += len(self._prefix) - i
+      self._codes = codes
+      self._prefix = self._prefix[:i]
+    self._codes[i - len(self._prefix)] = _pack_event(event)
+
+  def __iter__(self):
+    for event_code in self.event_codes.tolist():
+      yield _unpack_event(event_code)
+
+  def __eq__(self, other):
+    if not isinstance(other, PerformanceEventArray):
+      return list(self) == other
+    return np.array_equal(self.event_codes, other.event_codes)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return 'PerformanceEventArray(%r)' % list(self)
+
+  def __deepcopy__(self, memo=None):
+    if self._size:
+      prefix = self.event_codes
+      prefix.flags.writeable = False
+      self._prefix = prefix
+      self._codes = np.zeros([16], np.int32)
+      self._size = 0
+    event_array = PerformanceEventArray()
+    event_array._prefix = self._prefix  # pylint:disable=protected-access
+    return event_array
+
+  def append(self, event):
+    self.extend_codes([_pack_event(event)])
+
+  def extend_codes(self, event_codes):
+    """Appends packed event codes to the end of the array."""
+    event_codes = np.asarray(event_codes, np.int32)
+    size = self._size + len(event_codes)
+    if size > len(self._codes):
+      codes = np.zeros([max(size, 2 * len(self._codes))], np.int32)
+      codes[:self._size] = self._codes[:self._size]
+      self._codes = codes
+    self._codes[self._size:size] = event_codes
+    self._size = size
+
+  def pop(self):
+    event = self[-1]
+    if self._size:
+      self._size -= 1
+    else:
+      self._prefix = self._prefix[:-1]
+    return event
+
+
 def _velocity_bin_size(num_velocity_bins):
   return int(math.ceil(
       (MAX_MIDI_VELOCITY - MIN_MIDI_VELOCITY + 1) / num_velocity_bins))
@@ -133,10 +316,165 @@ def _program_and_is_drum_from_sequence(sequence, instrument=None):
   return program, is_drum
 
 
+def _event_codes_from_notes(notes, start_step, num_velocity_bins,
+                            max_shift_steps, instrument=None):
+  """Extract performance events from an array of quantized notes.
+
+  See `BasePerformance._from_quantized_sequence` for details.
+
+  Args:
+    notes: A structured NumPy array of notes with `_PERFORMANCE_NOTE_DTYPE`.
+    start_step: Start converting the notes at this time step.
+    num_velocity_bins: Number of velocity bins to use. If 0, velocity events
+        will not be included at all.
+    max_shift_steps: Maximum number of steps for a single time-shift event.
+    instrument: If not None, extract only the specified instrument. Otherwise,
+        extract all instruments into a single event list.
+
+  Returns:
+    A PerformanceEventArray of events.
+
+  Raises:
+    ValueError: If a note has an invalid pitch or velocity.
+  """
+  if not len(notes):  # pylint:disable=g-explicit-length-test,len-as-condition
+    return PerformanceEventArray()
+  keep = notes['quantized_start_step'] >= start_step
+  if instrument is not None:
+    keep &= notes['instrument'] == instrument
+  notes = notes[keep]
+  # Stable sort, matching `sorted(notes, key=(start_time, pitch))`.
+  notes = notes[np.lexsort((notes['pitch'], notes['start_time']))]
+  num_notes = len(notes)
+  if not num_notes:
+    return PerformanceEventArray()
+  if (np.any(notes['pitch'] < MIN_MIDI_PITCH) or
+      np.any(notes['pitch'] > MAX_MIDI_PITCH)):
+    raise ValueError('Invalid pitch value: %s' % notes['pitch'])
+
+  # Sort all note start and end events by (step, note index, is_offset).
+  note_steps = np.concatenate(
+      [notes['quantized_start_step'], notes['quantized_end_step']])
+  note_indices = np.tile(np.arange(num_notes), 2)
+  is_offset = np.repeat([False, True], num_notes)
+  order = np.lexsort((is_offset, note_indices, note_steps))
+  note_steps = note_steps[order]
+  note_indices = note_indices[order]
+  is_offset = is_offset[order]
+  num_note_events = len(order)
+
+  # Time shifts from the current step to each note event, split into as many
+  # shift events as needed to stay within `max_shift_steps`.
+  current_steps = np.maximum.accumulate(
+      np.concatenate([[start_step], note_steps]))
+  shift_steps = np.diff(current_steps)
+  num_shifts = -(-shift_steps // max_shift_steps)
+
+  # A velocity event precedes each onset whose velocity bin differs from the
+  # bin of the previous onset.
+  has_velocity = np.zeros(num_note_events, dtype=bool)
+  if num_velocity_bins:
+    velocity_bins = velocity_to_bin(
+        notes['velocity'][note_indices], num_velocity_bins)
+    onset_bins = velocity_bins[~is_offset]
+    has_velocity[~is_offset] = (
+        onset_bins != np.concatenate([[0], onset_bins[:-1]]))
+    velocity_bins = velocity_bins[has_velocity]
+    if (np.any(velocity_bins < 1) or
+        np.any(velocity_bins > MAX_NUM_VELOCITY_BINS)):
+      raise ValueError('Invalid velocity value: %s' % velocity_bins)
+
+  # Each note event is written after its time shifts and velocity event.
+  num_events = num_shifts + has_velocity + 1
+  note_event_positions = np.cumsum(num_events) - 1
+  event_codes = np.zeros(note_event_positions[-1] + 1, np.int32)
+  event_codes[note_event_positions] = pack_event_codes(
+      np.where(is_offset, PerformanceEvent.NOTE_OFF,
+               PerformanceEvent.NOTE_ON),
+      notes['pitch'][note_indices])
+  if num_velocity_bins:
+    event_codes[note_event_positions[has_velocity] - 1] = pack_event_codes(
+        PerformanceEvent.VELOCITY, velocity_bins)
+  total_shifts = num_shifts.sum()
+  if total_shifts:
+    shift_ends = np.cumsum(num_shifts)
+    shift_positions = (
+        np.repeat(note_event_positions - has_velocity - num_shifts,
+                  num_shifts) +
+        np.arange(total_shifts) - np.repeat(shift_ends - num_shifts,
+                                            num_shifts))
+    shift_values = np.full(total_shifts, max_shift_steps, np.int64)
+    shifted = num_shifts > 0
+    shift_values[shift_ends[shifted] - 1] = (
+        shift_steps[shifted] - (num_shifts[shifted] - 1) * max_shift_steps)
+    event_codes[shift_positions] = pack_event_codes(
+        PerformanceEvent.TIME_SHIFT, shift_values)
+
+  return PerformanceEventArray(event_codes)
+
+
+def note_sequence_to_event_codes(note_sequence, steps_per_second,
+                                 num_velocity_bins=0,
+                                 max_shift_steps=DEFAULT_MAX_SHIFT_STEPS):
+  """Returns the packed event codes of an unquantized NoteSequence.
+
+  The result is the same as the `event_codes` of a Performance built from
+  `sequences_lib.quantize_note_sequence_absolute(note_sequence,
+  steps_per_second)`, but note times are quantized all at once and the
+  NoteSequence is not copied.
+
+  Args:
+    note_sequence: An unquantized NoteSequence proto.
+    steps_per_second: Number of quantized time steps per second.
+    num_velocity_bins: Number of velocity bins to use. If 0, velocity events
+        will not be included at all.
+    max_shift_steps: Maximum number of steps for a single time-shift event.
+
+  Returns:
+    A 1-D int32 NumPy array with the packed code of each event.
+
+  Raises:
+    sequences_lib.NegativeTimeError: If a note or event occurs at a negative
+        time.
+    ValueError: If a note has an invalid pitch or velocity.
+  """
+  note_values = np.array(
+      [(note.start_time, note.end_time, note.pitch, note.velocity)
+       for note in note_sequence.notes],
+      dtype=np.float64).reshape([-1, 4])
+
+  # Quantize as in `sequences_lib.quantize_to_step`, truncating toward zero.
+  cutoff = 1 - sequences_lib.QUANTIZE_CUTOFF
+  start_steps = (note_values[:, 0] * steps_per_second + cutoff).astype(np.int64)
+  end_steps = (note_values[:, 1] * steps_per_second + cutoff).astype(np.int64)
+  end_steps += end_steps == start_steps
+  if np.any(start_steps < 0) or np.any(end_steps < 0):
+    raise sequences_lib.NegativeTimeError(
+        'Got negative note time: start_step = %s, end_step = %s' %
+        (start_steps.min(), end_steps.min()))
+  event_times = [event.time for event in itertools.chain(
+      note_sequence.control_changes, note_sequence.text_annotations)]
+  if (event_times and sequences_lib.quantize_to_step(
+      min(event_times), steps_per_second) < 0):
+    raise sequences_lib.NegativeTimeError(
+        'Got negative event time: %s' % min(event_times))
+
+  notes = np.zeros(len(note_values), dtype=_PERFORMANCE_NOTE_DTYPE)
+  notes['start_time'] = note_values[:, 0]
+  notes['quantized_start_step'] = start_steps
+  notes['quantized_end_step'] = end_steps
+  notes['pitch'] = note_values[:, 2]
+  notes['velocity'] = note_values[:, 3]
+  return _event_codes_from_notes(
+      notes, 0, num_velocity_bins, max_shift_steps).event_codes
+
+
 class BasePerformance(events_lib.EventSequence):
   """Stores a polyphonic sequence as a stream of performance events.
 
-  Events are PerformanceEvent objects that encode event type and value.
+  Events are PerformanceEvent objects that encode event type and value. They
+  are stored as packed integer codes in a PerformanceEventArray, which the
+  conversions to and from NoteSequences process all at once.
   """
   __metaclass__ = abc.ABCMeta
 
@@ -183,29 +521,35 @@ class BasePerformance(events_lib.EventSequence):
   def is_drum(self):
     return self._is_drum
 
+  @property
+  def event_codes(self):
+    """An int32 array of the packed code of each event (see `pack_events`)."""
+    return self._events.event_codes
+
+  def extend_codes(self, event_codes):
+    """Appends events given as packed event codes (see `pack_events`)."""
+    self._events.extend_codes(event_codes)
+
   def _append_steps(self, num_steps):
     """Adds steps to the end of the sequence."""
-    if (self._events and
-        self._events[-1].event_type == PerformanceEvent.TIME_SHIFT and
-        self._events[-1].event_value < self._max_shift_steps):
-      # Last event is already non-maximal time shift. Increase its duration.
-      added_steps = min(num_steps,
-                        self._max_shift_steps - self._events[-1].event_value)
-      self._events[-1] = PerformanceEvent(
-          PerformanceEvent.TIME_SHIFT,
-          self._events[-1].event_value + added_steps)
-      num_steps -= added_steps
-
-    while num_steps >= self._max_shift_steps:
-      self._events.append(
-          PerformanceEvent(event_type=PerformanceEvent.TIME_SHIFT,
-                           event_value=self._max_shift_steps))
-      num_steps -= self._max_shift_steps
+    if self._events:
+      last_event = self._events[-1]
+      if (last_event.event_type == PerformanceEvent.TIME_SHIFT and
+          last_event.event_value < self._max_shift_steps):
+        # Last event is already non-maximal time shift. Increase its duration.
+        added_steps = min(num_steps,
+                          self._max_shift_steps - last_event.event_value)
+        self._events[-1] = PerformanceEvent(
+            PerformanceEvent.TIME_SHIFT, last_event.event_value + added_steps)
+        num_steps -= added_steps
 
     if num_steps > 0:
-      self._events.append(
-          PerformanceEvent(event_type=PerformanceEvent.TIME_SHIFT,
-                           event_value=num_steps))
+      num_max_shifts, remaining_steps = divmod(num_steps, self._max_shift_steps)
+      shifts = [self._max_shift_steps] * num_max_shifts
+      if remaining_steps:
+        shifts.append(remaining_steps)
+      self._events.extend_codes(
+          pack_event_codes(PerformanceEvent.TIME_SHIFT, shifts))
 
   def _trim_steps(self, num_steps):
     """Trims a given number of steps from the end of the sequence."""
@@ -309,22 +653,19 @@ class BasePerformance(events_lib.EventSequence):
     Returns:
       Length of the sequence in quantized steps.
     """
-    steps = 0
-    for event in self:
-      if event.event_type == PerformanceEvent.TIME_SHIFT:
-        steps += event.event_value
-    return steps
+    return int(self._time_shift_steps().sum())
 
   @property
   def steps(self):
     """Return a Python list of the time step at each event in this sequence."""
-    step = self.start_step
-    result = []
-    for event in self:
-      result.append(step)
-      if event.event_type == PerformanceEvent.TIME_SHIFT:
-        step += event.event_value
-    return result
+    shift_steps = self._time_shift_steps()
+    return (self.start_step + np.cumsum(shift_steps) - shift_steps).tolist()
+
+  def _time_shift_steps(self):
+    """Returns an int64 array of the steps each event shifts time forward."""
+    event_types, event_values = unpack_event_codes(self.event_codes)
+    return np.where(event_types == PerformanceEvent.TIME_SHIFT,
+                    event_values, 0).astype(np.int64)
 
   @staticmethod
   def _from_quantized_sequence(quantized_sequence, start_step,
@@ -347,57 +688,19 @@ class BasePerformance(events_lib.EventSequence):
           extract all instruments into a single event list.
 
     Returns:
-      A list of events.
-    """
-    notes = [note for note in quantized_sequence.notes
-             if note.quantized_start_step >= start_step
-             and (instrument is None or note.instrument == instrument)]
-    sorted_notes = sorted(notes, key=lambda note: (note.start_time, note.pitch))
-
-    # Sort all note start and end events.
-    onsets = [(note.quantized_start_step, idx, False)
-              for idx, note in enumerate(sorted_notes)]
-    offsets = [(note.quantized_end_step, idx, True)
-               for idx, note in enumerate(sorted_notes)]
-    note_events = sorted(onsets + offsets)
+      A PerformanceEventArray of events.
 
-    current_step = start_step
-    current_velocity_bin = 0
-    performance_events = []
-
-    for step, idx, is_offset in note_events:
-      if step > current_step:
-        # Shift time forward from the current step to this event.
-        while step > current_step + max_shift_steps:
-          # We need to move further than the maximum shift size.
-          performance_events.append(
-              PerformanceEvent(event_type=PerformanceEvent.TIME_SHIFT,
-                               event_value=max_shift_steps))
-          current_step += max_shift_steps
-        performance_events.append(
-            PerformanceEvent(event_type=PerformanceEvent.TIME_SHIFT,
-                             event_value=int(step - current_step)))
-        current_step = step
-
-      # If we're using velocity and this note's velocity is different from the
-      # current velocity, change the current velocity.
-      if num_velocity_bins:
-        velocity_bin = velocity_to_bin(
-            sorted_notes[idx].velocity, num_velocity_bins)
-        if not is_offset and velocity_bin != current_velocity_bin:
-          current_velocity_bin = velocity_bin
-          performance_events.append(
-              PerformanceEvent(event_type=PerformanceEvent.VELOCITY,
-                               event_value=current_velocity_bin))
-
-      # Add a performance event for this note on/off.
-      event_type = (
-          PerformanceEvent.NOTE_OFF if is_offset else PerformanceEvent.NOTE_ON)
-      performance_events.append(
-          PerformanceEvent(event_type=event_type,
-                           event_value=sorted_notes[idx].pitch))
+    Raises:
+      ValueError: If a note has an invalid pitch or velocity.
+    """
+    notes = np.array(
+        [(note.start_time, note.quantized_start_step, note.quantized_end_step,
+          note.pitch, note.velocity, note.instrument)
+         for note in quantized_sequence.notes],
+        dtype=_PERFORMANCE_NOTE_DTYPE)
+    return _event_codes_from_notes(
+        notes, start_step, num_velocity_bins, max_shift_steps, instrument)
 
-    return performance_events
 
   @abc.abstractmethod
   def to_sequence(self, velocity, instrument, program, max_note_duration=None):
@@ -426,79 +729,108 @@ class BasePerformance(events_lib.EventSequence):
     sequence = music_pb2.NoteSequence()
     sequence.ticks_per_quarter = STANDARD_PPQ
 
-    step = 0
-
     if program is None:
       # Use program associated with the performance (or default program).
       program = self.program if self.program is not None else DEFAULT_PROGRAM
     is_drum = self.is_drum if self.is_drum is not None else False
 
-    # Map pitch to list because one pitch may be active multiple times.
-    pitch_start_steps_and_velocities = collections.defaultdict(list)
-    for i, event in enumerate(self):
-      if event.event_type == PerformanceEvent.NOTE_ON:
-        pitch_start_steps_and_velocities[event.event_value].append(
-            (step, velocity))
-      elif event.event_type == PerformanceEvent.NOTE_OFF:
-        if not pitch_start_steps_and_velocities[event.event_value]:
-          tf.logging.debug(
-              'Ignoring NOTE_OFF at position %d with no previous NOTE_ON' % i)
-        else:
-          # Create a note for the pitch that is now ending.
-          pitch_start_step, pitch_velocity = pitch_start_steps_and_velocities[
-              event.event_value][0]
-          pitch_start_steps_and_velocities[event.event_value] = (
-              pitch_start_steps_and_velocities[event.event_value][1:])
-          if step == pitch_start_step:
-            tf.logging.debug(
-                'Ignoring note with zero duration at step %d' % step)
-            continue
-          note = sequence.notes.add()
-          note.start_time = (pitch_start_step * seconds_per_step +
-                             sequence_start_time)
-          note.end_time = step * seconds_per_step + sequence_start_time
-          if (max_note_duration and
-              note.end_time - note.start_time > max_note_duration):
-            note.end_time = note.start_time + max_note_duration
-          note.pitch = event.event_value
-          note.velocity = pitch_velocity
-          note.instrument = instrument
-          note.program = program
-          note.is_drum = is_drum
-          if note.end_time > sequence.total_time:
-            sequence.total_time = note.end_time
-      elif event.event_type == PerformanceEvent.TIME_SHIFT:
-        step += event.event_value
-      elif event.event_type == PerformanceEvent.VELOCITY:
-        assert self._num_velocity_bins
-        velocity = velocity_bin_to_velocity(
-            event.event_value, self._num_velocity_bins)
-      else:
-        raise ValueError('Unknown event type: %s' % event.event_type)
-
-    # There could be remaining pitches that were never ended. End them now
-    # and create notes.
-    for pitch in pitch_start_steps_and_velocities:
-      for pitch_start_step, pitch_velocity in pitch_start_steps_and_velocities[
-          pitch]:
-        if step == pitch_start_step:
-          tf.logging.debug(
-              'Ignoring note with zero duration at step %d' % step)
-          continue
-        note = sequence.notes.add()
-        note.start_time = (pitch_start_step * seconds_per_step +
-                           sequence_start_time)
-        note.end_time = step * seconds_per_step + sequence_start_time
-        if (max_note_duration and
-            note.end_time - note.start_time > max_note_duration):
-          note.end_time = note.start_time + max_note_duration
-        note.pitch = pitch
-        note.velocity = pitch_velocity
-        note.instrument = instrument
-        note.program = program
-        note.is_drum = is_drum
-        if note.end_time > sequence.total_time:
-          sequence.total_time = note.end_time
+    event_types, event_values = unpack_event_codes(self.event_codes)
+    unknown = ((event_types != PerformanceEvent.NOTE_ON) &
+               (event_types != PerformanceEvent.NOTE_OFF) &
+               (event_types != PerformanceEvent.TIME_SHIFT) &
+               (event_types != PerformanceEvent.VELOCITY))
+    if np.any(unknown):
+      raise ValueError('Unknown event type: %s' % event_types[unknown][0])
+
+    shift_steps = self._time_shift_steps()
+    event_steps = np.cumsum(shift_steps) - shift_steps
+    step = int(shift_steps.sum())
+
+    # The velocity of each event is set by the most recent VELOCITY event.
+    is_velocity = event_types == PerformanceEvent.VELOCITY
+    event_velocities = np.full(len(event_types), velocity, np.int64)
+    if np.any(is_velocity):
+      assert self._num_velocity_bins
+      last_velocity = np.maximum.accumulate(
+          np.where(is_velocity, np.arange(len(event_types)), -1))
+      has_last_velocity = last_velocity >= 0
+      event_velocities[has_last_velocity] = velocity_bin_to_velocity(
+          event_values[last_velocity[has_last_velocity]],
+          self._num_velocity_bins)
+
+    # Group note events by pitch, in order within each pitch.
+    positions = np.flatnonzero((event_types == PerformanceEvent.NOTE_ON) |
+                               (event_types == PerformanceEvent.NOTE_OFF))
+    positions = positions[np.argsort(event_values[positions], kind='mergesort')]
+    pitches = event_values[positions]
+    is_onset = event_types[positions] == PerformanceEvent.NOTE_ON
+    is_group_start = np.ones(len(pitches), dtype=bool)
+    is_group_start[1:] = pitches[1:] != pitches[:-1]
+    group_ids = np.cumsum(is_group_start) - 1
+    group_starts = np.flatnonzero(is_group_start)
+
+    def grouped_cumsum(values):
+      cumsum = np.cumsum(values)
+      return cumsum - (cumsum - values)[group_starts][group_ids]
+
+    # Each pitch is a FIFO of start steps, so the k-th matched NOTE_OFF of a
+    # pitch ends its k-th NOTE_ON. A NOTE_OFF is unmatched (and ignored) when
+    # the FIFO is empty, which is when the running count of onsets minus
+    # offsets reaches a new minimum below zero.
+    pending = grouped_cumsum(np.where(is_onset, 1, -1))
+    group_offsets = group_ids * (2 * len(positions) + 2)
+    min_pending = np.minimum.accumulate(pending - group_offsets) + group_offsets
+    previous_min_pending = np.zeros_like(min_pending)
+    previous_min_pending[1:] = min_pending[:-1]
+    previous_min_pending[is_group_start] = 0
+    is_matched_offset = ~is_onset & (
+        pending >= np.minimum(previous_min_pending, 0))
+
+    onset_ranks = grouped_cumsum(is_onset) - 1
+    offset_ranks = grouped_cumsum(is_matched_offset) - 1
+    onsets = np.flatnonzero(is_onset)
+    num_group_onsets = np.bincount(group_ids[onsets],
+                                   minlength=len(group_starts))
+    group_onset_starts = np.cumsum(num_group_onsets) - num_group_onsets
+
+    # Notes ended by a NOTE_OFF, in event order.
+    offsets = np.flatnonzero(is_matched_offset)
+    offsets = offsets[np.argsort(positions[offsets], kind='mergesort')]
+    ended_onsets = onsets[
+        group_onset_starts[group_ids[offsets]] + offset_ranks[offsets]]
+    # Notes never ended, in order of each pitch's first event.
+    num_group_offsets = np.bincount(group_ids[offsets],
+                                    minlength=len(group_starts))
+    unended_onsets = onsets[
+        onset_ranks[onsets] >= num_group_offsets[group_ids[onsets]]]
+    unended_onsets = unended_onsets[np.argsort(
+        positions[group_starts][group_ids[unended_onsets]], kind='mergesort')]
+
+    onsets = np.concatenate([ended_onsets, unended_onsets])
+    start_steps = event_steps[positions[onsets]]
+    end_steps = np.concatenate(
+        [event_steps[positions[offsets]],
+         np.full(len(unended_onsets), step, np.int64)])
+    nonzero = start_steps != end_steps
+    onsets = onsets[nonzero]
+    start_steps = start_steps[nonzero]
+    end_steps = end_steps[nonzero]
+
+    start_times = start_steps * seconds_per_step + sequence_start_time
+    end_times = end_steps * seconds_per_step + sequence_start_time
+    if max_note_duration:
+      end_times = np.where(end_times - start_times > max_note_duration,
+                           start_times + max_note_duration, end_times)
+    for note_pitch, note_velocity, start_time, end_time in zip(
+        pitches[onsets].tolist(),
+        event_velocities[positions[onsets]].tolist(),
+        start_times.tolist(), end_times.tolist()):
+      sequence.notes.add(
+          pitch=note_pitch, velocity=note_velocity, start_time=start_time,
+          end_time=end_time, instrument=instrument, program=program,
+          is_drum=is_drum)
+    if len(end_times):  # pylint:disable=g-explicit-length-test,len-as-condition
+      sequence.total_time = max(0.0, float(end_times.max()))
 
     return sequence
 
@@ -551,7 +883,7 @@ class Performance(BasePerformance):
 
     else:
       self._steps_per_second = steps_per_second
-      self._events = []
+      self._events = PerformanceEventArray()
 
     super(Performance, self).__init__(
         start_step=start_step,
@@ -644,7 +976,7 @@ class MetricPerformance(BasePerformance):
 
     else:
       self._steps_per_quarter = steps_per_quarter
-      self._events = []
+      self._events = PerformanceEventArray()
 
     super(MetricPerformance, self).__init__(
         start_step=start_step,
@@ -14,10 +14,13 @@
 
 """Tests for performance_lib."""
 
+import copy
+
 from magenta.music import performance_lib
 from magenta.music import sequences_lib
 from magenta.music import testing_lib
 from magenta.protobuf import music_pb2
+import numpy as np
 import tensorflow as tf
 
 
@@ -185,6 +188,105 @@ class PerformanceLibTest(tf.test.TestCase):
     self.assertIsNone(performance.program)
     self.assertIsNone(performance.is_drum)
 
+  def testPerformanceEventArray(self):
+    pe = performance_lib.PerformanceEvent
+    events = [pe(pe.NOTE_ON, 60), pe(pe.TIME_SHIFT, 100), pe(pe.VELOCITY, 3)]
+    event_array = performance_lib.PerformanceEventArray()
+    for event in events * 10:
+      event_array.append(event)
+
+    self.assertEqual(30, len(event_array))
+    self.assertEqual(events * 10, list(event_array))
+    self.assertEqual(pe(pe.VELOCITY, 3), event_array[-1])
+    self.assertEqual(events[1:], list(event_array[1:3]))
+    self.assertEqual([pe.NOTE_ON, pe.TIME_SHIFT, pe.VELOCITY],
+                     event_array.event_types[:3].tolist())
+    self.assertEqual([60, 100, 3], event_array.event_values[:3].tolist())
+    self.assertEqual(
+        performance_lib.pack_events(events).tolist(),
+        event_array.event_codes[:3].tolist())
+
+    event_array[0] = pe(pe.NOTE_OFF, 61)
+    self.assertEqual(pe(pe.NOTE_OFF, 61), event_array[0])
+    self.assertEqual(pe(pe.VELOCITY, 3), event_array.pop())
+    self.assertEqual(29, len(event_array))
+
+  def testPerformanceEventArrayCopiesShareHistory(self):
+    pe = performance_lib.PerformanceEvent
+    events = [pe(pe.NOTE_ON, 60), pe(pe.TIME_SHIFT, 100), pe(pe.VELOCITY, 3)]
+    event_array = performance_lib.PerformanceEventArray()
+    for event in events:
+      event_array.append(event)
+
+    event_array_copy = copy.deepcopy(event_array)
+    self.assertTrue(np.shares_memory(event_array.event_codes,
+                                     event_array_copy.event_codes))
+
+    event_array.append(pe(pe.NOTE_OFF, 60))
+    event_array_copy[-1] = pe(pe.VELOCITY, 4)
+    event_array_copy.append(pe(pe.NOTE_ON, 62))
+    self.assertEqual(events + [pe(pe.NOTE_OFF, 60)], list(event_array))
+    self.assertEqual(events[:2] + [pe(pe.VELOCITY, 4), pe(pe.NOTE_ON, 62)],
+                     list(event_array_copy))
+
+    self.assertEqual(pe(pe.NOTE_ON, 62), event_array_copy.pop())
+    self.assertEqual(pe(pe.VELOCITY, 4), event_array_copy.pop())
+    self.assertEqual(pe(pe.TIME_SHIFT, 100), event_array_copy.pop())
+    self.assertEqual(events[:1], list(event_array_copy))
+    self.assertEqual(events + [pe(pe.NOTE_OFF, 60)], list(event_array))
+
+  def testNoteSequenceToEventCodes(self):
+    testing_lib.add_track_to_sequence(
+        self.note_sequence, 0,
+        [(60, 100, 0.0, 4.0), (64, 100, 0.0, 3.0), (67, 127, 1.0, 2.0),
+         (62, 80, 2.504, 2.504), (60, 90, 6.0, 7.5)])
+    quantized_sequence = sequences_lib.quantize_note_sequence_absolute(
+        self.note_sequence, steps_per_second=100)
+    for num_velocity_bins in [0, 32]:
+      performance = performance_lib.Performance(
+          quantized_sequence, num_velocity_bins=num_velocity_bins)
+      event_codes = performance_lib.note_sequence_to_event_codes(
+          self.note_sequence, steps_per_second=100,
+          num_velocity_bins=num_velocity_bins)
+      self.assertEqual(performance.event_codes.tolist(), event_codes.tolist())
+
+    self.note_sequence.notes[0].start_time = -1.0
+    with self.assertRaises(sequences_lib.NegativeTimeError):
+      performance_lib.note_sequence_to_event_codes(
+          self.note_sequence, steps_per_second=100)
+
+  def testToSequenceWithOverlappingNotes(self):
+    performance = performance_lib.Performance(
+        steps_per_second=100, num_velocity_bins=127)
+
+    pe = performance_lib.PerformanceEvent
+    perf_events = [
+        pe(pe.NOTE_OFF, 64),  # Was not started, should be ignored.
+        pe(pe.VELOCITY, 100),
+        pe(pe.NOTE_ON, 60),
+        pe(pe.NOTE_ON, 64),
+        pe(pe.TIME_SHIFT, 50),
+        pe(pe.VELOCITY, 80),
+        pe(pe.NOTE_ON, 60),
+        pe(pe.TIME_SHIFT, 50),
+        pe(pe.NOTE_OFF, 60),
+        pe(pe.NOTE_OFF, 64),
+        pe(pe.TIME_SHIFT, 50),
+        pe(pe.NOTE_OFF, 64),  # Already ended, should be ignored.
+        pe(pe.NOTE_ON, 67),
+    ]
+    for event in perf_events:
+      performance.append(event)
+
+    performance_ns = performance.to_sequence()
+
+    # Notes are ended first-in first-out, and notes still sounding at the end
+    # are ended there.
+    testing_lib.add_track_to_sequence(
+        self.note_sequence, 0,
+        [(60, 100, 0.0, 1.0), (64, 100, 0.0, 1.0), (60, 80, 0.5, 1.5)])
+    self.assertEqual(self.note_sequence, performance_ns)
+
   def testToSequence(self):
     testing_lib.add_track_to_sequence(
         self.note_sequence, 0,
@@ -14,10 +14,10 @@
 
 """Defines sequence of notes objects for creating datasets."""
 
+import bisect
 import collections
 import copy
 import itertools
-import math
 import operator
 import random
 
@@ -124,8 +124,57 @@ def trim_note_sequence(sequence, start_time, end_time):
   return subsequence
 
 
-def _extract_subsequences(sequence, split_times, sustain_control_number=64):
-  """Extracts multiple subsequences from a NoteSequence.
+# Repeated fields that are filled in separately for each subsequence, and so
+# are left out of the template that subsequences are copied from.
+_SUBSEQUENCE_EVENT_FIELDS = frozenset([
+    'notes', 'time_signatures', 'key_signatures', 'tempos', 'text_annotations',
+    'control_changes', 'pitch_bends'])
+
+
+def _subsequence_template(sequence):
+  """Copies all but the per-subsequence fields of a NoteSequence."""
+  template = music_pb2.NoteSequence()
+  for field, value in sequence.ListFields():
+    if field.name in _SUBSEQUENCE_EVENT_FIELDS:
+      continue
+    if field.label == field.LABEL_REPEATED:
+      getattr(template, field.name).extend(value)
+    elif field.cpp_type == field.CPPTYPE_MESSAGE:
+      getattr(template, field.name).CopyFrom(value)
+    else:
+      setattr(template, field.name, value)
+  template.total_time = 0.0
+  return template
+
+
+def _sort_by_time(events, key=operator.attrgetter('time')):
+  """Returns `events` sorted by time, and the sorted times."""
+  events = sorted(events, key=key)
+  return events, [key(event) for event in events]
+
+
+def _add_events(container, events, time_offset):
+  """Appends copies of `events` to `container`, shifted back by an offset."""
+  for event in events:
+    new_event = container.add()
+    new_event.CopyFrom(event)
+    new_event.time -= time_offset
+
+
+def _add_state_event(container, event):
+  """Appends a copy of `event` to `container`, moved to time zero."""
+  new_event = container.add()
+  new_event.CopyFrom(event)
+  new_event.time = 0.0
+
+
+def _iter_subsequences(sequence, split_times, sustain_control_number=64):
+  """Lazily extracts multiple subsequences from a NoteSequence.
+
+  Each event stream is sorted once, and the events of each subsequence are
+  found by binary search over the sorted event times, so producing a
+  subsequence costs time proportional to its own size rather than to the size
+  of `sequence`.
 
   Args:
     sequence: The NoteSequence to extract subsequences from.
@@ -137,7 +186,7 @@ def _extract_subsequences(sequence, split_times, sustain_control_number=64):
     sustain_control_number: The MIDI control number for sustain pedal.
 
   Returns:
-    A Python list of new NoteSequence containing the subsequences of `sequence`.
+    A generator of new NoteSequences containing the subsequences of `sequence`.
 
   Raises:
     QuantizationStatusError: If the sequence has already been quantized.
@@ -156,161 +205,116 @@ def _extract_subsequences(sequence, split_times, sustain_control_number=64):
   if any(time >= sequence.total_time for time in split_times[:-1]):
     raise ValueError('Cannot extract subsequence past end of sequence.')
 
-  subsequence = music_pb2.NoteSequence()
-  subsequence.CopyFrom(sequence)
+  return _generate_subsequences(sequence, split_times, sustain_control_number)
 
-  subsequence.total_time = 0.0
 
-  del subsequence.notes[:]
-  del subsequence.time_signatures[:]
-  del subsequence.key_signatures[:]
-  del subsequence.tempos[:]
-  del subsequence.text_annotations[:]
-  del subsequence.control_changes[:]
-  del subsequence.pitch_bends[:]
-
-  subsequences = [
-      copy.deepcopy(subsequence) for _ in range(len(split_times) - 1)
-  ]
+def _generate_subsequences(sequence, split_times, sustain_control_number):
+  """Generator for `_iter_subsequences`, which validates the arguments."""
+  template = _subsequence_template(sequence)
 
-  # Extract notes into subsequences.
-  subsequence_index = -1
-  for note in sorted(sequence.notes, key=lambda note: note.start_time):
-    if note.start_time < split_times[0]:
-      continue
-    while (subsequence_index < len(split_times) - 1 and
-           note.start_time >= split_times[subsequence_index + 1]):
-      subsequence_index += 1
-    if subsequence_index == len(split_times) - 1:
-      break
-    subsequences[subsequence_index].notes.extend([note])
-    subsequences[subsequence_index].notes[-1].start_time -= (
-        split_times[subsequence_index])
-    subsequences[subsequence_index].notes[-1].end_time = min(
-        note.end_time,
-        split_times[subsequence_index + 1]) - split_times[subsequence_index]
-    if (subsequences[subsequence_index].notes[-1].end_time >
-        subsequences[subsequence_index].total_time):
-      subsequences[subsequence_index].total_time = (
-          subsequences[subsequence_index].notes[-1].end_time)
-
-  # Extract time signatures, key signatures, tempos, and chord changes (beats
-  # are handled below, other text annotations and pitch bends are deleted).
-  # Additional state events will be added to the beginning of each subsequence.
-
-  events_by_type = [
-      sequence.time_signatures, sequence.key_signatures, sequence.tempos,
-      [
+  notes, note_start_times = _sort_by_time(
+      sequence.notes, key=operator.attrgetter('start_time'))
+
+  # Time signatures, key signatures, tempos, and chord changes are state
+  # events: the most recent one at or before the start of a subsequence is
+  # added to its beginning. Beats are stateless; other text annotations and
+  # pitch bends are deleted.
+  state_events_by_field = [
+      ('time_signatures', _sort_by_time(sequence.time_signatures)),
+      ('key_signatures', _sort_by_time(sequence.key_signatures)),
+      ('tempos', _sort_by_time(sequence.tempos)),
+      ('text_annotations', _sort_by_time(
           annotation for annotation in sequence.text_annotations
-          if annotation.annotation_type == CHORD_SYMBOL
-      ]
+          if annotation.annotation_type == CHORD_SYMBOL)),
   ]
-  new_event_containers = [[s.time_signatures for s in subsequences],
-                          [s.key_signatures for s in subsequences],
-                          [s.tempos for s in subsequences],
-                          [s.text_annotations for s in subsequences]]
-
-  for events, containers in zip(events_by_type, new_event_containers):
-    previous_event = None
-    subsequence_index = -1
-    for event in sorted(events, key=lambda event: event.time):
-      if event.time <= split_times[0]:
-        previous_event = event
-        continue
-      while (subsequence_index < len(split_times) - 1 and
-             event.time > split_times[subsequence_index + 1]):
-        subsequence_index += 1
-        if subsequence_index == len(split_times) - 1:
-          break
-        if previous_event is not None:
-          # Add state event to the beginning of the subsequence.
-          containers[subsequence_index].extend([previous_event])
-          containers[subsequence_index][-1].time = 0.0
-      if subsequence_index == len(split_times) - 1:
-        break
-      # Only add the event if it's actually inside the subsequence (and not on
-      # the boundary with the next one).
-      if event.time < split_times[subsequence_index + 1]:
-        containers[subsequence_index].extend([event])
-        containers[subsequence_index][-1].time -= split_times[subsequence_index]
-      previous_event = event
-    # Add final state event to the beginning of all remaining subsequences.
-    while subsequence_index < len(split_times) - 2:
-      subsequence_index += 1
-      if previous_event is not None:
-        containers[subsequence_index].extend([previous_event])
-        containers[subsequence_index][-1].time = 0.0
-
-  # Copy stateless events to subsequences. Unlike the stateful events above,
-  # stateless events do not have an effect outside of the subsequence in which
-  # they occur.
-  stateless_events_by_type = [[
+  beats, beat_times = _sort_by_time(
       annotation for annotation in sequence.text_annotations
-      if annotation.annotation_type in (BEAT,)
-  ]]
-  new_stateless_event_containers = [[s.text_annotations for s in subsequences]]
-  for events, containers in zip(stateless_events_by_type,
-                                new_stateless_event_containers):
-    subsequence_index = -1
-    for event in sorted(events, key=lambda event: event.time):
-      if event.time < split_times[0]:
-        continue
-      while (subsequence_index < len(split_times) - 1 and
-             event.time >= split_times[subsequence_index + 1]):
-        subsequence_index += 1
-      if subsequence_index == len(split_times) - 1:
-        break
-      containers[subsequence_index].extend([event])
-      containers[subsequence_index][-1].time -= split_times[subsequence_index]
+      if annotation.annotation_type in (BEAT,))
 
-  # Extract sustain pedal events (other control changes are deleted). Sustain
-  # pedal state is maintained per-instrument and added to the beginning of each
-  # subsequence.
-  sustain_events = [
+  # Sustain pedal state is maintained per-instrument, in the order that the
+  # instruments first use the pedal (other control changes are deleted).
+  sustain_events, sustain_times = _sort_by_time(
       cc for cc in sequence.control_changes
-      if cc.control_number == sustain_control_number
-  ]
-  previous_sustain_events = {}
-  subsequence_index = -1
-  for sustain_event in sorted(sustain_events, key=lambda event: event.time):
-    if sustain_event.time <= split_times[0]:
-      previous_sustain_events[sustain_event.instrument] = sustain_event
-      continue
-    while (subsequence_index < len(split_times) - 1 and
-           sustain_event.time > split_times[subsequence_index + 1]):
-      subsequence_index += 1
-      if subsequence_index == len(split_times) - 1:
-        break
-      # Add the current sustain pedal state to the beginning of the subsequence.
-      for previous_sustain_event in previous_sustain_events.values():
-        subsequences[subsequence_index].control_changes.extend(
-            [previous_sustain_event])
-        subsequences[subsequence_index].control_changes[-1].time = 0.0
-    if subsequence_index == len(split_times) - 1:
-      break
-    # Only add the sustain event if it's actually inside the subsequence (and
-    # not on the boundary with the next one).
-    if sustain_event.time < split_times[subsequence_index + 1]:
-      subsequences[subsequence_index].control_changes.extend([sustain_event])
-      subsequences[subsequence_index].control_changes[-1].time -= (
-          split_times[subsequence_index])
-    previous_sustain_events[sustain_event.instrument] = sustain_event
-  # Add final sustain pedal state to the beginning of all remaining
-  # subsequences.
-  while subsequence_index < len(split_times) - 2:
-    subsequence_index += 1
-    for _, previous_sustain_event in previous_sustain_events.items():
-      subsequences[subsequence_index].control_changes.extend(
-          [previous_sustain_event])
-      subsequences[subsequence_index].control_changes[-1].time = 0.0
-
-  # Set subsequence info for all subsequences.
-  for subsequence, start_time in zip(subsequences, split_times[:-1]):
+      if cc.control_number == sustain_control_number)
+  sustain_events_by_instrument = collections.OrderedDict()
+  for sustain_event in sustain_events:
+    sustain_events_by_instrument.setdefault(
+        sustain_event.instrument, []).append(sustain_event)
+  sustain_times_by_instrument = dict(
+      (instrument, [event.time for event in events])
+      for instrument, events in sustain_events_by_instrument.items())
+
+  for start_time, end_time in zip(split_times[:-1], split_times[1:]):
+    subsequence = music_pb2.NoteSequence()
+    subsequence.CopyFrom(template)
+
+    # Notes starting inside the subsequence are included and truncated at its
+    # end.
+    for note in notes[bisect.bisect_left(note_start_times, start_time):
+                      bisect.bisect_left(note_start_times, end_time)]:
+      new_note = subsequence.notes.add()
+      new_note.CopyFrom(note)
+      new_note.start_time -= start_time
+      new_note.end_time = min(note.end_time, end_time) - start_time
+      if new_note.end_time > subsequence.total_time:
+        subsequence.total_time = new_note.end_time
+
+    # Only events strictly inside the subsequence (and not on the boundary
+    # with the previous or next one) are added, after the state event.
+    for field_name, (events, times) in state_events_by_field:
+      container = getattr(subsequence, field_name)
+      first = bisect.bisect_right(times, start_time)
+      if first > 0:
+        _add_state_event(container, events[first - 1])
+      _add_events(container, events[first:bisect.bisect_left(times, end_time)],
+                  start_time)
+
+    _add_events(subsequence.text_annotations,
+                beats[bisect.bisect_left(beat_times, start_time):
+                      bisect.bisect_left(beat_times, end_time)],
+                start_time)
+
+    for instrument, events in sustain_events_by_instrument.items():
+      first = bisect.bisect_right(
+          sustain_times_by_instrument[instrument], start_time)
+      if first > 0:
+        _add_state_event(subsequence.control_changes, events[first - 1])
+    _add_events(subsequence.control_changes,
+                sustain_events[bisect.bisect_right(sustain_times, start_time):
+                               bisect.bisect_left(sustain_times, end_time)],
+                start_time)
+
     subsequence.subsequence_info.start_time_offset = start_time
     subsequence.subsequence_info.end_time_offset = (
         sequence.total_time - start_time - subsequence.total_time)
 
-  return subsequences
+    yield subsequence
+
+
+def _extract_subsequences(sequence, split_times, sustain_control_number=64):
+  """Extracts multiple subsequences from a NoteSequence.
+
+  Args:
+    sequence: The NoteSequence to extract subsequences from.
+    split_times: A Python list of subsequence boundary times. The first
+      subsequence will start at `split_times[0]` and end at `split_times[1]`,
+      the next subsequence will start at `split_times[1]` and end at
+      `split_times[2]`, and so on with the last subsequence ending at
+      `split_times[-1]`.
+    sustain_control_number: The MIDI control number for sustain pedal.
+
+  Returns:
+    A Python list of new NoteSequence containing the subsequences of `sequence`.
+
+  Raises:
+    QuantizationStatusError: If the sequence has already been quantized.
+    ValueError: If there are fewer than 2 split times, or the split times are
+        unsorted, or if any of the subsequences would start past the end of the
+        sequence.
+  """
+  return [subsequence.to_note_sequence() for subsequence in
+          NoteArrays.from_note_sequence(sequence).extract_subsequences(
+              split_times, sustain_control_number)]
 
 
 def extract_subsequence(sequence,
@@ -666,6 +670,40 @@ def steps_per_bar_in_quantized_sequence(note_sequence):
   return steps_per_bar_float
 
 
+def _valid_split_times(note_sequence, hop_size_seconds,
+                       skip_splits_inside_notes):
+  """Returns the subsequence boundary times for `split_note_sequence`."""
+  if isinstance(hop_size_seconds, list):
+    split_times = sorted(hop_size_seconds)
+  else:
+    split_times = np.arange(hop_size_seconds, note_sequence.total_time,
+                            hop_size_seconds)
+
+  valid_split_times = [0.0]
+  if skip_splits_inside_notes:
+    # A split is inside a note if any note starting before it ends after it.
+    notes_by_start_time = sorted(
+        note_sequence.notes, key=lambda note: note.start_time)
+    note_idx = 0
+    latest_end_time = float('-inf')
+    for split_time in split_times:
+      while (note_idx < len(notes_by_start_time) and
+             notes_by_start_time[note_idx].start_time < split_time):
+        latest_end_time = max(latest_end_time,
+                              notes_by_start_time[note_idx].end_time)
+        note_idx += 1
+      if latest_end_time <= split_time:
+        valid_split_times.append(split_time)
+  else:
+    valid_split_times.extend(split_times)
+
+  # Handle the final subsequence.
+  if note_sequence.total_time > valid_split_times[-1]:
+    valid_split_times.append(note_sequence.total_time)
+
+  return valid_split_times
+
+
 def split_note_sequence(note_sequence,
                         hop_size_seconds,
                         skip_splits_inside_notes=False):
@@ -694,40 +732,36 @@ def split_note_sequence(note_sequence,
   Returns:
     A Python list of NoteSequences.
   """
-  notes_by_start_time = sorted(
-      list(note_sequence.notes), key=lambda note: note.start_time)
-  note_idx = 0
-  notes_crossing_split = []
+  return list(split_note_sequence_iterator(
+      note_sequence, hop_size_seconds, skip_splits_inside_notes))
 
-  if isinstance(hop_size_seconds, list):
-    split_times = sorted(hop_size_seconds)
-  else:
-    split_times = np.arange(hop_size_seconds, note_sequence.total_time,
-                            hop_size_seconds)
 
-  valid_split_times = [0.0]
+def split_note_sequence_iterator(note_sequence,
+                                 hop_size_seconds,
+                                 skip_splits_inside_notes=False):
+  """Lazily split one NoteSequence into many at specified time intervals.
 
-  for split_time in split_times:
-    # Update notes crossing potential split.
-    while (note_idx < len(notes_by_start_time) and
-           notes_by_start_time[note_idx].start_time < split_time):
-      notes_crossing_split.append(notes_by_start_time[note_idx])
-      note_idx += 1
-    notes_crossing_split = [
-        note for note in notes_crossing_split if note.end_time > split_time
-    ]
-
-    if not (skip_splits_inside_notes and notes_crossing_split):
-      valid_split_times.append(split_time)
+  Like `split_note_sequence`, but each subsequence is only created when it is
+  needed, so the subsequences of a long NoteSequence don't all have to be held
+  in memory at once.
 
-  # Handle the final subsequence.
-  if note_sequence.total_time > valid_split_times[-1]:
-    valid_split_times.append(note_sequence.total_time)
+  Args:
+    note_sequence: The NoteSequence to split.
+    hop_size_seconds: The hop size, in seconds, at which the NoteSequence will
+      be split. Alternatively, this can be a Python list of times in seconds at
+      which to split the NoteSequence.
+    skip_splits_inside_notes: If True, the NoteSequence will not be split at
+      positions that occur within sustained notes.
 
+  Returns:
+    An iterator over NoteSequences.
+  """
+  valid_split_times = _valid_split_times(
+      note_sequence, hop_size_seconds, skip_splits_inside_notes)
   if len(valid_split_times) > 1:
-    return _extract_subsequences(note_sequence, valid_split_times)
+    return _iter_subsequences(note_sequence, valid_split_times)
   else:
-    return []
+    return iter([])
 
 
 def split_note_sequence_on_time_changes(note_sequence,
@@ -834,81 +868,25 @@ def steps_per_quarter_to_steps_per_second(steps_per_quarter, qpm):
   return steps_per_quarter * qpm / 60.0
 
 
-def _quantize_notes(note_sequence, steps_per_second):
-  """Quantize the notes and chords of a NoteSequence proto in place.
-
-  Note start and end times, and chord times are snapped to a nearby quantized
-  step, and the resulting times are stored in a separate field (e.g.,
-  quantized_start_step). See the comments above `QUANTIZE_CUTOFF` for details on
-  how the quantizing algorithm works.
-
-  Args:
-    note_sequence: A music_pb2.NoteSequence protocol buffer. Will be modified in
-      place.
-    steps_per_second: Each second will be divided into this many quantized time
-      steps.
-
-  Raises:
-    NegativeTimeError: If a note or chord occurs at a negative time.
-  """
-  for note in note_sequence.notes:
-    # Quantize the start and end times of the note.
-    note.quantized_start_step = quantize_to_step(note.start_time,
-                                                 steps_per_second)
-    note.quantized_end_step = quantize_to_step(note.end_time, steps_per_second)
-    if note.quantized_end_step == note.quantized_start_step:
-      note.quantized_end_step += 1
-
-    # Do not allow notes to start or end in negative time.
-    if note.quantized_start_step < 0 or note.quantized_end_step < 0:
-      raise NegativeTimeError(
-          'Got negative note time: start_step = %s, end_step = %s' %
-          (note.quantized_start_step, note.quantized_end_step))
-
-    # Extend quantized sequence if necessary.
-    if note.quantized_end_step > note_sequence.total_quantized_steps:
-      note_sequence.total_quantized_steps = note.quantized_end_step
-
-  # Also quantize control changes and text annotations.
-  for event in itertools.chain(note_sequence.control_changes,
-                               note_sequence.text_annotations):
-    # Quantize the event time, disallowing negative time.
-    event.quantized_step = quantize_to_step(event.time, steps_per_second)
-    if event.quantized_step < 0:
-      raise NegativeTimeError(
-          'Got negative event time: step = %s' % event.quantized_step)
-
-
-def quantize_note_sequence(note_sequence, steps_per_quarter):
-  """Quantize a NoteSequence proto relative to tempo.
-
-  The input NoteSequence is copied and quantization-related fields are
-  populated. Sets the `steps_per_quarter` field in the `quantization_info`
-  message in the NoteSequence.
-
-  Note start and end times, and chord times are snapped to a nearby quantized
-  step, and the resulting times are stored in a separate field (e.g.,
-  quantized_start_step). See the comments above `QUANTIZE_CUTOFF` for details on
-  how the quantizing algorithm works.
+def _quantize_time_changes(qns, steps_per_quarter):
+  """Quantizes the time signatures, tempos and total time of a NoteSequence.
 
   Args:
-    note_sequence: A music_pb2.NoteSequence protocol buffer.
+    qns: The music_pb2.NoteSequence protocol buffer to quantize. Will be
+      modified in place.
     steps_per_quarter: Each quarter note of music will be divided into this many
       quantized time steps.
 
   Returns:
-    A copy of the original NoteSequence, with quantized times added.
+    The number of quantized steps per second.
 
   Raises:
     MultipleTimeSignatureError: If there is a change in time signature
-        in `note_sequence`.
-    MultipleTempoError: If there is a change in tempo in `note_sequence`.
-    BadTimeSignatureError: If the time signature found in `note_sequence`
-        has a 0 numerator or a denominator which is not a power of 2.
-    NegativeTimeError: If a note or chord occurs at a negative time.
+        in `qns`.
+    MultipleTempoError: If there is a change in tempo in `qns`.
+    BadTimeSignatureError: If the time signature found in `qns` has a 0
+        numerator or a denominator which is not a power of 2.
   """
-  qns = copy.deepcopy(note_sequence)
-
   qns.quantization_info.steps_per_quarter = steps_per_quarter
 
   if qns.time_signatures:
@@ -986,9 +964,39 @@ def quantize_note_sequence(note_sequence, steps_per_quarter):
       steps_per_quarter, qns.tempos[0].qpm)
 
   qns.total_quantized_steps = quantize_to_step(qns.total_time, steps_per_second)
-  _quantize_notes(qns, steps_per_second)
+  return steps_per_second
 
-  return qns
+
+def quantize_note_sequence(note_sequence, steps_per_quarter):
+  """Quantize a NoteSequence proto relative to tempo.
+
+  The input NoteSequence is copied and quantization-related fields are
+  populated. Sets the `steps_per_quarter` field in the `quantization_info`
+  message in the NoteSequence.
+
+  Note start and end times, and chord times are snapped to a nearby quantized
+  step, and the resulting times are stored in a separate field (e.g.,
+  quantized_start_step). See the comments above `QUANTIZE_CUTOFF` for details on
+  how the quantizing algorithm works.
+
+  Args:
+    note_sequence: A music_pb2.NoteSequence protocol buffer.
+    steps_per_quarter: Each quarter note of music will be divided into this many
+      quantized time steps.
+
+  Returns:
+    A copy of the original NoteSequence, with quantized times added.
+
+  Raises:
+    MultipleTimeSignatureError: If there is a change in time signature
+        in `note_sequence`.
+    MultipleTempoError: If there is a change in tempo in `note_sequence`.
+    BadTimeSignatureError: If the time signature found in `note_sequence`
+        has a 0 numerator or a denominator which is not a power of 2.
+    NegativeTimeError: If a note or chord occurs at a negative time.
+  """
+  return NoteArrays.from_note_sequence(note_sequence).quantize(
+      steps_per_quarter).to_note_sequence()
 
 
 def quantize_note_sequence_absolute(note_sequence, steps_per_second):
@@ -1016,13 +1024,8 @@ def quantize_note_sequence_absolute(note_sequence, steps_per_second):
   Raises:
     NegativeTimeError: If a note or chord occurs at a negative time.
   """
-  qns = copy.deepcopy(note_sequence)
-  qns.quantization_info.steps_per_second = steps_per_second
-
-  qns.total_quantized_steps = quantize_to_step(qns.total_time, steps_per_second)
-  _quantize_notes(qns, steps_per_second)
-
-  return qns
+  return NoteArrays.from_note_sequence(note_sequence).quantize_absolute(
+      steps_per_second).to_note_sequence()
 
 
 def transpose_note_sequence(ns,
@@ -1050,57 +1053,12 @@ def transpose_note_sequence(ns,
   Raises:
     ChordSymbolError: If a chord symbol is unable to be transposed.
   """
-  if not in_place:
-    new_ns = music_pb2.NoteSequence()
-    new_ns.CopyFrom(ns)
-    ns = new_ns
-
-  new_note_list = []
-  deleted_note_count = 0
-  end_time = 0
-
-  for note in ns.notes:
-    new_pitch = note.pitch + amount
-    if (min_allowed_pitch <= new_pitch <= max_allowed_pitch) or note.is_drum:
-      end_time = max(end_time, note.end_time)
-
-      if not note.is_drum:
-        note.pitch += amount
-
-        # The pitch name, if present, will no longer be valid.
-        note.pitch_name = UNKNOWN_PITCH_NAME
-
-      new_note_list.append(note)
-    else:
-      deleted_note_count += 1
-
-  if deleted_note_count > 0:
-    del ns.notes[:]
-    ns.notes.extend(new_note_list)
-
-  # Since notes were deleted, we may need to update the total time.
-  ns.total_time = end_time
-
-  if transpose_chords:
-    # Also update the chord symbol text annotations. This can raise a
-    # ChordSymbolError if a chord symbol cannot be interpreted.
-    for ta in ns.text_annotations:
-      if ta.annotation_type == CHORD_SYMBOL and ta.text != constants.NO_CHORD:
-        ta.text = chord_symbols_lib.transpose_chord_symbol(ta.text, amount)
+  transposed, deleted_note_count = NoteArrays.from_note_sequence(ns).transpose(
+      amount, min_allowed_pitch, max_allowed_pitch, transpose_chords)
+  if in_place:
+    ns.CopyFrom(transposed.to_note_sequence())
   else:
-    # Remove chord symbol text annotations.
-    text_annotations_to_keep = []
-    for ta in ns.text_annotations:
-      if ta.annotation_type != CHORD_SYMBOL:
-        text_annotations_to_keep.append(ta)
-    if len(text_annotations_to_keep) < len(ns.text_annotations):
-      del ns.text_annotations[:]
-      ns.text_annotations.extend(text_annotations_to_keep)
-
-  # Also transpose key signatures.
-  for ks in ns.key_signatures:
-    ks.key = (ks.key + amount) % 12
-
+    ns = transposed.to_note_sequence()
   return ns, deleted_note_count
 
 
@@ -1233,37 +1191,11 @@ def stretch_note_sequence(note_sequence, stretch_factor, in_place=False):
     QuantizationStatusError: If the `note_sequence` is quantized. Only
         unquantized NoteSequences can be stretched.
   """
-  if is_quantized_sequence(note_sequence):
-    raise QuantizationStatusError(
-        'Can only stretch unquantized NoteSequence.')
-
+  stretched_sequence = NoteArrays.from_note_sequence(note_sequence).stretch(
+      stretch_factor).to_note_sequence()
   if in_place:
-    stretched_sequence = note_sequence
-  else:
-    stretched_sequence = music_pb2.NoteSequence()
-    stretched_sequence.CopyFrom(note_sequence)
-
-  if stretch_factor == 1.0:
-    return stretched_sequence
-
-  # Stretch all notes.
-  for note in stretched_sequence.notes:
-    note.start_time *= stretch_factor
-    note.end_time *= stretch_factor
-  stretched_sequence.total_time *= stretch_factor
-
-  # Stretch all other event times.
-  events = itertools.chain(
-      stretched_sequence.time_signatures, stretched_sequence.key_signatures,
-      stretched_sequence.tempos, stretched_sequence.pitch_bends,
-      stretched_sequence.control_changes, stretched_sequence.text_annotations)
-  for event in events:
-    event.time *= stretch_factor
-
-  # Stretch tempos.
-  for tempo in stretched_sequence.tempos:
-    tempo.qpm /= stretch_factor
-
+    note_sequence.CopyFrom(stretched_sequence)
+    return note_sequence
   return stretched_sequence
 
 
@@ -1427,16 +1359,6 @@ def rectify_beats(sequence, beats_per_minute):
                                        rectified_beat_times]).T
 
 
-# Constants for processing the note/sustain stream.
-# The order here matters because we we want to process 'on' events before we
-# process 'off' events, and we want to process sustain events before note
-# events.
-_SUSTAIN_ON = 0
-_SUSTAIN_OFF = 1
-_NOTE_ON = 2
-_NOTE_OFF = 3
-
-
 def apply_sustain_control_changes(note_sequence, sustain_control_number=64):
   """Returns a new NoteSequence with sustain pedal control changes applied.
 
@@ -1461,99 +1383,9 @@ def apply_sustain_control_changes(note_sequence, sustain_control_number=64):
     QuantizationStatusError: If `note_sequence` is quantized. Sustain can
         only be applied to unquantized note sequences.
   """
-  if is_quantized_sequence(note_sequence):
-    raise QuantizationStatusError(
-        'Can only apply sustain to unquantized NoteSequence.')
-
-  sequence = copy.deepcopy(note_sequence)
-
-  # Sort all note on/off and sustain on/off events.
-  events = []
-  events.extend([(note.start_time, _NOTE_ON, note) for note in sequence.notes])
-  events.extend([(note.end_time, _NOTE_OFF, note) for note in sequence.notes])
-
-  for cc in sequence.control_changes:
-    if cc.control_number != sustain_control_number:
-      continue
-    value = cc.control_value
-    if value < 0 or value > 127:
-      tf.logging.warn('Sustain control change has out of range value: %d',
-                      value)
-    if value >= 64:
-      events.append((cc.time, _SUSTAIN_ON, cc))
-    elif value < 64:
-      events.append((cc.time, _SUSTAIN_OFF, cc))
-
-  # Sort, using the event type constants to ensure the order events are
-  # processed.
-  events.sort(key=operator.itemgetter(0))
-
-  # Lists of active notes, keyed by instrument.
-  active_notes = collections.defaultdict(list)
-  # Whether sustain is active for a given instrument.
-  sus_active = collections.defaultdict(lambda: False)
-
-  # Iterate through all sustain on/off and note on/off events in order.
-  time = 0
-  for time, event_type, event in events:
-    if event_type == _SUSTAIN_ON:
-      sus_active[event.instrument] = True
-    elif event_type == _SUSTAIN_OFF:
-      sus_active[event.instrument] = False
-      # End all notes for the instrument that were being extended.
-      new_active_notes = []
-      for note in active_notes[event.instrument]:
-        if note.end_time < time:
-          # This note was being extended because of sustain.
-          # Update the end time and don't keep it in the list.
-          note.end_time = time
-          if time > sequence.total_time:
-            sequence.total_time = time
-        else:
-          # This note is actually still active, keep it.
-          new_active_notes.append(note)
-      active_notes[event.instrument] = new_active_notes
-    elif event_type == _NOTE_ON:
-      if sus_active[event.instrument]:
-        # If sustain is on, end all previous notes with the same pitch.
-        new_active_notes = []
-        for note in active_notes[event.instrument]:
-          if note.pitch == event.pitch:
-            note.end_time = time
-            if note.start_time == note.end_time:
-              # This note now has no duration because another note of the same
-              # pitch started at the same time. Only one of these notes should
-              # be preserved, so delete this one.
-              # TODO(fjord): A more correct solution would probably be to
-              # preserve both notes and make the same duration, but that is a
-              # little more complicated to implement. Will keep this solution
-              # until we find that we need the more complex one.
-              sequence.notes.remove(note)
-          else:
-            new_active_notes.append(note)
-        active_notes[event.instrument] = new_active_notes
-      # Add this new note to the list of active notes.
-      active_notes[event.instrument].append(event)
-    elif event_type == _NOTE_OFF:
-      if sus_active[event.instrument]:
-        # Note continues until another note of the same pitch or sustain ends.
-        pass
-      else:
-        # Remove this particular note from the active list.
-        # It may have already been removed if a note of the same pitch was
-        # played when sustain was active.
-        if event in active_notes[event.instrument]:
-          active_notes[event.instrument].remove(event)
-    else:
-      raise AssertionError('Invalid event_type: %s' % event_type)
-
-  # End any notes that were still active due to sustain.
-  for instrument in active_notes.values():
-    for note in instrument:
-      note.end_time = time
-      sequence.total_time = time
-
-  return sequence
+  return NoteArrays.from_note_sequence(
+      note_sequence).apply_sustain_control_changes(
+          sustain_control_number).to_note_sequence()
 
 
 def infer_dense_chords_for_sequence(sequence,
@@ -1648,6 +1480,70 @@ Pianoroll = collections.namedtuple(  # pylint:disable=invalid-name
      'offsets', 'control_changes'])
 
 
+def _expand_slices(starts, ends, length):
+  """Expands per-note slices `[start:end]` of a sequence into index arrays.
+
+  Slice bounds are interpreted as Python would for a sequence of `length`
+  items, including negative and out of range bounds.
+
+  Args:
+    starts: An int array of slice starts, one per note.
+    ends: An int array of slice ends, one per note.
+    length: The length of the sequence being sliced.
+
+  Returns:
+    notes: For each index covered by a slice, the index of its note.
+    indices: The covered indices, grouped by note in note order.
+    positions: The position of each index within its note's slice.
+  """
+  starts = np.where(starts < 0, np.maximum(starts + length, 0),
+                    np.minimum(starts, length))
+  ends = np.where(ends < 0, np.maximum(ends + length, 0),
+                  np.minimum(ends, length))
+  lengths = np.maximum(ends - starts, 0)
+  notes = np.repeat(np.arange(len(starts)), lengths)
+  positions = np.arange(len(notes)) - np.repeat(np.cumsum(lengths) - lengths,
+                                                lengths)
+  return notes, starts[notes] + positions, positions
+
+
+def _assign_in_order(target, columns, assignments):
+  """Performs element assignments to a 2D array as a sequence of notes would.
+
+  Equivalent to looping over the notes in order and, for each note, making its
+  assignments from each entry of `assignments` in turn, so that where several
+  assignments hit the same element the last one wins.
+
+  Args:
+    target: The 2D array to assign into.
+    columns: An int array giving the column of `target` for each note.
+    assignments: A list of `(notes, rows, values)` tuples of equal-length
+        arrays, each describing element assignments of `values` to
+        `target[rows, columns[notes]]`. Within each tuple, assignments for
+        the same note are in the order they are made.
+  """
+  notes = np.concatenate([a[0] for a in assignments]).astype(np.int64)
+  rows = np.concatenate([a[1] for a in assignments]).astype(np.int64)
+  values = np.concatenate([a[2] for a in assignments])
+  if not len(notes):  # pylint: disable=g-explicit-length-test
+    return
+  steps = np.concatenate(
+      [np.full(len(a[0]), i) for i, a in enumerate(assignments)])
+  rows = np.where(rows < 0, rows + target.shape[0], rows)
+  if np.any((rows < 0) | (rows >= target.shape[0])):
+    raise IndexError('Row index out of range for array with %d rows' %
+                     target.shape[0])
+  flat_indices = np.ravel_multi_index((rows, columns[notes]), target.shape)
+
+  # Order the assignments as the loop would make them, then keep the last one
+  # for each element.
+  order = np.lexsort((steps, notes))
+  flat_indices = flat_indices[order][::-1]
+  values = values[order][::-1]
+  _, last = np.unique(flat_indices, return_index=True)
+  target.flat[flat_indices[last]] = values[last]
+
+
 def sequence_to_pianoroll(
     sequence,
     frames_per_second,
@@ -1709,103 +1605,142 @@ def sequence_to_pianoroll(
     control_changes: Control change onsets as a 2D array (time, control number)
       with 0 when there is no onset and (control_value + 1) when there is.
   """
-  roll = np.zeros((int(sequence.total_time * frames_per_second + 1),
-                   max_pitch - min_pitch + 1),
-                  dtype=np.float32)
+  num_frames = int(sequence.total_time * frames_per_second + 1)
+  num_pitches = max_pitch - min_pitch + 1
+  roll = np.zeros((num_frames, num_pitches), dtype=np.float32)
 
   roll_weights = np.ones_like(roll)
 
   onsets = np.zeros_like(roll)
   offsets = np.zeros_like(roll)
 
-  control_changes = np.zeros(
-      (int(sequence.total_time * frames_per_second + 1), 128), dtype=np.int32)
+  control_changes = np.zeros((num_frames, 128), dtype=np.int32)
 
-  def frames_from_times(start_time, end_time):
-    """Converts start/end times to start/end frames."""
+  def frames_from_times(start_times, end_times):
+    """Converts arrays of start/end times to start/end frames."""
     # Will round down because note may start or end in the middle of the frame.
-    start_frame = int(start_time * frames_per_second)
-    start_frame_occupancy = (start_frame + 1 - start_time * frames_per_second)
+    start_frames = np.trunc(start_times * frames_per_second).astype(np.int64)
+    start_frame_occupancy = (start_frames + 1 - start_times * frames_per_second)
     # check for > 0.0 to avoid possible numerical issues
-    if (min_frame_occupancy_for_label > 0.0 and
-        start_frame_occupancy < min_frame_occupancy_for_label):
-      start_frame += 1
-
-    end_frame = int(math.ceil(end_time * frames_per_second))
-    end_frame_occupancy = end_time * frames_per_second - start_frame - 1
-    if (min_frame_occupancy_for_label > 0.0 and
-        end_frame_occupancy < min_frame_occupancy_for_label):
-      end_frame -= 1
+    if min_frame_occupancy_for_label > 0.0:
+      start_frames += start_frame_occupancy < min_frame_occupancy_for_label
+
+    end_frames = np.ceil(end_times * frames_per_second).astype(np.int64)
+    end_frame_occupancy = end_times * frames_per_second - start_frames - 1
+    if min_frame_occupancy_for_label > 0.0:
       # can be a problem for very short notes
-      end_frame = max(start_frame, end_frame)
+      end_frames = np.where(
+          end_frame_occupancy < min_frame_occupancy_for_label,
+          np.maximum(start_frames, end_frames - 1), end_frames)
 
-    return start_frame, end_frame
+    return start_frames, end_frames
 
-  velocities_roll = np.zeros_like(roll, dtype=np.float32)
-
-  for note in sorted(sequence.notes, key=lambda n: n.start_time):
+  notes = sorted(sequence.notes, key=lambda n: n.start_time)
+  for note in notes:
     if note.pitch < min_pitch or note.pitch > max_pitch:
       tf.logging.warn('Skipping out of range pitch: %d', note.pitch)
-      continue
-    start_frame, end_frame = frames_from_times(note.start_time, note.end_time)
-
-    # label onset events. Use a window size of onset_window to account of
-    # rounding issue in the start_frame computation.
-    onset_start_time = note.start_time + onset_delay_ms / 1000.
-    onset_end_time = note.end_time + onset_delay_ms / 1000.
-    if onset_mode == 'window':
-      onset_start_frame_without_window, _ = frames_from_times(
-          onset_start_time, onset_end_time)
-
-      onset_start_frame = max(0,
-                              onset_start_frame_without_window - onset_window)
-      onset_end_frame = min(onsets.shape[0],
-                            onset_start_frame_without_window + onset_window + 1)
-    elif onset_mode == 'length_ms':
-      onset_end_time = min(onset_end_time,
-                           onset_start_time + onset_length_ms / 1000.)
-      onset_start_frame, onset_end_frame = frames_from_times(
-          onset_start_time, onset_end_time)
-    else:
-      raise ValueError('Unknown onset mode: {}'.format(onset_mode))
-
-    # label offset events.
-    offset_start_time = min(note.end_time,
-                            sequence.total_time - offset_length_ms / 1000.)
-    offset_end_time = offset_start_time + offset_length_ms / 1000.
-    offset_start_frame, offset_end_frame = frames_from_times(
-        offset_start_time, offset_end_time)
-    offset_end_frame = max(offset_end_frame, offset_start_frame + 1)
-
-    if not onset_overlap:
-      start_frame = onset_end_frame
-      end_frame = max(start_frame + 1, end_frame)
-
-    offsets[offset_start_frame:offset_end_frame, note.pitch - min_pitch] = 1.0
-    onsets[onset_start_frame:onset_end_frame, note.pitch - min_pitch] = 1.0
-    roll[start_frame:end_frame, note.pitch - min_pitch] = 1.0
-
+  notes = [note for note in notes if min_pitch <= note.pitch <= max_pitch]
+  for note in notes:
     if note.velocity > max_velocity:
       raise ValueError('Note velocity exceeds max velocity: %d > %d' %
                        (note.velocity, max_velocity))
 
-    velocities_roll[start_frame:end_frame, note.pitch -
-                    min_pitch] = float(note.velocity) / max_velocity
-    roll_weights[onset_start_frame:onset_end_frame, note.pitch - min_pitch] = (
-        onset_upweight)
-    roll_weights[onset_end_frame:end_frame, note.pitch - min_pitch] = [
-        onset_upweight / x for x in range(1, end_frame - onset_end_frame + 1)
-    ]
-
-    if add_blank_frame_before_onset:
-      if start_frame > 0:
-        roll[start_frame - 1, note.pitch - min_pitch] = 0.0
-        roll_weights[start_frame - 1, note.pitch - min_pitch] = 1.0
+  pitches = np.array([note.pitch - min_pitch for note in notes],
+                     dtype=np.int64)
+  start_times = np.array([note.start_time for note in notes],
+                         dtype=np.float64)
+  end_times = np.array([note.end_time for note in notes], dtype=np.float64)
+  velocities = np.array([float(note.velocity) / max_velocity for note in notes],
+                        dtype=np.float32)
+
+  start_frames, end_frames = frames_from_times(start_times, end_times)
+
+  # label onset events. Use a window size of onset_window to account of
+  # rounding issue in the start_frame computation.
+  onset_start_times = start_times + onset_delay_ms / 1000.
+  onset_end_times = end_times + onset_delay_ms / 1000.
+  if onset_mode == 'window':
+    onset_start_frames_without_window, _ = frames_from_times(
+        onset_start_times, onset_end_times)
+
+    onset_start_frames = np.maximum(
+        0, onset_start_frames_without_window - onset_window)
+    onset_end_frames = np.minimum(
+        onsets.shape[0], onset_start_frames_without_window + onset_window + 1)
+  elif onset_mode == 'length_ms':
+    onset_end_times = np.minimum(onset_end_times,
+                                 onset_start_times + onset_length_ms / 1000.)
+    onset_start_frames, onset_end_frames = frames_from_times(
+        onset_start_times, onset_end_times)
+  else:
+    raise ValueError('Unknown onset mode: {}'.format(onset_mode))
+
+  # label offset events.
+  offset_start_times = np.minimum(
+      end_times, sequence.total_time - offset_length_ms / 1000.)
+  offset_end_times = offset_start_times + offset_length_ms / 1000.
+  offset_start_frames, offset_end_frames = frames_from_times(
+      offset_start_times, offset_end_times)
+  offset_end_frames = np.maximum(offset_end_frames, offset_start_frames + 1)
+
+  if not onset_overlap:
+    start_frames = onset_end_frames
+    end_frames = np.maximum(start_frames + 1, end_frames)
+
+  # Notes are labeled in order of start time, so where notes of the same pitch
+  # overlap, the later note's values win. Onsets and offsets are only ever set
+  # to 1, but the other rolls are assigned through `_assign_in_order` to keep
+  # that behavior.
+  offset_notes, offset_frames, _ = _expand_slices(
+      offset_start_frames, offset_end_frames, num_frames)
+  offsets[offset_frames, pitches[offset_notes]] = 1.0
+  onset_notes, onset_frames, _ = _expand_slices(
+      onset_start_frames, onset_end_frames, num_frames)
+  onsets[onset_frames, pitches[onset_notes]] = 1.0
+
+  active_notes, active_frames, _ = _expand_slices(
+      start_frames, end_frames, num_frames)
+  decay_notes, decay_frames, decay_positions = _expand_slices(
+      onset_end_frames, end_frames, num_frames)
+  # The decaying weights are assigned as a list, which must fit its slice.
+  decay_lengths = np.maximum(0, end_frames - onset_end_frames)
+  decay_slice_lengths = np.bincount(decay_notes, minlength=len(notes))
+  if np.any((decay_slice_lengths != decay_lengths) & (decay_lengths != 1)):
+    raise ValueError('Onset weight decay does not fit in the pianoroll.')
+  decay_weights = (onset_upweight /
+                   (decay_positions + 1).astype(np.float64)).astype(np.float32)
+
+  if add_blank_frame_before_onset:
+    blank_notes = np.where(start_frames > 0)[0]
+    blank_frames = start_frames[blank_notes] - 1
+  else:
+    blank_notes = blank_frames = np.zeros(0, dtype=np.int64)
 
-  for cc in sequence.control_changes:
-    frame, _ = frames_from_times(cc.time, 0)
-    if frame < len(control_changes):
-      control_changes[frame, cc.control_number] = cc.control_value + 1
+  _assign_in_order(
+      roll, pitches,
+      [(active_notes, active_frames, np.ones(len(active_notes))),
+       (blank_notes, blank_frames, np.zeros(len(blank_notes)))])
+  velocities_roll = np.zeros_like(roll, dtype=np.float32)
+  _assign_in_order(
+      velocities_roll, pitches,
+      [(active_notes, active_frames, velocities[active_notes])])
+  _assign_in_order(
+      roll_weights, pitches,
+      [(onset_notes, onset_frames, np.full(len(onset_notes), onset_upweight)),
+       (decay_notes, decay_frames, decay_weights),
+       (blank_notes, blank_frames, np.ones(len(blank_notes)))])
+
+  if sequence.control_changes:
+    cc_frames, _ = frames_from_times(
+        np.array([cc.time for cc in sequence.control_changes]), 0.0)
+    cc_numbers = np.array(
+        [cc.control_number for cc in sequence.control_changes])
+    cc_values = np.array(
+        [cc.control_value + 1 for cc in sequence.control_changes])
+    in_range = np.where(cc_frames < len(control_changes))[0]
+    _assign_in_order(
+        control_changes, cc_numbers,
+        [(in_range, cc_frames[in_range], cc_values[in_range])])
 
   return Pianoroll(
       active=roll,
@@ -1835,15 +1770,8 @@ def pianoroll_to_note_sequence(frames,
   sequence.tempos.add().qpm = qpm
   sequence.ticks_per_quarter = constants.STANDARD_PPQ
 
-  pitch_start_step = {}
-  onset_velocities = velocity * np.ones(
-      constants.MAX_MIDI_PITCH, dtype=np.int32)
-
-  # Add silent frame at the end so we can do a final loop and terminate any
-  # notes that are still active.
+  # Add silent frame at the end so all notes that are still active end there.
   frames = np.append(frames, [np.zeros(frames[0].shape)], 0)
-  if velocity_values is None:
-    velocity_values = velocity * np.ones_like(frames, dtype=np.int32)
 
   if onset_predictions is not None:
     onset_predictions = np.append(onset_predictions,
@@ -1857,63 +1785,590 @@ def pianoroll_to_note_sequence(frames,
     # If the frame and offset are both on, then turn it off
     frames[np.where(np.logical_and(frames > 0, offset_predictions > 0))] = 0
 
-  def end_pitch(pitch, end_frame):
-    """End an active pitch."""
-    start_time = pitch_start_step[pitch] * frame_length_seconds
-    end_time = end_frame * frame_length_seconds
-
-    if (end_time - start_time) * 1000 >= min_duration_ms:
-      note = sequence.notes.add()
-      note.start_time = start_time
-      note.end_time = end_time
-      note.pitch = pitch + min_midi_pitch
-      note.velocity = onset_velocities[pitch]
-      note.instrument = instrument
-      note.program = program
-
-    del pitch_start_step[pitch]
-
-  def unscale_velocity(velocity):
-    """Translates a velocity estimate to a MIDI velocity value."""
-    unscaled = max(min(velocity, 1.), 0) * 80. + 10.
-    if math.isnan(unscaled):
-      return 0
-    return int(unscaled)
-
-  def process_active_pitch(pitch, i):
-    """Process a pitch being active in a given frame."""
-    if pitch not in pitch_start_step:
-      if onset_predictions is not None:
-        # If onset predictions were supplied, only allow a new note to start
-        # if we've predicted an onset.
-        if onset_predictions[i, pitch]:
-          pitch_start_step[pitch] = i
-          onset_velocities[pitch] = unscale_velocity(velocity_values[i, pitch])
-        else:
-          # Even though the frame is active, the onset predictor doesn't
-          # say there should be an onset, so ignore it.
-          pass
-      else:
-        pitch_start_step[pitch] = i
+  active = frames.astype(bool)
+  # Note starts are found by comparing each frame with the previous one, for
+  # which the appended silent frame doubles as the frame before the first.
+  if onset_predictions is not None:
+    # A note only starts on an active frame with an onset. A frame continuing
+    # a run of such frames is already part of the note that started with the
+    # run, so notes start exactly on the first frame of each run, ending any
+    # note of the same pitch that was already active.
+    active_onsets = active & onset_predictions.astype(bool)
+    starts = active_onsets & ~np.roll(active_onsets, 1, axis=0)
+  else:
+    starts = active & ~np.roll(active, 1, axis=0)
+
+  # Work in pitch-major flat indices, so that searching forward from a frame
+  # never leaves its pitch: the last frame of every pitch is inactive.
+  num_frames = len(frames)
+  start_indices = np.flatnonzero(starts.T)
+  inactive_indices = np.flatnonzero(~active.T)
+  end_indices = inactive_indices[
+      np.searchsorted(inactive_indices, start_indices, side='right')]
+  if onset_predictions is not None:
+    # A new onset during a note ends it.
+    next_start_indices = np.append(start_indices[1:], end_indices[-1:])
+    end_indices = np.minimum(end_indices, next_start_indices)
+
+  pitches, start_frames = np.divmod(start_indices, num_frames)
+  end_frames = end_indices - pitches * num_frames
+
+  if onset_predictions is not None:
+    if velocity_values is None:
+      onset_velocities = np.full(len(start_frames), velocity, dtype=np.float64)
     else:
-      if onset_predictions is not None:
-        # pitch is already active, but if this is a new onset, we should end
-        # the note and start a new one.
-        if (onset_predictions[i, pitch] and
-            not onset_predictions[i - 1, pitch]):
-          end_pitch(pitch, i)
-          pitch_start_step[pitch] = i
-          onset_velocities[pitch] = unscale_velocity(velocity_values[i, pitch])
-
-  for i, frame in enumerate(frames):
-    for pitch, active in enumerate(frame):
-      if active:
-        process_active_pitch(pitch, i)
-      elif pitch in pitch_start_step:
-        end_pitch(pitch, i)
+      onset_velocities = np.asarray(
+          velocity_values, dtype=np.float64)[start_frames, pitches]
+    # Translate velocity estimates to MIDI velocity values.
+    onset_velocities = np.clip(onset_velocities, 0, 1.) * 80. + 10.
+    onset_velocities = np.where(np.isnan(onset_velocities), 0,
+                                onset_velocities).astype(np.int64)
+  else:
+    onset_velocities = np.full(len(start_frames), velocity, dtype=np.int64)
+
+  start_times = start_frames * frame_length_seconds
+  end_times = end_frames * frame_length_seconds
+  keep = (end_times - start_times) * 1000 >= min_duration_ms
+
+  # Add notes in the order they end, and by pitch for notes that end together.
+  for i in np.lexsort((pitches, end_frames)):
+    if not keep[i]:
+      continue
+    note = sequence.notes.add()
+    note.start_time = float(start_times[i])
+    note.end_time = float(end_times[i])
+    note.pitch = int(pitches[i]) + min_midi_pitch
+    note.velocity = int(onset_velocities[i])
+    note.instrument = instrument
+    note.program = program
 
   sequence.total_time = len(frames) * frame_length_seconds
   if sequence.notes:
     assert sequence.total_time >= sequence.notes[-1].end_time
 
   return sequence
+
+
+# Columns of the structured arrays in `NoteArrays`, one per proto field.
+NOTE_DTYPE = np.dtype([
+    ('pitch', np.int32), ('pitch_name', np.int32), ('velocity', np.int32),
+    ('start_time', np.float64), ('quantized_start_step', np.int64),
+    ('end_time', np.float64), ('quantized_end_step', np.int64),
+    ('numerator', np.int32), ('denominator', np.int32),
+    ('instrument', np.int32), ('program', np.int32), ('is_drum', np.bool_),
+    ('part', np.int32), ('voice', np.int32)])
+CONTROL_CHANGE_DTYPE = np.dtype([
+    ('time', np.float64), ('quantized_step', np.int64),
+    ('control_number', np.int32), ('control_value', np.int32),
+    ('instrument', np.int32), ('program', np.int32), ('is_drum', np.bool_)])
+TEXT_ANNOTATION_DTYPE = np.dtype([
+    ('time', np.float64), ('quantized_step', np.int64), ('text', object),
+    ('annotation_type', np.int32)])
+
+
+def _messages_to_array(messages, dtype):
+  """Reads a repeated proto field into a structured array, one row each."""
+  get_fields = operator.attrgetter(*dtype.names)
+  return np.array([get_fields(message) for message in messages], dtype=dtype)
+
+
+def _array_to_messages(array, messages):
+  """Appends one message per row of a structured array to a repeated field."""
+  names = array.dtype.names
+  columns = [array[name].tolist() for name in names]
+  for values in zip(*columns):
+    # Fields left at their default values are not serialized, so skipping them
+    # saves time without changing the message.
+    messages.add(**dict((name, value) for name, value in zip(names, values)
+                        if value))
+
+
+def _quantize_times(times, steps_per_second):
+  """Vectorized `quantize_to_step`."""
+  return np.trunc(times * steps_per_second + (1 - QUANTIZE_CUTOFF)).astype(
+      np.int64)
+
+
+def _pedal_down_before(event_times, pedal_down, times):
+  """Returns whether the pedal is down just before each of `times`.
+
+  Args:
+    event_times: The sorted times of the sustain events of one instrument.
+    pedal_down: Whether each sustain event puts the pedal down.
+    times: The times at which to look up the pedal state.
+
+  Returns:
+    A boolean array, True where the latest sustain event strictly before the
+    time puts the pedal down.
+  """
+  previous = np.searchsorted(event_times, times, side='left') - 1
+  return (previous >= 0) & pedal_down[np.maximum(previous, 0)]
+
+
+class NoteArrays(object):
+  """A columnar view of a NoteSequence.
+
+  Notes, control changes and text annotations are held in structured NumPy
+  arrays with one column per proto field (see `NOTE_DTYPE`,
+  `CONTROL_CHANGE_DTYPE` and `TEXT_ANNOTATION_DTYPE`), so transforms can work on
+  whole columns instead of reading and writing proto fields one note at a time.
+  All other fields are kept in `metadata`, a NoteSequence with no notes,
+  control changes or text annotations.
+
+  The transforms return new `NoteArrays`. The proto functions for quantizing,
+  transposing, stretching, splitting and applying sustain convert to
+  `NoteArrays`, apply the transform and convert back, so converting once,
+  applying several transforms, and converting back avoids most of the protobuf
+  overhead of chaining them.
+  """
+
+  def __init__(self, metadata, notes, control_changes, text_annotations):
+    """Constructs a `NoteArrays`.
+
+    Args:
+      metadata: A NoteSequence with every field except notes, control changes
+          and text annotations.
+      notes: A structured array with dtype `NOTE_DTYPE`.
+      control_changes: A structured array with dtype `CONTROL_CHANGE_DTYPE`.
+      text_annotations: A structured array with dtype `TEXT_ANNOTATION_DTYPE`.
+    """
+    self.metadata = metadata
+    self.notes = notes
+    self.control_changes = control_changes
+    self.text_annotations = text_annotations
+
+  @classmethod
+  def from_note_sequence(cls, sequence):
+    """Creates a `NoteArrays` from a NoteSequence proto."""
+    metadata = music_pb2.NoteSequence()
+    metadata.CopyFrom(sequence)
+    metadata.ClearField('notes')
+    metadata.ClearField('control_changes')
+    metadata.ClearField('text_annotations')
+    return cls(
+        metadata,
+        _messages_to_array(sequence.notes, NOTE_DTYPE),
+        _messages_to_array(sequence.control_changes, CONTROL_CHANGE_DTYPE),
+        _messages_to_array(sequence.text_annotations, TEXT_ANNOTATION_DTYPE))
+
+  def to_note_sequence(self):
+    """Returns the NoteSequence proto for these arrays."""
+    sequence = music_pb2.NoteSequence()
+    sequence.CopyFrom(self.metadata)
+    _array_to_messages(self.notes, sequence.notes)
+    _array_to_messages(self.control_changes, sequence.control_changes)
+    _array_to_messages(self.text_annotations, sequence.text_annotations)
+    return sequence
+
+  def __len__(self):
+    return len(self.notes)
+
+  @property
+  def total_time(self):
+    return self.metadata.total_time
+
+  def _replace(self, metadata=None, notes=None, control_changes=None,
+               text_annotations=None):
+    """Returns a new `NoteArrays`, copying the fields that are not replaced."""
+    if metadata is None:
+      metadata = music_pb2.NoteSequence()
+      metadata.CopyFrom(self.metadata)
+    return NoteArrays(
+        metadata,
+        self.notes.copy() if notes is None else notes,
+        (self.control_changes.copy() if control_changes is None
+         else control_changes),
+        (self.text_annotations.copy() if text_annotations is None
+         else text_annotations))
+
+  def _quantize(self, metadata, steps_per_second):
+    """Quantizes the arrays into a copy with already-quantized `metadata`."""
+    notes = self.notes.copy()
+    notes['quantized_start_step'] = _quantize_times(
+        notes['start_time'], steps_per_second)
+    notes['quantized_end_step'] = _quantize_times(
+        notes['end_time'], steps_per_second)
+    notes['quantized_end_step'] += (
+        notes['quantized_end_step'] == notes['quantized_start_step'])
+
+    negative = np.flatnonzero((notes['quantized_start_step'] < 0) |
+                              (notes['quantized_end_step'] < 0))
+    if negative.size:
+      note = notes[negative[0]]
+      raise NegativeTimeError(
+          'Got negative note time: start_step = %s, end_step = %s' %
+          (note['quantized_start_step'], note['quantized_end_step']))
+    if notes.size:
+      metadata.total_quantized_steps = max(
+          metadata.total_quantized_steps,
+          int(notes['quantized_end_step'].max()))
+
+    events = []
+    for array in (self.control_changes, self.text_annotations):
+      array = array.copy()
+      array['quantized_step'] = _quantize_times(array['time'], steps_per_second)
+      negative = np.flatnonzero(array['quantized_step'] < 0)
+      if negative.size:
+        raise NegativeTimeError(
+            'Got negative event time: step = %s' %
+            array['quantized_step'][negative[0]])
+      events.append(array)
+
+    return NoteArrays(metadata, notes, *events)
+
+  def quantize(self, steps_per_quarter):
+    """Quantizes relative to tempo, like `quantize_note_sequence`."""
+    metadata = music_pb2.NoteSequence()
+    metadata.CopyFrom(self.metadata)
+    steps_per_second = _quantize_time_changes(metadata, steps_per_quarter)
+    return self._quantize(metadata, steps_per_second)
+
+  def quantize_absolute(self, steps_per_second):
+    """Quantizes absolute times, like `quantize_note_sequence_absolute`."""
+    metadata = music_pb2.NoteSequence()
+    metadata.CopyFrom(self.metadata)
+    metadata.quantization_info.steps_per_second = steps_per_second
+    metadata.total_quantized_steps = quantize_to_step(
+        metadata.total_time, steps_per_second)
+    return self._quantize(metadata, steps_per_second)
+
+  def transpose(self,
+                amount,
+                min_allowed_pitch=constants.MIN_MIDI_PITCH,
+                max_allowed_pitch=constants.MAX_MIDI_PITCH,
+                transpose_chords=True):
+    """Transposes, like `transpose_note_sequence`.
+
+    Args:
+      amount: Number of half-steps to transpose up or down.
+      min_allowed_pitch: Minimum pitch allowed in the transposed notes. Notes
+        assigned lower pitches will be deleted.
+      max_allowed_pitch: Maximum pitch allowed in the transposed notes. Notes
+        assigned higher pitches will be deleted.
+      transpose_chords: If True, also transpose chord symbol text annotations.
+        If False, chord symbols will be removed.
+
+    Returns:
+      The transposed `NoteArrays` and a count of how many notes were deleted.
+
+    Raises:
+      ChordSymbolError: If a chord symbol is unable to be transposed.
+    """
+    new_pitches = self.notes['pitch'] + amount
+    keep = (((min_allowed_pitch <= new_pitches) &
+             (new_pitches <= max_allowed_pitch)) | self.notes['is_drum'])
+    notes = self.notes[keep]
+    pitched = ~notes['is_drum']
+    notes['pitch'][pitched] += amount
+    notes['pitch_name'][pitched] = UNKNOWN_PITCH_NAME
+
+    metadata = music_pb2.NoteSequence()
+    metadata.CopyFrom(self.metadata)
+    metadata.total_time = max([0] + notes['end_time'].tolist())
+    for ks in metadata.key_signatures:
+      ks.key = (ks.key + amount) % 12
+
+    is_chord = self.text_annotations['annotation_type'] == CHORD_SYMBOL
+    if transpose_chords:
+      text_annotations = self.text_annotations.copy()
+      for i in np.flatnonzero(is_chord):
+        text = text_annotations['text'][i]
+        if text != constants.NO_CHORD:
+          text_annotations['text'][i] = (
+              chord_symbols_lib.transpose_chord_symbol(text, amount))
+    else:
+      text_annotations = self.text_annotations[~is_chord]
+
+    return (self._replace(metadata=metadata, notes=notes,
+                          text_annotations=text_annotations),
+            len(self.notes) - len(notes))
+
+  def stretch(self, stretch_factor):
+    """Stretches all times, like `stretch_note_sequence`."""
+    if is_quantized_sequence(self.metadata):
+      raise QuantizationStatusError(
+          'Can only stretch unquantized NoteSequence.')
+
+    stretched = self._replace()
+    if stretch_factor == 1.0:
+      return stretched
+    metadata = stretched.metadata
+    metadata.total_time *= stretch_factor
+    for event in itertools.chain(
+        metadata.time_signatures, metadata.key_signatures, metadata.tempos,
+        metadata.pitch_bends):
+      event.time *= stretch_factor
+    for tempo in metadata.tempos:
+      tempo.qpm /= stretch_factor
+    stretched.notes['start_time'] *= stretch_factor
+    stretched.notes['end_time'] *= stretch_factor
+    stretched.control_changes['time'] *= stretch_factor
+    stretched.text_annotations['time'] *= stretch_factor
+    return stretched
+
+  def shift(self, shift_seconds):
+    """Shifts all times forward, like `shift_sequence_times`."""
+    metadata = shift_sequence_times(self.metadata, shift_seconds)
+    shifted = self._replace(metadata=metadata)
+    shifted.notes['start_time'] += shift_seconds
+    shifted.notes['end_time'] += shift_seconds
+    shifted.control_changes['time'] += shift_seconds
+    shifted.text_annotations['time'] += shift_seconds
+    return shifted
+
+  def trim(self, start_time, end_time):
+    """Trims notes to a time range, like `trim_note_sequence`."""
+    metadata = trim_note_sequence(self.metadata, start_time, end_time)
+    starts = self.notes['start_time']
+    notes = self.notes[(starts >= start_time) & (starts < end_time)]
+    notes['end_time'] = np.minimum(notes['end_time'], end_time)
+    return self._replace(metadata=metadata, notes=notes)
+
+  def apply_sustain_control_changes(self, sustain_control_number=64):
+    """Applies sustain pedal events, like `apply_sustain_control_changes`.
+
+    Each note is ended by the first of: its own note-off while the pedal is
+    up, the next note of the same pitch and instrument that starts while the
+    pedal is down, or the first pedal release after its note-off. The pedal
+    state at a time is that set by the latest earlier sustain event of the
+    note's instrument, since note events are processed before sustain events
+    at the same time.
+
+    Args:
+      sustain_control_number: The MIDI control number for sustain pedal.
+
+    Returns:
+      A `NoteArrays` with note end times extended to account for sustain.
+
+    Raises:
+      QuantizationStatusError: If the sequence is quantized.
+    """
+    if is_quantized_sequence(self.metadata):
+      raise QuantizationStatusError(
+          'Can only apply sustain to unquantized NoteSequence.')
+
+    sustain_events = self.control_changes[
+        self.control_changes['control_number'] == sustain_control_number]
+    values = sustain_events['control_value']
+    for value in values[(values < 0) | (values > 127)].tolist():
+      tf.logging.warn('Sustain control change has out of range value: %d',
+                      value)
+
+    result = self._replace()
+    if not self.notes.size:
+      return result
+
+    notes = result.notes
+    keep = np.ones(len(notes), dtype=np.bool_)
+    last_event_time = max(notes['start_time'].max(), notes['end_time'].max(),
+                          max([0.0] + sustain_events['time'].tolist()))
+    release_times = []
+    sustained_to_end = False
+
+    for instrument in np.unique(sustain_events['instrument']).tolist():
+      indices = np.flatnonzero(notes['instrument'] == instrument)
+      if not indices.size:
+        continue
+      events = sustain_events[sustain_events['instrument'] == instrument]
+      events = events[np.argsort(events['time'], kind='mergesort')]
+      event_times = events['time']
+      pedal_down = events['control_value'] >= 64
+
+      # Sort the note-ons by pitch, then in the order they are processed.
+      indices = indices[np.lexsort(
+          (indices, notes['start_time'][indices], notes['pitch'][indices]))]
+      pitches = notes['pitch'][indices]
+      start_times = notes['start_time'][indices]
+      end_times = notes['end_time'][indices]
+
+      # A note starting while the pedal is down ends the previous notes of the
+      # same pitch.
+      retriggers = _pedal_down_before(event_times, pedal_down, start_times)
+      positions = np.where(retriggers, np.arange(len(indices)), len(indices))
+      next_positions = np.minimum.accumulate(positions[::-1])[::-1]
+      next_positions = np.append(next_positions[1:], len(indices))
+      retrigger_times = np.where(
+          np.append(pitches, -1)[next_positions] == pitches,
+          np.append(start_times, np.inf)[next_positions], np.inf)
+
+      # Notes whose note-off comes while the pedal is down are held until
+      # the pedal is released.
+      held = (_pedal_down_before(event_times, pedal_down, end_times) &
+              (retrigger_times > end_times))
+      releases = event_times[~pedal_down]
+      next_release_times = np.append(releases, np.inf)[
+          np.searchsorted(releases, end_times, side='right')]
+
+      new_end_times = np.where(
+          held, np.minimum(retrigger_times, next_release_times),
+          np.minimum(retrigger_times, end_times))
+      released = held & (next_release_times < retrigger_times)
+      release_times.extend(next_release_times[released].tolist())
+      unreleased = held & np.isinf(new_end_times)
+      sustained_to_end |= bool(unreleased.any())
+      new_end_times[unreleased] = last_event_time
+      notes['end_time'][indices] = new_end_times
+
+      # A note that another of the same pitch starts with while the pedal is
+      # down is deleted.
+      keep[indices[retrigger_times == start_times]] = False
+
+    if sustained_to_end:
+      result.metadata.total_time = last_event_time
+    else:
+      result.metadata.total_time = max(
+          [result.metadata.total_time] + release_times)
+    result.notes = notes[keep]
+    return result
+
+  def extract_subsequences(self, split_times, sustain_control_number=64):
+    """Extracts subsequences between split times, like `extract_subsequence`.
+
+    Args:
+      split_times: A sorted Python list of subsequence boundary times, as in
+        `split_note_sequence` with a list of split times.
+      sustain_control_number: The MIDI control number for sustain pedal.
+
+    Returns:
+      A Python list of `NoteArrays`, one per subsequence.
+
+    Raises:
+      QuantizationStatusError: If the sequence has already been quantized.
+      ValueError: If there are fewer than 2 split times, or the split times are
+          unsorted, or if any of the subsequences would start past the end of
+          the sequence.
+    """
+    # Time signatures, key signatures, tempos and text annotations are few, so
+    # they are split by the proto implementation.
+    metadata = music_pb2.NoteSequence()
+    metadata.CopyFrom(self.metadata)
+    _array_to_messages(self.text_annotations, metadata.text_annotations)
+    subsequences = list(_iter_subsequences(
+        metadata, split_times, sustain_control_number))
+    split_times = np.asarray(split_times, dtype=np.float64)
+    num_subsequences = len(subsequences)
+
+    # Each note goes in the last subsequence starting at or before it.
+    order = np.argsort(self.notes['start_time'], kind='mergesort')
+    notes = self.notes[order]
+    indices = np.searchsorted(split_times, notes['start_time'],
+                              side='right') - 1
+    in_range = (indices >= 0) & (indices < num_subsequences)
+    notes = notes[in_range]
+    indices = indices[in_range]
+    notes['end_time'] = (np.minimum(notes['end_time'], split_times[indices + 1])
+                         - split_times[indices])
+    notes['start_time'] -= split_times[indices]
+
+    sustain_indices = self._split_sustain_events(
+        split_times, sustain_control_number)
+
+    results = []
+    for i, subsequence in enumerate(subsequences):
+      subsequence_notes = notes[indices == i]
+      subsequence.total_time = max(
+          [0.0] + subsequence_notes['end_time'].tolist())
+      subsequence.subsequence_info.end_time_offset = (
+          self.metadata.total_time - split_times[i] - subsequence.total_time)
+      text_annotations = _messages_to_array(subsequence.text_annotations,
+                                            TEXT_ANNOTATION_DTYPE)
+      subsequence.ClearField('text_annotations')
+
+      control_changes = self.control_changes[
+          [index for index, _ in sustain_indices[i]]]
+      control_changes['time'] = [
+          0.0 if is_state else time - split_times[i]
+          for (_, is_state), time in zip(sustain_indices[i],
+                                         control_changes['time'].tolist())]
+      results.append(NoteArrays(subsequence, subsequence_notes,
+                                control_changes, text_annotations))
+    return results
+
+  def _split_sustain_events(self, split_times, sustain_control_number):
+    """Assigns sustain pedal events to subsequences.
+
+    Follows `_iter_subsequences`: events inside a subsequence are kept, and
+    each subsequence also starts with the latest earlier event per instrument.
+
+    Args:
+      split_times: A sorted array of subsequence boundary times.
+      sustain_control_number: The MIDI control number for sustain pedal.
+
+    Returns:
+      A list with one entry per subsequence, each a list of
+      `(control change index, is_state)` tuples in output order. State events
+      are moved to time zero.
+    """
+    num_subsequences = len(split_times) - 1
+    results = [[] for _ in range(num_subsequences)]
+    is_sustain = (
+        self.control_changes['control_number'] == sustain_control_number)
+    sustain_indices = np.flatnonzero(is_sustain)
+    order = np.argsort(self.control_changes['time'][sustain_indices],
+                       kind='mergesort')
+    sustain_indices = sustain_indices[order].tolist()
+    times = self.control_changes['time'][sustain_indices].tolist()
+    instruments = self.control_changes['instrument'][sustain_indices].tolist()
+    split_times = split_times.tolist()
+
+    previous = collections.OrderedDict()
+    subsequence_index = -1
+    for index, time, instrument in zip(sustain_indices, times, instruments):
+      if time <= split_times[0]:
+        previous[instrument] = index
+        continue
+      while (subsequence_index < num_subsequences and
+             time > split_times[subsequence_index + 1]):
+        subsequence_index += 1
+        if subsequence_index == num_subsequences:
+          break
+        results[subsequence_index].extend(
+            (state, True) for state in previous.values())
+      if subsequence_index == num_subsequences:
+        break
+      if time < split_times[subsequence_index + 1]:
+        results[subsequence_index].append((index, False))
+      previous[instrument] = index
+    while subsequence_index < num_subsequences - 1:
+      subsequence_index += 1
+      results[subsequence_index].extend(
+          (state, True) for state in previous.values())
+    return results
+
+  def split(self, hop_size_seconds, skip_splits_inside_notes=False):
+    """Splits at specified time intervals, like `split_note_sequence`.
+
+    Args:
+      hop_size_seconds: The hop size, in seconds, at which to split.
+        Alternatively, this can be a Python list of times in seconds at which
+        to split.
+      skip_splits_inside_notes: If True, do not split at positions that occur
+        within sustained notes.
+
+    Returns:
+      A Python list of `NoteArrays`.
+    """
+    if isinstance(hop_size_seconds, list):
+      split_times = np.array(sorted(hop_size_seconds), dtype=np.float64)
+    else:
+      split_times = np.arange(hop_size_seconds, self.metadata.total_time,
+                              hop_size_seconds)
+
+    if skip_splits_inside_notes and self.notes.size:
+      # A split is inside a note if any note starting before it ends after it.
+      order = np.argsort(self.notes['start_time'], kind='mergesort')
+      starts = self.notes['start_time'][order]
+      latest_ends = np.maximum.accumulate(self.notes['end_time'][order])
+      num_started = np.searchsorted(starts, split_times, side='left')
+      inside_note = (num_started > 0) & (
+          latest_ends[np.maximum(num_started - 1, 0)] > split_times)
+      split_times = split_times[~inside_note]
+
+    valid_split_times = [0.0] + split_times.tolist()
+    if self.metadata.total_time > valid_split_times[-1]:
+      valid_split_times.append(self.metadata.total_time)
+
+    if len(valid_split_times) > 1:
+      return self.extract_subsequences(valid_split_times)
+    else:
+      return []
@@ -277,6 +277,31 @@ class SequencesLibTest(tf.test.TestCase):
     with self.assertRaises(ValueError):
       sequences_lib.extract_subsequence(sequence, 15.0, 16.0)
 
+  def testSplitNoteSequenceIterator(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(12, 100, 0.01, 8.0), (11, 55, 0.22, 0.50), (40, 45, 2.50, 3.50),
+         (55, 120, 4.0, 4.01), (52, 99, 4.75, 5.0)])
+    testing_lib.add_chords_to_sequence(
+        sequence, [('C', 1.0), ('G7', 2.0), ('F', 4.0)])
+    testing_lib.add_control_changes_to_sequence(
+        sequence, 0, [(0.0, 64, 127), (3.5, 64, 0)])
+
+    subsequences = sequences_lib.split_note_sequence_iterator(
+        sequence, hop_size_seconds=3.0)
+    self.assertFalse(isinstance(subsequences, list))
+    self.assertEqual(
+        sequences_lib.split_note_sequence(sequence, hop_size_seconds=3.0),
+        list(subsequences))
+
+    # Invalid sequences are reported before iteration starts.
+    with self.assertRaises(sequences_lib.QuantizationStatusError):
+      sequences_lib.split_note_sequence_iterator(
+          sequences_lib.quantize_note_sequence(
+              sequence, self.steps_per_quarter),
+          hop_size_seconds=3.0)
+
   def testSplitNoteSequenceWithHopSize(self):
     # Tests splitting a NoteSequence at regular hop size, truncating notes.
     sequence = common_testing_lib.parse_test_proto(
@@ -1959,5 +1984,94 @@ class SequencesLibTest(tf.test.TestCase):
     np.testing.assert_allclose(expected_cc_roll, cc_roll)
 
 
+  def _note_arrays_test_sequence(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(12, 100, 0.01, 10.0), (11, 55, 0.22, 0.50), (40, 45, 2.50, 3.50),
+         (55, 120, 4.0, 4.01), (52, 99, 4.75, 5.0)])
+    testing_lib.add_track_to_sequence(
+        sequence, 1, [(36, 100, 1.0, 1.5), (38, 100, 2.25, 2.5)],
+        is_drum=True)
+    testing_lib.add_control_changes_to_sequence(
+        sequence, 0, [(0.0, 64, 127), (2.0, 64, 0), (4.5, 64, 127)])
+    testing_lib.add_control_changes_to_sequence(
+        sequence, 1, [(1.0, 7, 100), (3.0, 64, 127)])
+    sequence.text_annotations.add(
+        time=1, annotation_type=CHORD_SYMBOL, text='N.C.')
+    sequence.text_annotations.add(
+        time=2, annotation_type=CHORD_SYMBOL, text='E7')
+    sequence.key_signatures.add(
+        time=0, key=music_pb2.NoteSequence.KeySignature.E)
+    sequence.total_time = 10.0
+    return sequence
+
+  def testNoteArraysRoundTrip(self):
+    sequence = self._note_arrays_test_sequence()
+    note_arrays = sequences_lib.NoteArrays.from_note_sequence(sequence)
+    self.assertEqual(7, len(note_arrays))
+    self.assertAllEqual([12, 11, 40, 55, 52, 36, 38],
+                        note_arrays.notes['pitch'])
+    self.assertAllEqual([False] * 5 + [True] * 2, note_arrays.notes['is_drum'])
+    self.assertAllEqual([64, 64, 64, 7, 64],
+                        note_arrays.control_changes['control_number'])
+    self.assertEqual(['N.C.', 'E7'],
+                     note_arrays.text_annotations['text'].tolist())
+    self.assertFalse(note_arrays.metadata.notes)
+    self.assertProtoEquals(sequence, note_arrays.to_note_sequence())
+
+  def testNoteArraysMatchesProtoTransforms(self):
+    sequence = self._note_arrays_test_sequence()
+    note_arrays = sequences_lib.NoteArrays.from_note_sequence(sequence)
+
+    self.assertProtoEquals(
+        sequences_lib.quantize_note_sequence(sequence, 4),
+        note_arrays.quantize(4).to_note_sequence())
+    self.assertProtoEquals(
+        sequences_lib.quantize_note_sequence_absolute(sequence, 100),
+        note_arrays.quantize_absolute(100).to_note_sequence())
+    self.assertProtoEquals(
+        sequences_lib.stretch_note_sequence(sequence, 1.5),
+        note_arrays.stretch(1.5).to_note_sequence())
+    self.assertProtoEquals(
+        sequences_lib.shift_sequence_times(sequence, 2.0),
+        note_arrays.shift(2.0).to_note_sequence())
+    self.assertProtoEquals(
+        sequences_lib.trim_note_sequence(sequence, 1.0, 4.5),
+        note_arrays.trim(1.0, 4.5).to_note_sequence())
+    self.assertProtoEquals(
+        sequences_lib.apply_sustain_control_changes(sequence),
+        note_arrays.apply_sustain_control_changes().to_note_sequence())
+
+    for transpose_chords in (True, False):
+      expected_sequence, expected_deleted = (
+          sequences_lib.transpose_note_sequence(
+              sequence, 30, max_allowed_pitch=80,
+              transpose_chords=transpose_chords))
+      transposed, deleted = note_arrays.transpose(
+          30, max_allowed_pitch=80, transpose_chords=transpose_chords)
+      self.assertProtoEquals(expected_sequence, transposed.to_note_sequence())
+      self.assertEqual(expected_deleted, deleted)
+    self.assertEqual(2, deleted)
+
+    # The original arrays are not modified.
+    self.assertProtoEquals(sequence, note_arrays.to_note_sequence())
+
+  def testNoteArraysSplitMatchesProto(self):
+    sequence = self._note_arrays_test_sequence()
+    note_arrays = sequences_lib.NoteArrays.from_note_sequence(sequence)
+    for hop_size in (1.0, 2.5, [4.25, 0.75, 2.25]):
+      for skip_splits_inside_notes in (False, True):
+        expected_subsequences = sequences_lib.split_note_sequence(
+            sequence, hop_size, skip_splits_inside_notes)
+        subsequences = note_arrays.split(hop_size, skip_splits_inside_notes)
+        self.assertEqual(len(expected_subsequences), len(subsequences))
+        for expected, subsequence in zip(expected_subsequences, subsequences):
+          self.assertProtoEquals(expected, subsequence.to_note_sequence())
+
+    self.assertProtoEquals(
+        sequences_lib.extract_subsequence(sequence, 1.0, 4.5),
+        note_arrays.extract_subsequences([1.0, 4.5])[0].to_note_sequence())
+
 if __name__ == '__main__':
   tf.test.main()
@@ -487,14 +487,13 @@ class DAGPipeline(pipeline.Pipeline):
       depend on implementation. Each output name corresponds to an output
       collection. See get_output_names method.
     """
-    def stats_accumulator(unit, unit_inputs, cumulative_stats):
+    def stats_accumulator(unit, unit_inputs):
       for single_input in unit_inputs:
         results_ = unit.transform(single_input)
-        stats = unit.get_stats()
-        cumulative_stats.extend(stats)
+        self._merge_stats(unit.get_stats())
         yield results_
 
-    stats = []
+    self._reset_stats()
     results = {self.input: [input_object]}
     for unit in self.call_list[1:]:
       # Compute transformation.
@@ -508,12 +507,10 @@ class DAGPipeline(pipeline.Pipeline):
           results[unit] = []
           continue
 
-        unjoined_outputs = list(
-            stats_accumulator(unit, unit_inputs, stats))
+        unjoined_outputs = list(stats_accumulator(unit, unit_inputs))
         unit_outputs = self._join_lists_or_dicts(unjoined_outputs, unit)
       results[unit] = unit_outputs
 
-    self._set_stats(stats)
     return dict((output.name, results[output]) for output in self.outputs)
 
   def _get_outputs_as_signature(self, dependency, outputs):
@@ -45,18 +45,27 @@ class NoteSequencePipeline(pipeline.Pipeline):
 class Splitter(NoteSequencePipeline):
   """A Pipeline that splits NoteSequences at regular intervals."""
 
-  def __init__(self, hop_size_seconds, name=None):
+  def __init__(self, hop_size_seconds, lazy=False, name=None):
     """Creates a Splitter pipeline.
 
     Args:
       hop_size_seconds: Hop size in seconds that will be used to split a
           NoteSequence at regular intervals.
+      lazy: If True, `transform` returns an iterator that creates each split
+          NoteSequence as it is consumed, instead of a list. This streams the
+          splits of long NoteSequences when the Splitter is run directly by
+          `pipeline.run_pipeline_serial` or `pipeline.run_pipeline_parallel`,
+          but cannot be used inside a `DAGPipeline`, which requires lists.
       name: Pipeline name.
     """
     super(Splitter, self).__init__(name=name)
     self._hop_size_seconds = hop_size_seconds
+    self._lazy = lazy
 
   def transform(self, note_sequence):
+    if self._lazy:
+      return sequences_lib.split_note_sequence_iterator(
+          note_sequence, self._hop_size_seconds)
     return sequences_lib.split_note_sequence(
         note_sequence, self._hop_size_seconds)
 
@@ -167,8 +176,8 @@ class TranspositionPipeline(NoteSequencePipeline):
     self._max_pitch = max_pitch
 
   def transform(self, sequence):
-    stats = dict((state_name, statistics.Counter(state_name)) for state_name in
-                 ['skipped_due_to_range_exceeded', 'transpositions_generated'])
+    self._reset_stats()
+    self._increment_stat('skipped_due_to_range_exceeded', 0)
 
     if sequence.key_signatures:
       tf.logging.warn('Key signatures ignored by TranspositionPipeline.')
@@ -182,21 +191,20 @@ class TranspositionPipeline(NoteSequencePipeline):
     for amount in self._transposition_range:
       # Note that transpose is called even with a transpose amount of zero, to
       # ensure that out-of-range pitches are handled correctly.
-      ts = self._transpose(sequence, amount, stats)
+      ts = self._transpose(sequence, amount)
       if ts is not None:
         transposed.append(ts)
 
-    stats['transpositions_generated'].increment(len(transposed))
-    self._set_stats(stats.values())
+    self._increment_stat('transpositions_generated', len(transposed))
     return transposed
 
-  def _transpose(self, ns, amount, stats):
+  def _transpose(self, ns, amount):
     """Transposes a note sequence by the specified amount."""
     ts = copy.deepcopy(ns)
     for note in ts.notes:
       if not note.is_drum:
         note.pitch += amount
         if note.pitch < self._min_pitch or note.pitch > self._max_pitch:
-          stats['skipped_due_to_range_exceeded'].increment()
+          self._increment_stat('skipped_due_to_range_exceeded')
           return None
     return ts
@@ -20,12 +20,21 @@ from __future__ import print_function
 
 import abc
 import inspect
+import multiprocessing
 import os.path
+import random
+import traceback
 
 from magenta.pipelines import statistics
+import numpy as np
 import six
+from six.moves import queue
 import tensorflow as tf
 
+# How often, in seconds, `run_pipeline_parallel` checks that its workers are
+# still alive while waiting on them.
+_WORKER_POLL_SECS = 1.0
+
 
 class InvalidTypeSignatureError(Exception):
   """Thrown when `Pipeline.input_type` or `Pipeline.output_type` is not valid.
@@ -123,6 +132,9 @@ class Pipeline(object):
 
   `Pipeline` implementers should call `_set_stats` from within `transform` to
   set the Statistics that will be returned by the next call to `get_stats`.
+  Alternatively, they can call `_reset_stats` at the start of `transform` and
+  then update the statistics in place with `_increment_stat` and
+  `_merge_stats`, without building a new list of Statistics for every input.
   """
 
   __metaclass__ = abc.ABCMeta
@@ -165,7 +177,7 @@ class Pipeline(object):
     _assert_valid_type_signature(output_type, 'output_type')
     self._input_type = input_type
     self._output_type = output_type
-    self._stats = []
+    self._stats = statistics.StatisticsRegistry()
 
   def __getitem__(self, key):
     return PipelineKey(self, key)
@@ -229,6 +241,43 @@ class Pipeline(object):
     Args:
       stats: An iterable of Statistic objects.
 
+    Raises:
+      InvalidStatisticsError: If `stats` is not iterable, or if any
+          object in the list is not a `Statistic` instance.
+    """
+    self._reset_stats()
+    self._merge_stats(stats)
+
+  def _reset_stats(self):
+    """Clears the current Statistics returned by `get_stats`.
+
+    Implementers of Pipeline that update their statistics with
+    `_increment_stat` or `_merge_stats` should call `_reset_stats` at the start
+    of `transform`.
+    """
+    self._stats = statistics.StatisticsRegistry()
+
+  def _increment_stat(self, name, inc=1):
+    """Increments the `Counter` with the given name in the current Statistics.
+
+    The counter is created if needed, and `self.name` is prepended to its name.
+
+    Args:
+      name: String name of the counter.
+      inc: The amount to increment the counter by.
+    """
+    self._stats.counter(self._name + '_' + name).increment(inc)
+
+  def _merge_stats(self, stats):
+    """Merges Statistics into the current Statistics returned by `get_stats`.
+
+    `self.name` is prepended to the name of each Statistic. Statistics with the
+    same resulting name are merged together.
+
+    Args:
+      stats: An iterable of Statistic objects, for example the result of
+          `get_stats` on another Pipeline.
+
     Raises:
       InvalidStatisticsError: If `stats` is not iterable, or if any
           object in the list is not a `Statistic` instance.
@@ -236,16 +285,12 @@ class Pipeline(object):
     if not hasattr(stats, '__iter__'):
       raise InvalidStatisticsError(
           'Expecting iterable, got type %s' % type(stats))
-    self._stats = [self._prepend_name(stat) for stat in stats]
-
-  def _prepend_name(self, stat):
-    """Returns a copy of `stat` with `self.name` prepended to `stat.name`."""
-    if not isinstance(stat, statistics.Statistic):
-      raise InvalidStatisticsError(
-          'Expecting Statistic object, got %s' % stat)
-    stat_copy = stat.copy()
-    stat_copy.name = self._name + '_' + stat_copy.name
-    return stat_copy
+    stats = list(stats)
+    for stat in stats:
+      if not isinstance(stat, statistics.Statistic):
+        raise InvalidStatisticsError(
+            'Expecting Statistic object, got %s' % stat)
+    self._stats.merge(stats, name_prefix=self._name + '_')
 
   def get_stats(self):
     """Returns Statistics about pipeline runs.
@@ -256,7 +301,7 @@ class Pipeline(object):
     Returns:
       A list of `Statistic` objects.
     """
-    return list(self._stats)
+    return self._stats.values()
 
 
 def file_iterator(root_dir, extension=None, recurse=True):
@@ -311,6 +356,29 @@ def tf_record_iterator(tfrecord_file, proto):
     yield proto.FromString(raw_bytes)
 
 
+def _assert_serializable_output_type(pipeline):
+  """Checks that every output type of `pipeline` can be written to a TFRecord.
+
+  Args:
+    pipeline: A Pipeline instance.
+
+  Raises:
+    ValueError: If any of `pipeline`'s output types do not have a
+        SerializeToString method.
+  """
+  if isinstance(pipeline.output_type, dict):
+    for name, type_ in pipeline.output_type.items():
+      if not hasattr(type_, 'SerializeToString'):
+        raise ValueError(
+            'Pipeline output "%s" does not have method SerializeToString. '
+            'Output type = %s' % (name, pipeline.output_type))
+  else:
+    if not hasattr(pipeline.output_type, 'SerializeToString'):
+      raise ValueError(
+          'Pipeline output type %s does not have method SerializeToString.'
+          % pipeline.output_type)
+
+
 def run_pipeline_serial(pipeline,
                         input_iterator,
                         output_dir,
@@ -340,17 +408,7 @@ def run_pipeline_serial(pipeline,
     ValueError: If any of `pipeline`'s output types do not have a
         SerializeToString method.
   """
-  if isinstance(pipeline.output_type, dict):
-    for name, type_ in pipeline.output_type.items():
-      if not hasattr(type_, 'SerializeToString'):
-        raise ValueError(
-            'Pipeline output "%s" does not have method SerializeToString. '
-            'Output type = %s' % (name, pipeline.output_type))
-  else:
-    if not hasattr(pipeline.output_type, 'SerializeToString'):
-      raise ValueError(
-          'Pipeline output type %s does not have method SerializeToString.'
-          % pipeline.output_type)
+  _assert_serializable_output_type(pipeline)
 
   if not tf.gfile.Exists(output_dir):
     tf.gfile.MakeDirs(output_dir)
@@ -370,23 +428,263 @@ def run_pipeline_serial(pipeline,
 
   total_inputs = 0
   total_outputs = 0
-  stats = []
+  stats = statistics.StatisticsRegistry()
   for input_ in input_iterator:
     total_inputs += 1
     for name, outputs in _guarantee_dict(pipeline.transform(input_),
                                          list(output_names)[0]).items():
       for output in outputs:  # pylint:disable=not-an-iterable
         writers[name].write(output.SerializeToString())
-      total_outputs += len(outputs)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
+        total_outputs += 1
+    stats.merge(pipeline.get_stats())
     if total_inputs % 500 == 0:
       tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
                       total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+      statistics.log_statistics_list(stats.values(), tf.logging.info)
   tf.logging.info('\n\nCompleted.\n')
   tf.logging.info('Processed %d inputs total. Produced %d outputs.',
                   total_inputs, total_outputs)
-  statistics.log_statistics_list(stats, tf.logging.info)
+  statistics.log_statistics_list(stats.values(), tf.logging.info)
+
+
+def _run_pipeline_worker(pipeline, worker_index, num_workers, output_paths,
+                         input_queue, result_queue):
+  """Worker process body for `run_pipeline_parallel`.
+
+  Pulls inputs from `input_queue` until a None sentinel is received, runs
+  `pipeline.transform` on each of them, and writes the outputs to this worker's
+  shard. When done, puts a tuple of (worker_index, total_inputs, total_outputs,
+  stats, error) on `result_queue`, where `error` is a formatted traceback string
+  if the worker failed and None otherwise.
+
+  Args:
+    pipeline: The Pipeline instance to run.
+    worker_index: Index of this worker. Also the index of the shard it writes.
+    num_workers: Total number of workers.
+    output_paths: A dictionary mapping dataset names to shard paths.
+    input_queue: A multiprocessing queue of inputs to `pipeline.transform`.
+    result_queue: A multiprocessing queue the worker results are put on.
+  """
+  # Seed each worker differently, but deterministically, so pipelines that
+  # randomly partition their inputs produce the same shards on every run.
+  random.seed(worker_index)
+  np.random.seed(worker_index)
+
+  total_inputs = 0
+  total_outputs = 0
+  stats = statistics.StatisticsRegistry()
+  error = None
+  writers = {}
+  try:
+    writers = dict((name, tf.python_io.TFRecordWriter(path))
+                   for name, path in output_paths.items())
+    default_name = list(output_paths.keys())[0]
+    while True:
+      input_ = input_queue.get()
+      if input_ is None:
+        break
+      total_inputs += 1
+      for name, outputs in _guarantee_dict(pipeline.transform(input_),
+                                           default_name).items():
+        for output in outputs:  # pylint:disable=not-an-iterable
+          writers[name].write(output.SerializeToString())
+          total_outputs += 1
+      stats.merge(pipeline.get_stats())
+  except Exception:  # pylint:disable=broad-except
+    error = 'Worker %d of %d failed:\n%s' % (
+        worker_index, num_workers, traceback.format_exc())
+    # Drain the queue so the producer never blocks on a dead worker.
+    while input_queue.get() is not None:
+      pass
+  finally:
+    for writer in writers.values():
+      writer.close()
+  result_queue.put(
+      (worker_index, total_inputs, total_outputs, stats.snapshot(), error))
+
+
+def _fork_context():
+  """Returns a multiprocessing context that forks workers when possible."""
+  if not hasattr(multiprocessing, 'get_context'):
+    # Python 2 always forks on POSIX platforms.
+    return multiprocessing
+  try:
+    return multiprocessing.get_context('fork')
+  except ValueError:
+    return multiprocessing.get_context()
+
+
+def _check_worker_alive(worker, worker_index):
+  """Raises a RuntimeError if `worker` has exited."""
+  if not worker.is_alive():
+    raise RuntimeError('Worker %d exited unexpectedly with exit code %s.' %
+                       (worker_index, worker.exitcode))
+
+
+def _put_to_worker(input_queue, input_, worker, worker_index):
+  """Puts `input_` on a worker's bounded queue, failing if the worker dies."""
+  while True:
+    try:
+      input_queue.put(input_, timeout=_WORKER_POLL_SECS)
+      return
+    except queue.Full:
+      _check_worker_alive(worker, worker_index)
+
+
+def _get_worker_results(result_queue, workers):
+  """Collects one result per worker, failing if a worker dies without one.
+
+  Args:
+    result_queue: The multiprocessing queue the workers put their results on.
+    workers: The list of worker processes.
+
+  Returns:
+    The list of worker results, sorted by worker index.
+
+  Raises:
+    RuntimeError: If a worker exited without putting its result on the queue.
+  """
+  results = {}
+  while len(results) < len(workers):
+    try:
+      result = result_queue.get(timeout=_WORKER_POLL_SECS)
+      results[result[0]] = result
+      continue
+    except queue.Empty:
+      pass
+    dead_workers = [i for i, worker in enumerate(workers)
+                    if i not in results and not worker.is_alive()]
+    if dead_workers:
+      # A worker that exits normally flushes its result first, so drain the
+      # queue once more before deciding that the result is missing.
+      try:
+        while True:
+          result = result_queue.get(timeout=_WORKER_POLL_SECS)
+          results[result[0]] = result
+      except queue.Empty:
+        pass
+      for worker_index in dead_workers:
+        if worker_index not in results:
+          _check_worker_alive(workers[worker_index], worker_index)
+  return [results[i] for i in sorted(results)]
+
+
+def run_pipeline_parallel(pipeline,
+                          input_iterator,
+                          output_dir,
+                          num_workers=None,
+                          output_file_base=None,
+                          max_queued_inputs=64):
+  """Runs a pipeline on a data source over a pool of worker processes.
+
+  Like `run_pipeline_serial`, but `pipeline.transform` is fanned out over
+  `num_workers` processes. Inputs are handed out round-robin, so input `i` is
+  always processed by worker `i % num_workers`. Each worker writes its own
+  shard of every dataset, named like `<name>-00003-of-00016.tfrecord`, so for a
+  fixed input and number of workers the output is deterministic. Statistics
+  from all of the workers are merged once they have finished.
+
+  Workers are forked from the calling process where the platform supports it,
+  so `pipeline` does not need to be picklable, but the inputs and the
+  `Statistic` objects it produces do. On platforms without fork (Windows),
+  workers are spawned and `pipeline` must be picklable too.
+
+  Args:
+    pipeline: A Pipeline instance. `pipeline.output_type` must be a protocol
+        buffer or a dictionary mapping names to protocol buffers.
+    input_iterator: Iterates over the input data. Items returned by it are fed
+        directly into the pipeline's `transform` method.
+    output_dir: Path to directory where datasets will be written. Each dataset
+        is a set of sharded files whose names contain the pipeline's dataset
+        name. If the directory does not exist, it will be created.
+    num_workers: The number of worker processes to use. If None, the number of
+        CPUs is used. If 1, this is equivalent to `run_pipeline_serial` and a
+        single unsharded file is written per dataset.
+    output_file_base: An optional string prefix for all datasets output by this
+        run. The prefix will also be followed by an underscore.
+    max_queued_inputs: The maximum number of inputs waiting to be processed by
+        each worker. Bounds memory use when reading is faster than transforming.
+
+  Raises:
+    ValueError: If any of `pipeline`'s output types do not have a
+        SerializeToString method, or if `num_workers` is less than 1.
+    RuntimeError: If any of the workers failed or exited unexpectedly.
+  """
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  if num_workers < 1:
+    raise ValueError('num_workers must be at least 1, got %d' % num_workers)
+  if num_workers == 1:
+    run_pipeline_serial(pipeline, input_iterator, output_dir,
+                        output_file_base=output_file_base)
+    return
+
+  _assert_serializable_output_type(pipeline)
+
+  if not tf.gfile.Exists(output_dir):
+    tf.gfile.MakeDirs(output_dir)
+
+  output_names = list(pipeline.output_type_as_dict.keys())
+  if output_file_base is None:
+    shard_pattern = '%(name)s-%(index)05d-of-%(count)05d.tfrecord'
+  else:
+    shard_pattern = (output_file_base +
+                     '_%(name)s-%(index)05d-of-%(count)05d.tfrecord')
+
+  context = _fork_context()
+  result_queue = context.Queue()
+  input_queues = []
+  workers = []
+  for worker_index in range(num_workers):
+    output_paths = dict(
+        (name, os.path.join(output_dir, shard_pattern % {
+            'name': name, 'index': worker_index, 'count': num_workers}))
+        for name in output_names)
+    input_queue = context.Queue(max_queued_inputs)
+    worker = context.Process(
+        target=_run_pipeline_worker,
+        args=(pipeline, worker_index, num_workers, output_paths, input_queue,
+              result_queue))
+    worker.daemon = True
+    worker.start()
+    input_queues.append(input_queue)
+    workers.append(worker)
+
+  total_inputs = 0
+  try:
+    try:
+      for input_ in input_iterator:
+        worker_index = total_inputs % num_workers
+        _put_to_worker(input_queues[worker_index], input_,
+                       workers[worker_index], worker_index)
+        total_inputs += 1
+        if total_inputs % 500 == 0:
+          tf.logging.info('Dispatched %d inputs so far.', total_inputs)
+    finally:
+      for worker_index, input_queue in enumerate(input_queues):
+        _put_to_worker(input_queue, None, workers[worker_index], worker_index)
+    results = _get_worker_results(result_queue, workers)
+  except:  # pylint: disable=bare-except
+    for worker in workers:
+      if worker.is_alive():
+        worker.terminate()
+    raise
+  for worker in workers:
+    worker.join()
+
+  errors = [error for _, _, _, _, error in results if error is not None]
+  if errors:
+    raise RuntimeError('\n'.join(errors))
+
+  total_outputs = sum(outputs for _, _, outputs, _, _ in results)
+  stats = statistics.StatisticsRegistry()
+  for _, _, _, worker_stats, _ in results:
+    stats.merge(worker_stats)
+  tf.logging.info('\n\nCompleted.\n')
+  tf.logging.info('Processed %d inputs total with %d workers. '
+                  'Produced %d outputs.',
+                  total_inputs, num_workers, total_outputs)
+  statistics.log_statistics_list(stats.values(), tf.logging.info)
 
 
 def load_pipeline(pipeline, input_iterator):
@@ -408,21 +706,22 @@ def load_pipeline(pipeline, input_iterator):
   aggregated_outputs = dict((name, []) for name in pipeline.output_type_as_dict)
   total_inputs = 0
   total_outputs = 0
-  stats = []
+  stats = statistics.StatisticsRegistry()
   for input_object in input_iterator:
     total_inputs += 1
     outputs = _guarantee_dict(pipeline.transform(input_object),
                               list(aggregated_outputs.keys())[0])
     for name, output_list in outputs.items():
+      num_outputs = len(aggregated_outputs[name])
       aggregated_outputs[name].extend(output_list)
-      total_outputs += len(output_list)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
+      total_outputs += len(aggregated_outputs[name]) - num_outputs
+    stats.merge(pipeline.get_stats())
     if total_inputs % 500 == 0:
       tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
                       total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+      statistics.log_statistics_list(stats.values(), tf.logging.info)
   tf.logging.info('\n\nCompleted.\n')
   tf.logging.info('Processed %d inputs total. Produced %d outputs.',
                   total_inputs, total_outputs)
-  statistics.log_statistics_list(stats, tf.logging.info)
+  statistics.log_statistics_list(stats.values(), tf.logging.info)
   return aggregated_outputs
@@ -24,6 +24,7 @@ import tempfile
 from magenta.common import testing_lib
 from magenta.pipelines import pipeline
 from magenta.pipelines import statistics
+import six
 import tensorflow as tf
 
 MockStringProto = testing_lib.MockStringProto  # pylint: disable=invalid-name
@@ -45,6 +46,15 @@ class MockPipeline(pipeline.Pipeline):
         'dataset_2': [MockStringProto(input_object + '_C')]}
 
 
+class ExitingPipeline(MockPipeline):
+  """Hard-kills the process it runs in when it sees the input 'exit'."""
+
+  def transform(self, input_object):
+    if input_object == 'exit':
+      os._exit(1)  # pylint: disable=protected-access
+    return super(ExitingPipeline, self).transform(input_object)
+
+
 class PipelineTest(tf.test.TestCase):
 
   def testFileIteratorRecursive(self):
@@ -127,6 +137,41 @@ class PipelineTest(tf.test.TestCase):
         set(('serialized:%s_C' % s).encode('utf-8') for s in strings),
         set(dataset_2_reader))
 
+  def testRunPipelineParallel(self):
+    strings = ['abcdefg', 'helloworld!', 'qwerty', 'asdf', 'zxcv']
+    root_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    pipeline.run_pipeline_parallel(
+        MockPipeline(), iter(strings), root_dir, num_workers=2)
+
+    for name in ['dataset_1', 'dataset_2']:
+      for shard in range(2):
+        self.assertTrue(tf.gfile.Exists(os.path.join(
+            root_dir, '%s-%05d-of-00002.tfrecord' % (name, shard))))
+
+    # Inputs are assigned to shards round-robin.
+    dataset_1_shard_0 = os.path.join(
+        root_dir, 'dataset_1-00000-of-00002.tfrecord')
+    self.assertEqual(
+        [('serialized:%s_%s' % (s, suffix)).encode('utf-8')
+         for s in strings[::2] for suffix in 'AB'],
+        list(tf.python_io.tf_record_iterator(dataset_1_shard_0)))
+
+    dataset_2_records = set()
+    for path in tf.gfile.Glob(
+        os.path.join(root_dir, 'dataset_2-*-of-00002.tfrecord')):
+      dataset_2_records.update(tf.python_io.tf_record_iterator(path))
+    self.assertEqual(
+        set(('serialized:%s_C' % s).encode('utf-8') for s in strings),
+        dataset_2_records)
+
+  def testRunPipelineParallelWorkerExits(self):
+    strings = ['abcdefg', 'exit'] + ['qwerty'] * 20
+    root_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    with six.assertRaisesRegex(self, RuntimeError, 'exited unexpectedly'):
+      pipeline.run_pipeline_parallel(
+          ExitingPipeline(), iter(strings), root_dir, num_workers=2,
+          max_queued_inputs=1)
+
   def testPipelineIterator(self):
     strings = ['abcdefg', 'helloworld!', 'qwerty']
     result = pipeline.load_pipeline(MockPipeline(), iter(strings))
@@ -227,6 +272,34 @@ class PipelineTest(tf.test.TestCase):
         set([('TestPipeline123_counter_1', 5),
              ('TestPipeline123_counter_2', 10)]))
 
+  def testPipelineIncrementStats(self):
+
+    class TestPipeline123(pipeline.Pipeline):
+
+      def __init__(self):
+        super(TestPipeline123, self).__init__(str, str, 'TestName')
+
+      def transform(self, input_object):
+        self._reset_stats()
+        self._increment_stat('characters', 0)
+        for c in input_object:
+          if c != ' ':
+            self._increment_stat('characters')
+        self._merge_stats([statistics.Counter('inputs', 1),
+                           statistics.Counter('inputs', 1)])
+        return [input_object]
+
+    pipe = TestPipeline123()
+    for input_object, num_characters in [('hello world', 10), ('', 0)]:
+      pipe.transform(input_object)
+      self.assertEqual(
+          set([('TestName_characters', num_characters),
+               ('TestName_inputs', 2)]),
+          set((stat.name, stat.count) for stat in pipe.get_stats()))
+
+    with self.assertRaises(pipeline.InvalidStatisticsError):
+      pipe._merge_stats([12345])  # pylint: disable=protected-access
+
   def testInvalidStatisticsError(self):
 
     class TestPipeline1(pipeline.Pipeline):
@@ -129,6 +129,149 @@ def merge_statistics(stats_list):
   return list(name_map.values())
 
 
+class StatisticsRegistry(object):
+  """Accumulates `Statistic` objects by name, merging them in place.
+
+  `merge_statistics` builds a new merged list every time it is called, so
+  calling it once per input on the accumulated statistics costs time
+  proportional to everything seen so far. A `StatisticsRegistry` instead keeps
+  one `Statistic` per name in a dictionary and merges new statistics into it,
+  so the cost per input only depends on the statistics that input produced.
+
+  Statistics held by the registry can also be updated directly through
+  `counter` and `histogram`, which return the live instance for a name,
+  creating it if needed.
+
+  Usage:
+    registry = StatisticsRegistry()
+    for input_ in inputs:
+      pipeline.transform(input_)
+      registry.merge(pipeline.get_stats())
+    registry.counter('inputs_seen').increment()
+    log_statistics_list(registry.snapshot())
+  """
+
+  def __init__(self, stats=None):
+    """Constructs a `StatisticsRegistry`.
+
+    Args:
+      stats: An optional iterable of `Statistic` objects to start with.
+    """
+    self._stats = {}
+    if stats is not None:
+      self.merge(stats)
+
+  def __len__(self):
+    return len(self._stats)
+
+  def __contains__(self, name):
+    return name in self._stats
+
+  def __getitem__(self, name):
+    return self._stats[name]
+
+  def names(self):
+    """Returns a sorted list of the names of all held statistics."""
+    return sorted(self._stats)
+
+  def values(self):
+    """Returns the held statistics.
+
+    These are the live instances, so they should not be modified by the caller.
+    Use `snapshot` to get copies.
+
+    Returns:
+      A list of `Statistic` objects.
+    """
+    return list(self._stats.values())
+
+  def counter(self, name):
+    """Returns the `Counter` with the given name, creating it if needed.
+
+    Args:
+      name: String name of the counter.
+
+    Returns:
+      The `Counter` instance held by this registry.
+
+    Raises:
+      MergeStatisticsError: If a non-`Counter` statistic is held under `name`.
+    """
+    stat = self._stats.get(name)
+    if stat is None:
+      stat = self._stats[name] = Counter(name)
+    elif not isinstance(stat, Counter):
+      raise MergeStatisticsError(
+          'Statistic "%s" is a %s, not a Counter'
+          % (name, stat.__class__.__name__))
+    return stat
+
+  def histogram(self, name, buckets, verbose_pretty_print=False):
+    """Returns the `Histogram` with the given name, creating it if needed.
+
+    Args:
+      name: String name of the histogram.
+      buckets: The bucket lower bounds to use if the histogram is created. See
+          `Histogram.__init__`.
+      verbose_pretty_print: Passed to `Histogram.__init__` if the histogram is
+          created.
+
+    Returns:
+      The `Histogram` instance held by this registry.
+
+    Raises:
+      MergeStatisticsError: If a non-`Histogram` statistic is held under
+          `name`, or if its buckets do not match `buckets`.
+    """
+    stat = self._stats.get(name)
+    if stat is None:
+      stat = self._stats[name] = Histogram(name, buckets, verbose_pretty_print)
+    elif not isinstance(stat, Histogram):
+      raise MergeStatisticsError(
+          'Statistic "%s" is a %s, not a Histogram'
+          % (name, stat.__class__.__name__))
+    elif stat.buckets[1:] != sorted(set(buckets)):
+      raise MergeStatisticsError(
+          'Histogram buckets do not match. Expected %s, got %s'
+          % (stat.buckets[1:], sorted(set(buckets))))
+    return stat
+
+  def merge(self, stats, name_prefix=''):
+    """Merges the given statistics into this registry.
+
+    Statistics whose names are not yet held are copied, so the given objects
+    are never modified by later merges.
+
+    Args:
+      stats: An iterable of `Statistic` objects, or another
+          `StatisticsRegistry`.
+      name_prefix: An optional string prepended to the name of each statistic
+          before it is merged.
+    """
+    if isinstance(stats, StatisticsRegistry):
+      stats = stats.values()
+    for stat in stats:
+      name = name_prefix + stat.name
+      existing = self._stats.get(name)
+      if existing is None:
+        stat_copy = stat.copy()
+        stat_copy.name = name
+        self._stats[name] = stat_copy
+      else:
+        existing._merge_from(stat)  # pylint: disable=protected-access
+
+  def snapshot(self):
+    """Returns copies of all held statistics.
+
+    The copies are independent of the registry, which makes them suitable for
+    reporting or for sending to another process to be merged there.
+
+    Returns:
+      A list of `Statistic` objects sorted by name.
+    """
+    return [self._stats[name].copy() for name in self.names()]
+
+
 def log_statistics_list(stats_list, logger_fn=tf.logging.info):
   """Calls the given logger function on each `Statistic` in the list.
 
@@ -273,4 +416,7 @@ class Histogram(Statistic):
          if self.verbose_pretty_print or self.counters[lower]])
 
   def copy(self):
-    return copy.copy(self)
+    histogram_copy = copy.copy(self)
+    # The counts are mutated by `increment` and merging, so must not be shared.
+    histogram_copy.counters = dict(self.counters)
+    return histogram_copy
@@ -90,6 +90,55 @@ class StatisticsTest(tf.test.TestCase):
                      {float('-inf'): 6, 1: 1, 2: 13, 10: 3})
     self.assertEqual(histo_copy.name, 'name_123')
 
+  def testHistogramCopyIsIndependent(self):
+    histo = statistics.Histogram('name_123', [1, 2])
+    histo_copy = histo.copy()
+    histo_copy.increment(1)
+    self.assertEqual(histo.counters, {float('-inf'): 0, 1: 0, 2: 0})
+    self.assertEqual(histo_copy.counters, {float('-inf'): 0, 1: 1, 2: 0})
+
+  def testStatisticsRegistry(self):
+    registry = statistics.StatisticsRegistry()
+    counter = statistics.Counter('counter', 2)
+    histo = statistics.Histogram('histo', [1, 2])
+    histo.increment(1)
+    registry.merge([counter, histo])
+    registry.merge([statistics.Counter('counter', 3), histo])
+    self.assertEqual(len(registry), 2)
+    self.assertEqual(registry['counter'].count, 5)
+    self.assertEqual(registry['histo'].counters,
+                     {float('-inf'): 0, 1: 2, 2: 0})
+
+    # Merged statistics are not modified.
+    self.assertEqual(counter.count, 2)
+    self.assertEqual(histo.counters, {float('-inf'): 0, 1: 1, 2: 0})
+
+    # Statistics can be incremented in place.
+    registry.counter('counter').increment()
+    registry.counter('new_counter').increment(4)
+    registry.histogram('histo', [2, 1]).increment(0)
+    self.assertEqual(registry['counter'].count, 6)
+    self.assertEqual(registry['new_counter'].count, 4)
+    self.assertEqual(registry['histo'].counters,
+                     {float('-inf'): 1, 1: 2, 2: 0})
+    with self.assertRaises(statistics.MergeStatisticsError):
+      registry.histogram('counter', [1, 2])
+    with self.assertRaises(statistics.MergeStatisticsError):
+      registry.histogram('histo', [1, 3])
+    with self.assertRaises(statistics.MergeStatisticsError):
+      registry.counter('histo')
+
+    snapshot = registry.snapshot()
+    self.assertEqual([stat.name for stat in snapshot],
+                     ['counter', 'histo', 'new_counter'])
+    registry.counter('counter').increment()
+    self.assertEqual(snapshot[0].count, 6)
+
+    merged = statistics.StatisticsRegistry(snapshot)
+    merged.merge(registry)
+    self.assertEqual(merged['counter'].count, 13)
+    self.assertEqual(merged['new_counter'].count, 8)
+
   def testMergeDifferentNames(self):
     counter_1 = statistics.Counter('counter_1')
     counter_2 = statistics.Counter('counter_2')
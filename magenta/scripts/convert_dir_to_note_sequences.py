@@ -23,12 +23,18 @@ Example usage:
     --log=INFO
 """
 
+import collections
+import hashlib
+import json
+import multiprocessing
 import os
+import time
 
 from magenta.music import abc_parser
 from magenta.music import midi_io
 from magenta.music import musicxml_reader
 from magenta.music import note_sequence_io
+from magenta.protobuf import music_pb2
 import tensorflow as tf
 
 FLAGS = tf.app.flags.FLAGS
@@ -43,6 +49,95 @@ tf.app.flags.DEFINE_bool('recursive', False,
 tf.app.flags.DEFINE_string('log', 'INFO',
                            'The threshold for what messages will be logged '
                            'DEBUG, INFO, WARN, ERROR, or FATAL.')
+tf.app.flags.DEFINE_integer('num_workers', 1,
+                            'The number of worker processes to convert files '
+                            'with. If greater than 1, or if --manifest_file '
+                            'is set, sharded TFRecord files are written with '
+                            '--output_file as their path prefix.')
+tf.app.flags.DEFINE_integer('num_shards', None,
+                            'The number of TFRecord shards to write in sharded '
+                            'mode. Defaults to --num_workers.')
+tf.app.flags.DEFINE_string('manifest_file', None,
+                           'Path to a manifest recording every converted file '
+                           'and the shard its NoteSequences were written to. '
+                           'Files already in the manifest and unchanged are '
+                           'skipped, so an interrupted or incremental '
+                           'conversion can be resumed by re-running with the '
+                           'same --output_file and --manifest_file.')
+
+# Read files in chunks of this many bytes when hashing them.
+_HASH_CHUNK_BYTES = 1 << 20
+
+# Log conversion throughput every this many converted files.
+_LOG_EVERY_N_FILES = 1000
+
+
+def _get_converter(full_file_path):
+  """Returns the conversion function for a file, or None if there is none."""
+  lower_path = full_file_path.lower()
+  if lower_path.endswith('.mid') or lower_path.endswith('.midi'):
+    return convert_midi
+  elif lower_path.endswith('.xml') or lower_path.endswith('.mxl'):
+    return convert_musicxml
+  elif lower_path.endswith('.abc'):
+    return convert_abc
+  return None
+
+
+def convert_file(root_dir, sub_dir, full_file_path):
+  """Converts a single file to NoteSequence protos.
+
+  Args:
+    root_dir: A string specifying the root directory for the files being
+        converted.
+    sub_dir: The directory being converted currently.
+    full_file_path: the full path to the file to convert.
+
+  Returns:
+    A list of NoteSequence protos, empty if the file could not be converted.
+
+  Raises:
+    ValueError: If there is no converter for the file type.
+  """
+  converter = _get_converter(full_file_path)
+  if converter is None:
+    raise ValueError('No converter for file %s' % full_file_path)
+  result = converter(root_dir, sub_dir, full_file_path)
+  if not result:
+    return []
+  return result if isinstance(result, list) else [result]
+
+
+def _list_files(root_dir, sub_dir, recursive=False):
+  """Yields `(sub_dir, full_file_path)` for every convertible file.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    sub_dir: A string specifying a path to a directory under `root_dir` in which
+        to list contents.
+    recursive: A boolean specifying whether or not to recurse into
+        subdirectories.
+
+  Yields:
+    Tuples of the sub directory relative to `root_dir` and the full path of
+    each file with a converter.
+  """
+  dir_to_convert = os.path.join(root_dir, sub_dir)
+  tf.logging.info("Converting files in '%s'.", dir_to_convert)
+  recurse_sub_dirs = []
+  for file_in_dir in sorted(tf.gfile.ListDirectory(dir_to_convert)):
+    full_file_path = os.path.join(dir_to_convert, file_in_dir)
+    if _get_converter(full_file_path) is not None:
+      yield sub_dir, full_file_path
+    elif recursive and tf.gfile.IsDirectory(full_file_path):
+      recurse_sub_dirs.append(os.path.join(sub_dir, file_in_dir))
+    else:
+      tf.logging.warning(
+          'Unable to find a converter for file %s', full_file_path)
+
+  for recurse_sub_dir in recurse_sub_dirs:
+    for item in _list_files(root_dir, recurse_sub_dir, recursive):
+      yield item
 
 
 def convert_files(root_dir, sub_dir, writer, recursive=False):
@@ -55,55 +150,19 @@ def convert_files(root_dir, sub_dir, writer, recursive=False):
     writer: A TFRecord writer
     recursive: A boolean specifying whether or not recursively convert files
         contained in subdirectories of the specified directory.
-
-  Returns:
-    A map from the resulting Futures to the file paths being converted.
   """
-  dir_to_convert = os.path.join(root_dir, sub_dir)
-  tf.logging.info("Converting files in '%s'.", dir_to_convert)
-  files_in_dir = tf.gfile.ListDirectory(os.path.join(dir_to_convert))
-  recurse_sub_dirs = []
   written_count = 0
-  for file_in_dir in files_in_dir:
+  for file_sub_dir, full_file_path in _list_files(root_dir, sub_dir, recursive):
     tf.logging.log_every_n(tf.logging.INFO, '%d files converted.',
                            1000, written_count)
-    full_file_path = os.path.join(dir_to_convert, file_in_dir)
-    if (full_file_path.lower().endswith('.mid') or
-        full_file_path.lower().endswith('.midi')):
-      try:
-        sequence = convert_midi(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequence:
-        writer.write(sequence)
-    elif (full_file_path.lower().endswith('.xml') or
-          full_file_path.lower().endswith('.mxl')):
-      try:
-        sequence = convert_musicxml(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequence:
-        writer.write(sequence)
-    elif full_file_path.lower().endswith('.abc'):
-      try:
-        sequences = convert_abc(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequences:
-        for sequence in sequences:
-          writer.write(sequence)
-    else:
-      if recursive and tf.gfile.IsDirectory(full_file_path):
-        recurse_sub_dirs.append(os.path.join(sub_dir, file_in_dir))
-      else:
-        tf.logging.warning(
-            'Unable to find a converter for file %s', full_file_path)
-
-  for recurse_sub_dir in recurse_sub_dirs:
-    convert_files(root_dir, recurse_sub_dir, writer, recursive)
+    try:
+      sequences = convert_file(root_dir, file_sub_dir, full_file_path)
+    except Exception as exc:  # pylint: disable=broad-except
+      tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
+      continue
+    for sequence in sequences:
+      writer.write(sequence)
+    written_count += 1
 
 
 def convert_midi(root_dir, sub_dir, full_file_path):
@@ -216,6 +275,261 @@ def convert_directory(root_dir, output_file, recursive=False):
     convert_files(root_dir, '', writer, recursive)
 
 
+def _file_md5(full_file_path):
+  """Returns the hex MD5 digest of a file's contents."""
+  md5 = hashlib.md5()
+  with tf.gfile.Open(full_file_path, 'rb') as f:
+    while True:
+      chunk = f.read(_HASH_CHUNK_BYTES)
+      if not chunk:
+        break
+      md5.update(chunk)
+  return md5.hexdigest()
+
+
+def _read_manifest_entries(manifest_file):
+  """Yields every entry in a manifest file, in the order they were written."""
+  if not tf.gfile.Exists(manifest_file):
+    return
+  with tf.gfile.Open(manifest_file, 'r') as f:
+    for line in f:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        tf.logging.warning('Ignoring malformed manifest line: %r', line)
+        continue
+      yield entry
+
+
+def read_manifest(manifest_file):
+  """Reads a conversion manifest written by `convert_directory_sharded`.
+
+  The manifest is a file of JSON lines, one per converted input file, which is
+  appended to during a run. Later lines for the same path supersede earlier
+  ones, and a truncated final line left by an interrupted run is ignored.
+
+  Args:
+    manifest_file: Path to the manifest file.
+
+  Returns:
+    A dictionary mapping each input path relative to the root directory to its
+    most recent manifest entry, a dictionary with keys 'path', 'size',
+    'mtime_nsec', 'md5', 'output' and 'num_sequences'. 'output' is None for
+    files that produced no sequences.
+  """
+  return dict((entry['path'], entry)
+              for entry in _read_manifest_entries(manifest_file))
+
+
+def _remove_sequences_from_shard(shard_path, filenames):
+  """Rewrites a TFRecord shard without the sequences of the given files.
+
+  Args:
+    shard_path: Path to the TFRecord shard of NoteSequences.
+    filenames: A set of NoteSequence `filename` values to remove.
+  """
+  if not tf.gfile.Exists(shard_path):
+    return
+  records = [
+      record for record in tf.python_io.tf_record_iterator(shard_path)
+      if music_pb2.NoteSequence.FromString(record).filename not in filenames]
+  if not records:
+    tf.gfile.Remove(shard_path)
+    return
+  tmp_path = shard_path + '.tmp'
+  with tf.python_io.TFRecordWriter(tmp_path) as writer:
+    for record in records:
+      writer.write(record)
+  tf.gfile.Rename(tmp_path, shard_path, overwrite=True)
+
+
+def compact_manifest(manifest_file):
+  """Drops superseded sequences and manifest entries after a sharded run.
+
+  When a file changes, `convert_directory_sharded` writes its new sequences to
+  the shards of the current run. This removes the old sequences from the shard
+  named by the superseded manifest entry, then rewrites the manifest so that it
+  only holds the latest entry for every file. Both steps replace files
+  atomically and can be repeated safely if interrupted.
+
+  Args:
+    manifest_file: Path to the manifest file.
+  """
+  latest = collections.OrderedDict()
+  stale = collections.defaultdict(set)
+  num_entries = 0
+  for entry in _read_manifest_entries(manifest_file):
+    num_entries += 1
+    previous = latest.pop(entry['path'], None)
+    if (previous and previous['output'] and
+        previous['output'] != entry['output']):
+      stale[previous['output']].add(entry['path'])
+    latest[entry['path']] = entry
+  if num_entries == len(latest):
+    return
+
+  for shard_path in sorted(stale):
+    _remove_sequences_from_shard(shard_path, stale[shard_path])
+
+  tmp_path = manifest_file + '.tmp'
+  with tf.gfile.Open(tmp_path, 'w') as f:
+    for entry in latest.values():
+      f.write(json.dumps(entry, sort_keys=True) + '\n')
+  tf.gfile.Rename(tmp_path, manifest_file, overwrite=True)
+
+
+def _convert_file_for_manifest(task):
+  """Converts one file in a worker process for `convert_directory_sharded`.
+
+  Args:
+    task: A tuple of the root directory, sub directory, full file path, file
+        size, file modification time, and the MD5 digest recorded for the file
+        by a previous run (or None).
+
+  Returns:
+    A tuple of the manifest entry for the file (None if conversion raised an
+    exception) and a list of serialized NoteSequence protos, or None if the
+    file's contents are unchanged since the previous run.
+  """
+  root_dir, sub_dir, full_file_path, size, mtime_nsec, previous_md5 = task
+  entry = {
+      'path': os.path.relpath(full_file_path, root_dir),
+      'size': size,
+      'mtime_nsec': mtime_nsec,
+      'md5': _file_md5(full_file_path),
+  }
+  if entry['md5'] == previous_md5:
+    return entry, None
+  try:
+    sequences = convert_file(root_dir, sub_dir, full_file_path)
+  except Exception as exc:  # pylint: disable=broad-except
+    tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
+    return None, []
+  return entry, [sequence.SerializeToString() for sequence in sequences]
+
+
+def convert_directory_sharded(root_dir, output_file, manifest_file=None,
+                              num_workers=1, num_shards=None,
+                              recursive=False):
+  """Converts files with a pool of workers, writing sharded TFRecord files.
+
+  Input files are converted as in `convert_directory`, but by `num_workers`
+  processes, and the resulting NoteSequences are written to `num_shards`
+  TFRecord files named `<output_file>-<run>-<shard>-of-<num_shards>`.
+
+  If `manifest_file` is given, a line is appended to it for every converted
+  file once the file's sequences have been flushed to their shard. It records
+  the file's relative path, size, modification time and MD5 digest, and the
+  shard its sequences were written to. Files that already have an entry are
+  skipped when their size and modification time are unchanged, or when their
+  contents hash to the recorded digest. An interrupted conversion can then be
+  resumed, and a grown corpus converted incrementally, by re-running with the
+  same `output_file` and `manifest_file`. Each run writes new shards with the
+  next run number, so the shards of earlier runs stay valid. When a file has
+  changed, its earlier sequences are removed from the shard named by its
+  previous manifest entry at the end of the run (see `compact_manifest`).
+
+  Files are converted and assigned to shards round-robin in a fixed order, so
+  for the same input files and number of shards, every shard has the same
+  contents in the same order regardless of the number of workers.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    output_file: Path prefix for the TFRecord shards.
+    manifest_file: Optional path to the manifest file, which is created if it
+        does not exist.
+    num_workers: The number of worker processes to convert files with.
+    num_shards: The number of TFRecord shards to write. Defaults to
+        `num_workers`.
+    recursive: A boolean specifying whether or not recursively convert files
+        contained in subdirectories of the specified directory.
+
+  Returns:
+    A list of the shard paths written by this run.
+
+  Raises:
+    ValueError: If `num_workers` is less than 1.
+  """
+  if num_workers < 1:
+    raise ValueError('num_workers must be at least 1, got %d' % num_workers)
+  num_shards = num_shards or num_workers
+
+  manifest = read_manifest(manifest_file) if manifest_file else {}
+  run = 0
+  for entry in manifest.values():
+    if entry['output']:
+      run = max(run, int(entry['output'].rsplit('-', 4)[1]) + 1)
+  shard_paths = ['%s-%05d-%05d-of-%05d' % (output_file, run, i, num_shards)
+                 for i in range(num_shards)]
+
+  def tasks():
+    for sub_dir, full_file_path in _list_files(root_dir, '', recursive):
+      stat = tf.gfile.Stat(full_file_path)
+      previous = manifest.get(os.path.relpath(full_file_path, root_dir))
+      if (previous and previous['size'] == stat.length and
+          previous['mtime_nsec'] == stat.mtime_nsec):
+        continue
+      yield (root_dir, sub_dir, full_file_path, stat.length, stat.mtime_nsec,
+             previous['md5'] if previous else None)
+
+  writers = [None] * num_shards
+  manifest_writer = (tf.gfile.Open(manifest_file, 'a') if manifest_file
+                     else None)
+  pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+  results = (pool.imap(_convert_file_for_manifest, tasks())
+             if pool else (_convert_file_for_manifest(t) for t in tasks()))
+  num_converted = 0
+  num_unchanged = 0
+  start_time = time.time()
+  try:
+    for entry, serialized_sequences in results:
+      if entry is None:
+        continue
+      if serialized_sequences is None:
+        # The contents are unchanged, so the previous output is still current.
+        entry['output'] = manifest[entry['path']]['output']
+        entry['num_sequences'] = manifest[entry['path']]['num_sequences']
+        num_unchanged += 1
+      else:
+        shard = num_converted % num_shards
+        entry['output'] = (shard_paths[shard] if serialized_sequences
+                           else None)
+        entry['num_sequences'] = len(serialized_sequences)
+        if serialized_sequences:
+          if writers[shard] is None:
+            writers[shard] = tf.python_io.TFRecordWriter(shard_paths[shard])
+          for serialized_sequence in serialized_sequences:
+            writers[shard].write(serialized_sequence)
+          # Make sure the sequences are in the shard before the manifest says
+          # so, in case the run is interrupted.
+          writers[shard].flush()
+        num_converted += 1
+        if num_converted % _LOG_EVERY_N_FILES == 0:
+          tf.logging.info('%d files converted (%.1f files/sec).',
+                          num_converted,
+                          num_converted / (time.time() - start_time))
+      if manifest_writer:
+        manifest_writer.write(json.dumps(entry, sort_keys=True) + '\n')
+        manifest_writer.flush()
+  finally:
+    if pool:
+      pool.terminate()
+    for writer in writers:
+      if writer is not None:
+        writer.close()
+    if manifest_writer:
+      manifest_writer.close()
+
+  elapsed = time.time() - start_time
+  tf.logging.info(
+      'Converted %d files in %.1f seconds (%.1f files/sec); %d unchanged files '
+      'skipped.', num_converted, elapsed,
+      num_converted / elapsed if elapsed else 0.0, num_unchanged)
+  if manifest_file:
+    compact_manifest(manifest_file)
+  return [path for path, writer in zip(shard_paths, writers) if writer]
+
+
 def main(unused_argv):
   tf.logging.set_verbosity(FLAGS.log)
 
@@ -233,7 +547,15 @@ def main(unused_argv):
   if output_dir:
     tf.gfile.MakeDirs(output_dir)
 
-  convert_directory(input_dir, output_file, FLAGS.recursive)
+  if FLAGS.num_workers > 1 or FLAGS.manifest_file:
+    convert_directory_sharded(
+        input_dir, output_file,
+        manifest_file=(os.path.expanduser(FLAGS.manifest_file)
+                       if FLAGS.manifest_file else None),
+        num_workers=FLAGS.num_workers, num_shards=FLAGS.num_shards,
+        recursive=FLAGS.recursive)
+  else:
+    convert_directory(input_dir, output_file, FLAGS.recursive)
 
 
 def console_entry_point():
@@ -101,6 +101,69 @@ class ConvertMidiDirToSequencesTest(tf.test.TestCase):
     self.runTest('sub_1/sub', recursive=True)
     self.runTest('sub_2', recursive=True)
 
+  def testConvertDirectorySharded(self):
+    output_prefix = os.path.join(self.get_temp_dir(), 'sharded')
+    manifest_file = os.path.join(self.get_temp_dir(), 'manifest.jsonl')
+
+    def read_filenames(shard_paths):
+      return sorted(
+          sequence.filename for path in shard_paths
+          for sequence in note_sequence_io.note_sequence_record_iterator(path))
+
+    shard_paths = convert_dir_to_note_sequences.convert_directory_sharded(
+        self.root_dir, output_prefix, manifest_file=manifest_file,
+        num_workers=2, recursive=True)
+    self.assertEqual(
+        [output_prefix + '-00000-00000-of-00002',
+         output_prefix + '-00000-00001-of-00002'], shard_paths)
+    self.assertEqual(
+        ['midi_1.mid', 'midi_2.mid', 'sub_1/midi_3.mid', 'sub_1/sub/midi_5.mid',
+         'sub_2/midi_3.mid', 'sub_2/midi_4.mid'],
+        read_filenames(shard_paths))
+    # Files are assigned to shards round-robin in directory listing order.
+    self.assertEqual(
+        ['midi_1.mid', 'sub_1/midi_3.mid', 'sub_2/midi_3.mid'],
+        [sequence.filename for sequence in
+         note_sequence_io.note_sequence_record_iterator(shard_paths[0])])
+    first_run_shard_paths = shard_paths
+    manifest = convert_dir_to_note_sequences.read_manifest(manifest_file)
+    self.assertEqual(6, len(manifest))
+    self.assertEqual(1, manifest['sub_2/midi_4.mid']['num_sequences'])
+
+    # Nothing has changed, so nothing is converted again.
+    self.assertEqual(
+        [], convert_dir_to_note_sequences.convert_directory_sharded(
+            self.root_dir, output_prefix, manifest_file=manifest_file,
+            num_workers=2, recursive=True))
+    self.assertEqual(
+        manifest, convert_dir_to_note_sequences.read_manifest(manifest_file))
+
+    # Only a changed file is converted, into the shards of a new run. A file
+    # that was only touched is skipped because its contents hash the same.
+    os.utime(os.path.join(self.root_dir, 'midi_1.mid'), (0, 0))
+    tf.gfile.Copy(
+        os.path.join(tf.resource_loader.get_data_files_path(),
+                     '../testdata/example_complex.mid'),
+        os.path.join(self.root_dir, 'sub_2', 'midi_4.mid'), overwrite=True)
+    shard_paths = convert_dir_to_note_sequences.convert_directory_sharded(
+        self.root_dir, output_prefix, manifest_file=manifest_file,
+        num_workers=1, recursive=True)
+    self.assertEqual([output_prefix + '-00001-00000-of-00001'], shard_paths)
+    self.assertEqual(['sub_2/midi_4.mid'], read_filenames(shard_paths))
+    manifest = convert_dir_to_note_sequences.read_manifest(manifest_file)
+    self.assertEqual(shard_paths[0], manifest['sub_2/midi_4.mid']['output'])
+    self.assertIn(manifest['midi_1.mid']['output'], first_run_shard_paths)
+    self.assertEqual(0, manifest['midi_1.mid']['mtime_nsec'])
+
+    # The changed file's old sequences are gone from the first run's shards,
+    # and the manifest only holds the latest entry for every file.
+    self.assertEqual(
+        ['midi_1.mid', 'midi_2.mid', 'sub_1/midi_3.mid', 'sub_1/sub/midi_5.mid',
+         'sub_2/midi_3.mid'],
+        read_filenames(first_run_shard_paths))
+    with tf.gfile.Open(manifest_file) as f:
+      self.assertEqual(6, len(f.readlines()))
+
 
 if __name__ == '__main__':
   tf.test.main()
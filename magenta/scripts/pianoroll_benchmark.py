@@ -0,0 +1,354 @@
+# Copyright 2019 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks pianoroll conversion in `sequences_lib`.
+
+Times `sequence_to_pianoroll` and `pianoroll_to_note_sequence` against the
+previous per-note and per-frame loop implementations, kept here for reference,
+on random piano pieces about as long and dense as a MAESTRO performance. Also
+checks that both implementations produce identical results.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import time
+
+from magenta.music import constants
+from magenta.music import sequences_lib
+from magenta.protobuf import music_pb2
+import numpy as np
+import tensorflow as tf
+
+flags = tf.app.flags
+FLAGS = tf.app.flags.FLAGS
+flags.DEFINE_integer(
+    'num_pieces', 5,
+    'The number of random pieces to time each implementation on.')
+flags.DEFINE_float(
+    'piece_secs', 600,
+    'The length of each piece in seconds.')
+flags.DEFINE_float(
+    'notes_per_sec', 10,
+    'The average number of notes per second in each piece.')
+
+# Onsets and Frames defaults.
+_FRAMES_PER_SECOND = 16000 / 512
+_MIN_PITCH = constants.MIN_MIDI_PITCH + 21
+_MAX_PITCH = _MIN_PITCH + 87
+
+
+def _sequence_to_pianoroll_loop(
+    sequence,
+    frames_per_second,
+    min_pitch,
+    max_pitch,
+    # pylint: disable=unused-argument
+    min_velocity=constants.MIN_MIDI_PITCH,
+    # pylint: enable=unused-argument
+    max_velocity=constants.MAX_MIDI_PITCH,
+    add_blank_frame_before_onset=False,
+    onset_upweight=sequences_lib.ONSET_UPWEIGHT,
+    onset_window=sequences_lib.ONSET_WINDOW,
+    onset_length_ms=0,
+    offset_length_ms=0,
+    onset_mode='window',
+    onset_delay_ms=0.0,
+    min_frame_occupancy_for_label=0.0,
+    onset_overlap=True):
+  """The previous per-note implementation of `sequence_to_pianoroll`."""
+  roll = np.zeros((int(sequence.total_time * frames_per_second + 1),
+                   max_pitch - min_pitch + 1),
+                  dtype=np.float32)
+
+  roll_weights = np.ones_like(roll)
+
+  onsets = np.zeros_like(roll)
+  offsets = np.zeros_like(roll)
+
+  control_changes = np.zeros(
+      (int(sequence.total_time * frames_per_second + 1), 128), dtype=np.int32)
+
+  def frames_from_times(start_time, end_time):
+    """Converts start/end times to start/end frames."""
+    # Will round down because note may start or end in the middle of the frame.
+    start_frame = int(start_time * frames_per_second)
+    start_frame_occupancy = (start_frame + 1 - start_time * frames_per_second)
+    # check for > 0.0 to avoid possible numerical issues
+    if (min_frame_occupancy_for_label > 0.0 and
+        start_frame_occupancy < min_frame_occupancy_for_label):
+      start_frame += 1
+
+    end_frame = int(math.ceil(end_time * frames_per_second))
+    end_frame_occupancy = end_time * frames_per_second - start_frame - 1
+    if (min_frame_occupancy_for_label > 0.0 and
+        end_frame_occupancy < min_frame_occupancy_for_label):
+      end_frame -= 1
+      # can be a problem for very short notes
+      end_frame = max(start_frame, end_frame)
+
+    return start_frame, end_frame
+
+  velocities_roll = np.zeros_like(roll, dtype=np.float32)
+
+  for note in sorted(sequence.notes, key=lambda n: n.start_time):
+    if note.pitch < min_pitch or note.pitch > max_pitch:
+      tf.logging.warn('Skipping out of range pitch: %d', note.pitch)
+      continue
+    start_frame, end_frame = frames_from_times(note.start_time, note.end_time)
+
+    # label onset events. Use a window size of onset_window to account of
+    # rounding issue in the start_frame computation.
+    onset_start_time = note.start_time + onset_delay_ms / 1000.
+    onset_end_time = note.end_time + onset_delay_ms / 1000.
+    if onset_mode == 'window':
+      onset_start_frame_without_window, _ = frames_from_times(
+          onset_start_time, onset_end_time)
+
+      onset_start_frame = max(0,
+                              onset_start_frame_without_window - onset_window)
+      onset_end_frame = min(onsets.shape[0],
+                            onset_start_frame_without_window + onset_window + 1)
+    elif onset_mode == 'length_ms':
+      onset_end_time = min(onset_end_time,
+                           onset_start_time + onset_length_ms / 1000.)
+      onset_start_frame, onset_end_frame = frames_from_times(
+          onset_start_time, onset_end_time)
+    else:
+      raise ValueError('Unknown onset mode: {}'.format(onset_mode))
+
+    # label offset events.
+    offset_start_time = min(note.end_time,
+                            sequence.total_time - offset_length_ms / 1000.)
+    offset_end_time = offset_start_time + offset_length_ms / 1000.
+    offset_start_frame, offset_end_frame = frames_from_times(
+        offset_start_time, offset_end_time)
+    offset_end_frame = max(offset_end_frame, offset_start_frame + 1)
+
+    if not onset_overlap:
+      start_frame = onset_end_frame
+      end_frame = max(start_frame + 1, end_frame)
+
+    offsets[offset_start_frame:offset_end_frame, note.pitch - min_pitch] = 1.0
+    onsets[onset_start_frame:onset_end_frame, note.pitch - min_pitch] = 1.0
+    roll[start_frame:end_frame, note.pitch - min_pitch] = 1.0
+
+    if note.velocity > max_velocity:
+      raise ValueError('Note velocity exceeds max velocity: %d > %d' %
+                       (note.velocity, max_velocity))
+
+    velocities_roll[start_frame:end_frame, note.pitch -
+                    min_pitch] = float(note.velocity) / max_velocity
+    roll_weights[onset_start_frame:onset_end_frame, note.pitch - min_pitch] = (
+        onset_upweight)
+    roll_weights[onset_end_frame:end_frame, note.pitch - min_pitch] = [
+        onset_upweight / x for x in range(1, end_frame - onset_end_frame + 1)
+    ]
+
+    if add_blank_frame_before_onset:
+      if start_frame > 0:
+        roll[start_frame - 1, note.pitch - min_pitch] = 0.0
+        roll_weights[start_frame - 1, note.pitch - min_pitch] = 1.0
+
+  for cc in sequence.control_changes:
+    frame, _ = frames_from_times(cc.time, 0)
+    if frame < len(control_changes):
+      control_changes[frame, cc.control_number] = cc.control_value + 1
+
+  return sequences_lib.Pianoroll(
+      active=roll,
+      weights=roll_weights,
+      onsets=onsets,
+      onset_velocities=velocities_roll * onsets,
+      active_velocities=velocities_roll,
+      offsets=offsets,
+      control_changes=control_changes)
+
+
+def _pianoroll_to_note_sequence_loop(frames,
+                               frames_per_second,
+                               min_duration_ms,
+                               velocity=70,
+                               instrument=0,
+                               program=0,
+                               qpm=constants.DEFAULT_QUARTERS_PER_MINUTE,
+                               min_midi_pitch=constants.MIN_MIDI_PITCH,
+                               onset_predictions=None,
+                               offset_predictions=None,
+                               velocity_values=None):
+  """The previous per-frame implementation of `pianoroll_to_note_sequence`."""
+  frame_length_seconds = 1 / frames_per_second
+
+  sequence = music_pb2.NoteSequence()
+  sequence.tempos.add().qpm = qpm
+  sequence.ticks_per_quarter = constants.STANDARD_PPQ
+
+  pitch_start_step = {}
+  onset_velocities = velocity * np.ones(
+      constants.MAX_MIDI_PITCH, dtype=np.int32)
+
+  # Add silent frame at the end so we can do a final loop and terminate any
+  # notes that are still active.
+  frames = np.append(frames, [np.zeros(frames[0].shape)], 0)
+  if velocity_values is None:
+    velocity_values = velocity * np.ones_like(frames, dtype=np.int32)
+
+  if onset_predictions is not None:
+    onset_predictions = np.append(onset_predictions,
+                                  [np.zeros(onset_predictions[0].shape)], 0)
+    # Ensure that any frame with an onset prediction is considered active.
+    frames = np.logical_or(frames, onset_predictions)
+
+  if offset_predictions is not None:
+    offset_predictions = np.append(offset_predictions,
+                                   [np.zeros(offset_predictions[0].shape)], 0)
+    # If the frame and offset are both on, then turn it off
+    frames[np.where(np.logical_and(frames > 0, offset_predictions > 0))] = 0
+
+  def end_pitch(pitch, end_frame):
+    """End an active pitch."""
+    start_time = pitch_start_step[pitch] * frame_length_seconds
+    end_time = end_frame * frame_length_seconds
+
+    if (end_time - start_time) * 1000 >= min_duration_ms:
+      note = sequence.notes.add()
+      note.start_time = start_time
+      note.end_time = end_time
+      note.pitch = pitch + min_midi_pitch
+      note.velocity = onset_velocities[pitch]
+      note.instrument = instrument
+      note.program = program
+
+    del pitch_start_step[pitch]
+
+  def unscale_velocity(velocity):
+    """Translates a velocity estimate to a MIDI velocity value."""
+    unscaled = max(min(velocity, 1.), 0) * 80. + 10.
+    if math.isnan(unscaled):
+      return 0
+    return int(unscaled)
+
+  def process_active_pitch(pitch, i):
+    """Process a pitch being active in a given frame."""
+    if pitch not in pitch_start_step:
+      if onset_predictions is not None:
+        # If onset predictions were supplied, only allow a new note to start
+        # if we've predicted an onset.
+        if onset_predictions[i, pitch]:
+          pitch_start_step[pitch] = i
+          onset_velocities[pitch] = unscale_velocity(velocity_values[i, pitch])
+        else:
+          # Even though the frame is active, the onset predictor doesn't
+          # say there should be an onset, so ignore it.
+          pass
+      else:
+        pitch_start_step[pitch] = i
+    else:
+      if onset_predictions is not None:
+        # pitch is already active, but if this is a new onset, we should end
+        # the note and start a new one.
+        if (onset_predictions[i, pitch] and
+            not onset_predictions[i - 1, pitch]):
+          end_pitch(pitch, i)
+          pitch_start_step[pitch] = i
+          onset_velocities[pitch] = unscale_velocity(velocity_values[i, pitch])
+
+  for i, frame in enumerate(frames):
+    for pitch, active in enumerate(frame):
+      if active:
+        process_active_pitch(pitch, i)
+      elif pitch in pitch_start_step:
+        end_pitch(pitch, i)
+
+  sequence.total_time = len(frames) * frame_length_seconds
+  if sequence.notes:
+    assert sequence.total_time >= sequence.notes[-1].end_time
+
+  return sequence
+
+
+def _random_piece(piece_secs, notes_per_sec):
+  """Returns a random piano NoteSequence."""
+  sequence = music_pb2.NoteSequence()
+  num_notes = int(piece_secs * notes_per_sec)
+  start_times = np.sort(np.random.uniform(0, piece_secs, num_notes))
+  durations = np.random.exponential(0.5, num_notes)
+  pitches = np.random.randint(_MIN_PITCH, _MAX_PITCH + 1, num_notes)
+  velocities = np.random.randint(20, 128, num_notes)
+  for start_time, duration, pitch, velocity in zip(
+      start_times, durations, pitches, velocities):
+    sequence.notes.add(pitch=int(pitch), velocity=int(velocity),
+                       start_time=start_time, end_time=start_time + duration)
+  sequence.total_time = max(note.end_time for note in sequence.notes)
+  return sequence
+
+
+def _time(fn, *args, **kwargs):
+  """Returns the result of calling `fn` and the seconds it took."""
+  start_time = time.time()
+  result = fn(*args, **kwargs)
+  return result, time.time() - start_time
+
+
+def main(unused_argv):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  encode_times = [0.0, 0.0]
+  decode_times = [0.0, 0.0]
+  for _ in range(FLAGS.num_pieces):
+    sequence = _random_piece(FLAGS.piece_secs, FLAGS.notes_per_sec)
+    kwargs = dict(frames_per_second=_FRAMES_PER_SECOND, min_pitch=_MIN_PITCH,
+                  max_pitch=_MAX_PITCH, onset_mode='length_ms',
+                  onset_length_ms=32, offset_length_ms=32)
+
+    before, seconds = _time(_sequence_to_pianoroll_loop, sequence, **kwargs)
+    encode_times[0] += seconds
+    after, seconds = _time(sequences_lib.sequence_to_pianoroll, sequence,
+                           **kwargs)
+    encode_times[1] += seconds
+    for name in sequences_lib.Pianoroll._fields:
+      if not np.array_equal(getattr(before, name), getattr(after, name)):
+        raise AssertionError('Pianoroll %s differs.' % name)
+
+    kwargs = dict(frames_per_second=_FRAMES_PER_SECOND, min_duration_ms=0,
+                  min_midi_pitch=_MIN_PITCH,
+                  onset_predictions=after.onsets > 0,
+                  velocity_values=after.onset_velocities)
+    before, seconds = _time(_pianoroll_to_note_sequence_loop,
+                            after.active > 0, **kwargs)
+    decode_times[0] += seconds
+    after, seconds = _time(sequences_lib.pianoroll_to_note_sequence,
+                           after.active > 0, **kwargs)
+    decode_times[1] += seconds
+    if before != after:
+      raise AssertionError('Decoded NoteSequences differ.')
+
+  tf.logging.info('%d pieces of %.0f seconds, %.1f notes/sec.',
+                  FLAGS.num_pieces, FLAGS.piece_secs, FLAGS.notes_per_sec)
+  tf.logging.info('sequence_to_pianoroll: %.3f sec loop, %.3f sec vectorized '
+                  '(%.1fx)', encode_times[0], encode_times[1],
+                  encode_times[0] / encode_times[1])
+  tf.logging.info('pianoroll_to_note_sequence: %.3f sec loop, %.3f sec '
+                  'vectorized (%.1fx)', decode_times[0], decode_times[1],
+                  decode_times[0] / decode_times[1])
+
+
+def console_entry_point():
+  tf.app.run(main)
+
+
+if __name__ == '__main__':
+  console_entry_point()